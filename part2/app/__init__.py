@@ -1,12 +1,16 @@
 from flask import Flask
 from flask_restx import Api
+
+import config
 from app.api.v1.amenities import api as amenities_ns
 from app.api.v1.places import api as places_ns
 from app.api.v1.reviews import api as reviews_ns
 from app.api.v1.users import api as users_ns
+from app.services import facade
 
-def create_app():
+def create_app(config_class=config.DevelopmentConfig):
     app = Flask(__name__)
+    app.config.from_object(config_class)
     api = Api(app, version='1.0', title='HBnB API', description='HBnB Application API', doc='/api/v1/')
 
     api.add_namespace(users_ns, path='/api/v1/users')
@@ -14,4 +18,6 @@ def create_app():
     api.add_namespace(reviews_ns, path='/api/v1/reviews')
     api.add_namespace(amenities_ns, path='/api/v1/amenities')
 
+    facade.init_app(app)
+
     return app
@@ -236,8 +236,7 @@ class PlaceReviewList(Resource):
         if not place:
             return {'error': 'Place not found'}, 404
 
-        reviews = [review for review in facade.get_all_reviews()
-                   if review.place_id == place_id]
+        reviews = facade.get_reviews_by_place(place_id)
         return [{
             'id': review.id,
             'text': review.text,
@@ -119,7 +119,10 @@ class UserResource(Resource):
             return {'error': 'User not found'}, 404
 
         data = request.get_json()
-        updated_user = facade.put_user(user_id, data)
+        try:
+            updated_user = facade.put_user(user_id, data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
         if not updated_user:
             return {'error': 'Update failed'}, 400
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+"""
+Base model module.
+
+This module defines the BaseModel class shared by all the models, and the
+descriptors keeping their attributes in a compact form:
+
+- InternedId: an id referencing another entity is interned, so the
+  entities referencing the same one share a single string;
+- Timestamp: a datetime is stored as a float count of microseconds;
+- LazyList: a list attribute is only created when first read.
+
+The models use __slots__ instead of a per-instance __dict__. Reading an
+attribute returns the same value as before (str ids, datetime objects),
+so the public attributes and to_dict() outputs do not change.
+
+The id is stored as the str it was given, and every read returns that
+same object: the repositories key their storage and index entries on
+obj.id, so those keys share the object's string instead of each holding
+a copy.
+"""
+
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+# Microsecond counts up to 2**53 are exact as floats (until year 2255).
+_MAX_MICROSECONDS = 2 ** 53
+
+
+class _Compact:
+    """Descriptor storing an attribute encoded in the slot `_<name>`."""
+
+    def __set_name__(self, owner, name):
+        self.slot = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return self.decode(getattr(obj, self.slot))
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, self.encode(value))
+
+
+class InternedId(_Compact):
+    """Id string shared by every object holding the same value."""
+
+    def encode(self, value):
+        return sys.intern(value) if type(value) is str else value
+
+    def decode(self, value):
+        return value
+
+
+class Timestamp(_Compact):
+    """
+    Datetime stored as a float of microseconds since the epoch: positive
+    for a naive datetime, negative (minus one) for a UTC one. Other values
+    (other time zones, dates before 1970) are kept as is.
+    """
+
+    def encode(self, value):
+        if not isinstance(value, datetime):
+            return value
+        if value.tzinfo is None:
+            micros = (value - _EPOCH) // _MICROSECOND
+            if 0 <= micros < _MAX_MICROSECONDS:
+                return float(micros)
+        elif value.tzinfo is timezone.utc:
+            micros = (value - _EPOCH_UTC) // _MICROSECOND
+            if 0 <= micros < _MAX_MICROSECONDS:
+                return float(-micros - 1)
+        return value
+
+    def decode(self, value):
+        if not isinstance(value, float):
+            return value
+        if value >= 0:
+            return _EPOCH + timedelta(microseconds=int(value))
+        return _EPOCH_UTC + timedelta(microseconds=-int(value) - 1)
+
+
+class LazyList(_Compact):
+    """List attribute created on first access, so an instance whose list
+    is never read or set does not hold an empty list.
+    """
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot, None)
+        if value is None:
+            value = []
+            setattr(obj, self.slot, value)
+        return value
+
+    def encode(self, value):
+        return value
+
+
+class BaseModel:
+    """Base model that defines common attributes and methods.
+
+    Attributes:
+        id (str): Unique identifier for each instance.
+        created_at (datetime): Timestamp of instance creation.
+        updated_at (datetime): Timestamp of last instance update.
+    """
+
+    __slots__ = ('id', '_created_at', '_updated_at')
+
+    created_at = Timestamp()
+    updated_at = Timestamp()
+
+    def __init__(self, id=None, created_at=None, updated_at=None):
+        """Initializes the BaseModel instance.
+
+        Args:
+            id (str or None): ID of the instance. If None, a new UUID
+            is generated.
+            created_at (datetime or None): Creation time. Defaults to
+            current datetime.
+            updated_at (datetime or None): Last update time. Defaults to
+            current datetime.
+        """
+        self.id = id if id else str(uuid.uuid4())
+        self.created_at = created_at if created_at else datetime.now()
+        self.updated_at = updated_at if updated_at else datetime.now()
+
+    def save(self):
+        """Updates the `updated_at` timestamp to the current datetime."""
+        self.updated_at = datetime.now()
+
+    def update(self, data):
+        """Updates instance attributes based on a dictionary of
+        key-value pairs.
+
+        Args:
+            data (dict): Dictionary containing attribute names and their
+            new values.
+        """
+        for key, value in data.items():
+            if hasattr(self, key):
+                setattr(self, key, value)
+        self.save()
+
+    def __setstate__(self, state):
+        """Restores a pickled instance, including one pickled before the
+        models had slots (its state is then a plain attribute dict) or
+        while the id was stored packed.
+        """
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for key, value in state.items():
+            if key == '_id':
+                # Pickled when the id was stored as its UUID bytes
+                key = 'id'
+                if isinstance(value, bytes):
+                    value = str(uuid.UUID(bytes=value))
+            setattr(self, key, value)
@@ -1,79 +1,24 @@
 #!/usr/bin/python3
 """
-User and BaseModel module.
+User module.
 
-This module defines the BaseModel class which provides common attributes
-and methods
-for models, and the User class which represents a user with personal
+This module defines the User class which represents a user with personal
 information,
 including validation and management of related places and reviews.
 
 Classes:
-    BaseModel: Base class with unique ID and timestamp management.
     User: Represents a user with first name, last name, email, admin status,
     and related places and reviews.
 
 Dependencies:
-    uuid: For generating unique identifiers.
     re: For validating email addresses.
-    datetime: For managing creation and update timestamps.
-    app.models.place.Place: Represents places associated with a user.
-    app.models.review.Review: Represents reviews associated with a user.
+    app.models.baseclass.BaseModel: Base class with unique ID and
+    timestamp management.
 """
 
-import uuid
 import re
-from datetime import datetime
-from app.models.place import Place
-from app.models.review import Review
 
-
-class BaseModel:
-    """
-    BaseModel class that provides common attributes and methods for other
-    models.
-
-    Attributes:
-        id (str): Unique identifier for the instance, generated as a UUID4
-        string.
-        created_at (datetime): Timestamp when the instance was created.
-        updated_at (datetime): Timestamp when the instance was last updated.
-    """
-
-    def __init__(self, id=None, created_at=None, updated_at=None):
-        """
-        Initialize a new BaseModel instance.
-
-        Args:
-            id (str, optional): Unique identifier. If None, a new UUID4 string
-            is generated.
-            created_at (datetime, optional): Creation timestamp. If None,
-            current datetime is used.
-            updated_at (datetime, optional): Last update timestamp. If None,
-            current datetime is used.
-        """
-        self.id = id if id else str(uuid.uuid4())
-        self.created_at = created_at if created_at else datetime.now()
-        self.updated_at = updated_at if updated_at else datetime.now()
-
-    def save(self):
-        """
-        Update the `updated_at` timestamp to the current datetime.
-        """
-        self.updated_at = datetime.now()
-
-    def update(self, data):
-        """
-        Update attributes of the instance based on a dictionary and save
-        changes.
-
-        Args:
-            data (dict): Dictionary of attribute names and values to
-            update.
-        """
-        for key, value in data.items():
-            if hasattr(self, key):
-                setattr(self, key, value)
+from app.models.baseclass import BaseModel, LazyList
 
 
 class User(BaseModel):
@@ -90,6 +35,12 @@ class User(BaseModel):
         reviews (list): List of Review instances related to the user.
     """
 
+    __slots__ = ('first_name', 'last_name', 'email', 'is_admin', '_places',
+                 '_reviews')
+
+    places = LazyList()
+    reviews = LazyList()
+
     def __init__(self, first_name, last_name, email, is_admin=False, id=None,
                  created_at=None, updated_at=None):
         """
@@ -144,9 +95,6 @@ class User(BaseModel):
             raise ValueError("invalid email format")
         self.email = email
 
-        self.places = []
-        self.reviews = []
-
     def is_email_valid(self, email):
         """
         Validate the format of an email address using a regular expression.
@@ -0,0 +1,344 @@
+"""
+Durable in-memory repository: operation log and snapshots.
+
+A DurableInMemoryRepository keeps its objects in memory like
+ConcurrentInMemoryRepository and writes every committed change to an
+append-only operation log in its directory:
+
+    snapshot-<seq>.pickle   objects after operation <seq>
+    ops-<seq>.log           operations after <seq>, one record each
+
+A record holds the sequence number of the operation and the new state of
+every object it wrote (None for a deletion), so replaying a record does
+not depend on the clock or on model code. A model held by a written
+object (a place's owner, amenities and reviews) is saved as a reference,
+its class and id, not as a copy of its state: after a restore the
+references are resolved by relink() to the objects of the other
+repositories. Records are framed with their
+length and CRC32; a torn record at the end of the log (crash during a
+write) is dropped on recovery.
+
+Durability: appends go to the OS at once and are fsynced in batches,
+every `sync_seconds` (0 fsyncs every operation), and when the repository
+is closed or the interpreter exits cleanly. A crash of the machine loses
+at most `sync_seconds` of operations; a crash of the process alone loses
+nothing.
+
+Every `snapshot_every` operations, the log is rotated and the current
+state is written to a new snapshot (temporary file, fsync, rename), after
+which older snapshots and log files are removed. On startup the latest
+snapshot is memory-mapped and loaded, and the log files are replayed from
+its sequence number on.
+"""
+import atexit
+import io
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+from app.models.baseclass import BaseModel
+from app.persistence.repository import (ConcurrentInMemoryRepository,
+                                        _attribute_names)
+
+_HEADER = struct.Struct('>II')
+
+
+class Reference:
+    """A model held by a restored object, until relink() replaces it."""
+
+    __slots__ = ('cls', 'id')
+
+    def __init__(self, cls, obj_id):
+        self.cls = cls
+        self.id = obj_id
+
+
+class _Pickler(pickle.Pickler):
+    """Pickles the given objects, and the other models they hold as
+    (class, id) references."""
+
+    def __init__(self, stream, roots):
+        super().__init__(stream, pickle.HIGHEST_PROTOCOL)
+        self._roots = {id(obj) for obj in roots}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, BaseModel) and id(obj) not in self._roots:
+            return type(obj), obj.id
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        return Reference(*pid)
+
+
+def _dumps(value, roots):
+    stream = io.BytesIO()
+    _Pickler(stream, roots).dump(value)
+    return stream.getvalue()
+
+
+def _loads(data):
+    return _Unpickler(io.BytesIO(data)).load()
+
+
+class OperationLog:
+    """
+    Append-only file of records, fsynced in batches.
+
+    Args:
+        path (str): Log file, created if missing.
+        sync_seconds (float): Longest time an appended record waits for
+            fsync; 0 syncs on every append.
+    """
+
+    def __init__(self, path, sync_seconds=0.05):
+        self.path = path
+        self.sync_seconds = sync_seconds
+        self.bytes_written = 0
+        self._file = open(path, 'ab')
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        if sync_seconds > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='operation-log-sync')
+            self._thread.start()
+
+    def append(self, payload):
+        """Write one record; durable once the next sync() returns."""
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            self._file.write(record)
+            self._file.flush()
+            self.bytes_written += len(record)
+            self._dirty = True
+            if not self.sync_seconds:
+                self._sync_locked()
+
+    def sync(self):
+        """Fsync the records appended so far."""
+        with self._lock:
+            self._sync_locked()
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if not self._file.closed:
+                self._sync_locked()
+                self._file.close()
+
+    def _sync_locked(self):
+        if self._dirty and not self._file.closed:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _run(self):
+        while not self._closed.wait(self.sync_seconds):
+            self.sync()
+
+    @staticmethod
+    def read(path):
+        """
+        Return the payloads of the complete records of a log file and
+        truncate a torn record at its end.
+        """
+        payloads = []
+        with open(path, 'rb') as stream:
+            data = stream.read()
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            payload = data[offset + _HEADER.size:
+                           offset + _HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            payloads.append(payload)
+            offset += _HEADER.size + length
+        if offset < len(data):
+            with open(path, 'r+b') as stream:
+                stream.truncate(offset)
+        return payloads
+
+
+class DurableInMemoryRepository(ConcurrentInMemoryRepository):
+    """
+    ConcurrentInMemoryRepository restored from and logged to `directory`.
+
+    Args:
+        directory (str): Directory of the snapshots and log files.
+        unique (iterable): Attributes with a unique index.
+        indexes (iterable): Attributes with a multi-valued index.
+        sync_seconds (float): Fsync batching window of the log.
+        snapshot_every (int): Operations between two snapshots.
+    """
+
+    def __init__(self, directory, unique=(), indexes=(), sync_seconds=0.05,
+                 snapshot_every=10000):
+        super().__init__(unique=unique, indexes=indexes)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sync_seconds = sync_seconds
+        self.snapshot_every = snapshot_every
+        self.snapshot_bytes_written = 0
+        self._checkpoint_lock = threading.Lock()
+        self._seq = self._restore()
+        self._log_start = self._seq
+        self._log = OperationLog(self._path('ops', self._seq), sync_seconds)
+        self._log_bytes_written = 0
+        atexit.register(self.close)
+
+    def relink(self, resolve):
+        """
+        Replace the references held by the restored objects with
+        `resolve(cls, obj_id)`, dropping those it returns None for (the
+        model was deleted) from lists.
+        """
+        for obj in self._repo.get_all():
+            linked = False
+            for name in _attribute_names(obj):
+                value = getattr(obj, name, None)
+                if isinstance(value, Reference):
+                    setattr(obj, name, resolve(value.cls, value.id))
+                    linked = True
+                elif isinstance(value, list) and any(
+                        isinstance(item, Reference) for item in value):
+                    value[:] = [item for item in (
+                        resolve(item.cls, item.id)
+                        if isinstance(item, Reference) else item
+                        for item in value) if item is not None]
+            if linked:
+                self._repo.reindex(obj)
+
+    @property
+    def log_bytes_written(self):
+        """Bytes appended to the operation log since the repository opened."""
+        return self._log_bytes_written + self._log.bytes_written
+
+    def sync(self):
+        """Make the committed operations durable now."""
+        self._log.sync()
+
+    def checkpoint(self):
+        """
+        Write a snapshot of the current state and remove the snapshots and
+        log files it makes useless.
+        """
+        with self._write_lock:
+            seq, state = self._rotate()
+        self._write_snapshot(seq, state)
+
+    def close(self):
+        atexit.unregister(self.close)
+        self._log.close()
+
+    def _commit(self, draft):
+        changes = [(obj_id, draft.get(obj_id)) for obj_id in draft.touched]
+        if changes:
+            self._seq += 1
+            self._log.append(_dumps((self._seq, changes),
+                                    [obj for _, obj in changes]))
+        if self._seq - self._log_start >= self.snapshot_every and \
+                self._checkpoint_lock.acquire(blocking=False):
+            # The snapshot is written by a background thread while readers
+            # and writers go on. An object written meanwhile may be saved
+            # half updated, but that write is in the new log file and is
+            # replayed over the snapshot on restore.
+            threading.Thread(target=self._background_checkpoint,
+                             args=self._rotate(), daemon=True).start()
+
+    def _background_checkpoint(self, seq, state):
+        try:
+            self._write_snapshot(seq, state, locked=True)
+        finally:
+            self._checkpoint_lock.release()
+
+    def _rotate(self):
+        """Start a new log file at the current operation; write lock held."""
+        old = self._log
+        self._log = OperationLog(self._path('ops', self._seq),
+                                 self.sync_seconds)
+        self._log_start = self._seq
+        old.close()
+        self._log_bytes_written += old.bytes_written
+        return self._seq, self._repo.get_all()
+
+    def _write_snapshot(self, seq, state, locked=False):
+        if not locked:
+            self._checkpoint_lock.acquire()
+        try:
+            path = self._path('snapshot', seq)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as stream:
+                _Pickler(stream, state).dump((seq, state))
+                stream.flush()
+                os.fsync(stream.fileno())
+                self.snapshot_bytes_written += stream.tell()
+            os.replace(tmp, path)
+            self._sync_directory()
+            for kind, other in self._files():
+                if other < seq:
+                    os.remove(self._path(kind, other))
+        finally:
+            if not locked:
+                self._checkpoint_lock.release()
+
+    def _restore(self):
+        """Load the latest snapshot and replay the log; return the seq."""
+        files = self._files()
+        snapshots = [seq for kind, seq in files if kind == 'snapshot']
+        seq = 0
+        # The objects are indexed once replayed: a snapshot written while
+        # writes went on may not satisfy the unique indexes by itself.
+        objects = {}
+        if snapshots:
+            with open(self._path('snapshot', max(snapshots)), 'rb') as stream, \
+                    mmap.mmap(stream.fileno(), 0,
+                              access=mmap.ACCESS_READ) as mapped:
+                seq, saved = _Unpickler(mapped).load()
+            objects = {obj.id: obj for obj in saved}
+        for kind, start in files:
+            if kind != 'ops':
+                continue
+            for payload in OperationLog.read(self._path('ops', start)):
+                record_seq, changes = _loads(payload)
+                if record_seq <= seq:
+                    continue
+                for obj_id, obj in changes:
+                    if obj is None:
+                        objects.pop(obj_id, None)
+                    else:
+                        objects[obj_id] = obj
+                seq = record_seq
+        for obj in objects.values():
+            self._repo.add(obj)
+        return seq
+
+    def _files(self):
+        """(kind, seq) of the snapshot and log files, oldest first."""
+        files = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            kind, _, seq = stem.partition('-')
+            if (kind, ext) in (('snapshot', '.pickle'), ('ops', '.log')) \
+                    and seq.isdigit():
+                files.append((kind, int(seq)))
+        return sorted(files, key=lambda item: (item[1], item[0]))
+
+    def _path(self, kind, seq):
+        ext = '.pickle' if kind == 'snapshot' else '.log'
+        return os.path.join(self.directory, f'{kind}-{seq:020d}{ext}')
+
+    def _sync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -1,4 +1,8 @@
+import copy
+import threading
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from operator import attrgetter
 
 class Repository(ABC):
     @abstractmethod
@@ -27,10 +31,33 @@ class Repository(ABC):
 
 
 class InMemoryRepository(Repository):
-    def __init__(self):
+    """
+    Dictionary-backed repository with optional hash indexes.
+
+    Indexed attributes are given by name, dotted paths included
+    (e.g. 'email', 'place_id', 'owner.id'). A unique index maps a value to
+    one object and refuses a second object with the same value; a
+    multi-valued index maps a value to every object holding it, in
+    insertion order. None values are not indexed.
+
+    Indexes follow add(), update() and delete(). An object changed in
+    place by other means must be passed to reindex().
+
+    Args:
+        unique (iterable): Attributes with a unique index.
+        indexes (iterable): Attributes with a multi-valued index.
+    """
+
+    def __init__(self, unique=(), indexes=()):
         self._storage = {}
+        self._unique = {attr: {} for attr in unique}
+        self._indexes = {attr: {} for attr in indexes}
+        # Indexed values of each stored object, as last indexed, so an
+        # entry can be removed after the object changed.
+        self._indexed = {}
 
     def add(self, obj):
+        self._replace_entries(obj)
         self._storage[obj.id] = obj
 
     def get(self, obj_id):
@@ -42,11 +69,344 @@ class InMemoryRepository(Repository):
     def update(self, obj_id, data):
         obj = self.get(obj_id)
         if obj:
+            # Refuse a duplicate before the object is changed
+            for attr, index in self._unique.items():
+                value = data.get(attr)
+                if value is not None and index.get(value, obj_id) != obj_id:
+                    raise ValueError(f"{attr} already exists: {value}")
             obj.update(data)
+            self.reindex(obj)
 
     def delete(self, obj_id):
         if obj_id in self._storage:
+            self._unindex(obj_id)
             del self._storage[obj_id]
 
     def get_by_attribute(self, attr_name, attr_value):
-        return next((obj for obj in self._storage.values() if getattr(obj, attr_name) == attr_value), None)
+        if attr_name in self._unique:
+            return self.get(self._unique[attr_name].get(attr_value))
+        if attr_name in self._indexes:
+            ids = list(self._indexes[attr_name].get(attr_value, ()))
+            return next(filter(None, map(self._storage.get, ids)), None)
+        return next((obj for obj in list(self._storage.values())
+                     if getattr(obj, attr_name) == attr_value), None)
+
+    def get_all_by_attribute(self, attr_name, attr_value):
+        """Return every object whose attribute `attr_name` is `attr_value`."""
+        if attr_name in self._unique:
+            obj = self.get_by_attribute(attr_name, attr_value)
+            return [obj] if obj else []
+        if attr_name in self._indexes:
+            ids = list(self._indexes[attr_name].get(attr_value, ()))
+            return list(filter(None, map(self._storage.get, ids)))
+        getter = attrgetter(attr_name)
+        return [obj for obj in list(self._storage.values())
+                if _value(getter, obj) == attr_value]
+
+    def copy(self):
+        """
+        Return a repository holding the same objects and index entries.
+
+        The dictionaries and index buckets are copied, which is O(n); the
+        objects themselves are shared.
+        """
+        clone = copy.copy(self)
+        clone._storage = dict(self._storage)
+        clone._unique = {attr: dict(index)
+                         for attr, index in self._unique.items()}
+        clone._indexes = {attr: {value: dict(ids)
+                                 for value, ids in index.items()}
+                          for attr, index in self._indexes.items()}
+        clone._indexed = dict(self._indexed)
+        return clone
+
+    def reindex(self, obj):
+        """
+        Refresh the index entries of a stored object after it was changed
+        in place.
+
+        Raises:
+            ValueError: If the object now duplicates a unique value; its
+            previous entries are kept.
+        """
+        if obj.id in self._storage:
+            self._replace_entries(obj)
+
+    def _replace_entries(self, obj):
+        previous = self._indexed.get(obj.id)
+        if previous is not None:
+            self._unindex(obj.id)
+        try:
+            self._check_unique(obj)
+        except ValueError:
+            if previous is not None:
+                self._restore(obj.id, previous)
+            raise
+        self._index(obj)
+
+    def _check_unique(self, obj):
+        for attr, index in self._unique.items():
+            value = _value(attrgetter(attr), obj)
+            if value is not None and index.get(value, obj.id) != obj.id:
+                raise ValueError(f"{attr} already exists: {value}")
+
+    def _index(self, obj):
+        values = {'unique': {}, 'indexes': {}}
+        for attr, index in self._unique.items():
+            value = _value(attrgetter(attr), obj)
+            if value is not None:
+                index[value] = obj.id
+            values['unique'][attr] = value
+        for attr, index in self._indexes.items():
+            value = _value(attrgetter(attr), obj)
+            if value is not None:
+                self._bucket(attr, value)[obj.id] = None
+            values['indexes'][attr] = value
+        self._indexed[obj.id] = values
+
+    def _restore(self, obj_id, values):
+        for attr, value in values['unique'].items():
+            if value is not None:
+                self._unique[attr][value] = obj_id
+        for attr, value in values['indexes'].items():
+            if value is not None:
+                self._bucket(attr, value)[obj_id] = None
+        self._indexed[obj_id] = values
+
+    def _unindex(self, obj_id):
+        values = self._indexed.pop(obj_id)
+        for attr, value in values['unique'].items():
+            if self._unique[attr].get(value) == obj_id:
+                del self._unique[attr][value]
+        for attr, value in values['indexes'].items():
+            if value in self._indexes[attr]:
+                ids = self._indexes[attr][value]
+                ids.pop(obj_id, None)
+                if not ids:
+                    del self._indexes[attr][value]
+
+    def _bucket(self, attr, value):
+        """Ids holding `value` in index `attr`."""
+        return self._indexes[attr].setdefault(value, {})
+
+
+def _value(getter, obj):
+    """Value of an indexed attribute of `obj`, None when it is missing."""
+    try:
+        return getter(obj)
+    except AttributeError:
+        return None
+
+
+def _attribute_names(obj):
+    """Names of the slots and instance attributes of `obj`."""
+    names = [name for cls in type(obj).__mro__
+             for name in cls.__dict__.get('__slots__', ())]
+    return names + list(getattr(obj, '__dict__', ()))
+
+
+def _assign(target, source):
+    """Give `target` the attribute values of `source`, a copy of it."""
+    for name in _attribute_names(source):
+        try:
+            value = getattr(source, name)
+        except AttributeError:
+            continue
+        setattr(target, name, value)
+
+
+class _Transaction:
+    """
+    Writes to an InMemoryRepository held back until commit().
+
+    The written objects are kept by id (None for a deletion); an update
+    is made to a copy of the stored object. Reads through the transaction
+    see its writes, the repository itself does not until commit().
+    """
+
+    def __init__(self, repo):
+        self._repo = repo
+        self._pending = {}
+        # Ids whose pending object is a copy of the stored one
+        self._copies = set()
+
+    @property
+    def touched(self):
+        """Ids written by the transaction."""
+        return self._pending.keys()
+
+    def add(self, obj):
+        self._pending[obj.id] = obj
+        self._copies.discard(obj.id)
+
+    def update(self, obj_id, data):
+        obj = self.get(obj_id)
+        if obj:
+            if obj_id not in self._pending:
+                obj = copy.copy(obj)
+                self._pending[obj_id] = obj
+                self._copies.add(obj_id)
+            obj.update(data)
+
+    def delete(self, obj_id):
+        if self.get(obj_id):
+            self._pending[obj_id] = None
+            self._copies.discard(obj_id)
+
+    def rollback(self):
+        self._pending.clear()
+        self._copies.clear()
+
+    def commit(self):
+        """
+        Apply the writes to the repository. An updated object keeps its
+        identity: the values of its copy are assigned to it.
+
+        Raises:
+            ValueError: If the writes duplicate a unique value; none of
+            them is applied.
+        """
+        self._check_unique()
+        repo = self._repo
+        # Unindexed first, so objects may swap unique values
+        for obj_id in self._pending:
+            if obj_id in repo._indexed:
+                repo._unindex(obj_id)
+        for obj_id, obj in self._pending.items():
+            if obj is None:
+                repo._storage.pop(obj_id, None)
+                continue
+            if obj_id in self._copies:
+                stored = repo._storage[obj_id]
+                _assign(stored, obj)
+                obj = self._pending[obj_id] = stored
+            repo._index(obj)
+            repo._storage[obj_id] = obj
+
+    def _check_unique(self):
+        for attr, index in self._repo._unique.items():
+            getter = attrgetter(attr)
+            claimed = {}
+            for obj_id, obj in self._pending.items():
+                value = None if obj is None else _value(getter, obj)
+                if value is None:
+                    continue
+                holder = index.get(value, obj_id)
+                if claimed.setdefault(value, obj_id) != obj_id or (
+                        holder != obj_id and holder not in self._pending):
+                    raise ValueError(f"{attr} already exists: {value}")
+
+    def get(self, obj_id):
+        if obj_id in self._pending:
+            return self._pending[obj_id]
+        return self._repo.get(obj_id)
+
+    def get_all(self):
+        objects = [obj for obj in self._repo.get_all()
+                   if obj.id not in self._pending]
+        return objects + [obj for obj in self._pending.values()
+                          if obj is not None]
+
+    def get_by_attribute(self, attr_name, attr_value):
+        return next(iter(self.get_all_by_attribute(attr_name, attr_value)),
+                    None)
+
+    def get_all_by_attribute(self, attr_name, attr_value):
+        getter = attrgetter(attr_name)
+        objects = [obj for obj in
+                   self._repo.get_all_by_attribute(attr_name, attr_value)
+                   if obj.id not in self._pending]
+        return objects + [obj for obj in self._pending.values()
+                          if obj is not None
+                          and _value(getter, obj) == attr_value]
+
+
+class ConcurrentInMemoryRepository(Repository):
+    """
+    Thread-safe InMemoryRepository with lock-free reads.
+
+    Writers take a lock and change the objects and the dictionaries in
+    place, so an object keeps its identity: the other entities holding
+    it (a place's owner, amenities and reviews) see its updates, and a
+    write costs the same as in InMemoryRepository. The writes of a
+    transaction() are made to copies and only applied once it commits,
+    so readers never see writes that are rolled back.
+
+    Readers take no lock. Each read makes one atomic copy of what it
+    iterates (a list of the stored objects, of the ids of an index
+    bucket), so it never fails on a concurrent write, and get_all() lists
+    the objects stored at one point in time. Applying an update assigns
+    the new values of an object one attribute at a time, so a reader
+    may see some of them and not yet the others: this is accepted, as
+    swapping all of an object's values in one assignment would take one
+    more object per model, and the values read are each ones that were
+    committed.
+
+    Objects returned by the repository are shared and must only be
+    changed through update() or a transaction().
+    """
+
+    def __init__(self, unique=(), indexes=()):
+        self._repo = InMemoryRepository(unique=unique, indexes=indexes)
+        self._write_lock = threading.Lock()
+
+    def snapshot(self):
+        """
+        Return a read-only repository of the objects stored now. The
+        objects are shared, only the set of them is frozen; this copies
+        the dictionaries, which is O(n).
+        """
+        with self._write_lock:
+            return self._repo.copy()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Apply several writes under one lock acquisition, all or none.
+
+        Yields the repository to write to. Its reads see the writes made
+        so far; the other readers only see them once the block exits. If
+        the block raises, the writes are dropped and the exception
+        propagates.
+
+        Raises:
+            ValueError: If the writes duplicate a unique value; none of
+            them is applied.
+        """
+        with self._write_lock:
+            draft = _Transaction(self._repo)
+            try:
+                yield draft
+            except BaseException:
+                draft.rollback()
+                raise
+            draft.commit()
+            self._commit(draft)
+
+    def _commit(self, draft):
+        """Hook run once the writes of `draft` are applied, with the write
+        lock held."""
+
+    def add(self, obj):
+        with self.transaction() as draft:
+            draft.add(obj)
+
+    def get(self, obj_id):
+        return self._repo.get(obj_id)
+
+    def get_all(self):
+        return self._repo.get_all()
+
+    def update(self, obj_id, data):
+        with self.transaction() as draft:
+            draft.update(obj_id, data)
+
+    def delete(self, obj_id):
+        with self.transaction() as draft:
+            draft.delete(obj_id)
+
+    def get_by_attribute(self, attr_name, attr_value):
+        return self._repo.get_by_attribute(attr_name, attr_value)
+
+    def get_all_by_attribute(self, attr_name, attr_value):
+        return self._repo.get_all_by_attribute(attr_name, attr_value)
@@ -1,3 +1,4 @@
+import os
 import uuid
 from datetime import datetime, timezone
 
@@ -5,15 +6,53 @@ from app.models.amenity import Amenity
 from app.models.place import Place
 from app.models.review import Review
 from app.models.user import User
-from app.persistence.repository import InMemoryRepository
+from app.persistence.durable import DurableInMemoryRepository
+from app.persistence.repository import ConcurrentInMemoryRepository
 
 
 class HBnBFacade:
     def __init__(self):
-        self.user_repo = InMemoryRepository()
-        self.place_repo = InMemoryRepository()
-        self.review_repo = InMemoryRepository()
-        self.amenity_repo = InMemoryRepository()
+        self._create_repositories()
+
+    def init_app(self, app):
+        """
+        Make the repositories durable when DATA_DIR is set: they are
+        restored from, and logged to, one directory each under DATA_DIR.
+        """
+        data_dir = app.config.get('DATA_DIR')
+        if data_dir:
+            self.close()
+            self._create_repositories(
+                data_dir,
+                sync_seconds=app.config.get('LOG_SYNC_SECONDS', 0.05),
+                snapshot_every=app.config.get('SNAPSHOT_EVERY', 10000))
+
+    def close(self):
+        """Sync and close the logs of durable repositories."""
+        for repo in (self.user_repo, self.place_repo, self.review_repo,
+                     self.amenity_repo):
+            if isinstance(repo, DurableInMemoryRepository):
+                repo.close()
+
+    def _create_repositories(self, data_dir=None, **options):
+        def repository(name, **indexes):
+            if data_dir is None:
+                return ConcurrentInMemoryRepository(**indexes)
+            return DurableInMemoryRepository(os.path.join(data_dir, name),
+                                             **indexes, **options)
+
+        self.user_repo = repository('users', unique=('email',))
+        self.place_repo = repository('places', indexes=('owner.id',))
+        self.review_repo = repository('reviews',
+                                      indexes=('place_id', 'user_id'))
+        self.amenity_repo = repository('amenities')
+        if data_dir is not None:
+            # Restored objects hold references to the models of the other
+            # repositories until linked to them.
+            repos = {User: self.user_repo, Place: self.place_repo,
+                     Review: self.review_repo, Amenity: self.amenity_repo}
+            for repo in repos.values():
+                repo.relink(lambda cls, obj_id: repos[cls].get(obj_id))
 
     def create_place(self, place_data):
         owner_id = place_data.get('owner_id')
@@ -72,23 +111,29 @@ class HBnBFacade:
         if not place:
             return None
 
+        # The changes are applied by one repository write, so a failed
+        # validation leaves the place unchanged. Readers see none of them
+        # until the write commits, then may briefly see some and not yet
+        # the others: the place keeps its identity, so its values are
+        # assigned one at a time.
+        changes = {}
         if 'title' in place_data:
-            place.title = place_data['title']
+            changes['title'] = place_data['title']
         if 'description' in place_data:
-            place.description = place_data['description']
+            changes['description'] = place_data['description']
         if 'price' in place_data:
             try:
-                place.price = float(place_data['price'])
+                changes['price'] = float(place_data['price'])
             except ValueError:
                 raise ValueError("Invalid price value")
         if 'latitude' in place_data:
             try:
-                place.latitude = float(place_data['latitude'])
+                changes['latitude'] = float(place_data['latitude'])
             except ValueError:
                 raise ValueError("Invalid latitude value")
         if 'longitude' in place_data:
             try:
-                place.longitude = float(place_data['longitude'])
+                changes['longitude'] = float(place_data['longitude'])
             except ValueError:
                 raise ValueError("Invalid longitude value")
 
@@ -96,24 +141,27 @@ class HBnBFacade:
             owner = self.user_repo.get(place_data['owner_id'])
             if not owner:
                 raise ValueError("Owner not found")
-            place.owner = owner
+            changes['owner'] = owner
 
         if 'amenities' in place_data:
-            place.amenities.clear()
+            amenities = []
             for amenity_id in place_data['amenities']:
                 amenity = self.amenity_repo.get(amenity_id)
-                if amenity:
-                    place.add_amenity(amenity)
+                if amenity and amenity not in amenities:
+                    amenities.append(amenity)
+            changes['amenities'] = amenities
 
         if 'reviews' in place_data:
-            place.reviews.clear()
+            reviews = []
             for review_id in place_data['reviews']:
                 review = self.review_repo.get(review_id)
                 if review:
-                    place.add_review(review)
+                    reviews.append(review)
+            changes['reviews'] = reviews
 
-        place.updated_at = datetime.now(timezone.utc)
-        return place
+        changes['updated_at'] = datetime.now(timezone.utc)
+        self.place_repo.update(place_id, changes)
+        return self.place_repo.get(place_id)
 
     def create_user(self, user_data):
         user = User(**user_data)
@@ -130,8 +178,10 @@ class HBnBFacade:
         user = self.get_user(user_id)
         if not user:
             return None
-        user.update(new_data)
-        return user
+        # Readers may briefly see some of the new values and not yet the
+        # others, as for update_place().
+        self.user_repo.update(user_id, new_data)
+        return self.user_repo.get(user_id)
 
 
     def get_all_user(self):
@@ -166,9 +216,13 @@ class HBnBFacade:
         name = amenity_data.get('name')
         if not name:
             raise ValueError('Name invalid')
-        amenity.name = name
-        amenity.updated_at = datetime.now(timezone.utc)
-        return amenity
+        # Readers may briefly see the new name with the old updated_at,
+        # as for update_place().
+        self.amenity_repo.update(amenity_id, {
+            'name': name,
+            'updated_at': datetime.now(timezone.utc)
+        })
+        return self.amenity_repo.get(amenity_id)
 
     def create_review(self, review_data):
         user = self.get_user(review_data["user_id"])
@@ -191,15 +245,20 @@ class HBnBFacade:
         return self.review_repo.get_all()
 
     def get_reviews_by_place(self, place_id):
-        return self.review_repo.get(place_id)
+        return self.review_repo.get_all_by_attribute('place_id', place_id)
 
     def update_review(self, review_id, review_data):
         review = self.get_review(review_id)
         if not review:
             return None
+        # Readers may briefly see some of the new values and not yet the
+        # others, as for update_place().
         self.review_repo.update(review_id, review_data)
-        return review
+        return self.review_repo.get(review_id)
 
     def delete_review(self, review_id):
-       review = self.review_repo.get(review_id)
-       return self.review_repo.delete(review)
+        review = self.review_repo.get(review_id)
+        if not review:
+            return False
+        self.review_repo.delete(review_id)
+        return True
@@ -4,6 +4,14 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'default_secret_key')
     DEBUG = False
 
+    # Durable in-memory storage: operation log and snapshots of each
+    # repository under DATA_DIR; memory only when unset.
+    DATA_DIR = os.getenv('HBNB_DATA_DIR')
+    # Fsync batching window of the operation log (0 = every operation).
+    LOG_SYNC_SECONDS = 0.05
+    # Operations logged between two snapshots.
+    SNAPSHOT_EVERY = 10000
+
 class DevelopmentConfig(Config):
     DEBUG = True
 
@@ -0,0 +1,120 @@
+"""
+Write cost and recovery time of DurableInMemoryRepository.
+
+Writes --users users then updates each of them once, and reports:
+
+- the write throughput, and on a smaller store the throughput with fsync
+  batched every 50 ms against fsync on every operation;
+- the write amplification: bytes written to the log and the snapshots
+  divided by the size of the live data (the last snapshot);
+- the recovery time of a restart from the log alone, from a snapshot
+  alone, and from a snapshot plus a log tail of --tail operations.
+
+Run from part2:
+
+    python test/benchmark_durable.py [--users N] [--tail N]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.persistence.durable import DurableInMemoryRepository
+
+
+class User:
+
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+        self.visits = 0
+
+    def update(self, data):
+        for key, value in data.items():
+            setattr(self, key, value)
+
+
+def write(directory, users, sync_seconds, snapshot_every):
+    repo = DurableInMemoryRepository(directory, unique=('email',),
+                                     sync_seconds=sync_seconds,
+                                     snapshot_every=snapshot_every)
+    start = time.perf_counter()
+    for i in range(users):
+        repo.add(User(str(i), f'user{i}@example.com'))
+    for i in range(users):
+        repo.update(str(i), {'visits': 1})
+    repo.sync()
+    elapsed = time.perf_counter() - start
+    repo.close()
+    return repo, 2 * users / elapsed
+
+
+def recover(directory):
+    start = time.perf_counter()
+    repo = DurableInMemoryRepository(directory, unique=('email',))
+    elapsed = time.perf_counter() - start
+    repo.close()
+    return elapsed, len(repo.get_all())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--tail', type=int, default=1000)
+    args = parser.parse_args(argv)
+    root = tempfile.mkdtemp(prefix='hbnb-durable-')
+    try:
+        directory = os.path.join(root, 'batched')
+        repo, rate = write(directory, args.users, 0.05, 10 ** 9)
+        print(f"{args.users} adds + {args.users} updates, fsync batched "
+              f"every 50 ms: {rate:,.0f} ops/s, "
+              f"{repo.log_bytes_written / (2 * args.users):.0f} log "
+              f"bytes/op")
+        # Same store size for both fsync modes, as the copy-on-write
+        # cost of a write grows with the number of objects.
+        small = max(args.users // 20, 1)
+        for label, sync_seconds in (('batched every 50 ms', 0.05),
+                                    ('on every operation', 0)):
+            _, rate = write(os.path.join(root, f'fsync-{sync_seconds}'),
+                            small, sync_seconds, 10 ** 9)
+            print(f"{small} adds + {small} updates, fsync {label}: "
+                  f"{rate:,.0f} ops/s")
+
+        elapsed, count = recover(directory)
+        print(f"recovery from the log ({2 * args.users} operations): "
+              f"{elapsed * 1000:.0f} ms, {count} users")
+
+        repo = DurableInMemoryRepository(directory, unique=('email',))
+        repo.checkpoint()
+        repo.close()
+        live = repo.snapshot_bytes_written
+        elapsed, count = recover(directory)
+        print(f"recovery from the snapshot: {elapsed * 1000:.0f} ms, "
+              f"{count} users")
+
+        repo = DurableInMemoryRepository(directory, unique=('email',))
+        for i in range(args.tail):
+            repo.update(str(i % args.users), {'visits': 2})
+        repo.close()
+        elapsed, count = recover(directory)
+        print(f"recovery from the snapshot + {args.tail} logged "
+              f"operations: {elapsed * 1000:.0f} ms, {count} users")
+
+        directory = os.path.join(root, 'snapshots')
+        repo, rate = write(directory, args.users, 0.05,
+                           max(args.users // 4, 1))
+        time.sleep(0.5)
+        written = repo.log_bytes_written + repo.snapshot_bytes_written
+        print(f"with a snapshot every {max(args.users // 4, 1)} "
+              f"operations: {rate:,.0f} ops/s, write amplification "
+              f"{written / live:.1f}x the live data ({live:,} bytes)")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Memory used per model instance.
+
+Builds --count instances of each model and reports the bytes allocated per
+instance (tracemalloc), next to the same entities laid out as the models
+did before they had slots: an instance __dict__, UUID strings, datetime
+objects and an empty list per list attribute. Reviews reference 100
+places and 100 users, as in a repository holding many reviews.
+
+It then reports the bytes per entity stored in a
+ConcurrentInMemoryRepository with the indexes of the facade, which adds
+the storage and index entries keyed on each entity's id.
+
+Run from part2:
+
+    python test/benchmark_models.py [--count N]
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.amenity import Amenity
+from app.models.place import Place
+from app.models.review import Review
+from app.models.user import User
+from app.persistence.repository import ConcurrentInMemoryRepository
+
+
+class Plain:
+    """Entity with the attribute layout of the models without slots."""
+
+    def __init__(self, lists=(), **attrs):
+        self.id = str(uuid.uuid4())
+        self.created_at = datetime.now()
+        self.updated_at = datetime.now(timezone.utc)
+        for name, value in attrs.items():
+            setattr(self, name, value)
+        for name in lists:
+            setattr(self, name, [])
+
+
+# One class per model, as instances of a class share their dict keys
+PlainUser, PlainPlace, PlainReview, PlainAmenity = (
+    type(name, (Plain,), {})
+    for name in ('PlainUser', 'PlainPlace', 'PlainReview', 'PlainAmenity'))
+
+
+def per_instance(count, make):
+    gc.collect()
+    tracemalloc.start()
+    instances = [make(i) for i in range(count)]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (allocated - sys.getsizeof(instances)) / count
+
+
+def per_stored(count, make, **indexes):
+    gc.collect()
+    tracemalloc.start()
+    repo = ConcurrentInMemoryRepository(**indexes)
+    for i in range(count):
+        repo.add(make(i))
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return allocated / count
+
+
+def report(title, count, models, measure):
+    print(f"{'model':<8} {'before':>8} {'after':>8}  {title}, "
+          f"{count} instances")
+    for name, (make, make_plain, indexes) in models.items():
+        before = measure(count, make_plain, **indexes)
+        after = measure(count, make, **indexes)
+        print(f"{name:<8} {before:>8.0f} {after:>8.0f}  "
+              f"({100 * (1 - after / before):.0f}% less)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    owners = [User('Jane', 'Doe', f'owner{i}@example.com')
+              for i in range(100)]
+    places = [Place(None, owners[i], 'Loft', 'Nice', 80.0, 48.8, 2.3, None,
+                    None) for i in range(100)]
+    # Reviews built from request data get their own copy of each id
+    place_ids = [place.id for place in places]
+    user_ids = [owner.id for owner in owners]
+
+    # Indexes of the facade's repositories
+    models = {
+        'User': (
+            lambda i: User('Jane', 'Doe', f'user{i}@example.com'),
+            lambda i: PlainUser(first_name='Jane', last_name='Doe',
+                                email=f'user{i}@example.com', is_admin=False,
+                                lists=('places', 'reviews')),
+            {'unique': ('email',)}),
+        'Place': (
+            lambda i: Place(None, owners[i % 100], 'Loft', 'Nice', 80.0,
+                            48.8, 2.3, None, None),
+            lambda i: PlainPlace(owner=owners[i % 100], title='Loft',
+                                 description='Nice', price=80.0,
+                                 latitude=48.8, longitude=2.3,
+                                 lists=('amenities', 'reviews')),
+            {'indexes': ('owner.id',)}),
+        'Review': (
+            lambda i: Review(place_ids[i % 100].encode().decode(),
+                             user_ids[i % 97].encode().decode(), 4, 'Great'),
+            lambda i: PlainReview(
+                place_id=place_ids[i % 100].encode().decode(),
+                user_id=user_ids[i % 97].encode().decode(),
+                rating=4, text='Great'),
+            {'indexes': ('place_id', 'user_id')}),
+        'Amenity': (
+            lambda i: Amenity('Wifi', None, None, None),
+            lambda i: PlainAmenity(name='Wifi'),
+            {}),
+    }
+    report('bytes per instance', args.count, models,
+           lambda count, make, **indexes: per_instance(count, make))
+    print()
+    report('bytes per entity stored in an indexed repository', args.count,
+           models, per_stored)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Read throughput of the in-memory repositories under concurrency.
+
+Reader threads look users up by id and by email while one writer thread
+keeps updating users. ConcurrentInMemoryRepository readers take no lock;
+the baseline guards an InMemoryRepository with a single lock, as a plain
+dict repository would need to be safe.
+
+Run from part2:
+
+    python test/benchmark_repository.py [--users N] [--seconds S]
+
+On a CPython build with the GIL, pure Python readers cannot run in
+parallel, so the lock-free figures mostly show that readers do not slow
+down as threads are added; on a free-threaded build (3.13t+) they grow
+with the number of threads.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.persistence.repository import (ConcurrentInMemoryRepository,
+                                        InMemoryRepository)
+
+
+class User:
+
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+        self.visits = 0
+
+    def update(self, data):
+        for key, value in data.items():
+            setattr(self, key, value)
+
+
+class LockedRepository:
+    """InMemoryRepository behind one lock, readers included."""
+
+    def __init__(self, **indexes):
+        self._repo = InMemoryRepository(**indexes)
+        self._lock = threading.Lock()
+
+    def add(self, obj):
+        with self._lock:
+            self._repo.add(obj)
+
+    def get(self, obj_id):
+        with self._lock:
+            return self._repo.get(obj_id)
+
+    def update(self, obj_id, data):
+        with self._lock:
+            self._repo.update(obj_id, data)
+
+    def get_by_attribute(self, attr_name, attr_value):
+        with self._lock:
+            return self._repo.get_by_attribute(attr_name, attr_value)
+
+
+def load(repo, users):
+    if isinstance(repo, ConcurrentInMemoryRepository):
+        with repo.transaction() as draft:
+            for i in range(users):
+                draft.add(User(str(i), f'user{i}@example.com'))
+    else:
+        for i in range(users):
+            repo.add(User(str(i), f'user{i}@example.com'))
+    return repo
+
+
+def run(repo, threads, users, seconds):
+    """Return the reads per second of `threads` readers."""
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def reader(slot):
+        count = 0
+        i = slot
+        while not stop.is_set():
+            for _ in range(100):
+                i = (i + 7919) % users
+                repo.get(str(i))
+                repo.get_by_attribute('email', f'user{i}@example.com')
+            count += 200
+        counts[slot] = count
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            i = (i + 1) % users
+            repo.update(str(i), {'visits': i})
+            time.sleep(0.001)
+
+    workers = [threading.Thread(target=reader, args=(slot,))
+               for slot in range(threads)]
+    workers.append(threading.Thread(target=writer))
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=1.0)
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    args = parser.parse_args(argv)
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f"Python {sys.version.split()[0]}, GIL "
+          f"{'enabled' if gil else 'disabled'}, {args.users} users")
+    print(f"{'threads':>7} {'lock-free':>15} {'single lock':>15}")
+    for threads in args.threads:
+        free = run(load(ConcurrentInMemoryRepository(unique=('email',)),
+                       args.users), threads, args.users, args.seconds)
+        locked = run(load(LockedRepository(unique=('email',)), args.users),
+                     threads, args.users, args.seconds)
+        print(f"{threads:>7} {free:>13,.0f}/s {locked:>13,.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
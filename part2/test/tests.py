@@ -1,5 +1,19 @@
+import os
+import pickle
+import tempfile
+import threading
 import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import mock
 from app import create_app
+from app.models.review import Review
+from app.models.user import User
+from app.persistence.durable import DurableInMemoryRepository
+from app.persistence.repository import (ConcurrentInMemoryRepository,
+                                        InMemoryRepository)
+from app.services import facade
+from app.services.facade import HBnBFacade
 
 class TestUserEndpoints(unittest.TestCase):
 
@@ -22,3 +36,324 @@ class TestUserEndpoints(unittest.TestCase):
             "email": "invalid-email"
         })
         self.assertEqual(response.status_code, 400)
+
+
+class Record:
+
+    def __init__(self, id, **attrs):
+        self.id = id
+        self.__dict__.update(attrs)
+
+    def update(self, data):
+        for key, value in data.items():
+            setattr(self, key, value)
+
+
+class TestInMemoryRepositoryIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = InMemoryRepository(unique=('email',),
+                                       indexes=('place_id',))
+        self.repo.add(Record('1', email='a@example.com', place_id='p1'))
+        self.repo.add(Record('2', email='b@example.com', place_id='p1'))
+
+    def test_lookups(self):
+        self.assertEqual(
+            self.repo.get_by_attribute('email', 'b@example.com').id, '2')
+        self.assertEqual(
+            [r.id for r in self.repo.get_all_by_attribute('place_id', 'p1')],
+            ['1', '2'])
+
+    def test_unique_index_refuses_duplicates(self):
+        with self.assertRaises(ValueError):
+            self.repo.add(Record('3', email='a@example.com', place_id='p2'))
+        with self.assertRaises(ValueError):
+            self.repo.update('2', {'email': 'a@example.com'})
+        self.assertEqual(self.repo.get('2').email, 'b@example.com')
+
+    def test_indexes_follow_update_and_delete(self):
+        self.repo.update('2', {'place_id': 'p2'})
+        self.repo.delete('1')
+        self.assertEqual(self.repo.get_all_by_attribute('place_id', 'p1'), [])
+        self.assertEqual(
+            [r.id for r in self.repo.get_all_by_attribute('place_id', 'p2')],
+            ['2'])
+        self.assertIsNone(
+            self.repo.get_by_attribute('email', 'a@example.com'))
+
+
+class TestConcurrentInMemoryRepository(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = ConcurrentInMemoryRepository(unique=('email',),
+                                                 indexes=('place_id',))
+        self.repo.add(Record('1', email='a@example.com', place_id='p1'))
+
+    def test_update_keeps_the_object(self):
+        before = self.repo.get('1')
+        self.repo.update('1', {'email': 'b@example.com', 'place_id': 'p2'})
+        self.assertIs(self.repo.get('1'), before)
+        self.assertEqual(before.email, 'b@example.com')
+        self.assertEqual(
+            self.repo.get_by_attribute('email', 'b@example.com').id, '1')
+        self.assertEqual(
+            [r.id for r in self.repo.get_all_by_attribute('place_id', 'p2')],
+            ['1'])
+
+    def test_snapshot_is_a_point_in_time_view(self):
+        snapshot = self.repo.snapshot()
+        with self.repo.transaction() as draft:
+            draft.add(Record('2', email='b@example.com', place_id='p1'))
+            draft.delete('1')
+            self.assertEqual(len(self.repo.get_all()), 1)
+        self.assertEqual([r.id for r in snapshot.get_all()], ['1'])
+        self.assertEqual(
+            [r.id for r in self.repo.get_all_by_attribute('place_id', 'p1')],
+            ['2'])
+
+    def test_failed_transaction_is_dropped(self):
+        with self.assertRaises(ValueError):
+            with self.repo.transaction() as draft:
+                draft.add(Record('2', email='b@example.com', place_id='p1'))
+                draft.add(Record('3', email='b@example.com', place_id='p1'))
+        self.assertIsNone(self.repo.get('2'))
+
+    def test_failed_transaction_undoes_updates(self):
+        with self.assertRaises(ValueError):
+            with self.repo.transaction() as draft:
+                draft.update('1', {'email': 'b@example.com'})
+                draft.delete('1')
+                draft.add(Record('2', email='c@example.com', place_id='p1'))
+                raise ValueError("abort")
+        self.assertEqual(self.repo.get('1').email, 'a@example.com')
+        self.assertIsNone(self.repo.get('2'))
+        self.assertEqual(
+            self.repo.get_by_attribute('email', 'a@example.com').id, '1')
+        self.assertIsNone(
+            self.repo.get_by_attribute('email', 'b@example.com'))
+
+    def test_transaction_writes_are_hidden_until_commit(self):
+        before = self.repo.get('1')
+        with self.repo.transaction() as draft:
+            draft.update('1', {'email': 'b@example.com', 'place_id': 'p2'})
+            draft.add(Record('2', email='a@example.com', place_id='p2'))
+            self.assertEqual(draft.get('1').email, 'b@example.com')
+            self.assertEqual(
+                [r.id for r in draft.get_all_by_attribute('place_id',
+                                                          'p2')],
+                ['1', '2'])
+            self.assertEqual((before.email, before.place_id),
+                             ('a@example.com', 'p1'))
+            self.assertIsNone(self.repo.get('2'))
+        self.assertIs(self.repo.get('1'), before)
+        self.assertEqual((before.email, before.place_id),
+                         ('b@example.com', 'p2'))
+        self.assertEqual(
+            self.repo.get_by_attribute('email', 'a@example.com').id, '2')
+
+    def test_readers_never_fail_on_concurrent_writes(self):
+        stop = threading.Event()
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                i += 1
+                self.repo.add(Record(f'n{i}', email=f'{i}@example.com',
+                                     place_id='p1'))
+                if i > 50:
+                    self.repo.delete(f'n{i - 50}')
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            for _ in range(2000):
+                for record in self.repo.get_all_by_attribute('place_id',
+                                                              'p1'):
+                    self.assertEqual(record.place_id, 'p1')
+                self.repo.get_by_attribute('place_id', 'p1')
+                self.repo.get_all_by_attribute('email', 'x')
+        finally:
+            stop.set()
+            thread.join()
+
+
+class TestRelatedEntities(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.client = self.app.test_client()
+
+    def test_writes_show_through_related_entities(self):
+        user = self.client.post('/api/v1/users/', json={
+            "first_name": "A", "last_name": "Doe",
+            "email": "related@example.com"}).get_json()
+        place = self.client.post('/api/v1/places/', json={
+            "title": "Flat", "price": 50.0, "latitude": 1.0,
+            "longitude": 2.0, "owner_id": user['id']}).get_json()
+        review = facade.create_review({
+            "place_id": place['id'], "user_id": user['id'], "rating": 4,
+            "text": "Good"})
+        facade.update_place(place['id'], {'reviews': [review.id]})
+
+        self.client.put(f"/api/v1/users/{user['id']}", json={
+            "first_name": "Zed", "last_name": "Doe",
+            "email": "related@example.com"})
+        facade.update_review(review.id, {'text': 'Better'})
+
+        stored = facade.get_place(place['id'])
+        self.assertEqual(stored.owner.to_dict()['first_name'], 'Zed')
+        self.assertEqual([r.text for r in stored.reviews], ['Better'])
+        self.assertIs(stored.owner, facade.get_user(user['id']))
+
+
+class TestDurableInMemoryRepository(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo = self.open()
+
+    def tearDown(self):
+        self.repo.close()
+        self.tmp.cleanup()
+
+    def open(self):
+        return DurableInMemoryRepository(self.tmp.name, unique=('email',),
+                                         snapshot_every=1000)
+
+    def reopen(self):
+        self.repo.close()
+        self.repo = self.open()
+
+    def test_restart_replays_the_log(self):
+        self.repo.add(Record('1', email='a@example.com'))
+        self.repo.add(Record('2', email='b@example.com'))
+        self.repo.update('1', {'email': 'c@example.com'})
+        self.repo.delete('2')
+        self.reopen()
+        self.assertEqual([r.id for r in self.repo.get_all()], ['1'])
+        self.assertEqual(
+            self.repo.get_by_attribute('email', 'c@example.com').id, '1')
+
+    def test_restart_from_snapshot_and_log_tail(self):
+        self.repo.add(Record('1', email='a@example.com'))
+        self.repo.checkpoint()
+        self.repo.add(Record('2', email='b@example.com'))
+        self.reopen()
+        self.assertEqual(sorted(r.id for r in self.repo.get_all()),
+                         ['1', '2'])
+        self.assertEqual(sorted(os.listdir(self.tmp.name))[-1],
+                         'snapshot-00000000000000000001.pickle')
+
+    def test_torn_record_is_dropped(self):
+        self.repo.add(Record('1', email='a@example.com'))
+        self.repo.close()
+        log = os.path.join(self.tmp.name, 'ops-00000000000000000000.log')
+        with open(log, 'ab') as stream:
+            stream.write(b'\x00\x00\x00\x40torn')
+        self.repo = self.open()
+        self.repo.add(Record('2', email='b@example.com'))
+        self.reopen()
+        self.assertEqual(sorted(r.id for r in self.repo.get_all()),
+                         ['1', '2'])
+
+
+class TestDurableFacade(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = SimpleNamespace(config={'DATA_DIR': self.tmp.name,
+                                           'LOG_SYNC_SECONDS': 0})
+        self.facade = self.open()
+
+    def tearDown(self):
+        self.facade.close()
+        self.tmp.cleanup()
+
+    def open(self):
+        hbnb = HBnBFacade()
+        hbnb.init_app(self.app)
+        return hbnb
+
+    def test_restored_relations_are_linked(self):
+        user = self.facade.create_user({'first_name': 'Ann',
+                                        'last_name': 'Lee',
+                                        'email': 'ann@example.com'})
+        wifi = self.facade.create_amenity({'name': 'Wi-Fi'})
+        place = self.facade.create_place({
+            'title': 'Flat', 'price': 50.0, 'latitude': 1.0,
+            'longitude': 2.0, 'owner_id': user.id,
+            'amenities': [wifi.id]})
+        self.facade.close()
+        self.facade = self.open()
+
+        restored = self.facade.get_place(place.id)
+        self.assertIs(restored.owner, self.facade.get_user(user.id))
+        self.assertIs(restored.amenities[0],
+                      self.facade.get_amenity(wifi.id))
+        self.assertEqual(
+            [p.id for p in self.facade.place_repo.get_all_by_attribute(
+                'owner.id', user.id)], [place.id])
+
+    def test_records_hold_references_not_related_state(self):
+        user = self.facade.create_user({'first_name': 'Ann',
+                                        'last_name': 'Lee',
+                                        'email': 'ann@example.com'})
+        self.facade.create_place({'title': 'Flat', 'price': 50.0,
+                                  'latitude': 1.0, 'longitude': 2.0,
+                                  'owner_id': user.id})
+        places = os.path.join(self.tmp.name, 'places')
+        with open(os.path.join(places, os.listdir(places)[0]), 'rb') as log:
+            self.assertNotIn(b'ann@example.com', log.read())
+
+    def test_reopening_does_not_pile_up_exit_handlers(self):
+        registered = []
+
+        def unregister(func):
+            if func in registered:
+                registered.remove(func)
+
+        with mock.patch('atexit.register', registered.append), \
+                mock.patch('atexit.unregister', unregister):
+            for _ in range(3):
+                self.facade.init_app(self.app)
+        self.assertEqual(len(registered), 4)
+
+
+class TestCompactModels(unittest.TestCase):
+
+    def test_attributes_read_back_unchanged(self):
+        created = datetime(2024, 5, 1, 12, 0, 0, 123456)
+        updated = datetime(2024, 5, 2, 8, 30, 0, 654321, tzinfo=timezone.utc)
+        user = User('Jane', 'Doe', 'jane@example.com',
+                    id='6f1c2b8e-7a51-4c2b-9a0f-6bd1b2a7e0c4',
+                    created_at=created, updated_at=updated)
+        self.assertFalse(hasattr(user, '__dict__'))
+        self.assertEqual(user.to_dict()['id'],
+                         '6f1c2b8e-7a51-4c2b-9a0f-6bd1b2a7e0c4')
+        self.assertEqual(user.created_at, created)
+        self.assertEqual(user.to_dict()['updated_at'],
+                         '2024-05-02T08:30:00.654321+00:00')
+        self.assertEqual(user.places, [])
+
+    def test_reviews_share_referenced_ids(self):
+        place_id = '6f1c2b8e-7a51-4c2b-9a0f-6bd1b2a7e0c5'
+        first = Review(place_id.encode().decode(), 'user', 4, 'Great')
+        second = Review(place_id.encode().decode(), 'user', 5, 'Nice')
+        self.assertIs(first.place_id, second.place_id)
+
+    def test_repository_keys_share_the_id(self):
+        repo = ConcurrentInMemoryRepository(indexes=('place_id',))
+        review = Review('place', 'user', 4, 'Great')
+        repo.add(review)
+        key, = repo._repo._storage
+        self.assertIs(key, review.id)
+        self.assertIs(next(iter(repo._repo._indexes['place_id']['place'])),
+                      review.id)
+
+    def test_pickle_round_trip(self):
+        review = Review('place', 'user', 4, 'Great')
+        restored = pickle.loads(pickle.dumps(review))
+        self.assertEqual((restored.id, restored.place_id, restored.rating,
+                          restored.created_at),
+                         (review.id, review.place_id, review.rating,
+                          review.created_at))
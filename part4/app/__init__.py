@@ -1,16 +1,20 @@
 from flask import Flask, render_template
 from flask_restx import Api
 from flask_cors import CORS
-from app.extensions import db, bcrypt, jwt
+from app.extensions import db, bcrypt, jwt, replicas, shards
 
 import config
 
 from app.api.v1.admin import api as admin_ns
 from app.api.v1.auth import api as auth_ns
+from app.api.v1.batch import api as batch_ns
+from app.api.v1.changes import api as changes_ns
 from app.api.v1.users import api as users_ns
 from app.api.v1.amenities import api as amenities_ns
 from app.api.v1.places import api as places_ns
 from app.api.v1.reviews import api as reviews_ns
+from app.commands import register_commands
+from app.services import facade
 
 
 
@@ -38,6 +42,9 @@ def create_app(config_class=config.DevelopmentConfig):
     bcrypt.init_app(app)
     jwt.init_app(app)
     db.init_app(app)
+    replicas.init_app(app)
+    shards.init_app(app)
+    facade.init_app(app)
 
     api = Api(app, version='1.0', title='HBnB API', description='HBnB Application API')
 
@@ -47,6 +54,10 @@ def create_app(config_class=config.DevelopmentConfig):
     api.add_namespace(amenities_ns, path='/api/v1/amenities')
     api.add_namespace(auth_ns, path="/api/v1/auth")
     api.add_namespace(admin_ns, path='/api/v1/admin')
+    api.add_namespace(batch_ns, path='/api/v1/batch')
+    api.add_namespace(changes_ns, path='/api/v1/changes')
+
+    register_commands(app)
 
     @app.route('/login')
     def login():
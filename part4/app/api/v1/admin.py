@@ -1,6 +1,11 @@
+import os
+
 from app.services import facade
+from app.services.bulk_export import MIMETYPES, export_filename
+from app.services.facade import DatabaseRequired
+from app.services.versioning import PreconditionFailed, etag, parse_if_match
 from app.models.user import User
-from flask import request
+from flask import Response, request, send_file, stream_with_context
 from flask_restx import Namespace, Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
@@ -46,6 +51,10 @@ class AdminUserModify(Resource):
         data = request.json
         if not data:
              return {'error': 'Invalid or missing JSON data'}, 400
+        try:
+            versions = parse_if_match(request.headers.get('If-Match'))
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
         email = data.get('email')
         # Ensure email uniqueness
@@ -63,7 +72,10 @@ class AdminUserModify(Resource):
             user.hash_password(password)
             data.pop('password')
 
-        updated_user = facade.put_user(user_id, data)
+        try:
+            updated_user = facade.put_user(user_id, data, versions)
+        except PreconditionFailed as e:
+            return {'error': str(e)}, 412
         if not updated_user:
             return {'error': 'Update failed'}, 400
 
@@ -71,8 +83,9 @@ class AdminUserModify(Resource):
             'id': updated_user.id,
             'first_name': updated_user.first_name,
             'last_name': updated_user.last_name,
-            'email': updated_user.email
-        }, 200
+            'email': updated_user.email,
+            'version': updated_user.version
+        }, 200, {'ETag': etag(updated_user)}
 
 
 @api.route('/amenities/')
@@ -115,10 +128,17 @@ class AdminAmenityModify(Resource):
         if 'name' not in amenity_data or not amenity_data['name'].strip():
             return {'message': 'Name is required'}, 400
         name = amenity_data['name'].strip()
-        update_amenity = facade.update_amenity(amenity_id, {'name': name})
+        try:
+            versions = parse_if_match(request.headers.get('If-Match'))
+            update_amenity = facade.update_amenity(amenity_id, {'name': name},
+                                                   versions)
+        except PreconditionFailed as e:
+            return {'message': str(e)}, 412
+        except ValueError as e:
+            return {'message': str(e)}, 400
         if update_amenity is None:
             return {'message': 'Amenity not found'}, 404
-        return update_amenity.to_dict(), 200
+        return update_amenity.to_dict(), 200, {'ETag': etag(update_amenity)}
 
 
 @api.route('/places/<place_id>')
@@ -145,13 +165,17 @@ class AdminPlaceRessource(Resource):
             return {'message': 'Unauthorized action.'}, 403
 
         try:
-            updated_place = facade.update_place(place_id, place_data)
+            versions = parse_if_match(request.headers.get('If-Match'))
+            updated_place = facade.update_place(place_id, place_data,
+                                                versions)
             if not updated_place:
                 return {'message': 'Place not found'}, 404
             return {
                 "message": "Place updated successfully",
                 "place": updated_place.to_dict()
-            }, 200
+            }, 200, {'ETag': etag(updated_place)}
+        except PreconditionFailed as e:
+            return {'message': str(e)}, 412
         except ValueError as e:
             return {'message': str(e)}, 400
 
@@ -172,6 +196,185 @@ class AdminPlaceRessource(Resource):
         return {'message': 'Place deleted successfully'}, 200
 
 
+@api.route('/jobs/')
+class AdminJobList(Resource):
+    @jwt_required()
+    def get(self):
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        try:
+            jobs = facade.get_jobs(request.args.get('status'),
+                                   request.args.get('limit', 50, type=int))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        return [job.to_dict() for job in jobs], 200
+
+    @jwt_required()
+    def post(self):
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        job_data = request.json
+        if not job_data or 'name' not in job_data:
+            return {'error': 'Invalid or missing JSON data'}, 400
+
+        try:
+            job = facade.enqueue_job(job_data['name'],
+                                     job_data.get('payload'))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        except DatabaseRequired as e:
+            return {'error': str(e)}, 501
+        return job.to_dict(), 202
+
+
+@api.route('/jobs/<job_id>')
+class AdminJobResource(Resource):
+    @jwt_required()
+    def get(self, job_id):
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        job = facade.get_job(job_id)
+        if not job:
+            return {'error': 'Job not found'}, 404
+        return job.to_dict(), 200
+
+
+@api.route('/import/<kind>')
+class AdminBulkImport(Resource):
+    @jwt_required()
+    def post(self, kind):
+        """
+        Bulk import places, amenities or users from an NDJSON body.
+
+        The body is read as a stream, one JSON object per line. Send
+        `Content-Encoding: gzip` for a gzip compressed body.
+        """
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        compressed = request.headers.get('Content-Encoding') == 'gzip'
+        try:
+            report = facade.import_ndjson(kind, request.stream, compressed)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        except OSError:
+            return {'error': 'Invalid gzip body'}, 400
+        except DatabaseRequired as e:
+            return {'error': str(e)}, 501
+        return report.to_dict(), 200
+
+
+@api.route('/export/<entity>')
+class AdminExportStream(Resource):
+    @jwt_required()
+    def get(self, entity):
+        """
+        Stream an export of places or reviews.
+
+        Query parameters: format (csv, ndjson or parquet, default csv) and
+        compress (gzip).
+        """
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        fmt = request.args.get('format', 'csv')
+        compress = request.args.get('compress')
+        try:
+            chunks = facade.export_stream(entity, fmt, compress)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        except DatabaseRequired as e:
+            return {'error': str(e)}, 501
+        filename = export_filename(entity, fmt, compress)
+        return Response(
+            stream_with_context(chunks),
+            mimetype='application/gzip' if compress else MIMETYPES[fmt],
+            headers={'Content-Disposition':
+                     f'attachment; filename="{filename}"'})
+
+
+@api.route('/exports/')
+class AdminExportJobList(Resource):
+    @jwt_required()
+    def post(self):
+        """Start a background export; poll /exports/<job_id> for it."""
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        export_data = request.json
+        if not export_data or 'entity' not in export_data:
+            return {'error': 'Invalid or missing JSON data'}, 400
+
+        try:
+            job = facade.start_export(export_data['entity'],
+                                      export_data.get('format', 'csv'),
+                                      export_data.get('compress'))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        except DatabaseRequired as e:
+            return {'error': str(e)}, 501
+        return job.to_dict(), 202
+
+
+@api.route('/exports/<job_id>')
+class AdminExportJob(Resource):
+    @jwt_required()
+    def get(self, job_id):
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        job = facade.get_job(job_id)
+        if not job or job.name != 'export':
+            return {'error': 'Export not found'}, 404
+        return job.to_dict(), 200
+
+
+@api.route('/exports/<job_id>/download')
+class AdminExportDownload(Resource):
+    @jwt_required()
+    def get(self, job_id):
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        job = facade.get_job(job_id)
+        if not job or job.name != 'export':
+            return {'error': 'Export not found'}, 404
+        if job.status != 'done':
+            return {'error': 'Export not finished',
+                    'status': job.status, 'progress': job.progress}, 409
+        result = job.to_dict()['result']
+        if not os.path.exists(result['path']):
+            return {'error': 'Export file expired'}, 410
+        return send_file(os.path.abspath(result['path']), as_attachment=True,
+                         download_name=result['filename'])
+
+
+@api.route('/repository-cache')
+class AdminRepositoryCache(Resource):
+    @jwt_required()
+    def get(self):
+        """Lag and refresh cost of the cached repository backend."""
+        current_user = get_jwt_identity()
+        if not current_user.get('is_admin', False):
+            return {'error': 'Admin privileges required'}, 403
+
+        metrics = facade.get_repository_cache_metrics()
+        if metrics is None:
+            return {'error': 'The repository cache is not enabled'}, 404
+        return metrics, 200
+
+
 @api.route('/<review_id>')
 class AdminReviewRessource(Resource):
     @jwt_required()
@@ -192,7 +395,14 @@ class AdminReviewRessource(Resource):
         if not is_admin and review.owner_id != user_id:
             return {'message': 'Unauthorized action.'}, 403
 
-        update_review = facade.update_review(review_id, review_data)
+        try:
+            versions = parse_if_match(request.headers.get('If-Match'))
+            update_review = facade.update_review(review_id, review_data,
+                                                 versions)
+        except PreconditionFailed as e:
+            return {'error': str(e)}, 412
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
         if not update_review:
             return {'error': 'Update failed'}, 400
@@ -204,8 +414,9 @@ class AdminReviewRessource(Resource):
             'user_id': update_review.user_id,
             'place_id': update_review.place_id,
             'created_at': update_review.created_at.isoformat(),
-            'updated_at': update_review.updated_at.isoformat()
-        }, 200
+            'updated_at': update_review.updated_at.isoformat(),
+            'version': update_review.version
+        }, 200, {'ETag': etag(update_review)}
 
     @jwt_required()
     def delete(self, review_id):
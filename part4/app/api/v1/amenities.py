@@ -36,9 +36,12 @@ from flask import request
 from flask_restx import Namespace
 from flask_restx import Resource
 from flask_restx import fields
+from app.persistence.read_only import read_only_get
 from app.services import facade
+from app.services.versioning import PreconditionFailed, etag, parse_if_match
 
-api = Namespace('amenities', description='Amenity operations')
+api = Namespace('amenities', description='Amenity operations',
+                decorators=[read_only_get])
 
 # Define the amenity model for input validation and documentation
 amenity_model = api.model('Amenity', {
@@ -119,12 +122,13 @@ class AmenityResource(Resource):
         amenity = facade.get_amenity(amenity_id)
         if amenity is None:
             return {'message': 'Amenty not found'}, 404
-        return amenity.to_dict(), 200
+        return amenity.to_dict(), 200, {'ETag': etag(amenity)}
 
     @api.expect(amenity_model)
     @api.response(200, 'Amenity updated successfully')
     @api.response(404, 'Amenity not found')
     @api.response(400, 'Invalid input data')
+    @api.response(412, 'Amenity changed since the If-Match version')
     def put(self, amenity_id):
         """
         Update the name of an existing amenity.
@@ -140,7 +144,14 @@ class AmenityResource(Resource):
         if 'name' not in data or not data['name'].strip():
             return {'message': 'Name is required'}, 400
         name = data['name'].strip()
-        update_amenity = facade.update_amenity(amenity_id, {'name': name})
+        try:
+            versions = parse_if_match(request.headers.get('If-Match'))
+            update_amenity = facade.update_amenity(amenity_id, {'name': name},
+                                                   versions)
+        except PreconditionFailed as e:
+            return {'message': str(e)}, 412
+        except ValueError as e:
+            return {'message': str(e)}, 400
         if update_amenity is None:
             return {'message': 'Amenity not found'}, 404
-        return update_amenity.to_dict(), 200
+        return update_amenity.to_dict(), 200, {'ETag': etag(update_amenity)}
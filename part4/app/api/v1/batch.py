@@ -0,0 +1,170 @@
+"""
+batch.py - API namespace running several API calls in one round trip.
+
+A client posts an ordered list of sub-requests against the other
+namespaces:
+
+    {"requests": [
+        {"method": "POST", "path": "/api/v1/auth/login",
+         "body": {"email": "...", "password": "..."}},
+        {"method": "GET", "path": "/api/v1/places/"},
+        {"method": "GET", "path": "/api/v1/amenities/"}
+     ],
+     "parallel": true}
+
+and gets one result per sub-request, in the same order:
+
+    {"responses": [{"status": 200, "body": {...}}, ...]}
+
+Sub-requests are dispatched in-process through Flask's routing, without
+HTTP. They run in the application context of the batch, so they share
+its database session. The Authorization header of the batch is passed on
+to every sub-request, which verifies it as a request of its own would,
+and the token returned by a login sub-request is used by the ones after
+it.
+
+With "parallel": true, consecutive GET sub-requests are run concurrently
+on a small thread pool; each of them gets its own application context and
+session since a session is not thread safe. Writes are never reordered:
+a non-GET sub-request waits for the reads before it and the reads after
+it wait for it.
+
+Endpoints:
+    - /batch/ [POST]
+
+Dependencies:
+    - flask_restx
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, request
+from flask_restx import Namespace, Resource, fields
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+api = Namespace('batch', description='Batch operations')
+
+sub_request_model = api.model('SubRequest', {
+    'method': fields.String(description='HTTP method, GET by default'),
+    'path': fields.String(required=True,
+                          description='API path, e.g. /api/v1/places/'),
+    'body': fields.Raw(description='JSON body of the sub-request'),
+    'headers': fields.Raw(description='Extra headers of the sub-request')
+})
+
+batch_model = api.model('Batch', {
+    'requests': fields.List(fields.Nested(sub_request_model), required=True,
+                            description='Sub-requests, run in order'),
+    'parallel': fields.Boolean(description='Run consecutive GETs '
+                                           'concurrently')
+})
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(workers,
+                                           thread_name_prefix='batch')
+    return _executor
+
+
+def _dispatch(app, item, headers):
+    """Run one sub-request in the current app context."""
+    with app.test_request_context(item['path'],
+                                  method=item.get('method', 'GET').upper(),
+                                  json=item.get('body'), headers=headers):
+        try:
+            response = app.full_dispatch_request()
+        except Exception:
+            logger.exception("Batch sub-request %s %s failed",
+                             item.get('method', 'GET').upper(), item['path'])
+            db.session.rollback()
+            return {'status': 500, 'body': {'error': 'Internal server error'}}
+        body = response.get_json(silent=True)
+        if body is None:
+            body = response.get_data(as_text=True)
+        return {'status': response.status_code, 'body': body}
+
+
+def _dispatch_isolated(app, item, headers):
+    """Run one sub-request in an app context of its own (worker threads)."""
+    with app.app_context():
+        try:
+            return _dispatch(app, item, headers)
+        finally:
+            db.session.remove()
+
+
+def _validate(items, limit):
+    if not isinstance(items, list) or not items:
+        return "requests must be a non-empty list"
+    if len(items) > limit:
+        return f"A batch may contain at most {limit} requests"
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or \
+                not isinstance(item.get('path'), str):
+            return f"Request {index}: path is required"
+        if not item['path'].startswith('/api/v1/') or \
+                item['path'].startswith('/api/v1/batch'):
+            return f"Request {index}: path must be an API path"
+        if not isinstance(item.get('method', 'GET'), str) or \
+                item.get('method', 'GET').upper() not in (
+                    'GET', 'POST', 'PUT', 'DELETE'):
+            return f"Request {index}: invalid method"
+        if not isinstance(item.get('headers', {}), dict):
+            return f"Request {index}: headers must be an object"
+    return None
+
+
+@api.route('/')
+class Batch(Resource):
+    @api.expect(batch_model)
+    @api.response(200, 'Sub-requests run, see each status')
+    @api.response(400, 'Invalid batch')
+    def post(self):
+        """Run an ordered list of API calls and return their results."""
+        batch = request.get_json(silent=True)
+        if not isinstance(batch, dict):
+            return {'error': "The body must be a JSON object"}, 400
+        items = batch.get('requests')
+        error = _validate(items, current_app.config['BATCH_MAX_REQUESTS'])
+        if error:
+            return {'error': error}, 400
+
+        app = current_app._get_current_object()
+        authorization = request.headers.get('Authorization')
+        parallel = batch.get('parallel', False)
+        results = [None] * len(items)
+        pending = []
+
+        def wait_reads():
+            for index, future in pending:
+                results[index] = future.result()
+            pending.clear()
+
+        for index, item in enumerate(items):
+            headers = dict(item.get('headers', {}))
+            if authorization and 'Authorization' not in headers:
+                headers['Authorization'] = authorization
+            is_read = item.get('method', 'GET').upper() == 'GET'
+            if parallel and is_read:
+                pending.append((index, _get_executor(
+                    app.config['BATCH_WORKERS']).submit(
+                        _dispatch_isolated, app, item, headers)))
+                continue
+            wait_reads()
+            results[index] = _dispatch(app, item, headers)
+            token = isinstance(results[index]['body'], dict) and \
+                results[index]['body'].get('access_token')
+            if item['path'].rstrip('/') == '/api/v1/auth/login' and token:
+                authorization = f"Bearer {token}"
+        wait_reads()
+        return {'responses': results}, 200
@@ -0,0 +1,66 @@
+"""
+changes.py - API namespace for the delta sync of the catalogue.
+
+Clients mirroring places, reviews and amenities keep a cursor and pull
+only what changed since:
+
+    GET /api/v1/changes/             -> {"cursor": 1234}
+    GET /api/v1/changes/?since=1234  -> {"changes": [...], "cursor": 1290,
+                                         "has_more": false}
+
+Start with a cursor from the first call, then load the catalogue in full,
+then keep calling with `since` set to the last cursor (while has_more is
+true, call again immediately). Each change is
+{"seq", "entity", "id", "op", "data"}, where op is "upsert" (data holds
+the current representation) or "delete" (a tombstone, no data).
+
+A cursor older than the change log retention gets a 410: the client must
+reload the catalogue in full.
+
+Endpoints:
+    - /changes/ [GET]
+
+Dependencies:
+    - flask_restx
+    - app.services.facade: Reads the change log.
+"""
+from app.services import facade
+from app.services.change_log import ChangeLogUnavailable, CursorExpired
+from app.services.facade import DatabaseRequired
+from flask import request
+from flask_restx import Namespace, Resource
+
+api = Namespace('changes', description='Delta sync of the catalogue')
+
+
+@api.route('/')
+class ChangeList(Resource):
+    @api.doc(params={
+        'since': 'Cursor returned by the previous call',
+        'limit': 'Maximum number of log entries read (capped)'})
+    @api.response(200, 'Changes after the cursor')
+    @api.response(400, 'Invalid parameters')
+    @api.response(410, 'Cursor expired, resync required')
+    @api.response(501, 'No change log with sharded storage or the memory '
+                  'backend')
+    def get(self):
+        """Return the changes after a cursor, or the current cursor."""
+        since = request.args.get('since')
+        if since is None:
+            try:
+                return {'cursor': facade.get_changes_cursor()}, 200
+            except (ChangeLogUnavailable, DatabaseRequired) as e:
+                return {'error': str(e)}, 501
+        try:
+            since = int(since)
+            limit = int(request.args.get('limit', 0)) or None
+        except ValueError:
+            return {'error': 'since and limit must be integers'}, 400
+        if since < 0 or (limit is not None and limit < 0):
+            return {'error': 'since and limit must be positive'}, 400
+        try:
+            return facade.get_changes(since, limit), 200
+        except CursorExpired as e:
+            return {'error': str(e)}, 410
+        except (ChangeLogUnavailable, DatabaseRequired) as e:
+            return {'error': str(e)}, 501
@@ -0,0 +1,53 @@
+"""
+idempotency.py - Idempotency-Key support for the create endpoints.
+
+Decorate a Resource method with `idempotent` (below `jwt_required`) to let
+clients retry it safely: see app/services/idempotency.py.
+"""
+import hashlib
+from functools import wraps
+
+from app.services import facade
+from app.services.idempotency import KeyReused, RequestInProgress
+from flask import request
+
+
+def _normalize(rv):
+    """Split a Resource return value into (body, status, headers)."""
+    if not isinstance(rv, tuple):
+        return rv, 200, {}
+    status = rv[1] if len(rv) > 1 else 200
+    headers = dict(rv[2]) if len(rv) > 2 else {}
+    return rv[0], status, headers
+
+
+def idempotent(method):
+    """Replay the stored response of retries sharing an Idempotency-Key."""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        client_key = request.headers.get('Idempotency-Key')
+        if client_key is None:
+            return method(*args, **kwargs)
+        if not client_key or len(client_key) > 255:
+            return {'error': 'Idempotency-Key must have 1 to 255 '
+                             'characters'}, 400
+
+        scope = '\n'.join((request.method, request.path,
+                           request.headers.get('Authorization', ''),
+                           client_key))
+        key = hashlib.sha256(scope.encode()).hexdigest()
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        try:
+            body, status, headers, replayed = facade.idempotency.run(
+                key, request_hash,
+                lambda: _normalize(method(*args, **kwargs)))
+        except RequestInProgress:
+            return {'error': 'A request with this Idempotency-Key is '
+                             'in progress'}, 409
+        except KeyReused:
+            return {'error': 'Idempotency-Key already used for another '
+                             'request'}, 422
+        if replayed:
+            headers = dict(headers, **{'Idempotent-Replayed': 'true'})
+        return body, status, headers
+    return wrapper
@@ -16,18 +16,30 @@ Models:
 
 Endpoints:
     - /places/ [GET, POST]
+    - /places/top [GET]
+    - /places/trending [GET]
+    - /places/nearest [GET]
+    - /places/clusters [GET]
     - /places/<place_id> [GET, PUT]
+    - /places/<place_id>/events [GET]
 
 Dependencies:
     - flask_restx
     - app.services.facade: Business logic layer for place operations.
 """
 from app.models.place import Place
+from app.api.v1.idempotency import idempotent
+from app.persistence.read_only import read_only_get
 from app.services import facade
+from app.services.events import EventedWorkerRequired
+from app.services.facade import DatabaseRequired
+from app.services.versioning import PreconditionFailed, etag, parse_if_match
+from flask import Response, current_app, request
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-api = Namespace('places', description='Place operations')
+api = Namespace('places', description='Place operations',
+                decorators=[read_only_get])
 
 # Define the models for related entities
 amenity_model = api.model('PlaceAmenity', {
@@ -70,6 +82,46 @@ place_model = api.model('Place', {
         )
 })
 
+# Query parameters selecting the filtered listing of GET /places/
+SEARCH_ARGS = ('min_price', 'max_price', 'bbox', 'min_rating', 'amenities',
+               'offset', 'limit')
+
+
+def parse_bbox(value):
+    """
+    Read a south,west,north,east bounding box.
+
+    Raises:
+        ValueError: If the value is malformed.
+    """
+    bbox = tuple(float(part) for part in value.split(','))
+    if len(bbox) != 4 or bbox[0] > bbox[2]:
+        raise ValueError("bbox must be south,west,north,east")
+    return bbox
+
+
+def parse_search_args():
+    """
+    Read the filters of GET /places/ from the query string.
+
+    Raises:
+        ValueError: If a parameter is malformed.
+    """
+    args = request.args
+    filters = {}
+    for name in ('min_price', 'max_price', 'min_rating'):
+        if name in args:
+            filters[name] = float(args[name])
+    if 'bbox' in args:
+        filters['bbox'] = parse_bbox(args['bbox'])
+    if args.get('amenities'):
+        filters['amenity_ids'] = args['amenities'].split(',')
+    filters['offset'] = int(args.get('offset', 0))
+    filters['limit'] = int(args.get('limit', 50))
+    if filters['offset'] < 0 or filters['limit'] < 1:
+        raise ValueError("offset must be positive or zero, limit positive")
+    return filters
+
 
 @api.route('/')
 class PlaceList(Resource):
@@ -84,6 +136,9 @@ class PlaceList(Resource):
     @api.expect(place_model)
     @api.response(201, 'Place successfully created')
     @api.response(400, 'Invalid input data')
+    @api.response(409, 'Same Idempotency-Key still in progress')
+    @api.response(422, 'Idempotency-Key reused with another body')
+    @idempotent
     def post(self):
         """Register a new place"""
         """
@@ -111,17 +166,206 @@ class PlaceList(Resource):
         except ValueError:
             return {'error': 'Invalid input: please check your data'}, 400
 
+    @api.doc(params={
+        'sort': 'Optional sort key: rating, reviews or price',
+        'min_price': 'Optional minimum price',
+        'max_price': 'Optional maximum price',
+        'bbox': 'Optional area: south,west,north,east in degrees',
+        'min_rating': 'Optional minimum average rating',
+        'amenities': 'Optional comma separated ids of required amenities',
+        'offset': 'Places to skip when filtering (default 0)',
+        'limit': 'Places to return when filtering or paging (default 50)',
+        'cursor': 'Keyset paging: empty for the first page, then the '
+                  'X-Next-Cursor header of the previous page'
+    })
     @api.response(200, 'List of places retrieved successfully')
+    @api.response(400, 'Invalid sort key or filter')
     def get(self):
-        """Retrieve a list of all places"""
+        """Retrieve a list of all places, or of the places matching filters"""
         """
+        Without any filter, offset or limit every place is returned. With
+        one, the matching page is returned and the X-Total-Count header
+        holds the number of matching places. With a cursor (and at most a
+        limit), pages of every place are read by keyset instead; the
+        X-Next-Cursor header, absent on the last page, reads the next.
+
         Returns:
             list: A list of dictionaries, each representing a place.
             int: HTTP status code.
         """
-        places = facade.get_all_places()
-        result = [place.to_dict() for place in places]
-        return result, 200
+        sort = request.args.get('sort')
+        if 'cursor' in request.args:
+            if any(name in request.args for name in SEARCH_ARGS
+                   if name != 'limit'):
+                return {'message': "cursor cannot be combined with "
+                                   "filters or offset"}, 400
+            try:
+                limit = int(request.args.get('limit', 50))
+                if limit < 1:
+                    raise ValueError("limit must be positive")
+                places, cursor = facade.get_places_page(
+                    sort, request.args['cursor'] or None, limit)
+            except ValueError as e:
+                return {'message': str(e)}, 400
+            headers = {'X-Next-Cursor': cursor} if cursor else {}
+            return [place.to_dict() for place in places], 200, headers
+        if not any(name in request.args for name in SEARCH_ARGS):
+            try:
+                places = facade.get_all_places(sort)
+            except ValueError as e:
+                return {'message': str(e)}, 400
+            result = [place.to_dict() for place in places]
+            return result, 200
+        try:
+            total, places = facade.search_places(sort=sort,
+                                                 **parse_search_args())
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        return [place.to_dict() for place in places], 200, {
+            'X-Total-Count': str(total)}
+
+
+@api.route('/top')
+class TopPlaceList(Resource):
+    """
+    Resource class for the "top rated" and "most reviewed" leaderboards.
+
+    Methods:
+        - GET: Retrieve the best places for a metric, optionally in the
+          geographic cell around a point.
+    """
+    @api.doc(params={
+        'metric': 'rated (default) or reviewed',
+        'lat': 'Optional latitude, restricts to the surrounding area',
+        'lng': 'Optional longitude, restricts to the surrounding area',
+        'limit': 'Number of places to return (default 10)'
+    })
+    @api.response(200, 'Leaderboard retrieved successfully')
+    @api.response(400, 'Invalid query parameters')
+    def get(self):
+        """Retrieve the leaderboard of places for a metric"""
+        try:
+            metric = request.args.get('metric', 'rated')
+            latitude = request.args.get('lat', type=float)
+            longitude = request.args.get('lng', type=float)
+            limit = request.args.get('limit', 10, type=int)
+            if limit < 1:
+                raise ValueError("limit must be positive")
+            ranked = facade.get_top_places(metric, latitude, longitude,
+                                           limit)
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        return [{
+            'id': place.id,
+            'title': place.title,
+            'price': place.price,
+            'latitude': place.latitude,
+            'longitude': place.longitude,
+            'review_count': place.review_count,
+            'average_rating': place.average_rating
+        } for place, _ in ranked], 200
+
+
+@api.route('/trending')
+class TrendingPlaceList(Resource):
+    """
+    Resource class for the trending places feed.
+
+    Methods:
+        - GET: Retrieve the places with the most recent activity.
+    """
+    @api.doc(params={'limit': 'Number of places to return (default 10)'})
+    @api.response(200, 'Trending places retrieved successfully')
+    @api.response(400, 'Invalid query parameters')
+    def get(self):
+        """Retrieve the trending places"""
+        limit = request.args.get('limit', 10, type=int)
+        if limit < 1:
+            return {'message': 'limit must be positive'}, 400
+        return [{
+            'id': place.id,
+            'title': place.title,
+            'price': place.price,
+            'latitude': place.latitude,
+            'longitude': place.longitude,
+            'trending_score': round(score, 3)
+        } for place, score in facade.get_trending_places(limit)], 200
+
+
+@api.route('/nearest')
+class NearestPlaceList(Resource):
+    """
+    Resource class for the places around a point.
+
+    Methods:
+        - GET: Retrieve the places nearest to a point, by distance.
+    """
+    @api.doc(params={
+        'lat': 'Latitude of the point',
+        'lng': 'Longitude of the point',
+        'k': 'Number of places to return (default 10)',
+        'radius_km': 'Optional maximum distance in kilometres'
+    })
+    @api.response(200, 'Nearest places retrieved successfully')
+    @api.response(400, 'Invalid query parameters')
+    def get(self):
+        """Retrieve the places nearest to a point, nearest first"""
+        try:
+            latitude = request.args.get('lat', type=float)
+            longitude = request.args.get('lng', type=float)
+            if latitude is None or longitude is None:
+                raise ValueError("lat and lng are required")
+            k = request.args.get('k', 10, type=int)
+            if not 1 <= k <= current_app.config['NEAREST_MAX_RESULTS']:
+                raise ValueError("k must be between 1 and " + str(
+                    current_app.config['NEAREST_MAX_RESULTS']))
+            radius_km = request.args.get('radius_km')
+            if radius_km is not None:
+                try:
+                    radius_km = float(radius_km)
+                except ValueError:
+                    raise ValueError("radius_km must be a number")
+            nearest = facade.get_nearest_places(latitude, longitude, k,
+                                                radius_km)
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        return [{
+            'id': place.id,
+            'title': place.title,
+            'price': place.price,
+            'latitude': place.latitude,
+            'longitude': place.longitude,
+            'distance_km': round(distance, 3)
+        } for place, distance in nearest], 200
+
+
+@api.route('/clusters')
+class PlaceClusterList(Resource):
+    """
+    Resource class for the map view.
+
+    Methods:
+        - GET: Retrieve the places of a viewport grouped per geohash cell.
+    """
+    @api.doc(params={
+        'bbox': 'Viewport: south,west,north,east in degrees',
+        'zoom': 'Map zoom level, 0 to 22'
+    })
+    @api.response(200, 'Clusters retrieved successfully')
+    @api.response(400, 'Invalid query parameters')
+    def get(self):
+        """Retrieve the clusters of places of a map viewport"""
+        try:
+            if 'bbox' not in request.args:
+                raise ValueError("bbox is required")
+            bbox = parse_bbox(request.args['bbox'])
+            zoom = request.args.get('zoom', type=int)
+            if zoom is None:
+                raise ValueError("zoom is required")
+            precision, clusters = facade.get_place_clusters(bbox, zoom)
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        return {'precision': precision, 'clusters': clusters}, 200
 
 
 @api.route('/<place_id>')
@@ -146,21 +390,32 @@ class PlaceResource(Resource):
         Returns:
             dict: Place data if found.
             int: HTTP status code.
+
+        The view counter flushes its counts with UPDATEs the change log
+        does not record, so with the cached backend 'views' is the count
+        as of the last logged write of the place (or cache reload), not
+        the current one.
         """
         place = facade.get_place(place_id)
         if place is None:
             return {'message': 'Place not found'}, 404
-        return place.to_dict(), 200
+        facade.record_place_view(place_id)
+        return place.to_dict(), 200, {'ETag': etag(place)}
 
     @jwt_required()
     @api.expect(place_model)
     @api.response(200, 'Place updated successfully')
     @api.response(404, 'Place not found')
     @api.response(400, 'Invalid input data')
+    @api.response(412, 'Place changed since the If-Match version')
     def put(self, place_id):
         """Update a place's information"""
         current_user_id = get_jwt_identity()
         data = api.payload
+        try:
+            versions = parse_if_match(request.headers.get('If-Match'))
+        except ValueError as e:
+            return {'message': str(e)}, 400
         if isinstance(data.get('owner_id'), dict):
             data['owner_id'] = data['owner_id'].get('id')
         place = facade.get_place(place_id)
@@ -171,12 +426,45 @@ class PlaceResource(Resource):
             return {'message': 'Unauthorized action.'}, 403
 
         try:
-            updated_place = facade.update_place(place_id, data)
+            updated_place = facade.update_place(place_id, data, versions)
             if not updated_place:
                 return {'message': 'Place not found'}, 404
             return {
                 "message": "Place updated successfully",
                 "place": updated_place.to_dict()
-            }, 200
+            }, 200, {'ETag': etag(updated_place)}
+        except PreconditionFailed as e:
+            return {'message': str(e)}, 412
         except ValueError as e:
             return {'message': str(e)}, 400
+
+
+@api.route('/<place_id>/events')
+class PlaceEventStream(Resource):
+    """
+    Resource class for the live events of a place.
+
+    Methods:
+        - GET: Server-Sent Events stream of the review creates, updates
+          and deletes and of the updates of the place.
+    """
+    @api.response(200, 'Event stream (text/event-stream)')
+    @api.response(404, 'Place not found')
+    @api.response(501, 'No live events with the memory backend')
+    @api.response(503, 'Too many open streams, or no evented worker')
+    def get(self, place_id):
+        """Stream the events of a place as they are committed"""
+        if facade.get_place(place_id) is None:
+            return {'message': 'Place not found'}, 404
+        try:
+            stream = facade.subscribe_place_events(place_id)
+        except DatabaseRequired as e:
+            return {'message': str(e)}, 501
+        except EventedWorkerRequired as e:
+            return {'message': str(e)}, 503
+        if stream is None:
+            return {'message': 'Too many open streams, retry later'}, 503
+        return Response(stream, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
@@ -24,12 +24,16 @@ Author:
     Your Name (or team/project name)
 
 """
+from app.api.v1.idempotency import idempotent
+from app.persistence.read_only import read_only_get
 from app.services import facade
+from app.services.versioning import PreconditionFailed, etag, parse_if_match
 from flask import request
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-api = Namespace('reviews', description='Review operations')
+api = Namespace('reviews', description='Review operations',
+                decorators=[read_only_get])
 
 # Define the review model for input validation and documentation
 review_model = api.model('Review', {
@@ -53,6 +57,9 @@ class ReviewList(Resource):
     @api.expect(review_model)
     @api.response(201, 'Review successfully created')
     @api.response(400, 'Invalid input data')
+    @api.response(409, 'Same Idempotency-Key still in progress')
+    @api.response(422, 'Idempotency-Key reused with another body')
+    @idempotent
     def post(self):
         """
         Create a new review.
@@ -151,14 +158,16 @@ class ReviewResource(Resource):
             'user_id': review.user_id,
             'place_id': review.place_id,
             'created_at': review.created_at.isoformat(),
-            'updated_at': review.updated_at.isoformat()
-        }, 200
+            'updated_at': review.updated_at.isoformat(),
+            'version': review.version
+        }, 200, {'ETag': etag(review)}
 
     @jwt_required()
     @api.expect(review_model)
     @api.response(200, 'Review updated successfully')
     @api.response(404, 'Review not found')
     @api.response(400, 'Invalid input data')
+    @api.response(412, 'Review changed since the If-Match version')
     def put(self, review_id):
         """
         Update an existing review.
@@ -176,6 +185,7 @@ class ReviewResource(Resource):
             200: Review updated successfully.
             400: Invalid input or update failed.
             404: Review not found.
+            412: The review changed since the version sent in If-Match.
         """
         review = facade.get_review(review_id)
         if not review:
@@ -185,7 +195,13 @@ class ReviewResource(Resource):
             return {'error': 'Unauthorized action.'}, 403
 
         data = request.get_json()
-        update_review = facade.update_review(review_id, data)
+        try:
+            versions = parse_if_match(request.headers.get('If-Match'))
+            update_review = facade.update_review(review_id, data, versions)
+        except PreconditionFailed as e:
+            return {'error': str(e)}, 412
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
         if not update_review:
             return {'error': 'Update failed'}, 400
@@ -197,8 +213,9 @@ class ReviewResource(Resource):
             'user_id': update_review.user_id,
             'place_id': update_review.place_id,
             'created_at': update_review.created_at.isoformat(),
-            'updated_at': update_review.updated_at.isoformat()
-        }, 200
+            'updated_at': update_review.updated_at.isoformat(),
+            'version': update_review.version
+        }, 200, {'ETag': etag(update_review)}
 
     @jwt_required()
     @api.response(200, 'Review deleted successfully')
@@ -9,12 +9,16 @@ This module defines the RESTful routes for user-related operations such as:
 The endpoints are exposed under the '/users/' namespace using Flask-RESTx.
 """
 
+from app.api.v1.idempotency import idempotent
+from app.persistence.read_only import read_only_get
 from app.services import facade
+from app.services.versioning import PreconditionFailed, etag, parse_if_match
 from flask import request
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-api = Namespace('users', description='User operations')
+api = Namespace('users', description='User operations',
+                decorators=[read_only_get])
 
 # Define the user model for input validation and documentation
 user_model = api.model('User', {
@@ -41,6 +45,9 @@ class UserList(Resource):
     @api.response(201, 'User successfully created')
     @api.response(400, 'Email already registered')
     @api.response(400, 'Invalid input data')
+    @api.response(409, 'Same Idempotency-Key still in progress')
+    @api.response(422, 'Idempotency-Key reused with another body')
+    @idempotent
     def post(self):
         """Register a new user.
 
@@ -107,13 +114,15 @@ class UserResource(Resource):
         if not user:
             return {'error': 'User not found'}, 404
         return {'id': user.id, 'first_name': user.first_name,
-                'last_name': user.last_name, 'email': user.email}, 200
+                'last_name': user.last_name, 'email': user.email,
+                'version': user.version}, 200, {'ETag': etag(user)}
 
     @jwt_required()
     @api.expect(user_update_model, validate=True)
     @api.response(200, 'Successfully update')
     @api.response(400, 'Invalid input data')
     @api.response(403, 'Forbidden: cannot update another user')
+    @api.response(412, 'User changed since the If-Match version')
     def put(self, user_id):
         """Update user information.
 
@@ -141,7 +150,13 @@ class UserResource(Resource):
         data.pop('email', None)
         data.pop('password', None)
 
-        updated_user = facade.put_user(user_id, data)
+        try:
+            versions = parse_if_match(request.headers.get('If-Match'))
+            updated_user = facade.put_user(user_id, data, versions)
+        except PreconditionFailed as e:
+            return {'error': str(e)}, 412
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
         if not updated_user:
             return {'error': 'Update failed'}, 400
@@ -151,5 +166,6 @@ class UserResource(Resource):
             'first_name': updated_user.first_name,
             'last_name': updated_user.last_name,
             'email': updated_user.email,
+            'version': updated_user.version,
             'message': 'User successfully updated'
-        }, 200
+        }, 200, {'ETag': etag(updated_user)}
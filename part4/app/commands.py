@@ -0,0 +1,102 @@
+"""
+Flask CLI commands for maintenance tasks.
+
+The commands are registered on the application by `create_app` and run
+inside an application context, e.g.:
+
+    flask --app run reconcile-ratings
+"""
+import sys
+
+import click
+
+from app.extensions import replicas, shards
+from app.services import facade
+from app.services.facade import DatabaseRequired
+
+
+def register_commands(app):
+    """Attach the maintenance commands to the Flask CLI of `app`."""
+
+    @app.cli.command('reconcile-ratings')
+    def reconcile_ratings():
+        """Recompute the rating aggregates of every place from reviews."""
+        fixed = facade.reconcile_rating_aggregates()
+        click.echo(f"{fixed} place(s) had their rating aggregates fixed")
+
+    @app.cli.command('import-ndjson')
+    @click.argument('kind', type=click.Choice(['places', 'amenities',
+                                               'users']))
+    @click.argument('path')
+    def import_ndjson(kind, path):
+        """Bulk import KIND from the NDJSON file PATH ('-' for stdin).
+
+        Files ending in .gz are decompressed on the fly.
+        """
+        try:
+            if path == '-':
+                report = facade.import_ndjson(kind, sys.stdin.buffer)
+            else:
+                with open(path, 'rb') as stream:
+                    report = facade.import_ndjson(kind, stream,
+                                                  path.endswith('.gz'))
+        except DatabaseRequired as e:
+            raise click.UsageError(str(e))
+        for error in report.errors:
+            click.echo(f"line {error['line']}: {error['error']}", err=True)
+        click.echo(f"{report.inserted}/{report.total} {kind} imported, "
+                   f"{report.error_count} failed")
+
+    @app.cli.command('export')
+    @click.argument('entity', type=click.Choice(['places', 'reviews']))
+    @click.argument('path')
+    @click.option('--format', 'fmt', default='csv',
+                  type=click.Choice(['csv', 'ndjson', 'parquet']))
+    @click.option('--gzip', 'compress', flag_value='gzip', default=None,
+                  help='Compress the output with gzip.')
+    def export(entity, path, fmt, compress):
+        """Export ENTITY to the file PATH ('-' for stdout)."""
+        try:
+            chunks = facade.export_stream(entity, fmt, compress)
+        except (ValueError, DatabaseRequired) as e:
+            raise click.UsageError(str(e))
+        output = sys.stdout.buffer if path == '-' else open(path, 'wb')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+
+    @app.cli.command('build-catalogue')
+    def build_catalogue():
+        """Write the catalogue snapshot of CATALOGUE_SNAPSHOT_PATH now."""
+        try:
+            places, amenities = facade.build_catalogue()
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        click.echo(f"{places} place(s) and {amenities} amenity(ies) written")
+
+    @app.cli.command('sync-replicas')
+    def sync_replicas():
+        """Copy the primary SQLite database over the SQLite read replicas."""
+        try:
+            count = replicas.sync()
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        click.echo(f"{count} replica(s) synced")
+
+    @app.cli.command('reshard')
+    @click.argument('uris', nargs=-1, required=True)
+    @click.option('--batch-size', default=1000, show_default=True,
+                  help='Rows read from a shard at a time.')
+    def reshard(uris, batch_size):
+        """Move users, places and reviews to the shards URIS.
+
+        Rows are read from the shards of SQLALCHEMY_SHARDS (the primary
+        database when it is empty). Stop the application first, then set
+        SQLALCHEMY_SHARDS to URIS once done.
+        """
+        moved = shards.reshard(app, uris, batch_size)
+        for table, count in moved.items():
+            click.echo(f"{table}: {count} row(s) moved")
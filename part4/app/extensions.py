@@ -1,8 +1,24 @@
 # app/extensions.py
+import click
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 
-db = SQLAlchemy()
+from app.persistence.replicas import RoutingSession, replicas
+from app.persistence.sharding import shards
+
+
+def serving():
+    """
+    Whether the app is created to serve requests, i.e. not by a `flask`
+    command other than `flask run`: background threads (trending ticks,
+    view counter flushes, job dispatcher, repository cache and catalogue
+    refreshes) are only started when serving.
+    """
+    context = click.get_current_context(silent=True)
+    return context is None or context.info_name == 'run'
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 jwt = JWTManager()
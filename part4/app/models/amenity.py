@@ -6,6 +6,7 @@ and the Amenity class for storing information about place amenities.
 """
 from app.extensions import db
 from .baseclass import BaseModel
+from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import relationship
 
 
@@ -21,6 +22,9 @@ class Amenity(BaseModel):
     """
     __tablename__ = 'amenities'
     name = db.Column(db.String(128), nullable=False)
+    place_links = relationship('PlaceAmenity', back_populates='amenity',
+                               cascade='all, delete-orphan')
+    places = association_proxy('place_links', 'place')
 
     def __init__(self, name):
         super().__init__()
@@ -29,5 +33,6 @@ class Amenity(BaseModel):
     def to_dict(self):
         return {
             'id': self.id,
-            'name': self.name
+            'name': self.name,
+            'version': self.version
         }
@@ -1,5 +1,6 @@
 from app import db
 from datetime import datetime, timezone
+from sqlalchemy.orm import declared_attr
 import uuid
 
 
@@ -10,6 +11,14 @@ class BaseModel(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate= lambda: datetime.now(timezone.utc))
+    # Optimistic concurrency: every ORM UPDATE/DELETE checks the version
+    # read with the row and bumps it, raising StaleDataError when another
+    # writer got there first (see app/services/versioning.py).
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    @declared_attr.directive
+    def __mapper_args__(cls):
+        return {'version_id_col': cls.__table__.c.version}
 
     def save(self):
         """
@@ -27,7 +36,7 @@ class BaseModel(db.Model):
             data (dict): Dictionary of attributes to update.
         """
         for key, value in data.items():
-            if hasattr(self, key):
+            if hasattr(self, key) and key != 'version':
                 setattr(self, key, value)
         self.save()
 
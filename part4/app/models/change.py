@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+"""
+Change module.
+
+This module defines the Change model: one row of the change log read by
+the delta-sync endpoint (GET /api/v1/changes).
+"""
+from datetime import datetime, timezone
+
+from app.extensions import db
+
+
+class Change(db.Model):
+    """
+    A write to a place, review or amenity.
+
+    Attributes:
+        seq (int): Monotonic cursor of the log. AUTOINCREMENT guarantees
+            that a value is never reused, even after purging.
+        entity (str): 'places', 'reviews' or 'amenities'.
+        entity_id (str): Id of the written row.
+        op (str): 'upsert' for a create or update, 'delete' for a
+            tombstone.
+        created_at (datetime): When the write was logged.
+    """
+    __tablename__ = 'changes'
+
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.String(36), nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index('ix_changes_created_at', 'created_at'),
+        {'sqlite_autoincrement': True},
+    )
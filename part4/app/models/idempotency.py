@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+"""
+Idempotency module.
+
+This module defines the IdempotencyKey model: the stored outcome of a
+POST sent with an Idempotency-Key header, replayed to retries of it.
+"""
+from app.extensions import db
+
+
+class IdempotencyKey(db.Model):
+    """
+    One idempotent request and, once it completed, its response.
+
+    Attributes:
+        key (str): SHA-256 of the method, path, credentials and client key,
+            so two clients (or two endpoints) never share a key.
+        request_hash (str): SHA-256 of the request body; a retry with the
+            same key but another body is rejected.
+        status (str): 'running' while the first request executes, then
+            'done'.
+        response_status (int): HTTP status of the stored response.
+        response (str): JSON encoded body and headers of the response.
+        locked_until (datetime): A running request older than this is
+            considered dead and may be taken over by a retry.
+        expires_at (datetime): When the key may be forgotten.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(64), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(10), nullable=False)
+    response_status = db.Column(db.Integer)
+    response = db.Column(db.Text)
+    locked_until = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+"""
+Job module.
+
+This module defines the models backing the background job runner:
+- Job: one unit of deferred work in the persistent queue.
+- JobLease: a named, expiring lock, used to elect the single worker that
+  runs the scheduled jobs.
+"""
+import json
+
+from app.extensions import db
+from .baseclass import BaseModel
+
+
+class Job(BaseModel):
+    """
+    Represents a queued, running or finished background job.
+
+    Attributes:
+        name (str): Name of the registered handler to run.
+        payload (str): JSON encoded keyword arguments of the handler.
+        status (str): queued, running, done or failed.
+        attempts (int): Number of times the job has been started.
+        max_attempts (int): Attempts allowed before the job fails.
+        run_at (datetime): Earliest time the job may start.
+        unique_key (str): Optional key preventing duplicate jobs, used by
+            the scheduler so a cron slot is enqueued once.
+        locked_by (str): Worker running the job.
+        locked_at (datetime): When the job was claimed.
+        last_error (str): Error of the last failed attempt.
+        result (str): JSON encoded return value of the handler.
+        progress (float): Fraction of the work done, reported by the
+            handler (0.0 to 1.0).
+    """
+    __tablename__ = 'jobs'
+
+    STATUSES = ('queued', 'running', 'done', 'failed')
+
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False)
+    unique_key = db.Column(db.String(150), unique=True)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)
+    progress = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'payload': json.loads(self.payload),
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat(),
+            'last_error': self.last_error,
+            'result': json.loads(self.result) if self.result else None,
+            'progress': self.progress,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+class JobLease(db.Model):
+    """
+    A named lock held by one worker until it expires.
+
+    Attributes:
+        name (str): Name of the lease (e.g. "scheduler").
+        holder (str): Identifier of the worker holding the lease.
+        expires_at (datetime): Time after which another worker may take it.
+    """
+    __tablename__ = 'job_leases'
+
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
@@ -9,15 +9,32 @@ This module defines two classes: BaseModel and Place.
 """
 from app.extensions import db
 from .baseclass import BaseModel
-from sqlalchemy import Column, ForeignKey, Integer
+from sqlalchemy import Column, ForeignKey, String, case
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
 place_amenity = db.Table('place_amenity',
-                         Column('place_id', Integer, ForeignKey('places.id'), primary_key=True),
-                         Column('amenity_id', Integer, ForeignKey('amenities.id'), primary_key=True)
+                         Column('place_id', String(36), ForeignKey('places.id'), primary_key=True),
+                         Column('amenity_id', String(36), ForeignKey('amenities.id'), primary_key=True)
                          )
 
 
+class PlaceAmenity(db.Model):
+    """
+    Link between a place and one of its amenities.
+
+    Mapped as an association object rather than a plain many-to-many
+    `secondary` so that loading the amenities of places never joins the
+    places table: with sharded storage (app/persistence/sharding.py) the
+    links live with the amenities while places are spread over shards.
+    """
+    __table__ = place_amenity
+    place = relationship('Place', back_populates='amenity_links')
+    amenity = relationship('Amenity', back_populates='place_links',
+                           lazy='selectin')
+
+
 class Place(BaseModel):
     """
     Represents a place available for rental.
@@ -34,8 +51,20 @@ class Place(BaseModel):
         longitude (float): Longitude coordinate (-180.0 to 180.0).
         amenities (list): List of associated Amenity objects.
         reviews (list): List of associated Review objects.
+        review_count (int): Number of reviews left on the place.
+        rating_sum (int): Sum of all review ratings.
+        rating_1 .. rating_5 (int): Rating histogram, one counter per star.
+        views (int): Number of detail page views, flushed in batches by
+            the view counter.
+
+    The rating aggregates are maintained by ReviewRepository in the same
+    transaction as the review write, so the average rating can be read
+    (or sorted on) without loading the reviews table.
     """
 
+    RATING_COLUMNS = ('rating_1', 'rating_2', 'rating_3', 'rating_4',
+                      'rating_5')
+
     __tablename__ = 'places'
 
     title = db.Column(db.String(100), nullable=False)
@@ -44,11 +73,24 @@ class Place(BaseModel):
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
 
-    owner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    views = db.Column(db.Integer, nullable=False, default=0)
+
+    owner_id = Column(String(36), ForeignKey('users.id'), nullable=False)
     owner = relationship('User', back_populates="places")
     reviews = relationship('Review', backref='place', lazy=True)
-    amenities = relationship('Amenity', secondary=place_amenity, lazy='subquery',
-                             backref=db.backref('places', lazy=True))
+    amenity_links = relationship('PlaceAmenity', back_populates='place',
+                                 lazy='selectin',
+                                 cascade='all, delete-orphan')
+    amenities = association_proxy(
+        'amenity_links', 'amenity',
+        creator=lambda amenity: PlaceAmenity(amenity=amenity))
 
     def __init__(self, title, description, price, latitude, longitude, owner, owner_id):
         super().__init__()
@@ -60,6 +102,24 @@ class Place(BaseModel):
         self.owner = owner
         self.owner_id = owner_id
 
+    @hybrid_property
+    def average_rating(self):
+        """Average review rating, or None when the place has no review."""
+        if not self.review_count:
+            return None
+        return round(self.rating_sum / self.review_count, 2)
+
+    @average_rating.expression
+    def average_rating(cls):
+        return case((cls.review_count > 0,
+                     cls.rating_sum * 1.0 / cls.review_count), else_=None)
+
+    @property
+    def rating_histogram(self):
+        """Number of reviews for each star, keyed by rating ('1'..'5')."""
+        return {str(star): getattr(self, column) or 0
+                for star, column in enumerate(self.RATING_COLUMNS, start=1)}
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -73,6 +133,12 @@ class Place(BaseModel):
                 "first_name": self.owner.first_name,
                 "last_name": self.owner.last_name
             },
+            'review_count': self.review_count or 0,
+            'rating_sum': self.rating_sum or 0,
+            'average_rating': self.average_rating,
+            'rating_histogram': self.rating_histogram,
+            'views': self.views or 0,
+            'version': self.version,
             'amenities': [a.to_dict() for a in self.amenities],
             'reviews': [r.to_dict() for r in self.reviews]
         }
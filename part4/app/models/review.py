@@ -31,7 +31,7 @@ Usage example:
 
 from app.extensions import db
 from .baseclass import BaseModel
-from sqlalchemy import CheckConstraint, Column, ForeignKey, Integer
+from sqlalchemy import CheckConstraint, Column, ForeignKey, String
 from sqlalchemy.orm import relationship
 
 class Review(BaseModel):
@@ -41,8 +41,8 @@ class Review(BaseModel):
 
     text = db.Column(db.String(1000), nullable=False)
     rating = db.Column(db.Integer, nullable=False)
-    place_id = Column(Integer, ForeignKey('places.id'), nullable=False)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    place_id = Column(String(36), ForeignKey('places.id'), nullable=False)
+    user_id = Column(String(36), ForeignKey('users.id'), nullable=False)
     user = relationship('User', back_populates='reviews')
 
     __table_args__ = (
@@ -55,6 +55,8 @@ class Review(BaseModel):
             'id': self.id,
             'text': self.text,
             'rating': self.rating,
+            'place_id': self.place_id,
+            'version': self.version,
             'user':{
                 'user_first_name': self.user.first_name,
                 'user_last_name': self.user.last_name
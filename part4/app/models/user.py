@@ -79,8 +79,12 @@ class User(BaseModel):
     places = relationship('Place', back_populates="owner", lazy=True)
     reviews = relationship('Review', back_populates='user', lazy=True)
 
+    # Changed owners are polled by updated_at (cached repository backend)
+    __table_args__ = (db.Index('ix_users_updated_at', 'updated_at'),)
 
-    def is_email_valid(self, email):
+
+    @staticmethod
+    def is_email_valid(email):
         """
         Validate the format of an email address using a regular expression.
 
@@ -0,0 +1,80 @@
+"""
+Read-only request mode.
+
+GET handlers only read, yet the default session autoflushes before every
+query, keeps its implicit transaction (and, on SQLite, its shared lock)
+open until the request is torn down, and holds the pooled connection the
+whole time. `read_only_get`, installed as a namespace decorator, runs
+every GET of the namespace on a dedicated session instead:
+
+- autoflush is off;
+- its connection runs in AUTOCOMMIT, the lightest isolation level: no
+  BEGIN is issued, so each SELECT is its own implicit transaction and
+  takes no lock beyond the statement;
+- it is closed as soon as the response has been serialized, giving the
+  connection back to the pool before the request finishes;
+- any write through it raises ReadOnlySessionError: a flush, an INSERT,
+  UPDATE or DELETE statement, or changes still pending at the end;
+- all of its reads may go to a read replica (app/persistence/replicas.py).
+
+The request's regular session is set aside meanwhile and restored after,
+so callers sharing it (tests, batch sub-requests) are not disturbed.
+"""
+from functools import wraps
+
+from flask import request
+from sqlalchemy import event
+
+from app import db
+
+
+class ReadOnlySessionError(RuntimeError):
+    """A write was attempted during a read-only request."""
+
+
+def _refuse_flush(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        raise ReadOnlySessionError(
+            "Cannot flush changes in a read-only request")
+
+
+def _refuse_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update \
+            or orm_execute_state.is_delete:
+        raise ReadOnlySessionError(
+            "Cannot execute a write statement in a read-only request")
+
+
+def read_only_session():
+    """Create a session in read-only mode (see the module docstring)."""
+    session = db.session.session_factory(autoflush=False)
+    session.info['read_only'] = True
+    session.info['read_replica'] = True
+    event.listen(session, 'before_flush', _refuse_flush)
+    event.listen(session, 'do_orm_execute', _refuse_dml)
+    session.connection(execution_options={'isolation_level': 'AUTOCOMMIT'})
+    return session
+
+
+def read_only_get(view):
+    """Namespace decorator running GET requests in read-only mode."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET':
+            return view(*args, **kwargs)
+        registry = db.session.registry
+        previous = registry() if registry.has() else None
+        session = read_only_session()
+        registry.set(session)
+        try:
+            response = view(*args, **kwargs)
+            # Changes left pending would be silently dropped by close().
+            _refuse_flush(session, None, None)
+            return response
+        finally:
+            session.close()
+            if previous is None:
+                registry.clear()
+            else:
+                registry.set(previous)
+    return wrapper
@@ -0,0 +1,259 @@
+"""
+Read-replica routing.
+
+With SQLALCHEMY_REPLICAS set to a list of database URIs, the reads of GET
+requests go to a replica chosen round-robin among the healthy ones, and
+everything else goes to the primary (SQLALCHEMY_DATABASE_URI):
+
+- `db.session` is a RoutingSession whose get_bind sends SELECTs to a
+  replica when the session is in read mode: inside the read methods of
+  the repositories (`replica_read`) and for the whole of a read-only GET
+  (app/persistence/read_only.py). One replica is used per transaction so
+  a request never mixes two replication states.
+- Writes, flushes and every later statement of a request that has
+  written go to the primary, so a request reads its own writes. The
+  reads of other methods go to the primary too: a PUT must check the
+  If-Match version against the row it is about to update, not a lagging
+  copy.
+- Read-your-writes across requests: once a client has written, its reads
+  stay on the primary for READ_YOUR_WRITES_SECONDS. Clients are told
+  apart by their Authorization header, or by address when anonymous.
+- A replica whose connection fails (a disconnect or an OperationalError,
+  not the error of one bad statement) is taken out of rotation and probed
+  again with `SELECT 1` after REPLICA_RETRY_SECONDS. With no healthy
+  replica, reads fall back to the primary.
+- Outside requests (jobs, CLI) everything runs on the primary: those
+  read-modify-write paths cannot afford a lagging read.
+
+Locally, replicas can be SQLite files refreshed from the primary with
+`flask sync-replicas` or the `sync_replicas` job.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.exc import OperationalError
+
+# Set in the WSGI environ of a request once it has written to the database.
+WROTE = 'hbnb.replicas.wrote'
+
+
+def resolve_uri(app, uri):
+    """URL of `uri`, with relative SQLite paths made relative to the
+    instance folder as Flask-SQLAlchemy does for the primary."""
+    url = make_url(uri)
+    if url.drivername.startswith('sqlite') and url.database \
+            and url.database != ':memory:' \
+            and not os.path.isabs(url.database):
+        os.makedirs(app.instance_path, exist_ok=True)
+        url = url.set(database=os.path.join(app.instance_path,
+                                            url.database))
+    return url
+
+
+class Replica:
+    """A replica engine and its health."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.failed_at = 0.0
+
+
+class ReplicaRouter:
+    """
+    Chooses the engine of replica reads and remembers recent writers.
+
+    Attributes:
+        replicas (list): Configured Replica objects.
+        pin_seconds (float): Read-your-writes window after a write.
+        retry_seconds (float): Delay before probing a failed replica.
+    """
+
+    def __init__(self):
+        self.replicas = []
+        self.pin_seconds = 5.0
+        self.retry_seconds = 10.0
+        self._cycle = itertools.count()
+        self._pins = {}
+        self._lock = threading.Lock()
+        self._primary_uri = None
+
+    @property
+    def enabled(self):
+        return bool(self.replicas)
+
+    def init_app(self, app):
+        self.pin_seconds = app.config.get('READ_YOUR_WRITES_SECONDS',
+                                          self.pin_seconds)
+        self.retry_seconds = app.config.get('REPLICA_RETRY_SECONDS',
+                                            self.retry_seconds)
+        self._primary_uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.replicas = []
+        for index, uri in enumerate(app.config.get('SQLALCHEMY_REPLICAS',
+                                                   [])):
+            engine = create_engine(resolve_uri(app, uri), **options)
+            replica = Replica(f"replica-{index}", engine)
+            event.listen(engine, 'handle_error',
+                         lambda context, replica=replica:
+                         self._failed(replica, context))
+            self.replicas.append(replica)
+        app.after_request(self._pin_writer)
+
+    def _failed(self, replica, context):
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception,
+                                               OperationalError):
+            replica.healthy = False
+            replica.failed_at = time.monotonic()
+
+    def _probe(self, replica):
+        try:
+            with replica.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except Exception:
+            replica.failed_at = time.monotonic()
+            return False
+        replica.healthy = True
+        return True
+
+    def choose(self):
+        """Return the engine of the next healthy replica, or None."""
+        count = len(self.replicas)
+        start = next(self._cycle)
+        for offset in range(count):
+            replica = self.replicas[(start + offset) % count]
+            if replica.healthy:
+                return replica.engine
+            if time.monotonic() - replica.failed_at >= self.retry_seconds \
+                    and self._probe(replica):
+                return replica.engine
+        return None
+
+    def client_key(self):
+        return request.headers.get('Authorization') or request.remote_addr
+
+    def pinned(self):
+        """True if the client of the current request wrote recently."""
+        return self._pins.get(self.client_key(), 0.0) > time.monotonic()
+
+    def _pin_writer(self, response):
+        if self.enabled and request.environ.get(WROTE):
+            now = time.monotonic()
+            with self._lock:
+                if len(self._pins) > 10000:
+                    self._pins = {key: until for key, until
+                                  in self._pins.items() if until > now}
+                self._pins[self.client_key()] = now + self.pin_seconds
+        return response
+
+    def sync(self):
+        """
+        Copy the primary SQLite database over every replica file, with
+        SQLite's online backup.
+
+        Returns:
+            int: Number of replicas refreshed. A replica that cannot be
+            written is marked unhealthy and skipped.
+
+        Raises:
+            ValueError: If the primary or a replica is not a SQLite file.
+        """
+        primary = make_url(self._primary_uri)
+        if not primary.drivername.startswith('sqlite'):
+            raise ValueError("Only SQLite replicas can be synced locally")
+        from app.extensions import db
+
+        source = sqlite3.connect(db.engine.url.database)
+        synced = 0
+        try:
+            for replica in self.replicas:
+                if not replica.engine.url.drivername.startswith('sqlite'):
+                    raise ValueError(f"{replica.name} is not SQLite")
+                try:
+                    target = sqlite3.connect(replica.engine.url.database)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+                except sqlite3.Error:
+                    replica.healthy = False
+                    replica.failed_at = time.monotonic()
+                    continue
+                synced += 1
+        finally:
+            source.close()
+        return synced
+
+
+replicas = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session sending reads in read mode to replicas."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            engine = self.info.get('replica_engine')
+            if engine is None:
+                engine = self.info['replica_engine'] = replicas.choose()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+    def _reads_from_replica(self, clause):
+        return (replicas.enabled and self.info.get('read_replica')
+                and not self._flushing
+                and (clause is None or getattr(clause, 'is_select', False))
+                and has_request_context()
+                and request.method in ('GET', 'HEAD')
+                and not request.environ.get(WROTE)
+                and not replicas.pinned())
+
+
+def replica_read(method):
+    """Decorator letting the queries of a repository read method go to a
+    replica (see the module docstring)."""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        from app.extensions import db
+
+        info = db.session().info
+        previous = info.get('read_replica', False)
+        info['read_replica'] = True
+        try:
+            return method(*args, **kwargs)
+        finally:
+            info['read_replica'] = previous
+    return wrapper
+
+
+def _wrote():
+    if has_request_context():
+        request.environ[WROTE] = True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, flush_context):
+    _wrote()
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _executed(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update \
+            or orm_execute_state.is_delete:
+        _wrote()
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _transaction_ended(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('replica_engine', None)
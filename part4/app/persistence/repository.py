@@ -1,5 +1,9 @@
+import threading
 from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
 from app import db
+from app.persistence.replicas import replica_read
 
 
 class Repository(ABC):
@@ -36,9 +40,11 @@ class SQLAlchemyRepository(Repository):
         db.session.add(obj)
         db.session.commit()
 
+    @replica_read
     def get(self, obj_id):
         return self.model.query.get(obj_id)
 
+    @replica_read
     def get_all(self):
         return self.model.query.all()
 
@@ -55,6 +61,178 @@ class SQLAlchemyRepository(Repository):
             db.session.delete(obj)
             db.session.commit()
 
+    @replica_read
     def get_by_attribute(self, attr_name, attr_value):
         return self.model.query.filter(
             getattr(self.model, attr_name) == attr_value).first()
+
+
+class InMemoryRepository(Repository):
+    """
+    Repository keeping model instances in memory, never in the database.
+
+    The instances are transient ORM objects linked by plain references
+    (`place.owner`, `review.place`, ...). add() fills the columns left
+    unset with their defaults (id, timestamps, version, counters) as an
+    INSERT would, and save() bumps the version and updated_at as an ORM
+    UPDATE would, so the optimistic concurrency checks work the same.
+
+    Indexed attributes are given by name. A unique index maps a value to
+    one object and refuses a second object with the same value; a
+    multi-valued index maps a value to every object holding it, in
+    insertion order. None values are not indexed. An object changed in
+    place must be passed to save() or reindex().
+
+    Writers hold `lock`, shared by the repositories of a backend since a
+    write may change objects of several of them. Readers take no lock.
+
+    Args:
+        model: Model class of the stored objects.
+        unique (iterable): Attributes with a unique index.
+        indexes (iterable): Attributes with a multi-valued index.
+        lock: Lock of the writers, a new RLock by default.
+    """
+
+    def __init__(self, model, unique=(), indexes=(), lock=None):
+        self.model = model
+        self.lock = lock or threading.RLock()
+        self._storage = {}
+        self._unique = {attr: {} for attr in unique}
+        self._indexes = {attr: {} for attr in indexes}
+        # Indexed values of each stored object, as last indexed, so an
+        # entry can be removed after the object changed.
+        self._indexed = {}
+
+    def add(self, obj):
+        with self.lock:
+            _apply_defaults(obj)
+            self._replace_entries(obj)
+            self._storage[obj.id] = obj
+
+    def get(self, obj_id):
+        return self._storage.get(obj_id)
+
+    def get_all(self):
+        return list(self._storage.values())
+
+    def update(self, obj_id, data):
+        with self.lock:
+            obj = self.get(obj_id)
+            if obj:
+                # Refuse a duplicate before the object is changed
+                for attr, index in self._unique.items():
+                    value = data.get(attr)
+                    if value is not None \
+                            and index.get(value, obj_id) != obj_id:
+                        raise ValueError(f"{attr} already exists: {value}")
+                for key, value in data.items():
+                    setattr(obj, key, value)
+                self.save(obj)
+
+    def delete(self, obj_id):
+        with self.lock:
+            if obj_id in self._storage:
+                self._unindex(obj_id)
+                del self._storage[obj_id]
+
+    def get_by_attribute(self, attr_name, attr_value):
+        if attr_name in self._unique:
+            return self.get(self._unique[attr_name].get(attr_value))
+        return next(iter(self.get_all_by_attribute(attr_name, attr_value)),
+                    None)
+
+    def get_all_by_attribute(self, attr_name, attr_value):
+        """Return every object whose attribute `attr_name` is `attr_value`."""
+        if attr_name in self._unique:
+            obj = self.get_by_attribute(attr_name, attr_value)
+            return [obj] if obj else []
+        if attr_name in self._indexes:
+            ids = list(self._indexes[attr_name].get(attr_value, ()))
+            return [obj for obj in map(self._storage.get, ids)
+                    if obj is not None]
+        return [obj for obj in self.get_all()
+                if getattr(obj, attr_name) == attr_value]
+
+    def save(self, obj):
+        """Record a write of a stored object changed in place."""
+        with self.lock:
+            obj.version = (obj.version or 0) + 1
+            obj.updated_at = datetime.now(timezone.utc)
+            self.reindex(obj)
+
+    def replace(self, obj):
+        """
+        Store `obj` in place of the stored object with the same id, so
+        readers see either the previous object or the new one, never a
+        mix of both.
+
+        Raises:
+            ValueError: If the object duplicates a unique value; the
+            previous object is kept.
+        """
+        with self.lock:
+            self._replace_entries(obj)
+            self._storage[obj.id] = obj
+
+    def reindex(self, obj):
+        """
+        Refresh the index entries of a stored object after it was changed
+        in place.
+
+        Raises:
+            ValueError: If the object now duplicates a unique value; its
+            previous entries are kept.
+        """
+        with self.lock:
+            if obj.id in self._storage:
+                self._replace_entries(obj)
+
+    def _replace_entries(self, obj):
+        previous = self._indexed.get(obj.id)
+        if previous is not None:
+            self._unindex(obj.id)
+        for attr, index in self._unique.items():
+            value = getattr(obj, attr)
+            if value is not None and index.get(value, obj.id) != obj.id:
+                if previous is not None:
+                    self._index(obj.id, previous)
+                raise ValueError(f"{attr} already exists: {value}")
+        self._index(obj.id, {attr: getattr(obj, attr)
+                             for attr in (*self._unique, *self._indexes)})
+
+    def _index(self, obj_id, values):
+        for attr, value in values.items():
+            if value is None:
+                continue
+            if attr in self._unique:
+                self._unique[attr][value] = obj_id
+            else:
+                # Buckets are replaced, never changed, so a reader can
+                # iterate the one it got.
+                bucket = self._indexes[attr].get(value, {})
+                self._indexes[attr][value] = {**bucket, obj_id: None}
+        self._indexed[obj_id] = values
+
+    def _unindex(self, obj_id):
+        for attr, value in self._indexed.pop(obj_id).items():
+            if attr in self._unique:
+                if self._unique[attr].get(value) == obj_id:
+                    del self._unique[attr][value]
+            elif obj_id in self._indexes[attr].get(value, ()):
+                bucket = dict(self._indexes[attr][value])
+                del bucket[obj_id]
+                if bucket:
+                    self._indexes[attr][value] = bucket
+                else:
+                    del self._indexes[attr][value]
+
+
+def _apply_defaults(obj):
+    """Set the columns of `obj` left None to their default, as an INSERT
+    does."""
+    for column in obj.__table__.columns:
+        default = column.default
+        if default is None or getattr(obj, column.key) is not None:
+            continue
+        setattr(obj, column.key,
+                default.arg(None) if default.is_callable else default.arg)
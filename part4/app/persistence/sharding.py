@@ -0,0 +1,367 @@
+"""
+Hash-sharded storage of users, places and reviews.
+
+With SQLALCHEMY_SHARDS set to a list of database URIs, the rows of the
+sharded tables are spread over those databases by a hash of a shard key:
+
+    users    by id
+    places   by id
+    reviews  by place_id, so a place and its reviews share a shard
+
+Every other table (amenities, place_amenity, changes, jobs, ...) stays on
+the primary database (SQLALCHEMY_DATABASE_URI), known as the 'global'
+shard.
+
+`db.session` becomes a ShardedSession (sqlalchemy.ext.horizontal_shard),
+so the repositories and the facade work unchanged:
+
+- a new object is written to the shard of its key, and keeps it;
+- a statement whose WHERE clause pins the shard key (`id == x`,
+  `id IN (...)`, the lazy load of `place.reviews`, ...) runs on the
+  shards of those keys only;
+- any other query on a sharded table is scattered to every shard and the
+  results are gathered; sorted lists are sorted again in the repository
+  (PlaceRepository.get_all_places). Pages of places read by keyset
+  (PlaceRepository.get_places_page) merge the sorted pages of every
+  shard after the cursor, and exports merge the keyset batches of every
+  shard by id (app/services/bulk_export.py);
+- bulk inserts must be split by shard with `insert_rows`.
+
+Keys are placed with jump consistent hashing, so going from N to N+1
+shards moves about 1/(N+1) of the rows. `flask reshard URI...` moves the
+rows to a new list of shards; SQLALCHEMY_SHARDS is then set to that list.
+
+Limits of the scheme: uniqueness of user emails and the foreign keys
+from places and reviews to users are not enforced across shards (create
+shard schemas without those foreign keys on engines enforcing them); a
+review cannot move to a place of another shard; read replicas cannot be
+combined with shards. Nor can the change log (app/services/change_log.py):
+it is not kept, GET /api/v1/changes answers 501, and the features
+reading it, the cached repository backend and the catalogue snapshot,
+are refused.
+
+A session writing to several databases commits them one after the
+other, not atomically: a place is written on its shard but its amenity
+links (place_amenity) on the primary, so a crash between the two commits
+can leave a place without its links, or links to a place that was never
+committed. The links of a missing place are never read (places are
+loaded from their shard first); a place missing links is fixed by
+writing its amenities again.
+"""
+import hashlib
+import operator
+import uuid
+
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.ext import horizontal_shard
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+from sqlalchemy.sql.util import find_tables
+
+from app.persistence.replicas import resolve_uri
+
+GLOBAL = 'global'
+
+# Shard key column of each sharded table, in the order rows are moved.
+SHARD_KEYS = {'users': 'id', 'places': 'id', 'reviews': 'place_id'}
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash of a 64-bit integer key (Lamping & Veach)."""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_index(value, buckets):
+    """Index of the shard holding shard key `value` among `buckets`."""
+    digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, 'big'), buckets)
+
+
+class ShardRouter:
+    """
+    Places the rows of the sharded tables.
+
+    Attributes:
+        engines (dict): Engine of each shard id ('0', '1', ...).
+    """
+
+    def __init__(self):
+        self.engines = {}
+        self._base_session = None
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    @property
+    def shard_ids(self):
+        return list(self.engines)
+
+    def init_app(self, app):
+        from app.extensions import db
+
+        uris = app.config.get('SQLALCHEMY_SHARDS', [])
+        if uris and app.config.get('SQLALCHEMY_REPLICAS'):
+            raise ValueError("Read replicas cannot be used with shards")
+        if uris and (app.config.get('REPOSITORY_BACKEND') == 'cached'
+                     or app.config.get('CATALOGUE_SNAPSHOT_PATH')):
+            # Both follow the change log, which is not kept with shards
+            raise ValueError("The cached repository backend and the "
+                             "catalogue snapshot cannot be used with shards")
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.engines = {
+            str(index): create_engine(resolve_uri(app, uri), **options)
+            for index, uri in enumerate(uris)}
+        # The session class is chosen once the configuration is known;
+        # the sharded class derives from the regular one so the session
+        # event listeners registered on db.session still apply.
+        factory = db.session.session_factory
+        if self._base_session is None:
+            self._base_session = factory.class_
+        factory.class_ = self._base_session
+        if self.enabled:
+            factory.class_ = type('ShardedSession',
+                                  (ShardedSession, self._base_session), {})
+
+    def shard_of(self, value):
+        """Shard id holding shard key `value`."""
+        return str(shard_index(value, len(self.engines)))
+
+    def shard_for_row(self, table, row):
+        """Shard id of a row (a dict) of `table`."""
+        if table not in SHARD_KEYS:
+            return GLOBAL
+        return self.shard_of(row[SHARD_KEYS[table]])
+
+    def engines_for(self, table):
+        """Engines holding rows of `table`."""
+        from app.extensions import db
+
+        if self.enabled and table in SHARD_KEYS:
+            return list(self.engines.values())
+        return [db.engine]
+
+    def split_keys(self, table, keys):
+        """
+        Group shard keys of `table` by the engine holding them.
+
+        Returns:
+            list: (engine, keys) pairs.
+        """
+        from app.extensions import db
+
+        if not self.enabled or table not in SHARD_KEYS:
+            return [(db.engine, list(keys))]
+        by_shard = {}
+        for key in keys:
+            by_shard.setdefault(self.shard_of(key), []).append(key)
+        return [(self.engines[shard_id], shard_keys)
+                for shard_id, shard_keys in by_shard.items()]
+
+    def insert_rows(self, session, model, rows):
+        """
+        Bulk insert `rows` (dicts) of `model` in the session's transaction,
+        with one executemany per shard of the rows. With sharded storage,
+        where the ORM bulk insert is not available, a Core insert is run on
+        the session's connection to each shard.
+        """
+        if not self.enabled:
+            session.execute(insert(model), rows)
+            return
+        table = model.__table__
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(self.shard_for_row(table.name, row),
+                                []).append(row)
+        for shard_id, shard_rows in by_shard.items():
+            session.connection(bind_arguments={'shard_id': shard_id}) \
+                .execute(insert(table), shard_rows)
+
+    def create_all(self):
+        """Create the sharded tables on every shard."""
+        from app.extensions import db
+
+        tables = [db.metadata.tables[name] for name in SHARD_KEYS]
+        for engine in self.engines.values():
+            db.metadata.create_all(engine, tables=tables)
+
+    # Choosers of the ShardedSession
+
+    def choose_shard(self, mapper, instance, clause=None, **kw):
+        table = mapper.local_table.name
+        if table not in SHARD_KEYS:
+            return GLOBAL
+        if instance is None:
+            raise ValueError(f"No shard for {table} without a row")
+        key = SHARD_KEYS[table]
+        value = getattr(instance, key)
+        if value is None and key == 'id':
+            # BaseModel ids are column defaults, only set at INSERT time
+            value = instance.id = str(uuid.uuid4())
+        if value is None and table == 'reviews' \
+                and instance.place is not None:
+            value = instance.place.id
+        if value is None:
+            raise ValueError(f"No shard key ({key}) on {instance!r}")
+        return self.shard_of(value)
+
+    def identity_shards(self, mapper, primary_key, **kw):
+        table = mapper.local_table.name
+        if table not in SHARD_KEYS:
+            return [GLOBAL]
+        if SHARD_KEYS[table] == 'id':
+            return [self.shard_of(primary_key[0])]
+        return self.shard_ids
+
+    def execute_shards(self, orm_context):
+        statement = orm_context.statement
+        tables = {table.name for table in find_tables(
+            statement, include_crud=True)} & set(SHARD_KEYS)
+        if not tables:
+            return [GLOBAL]
+        if orm_context.is_insert:
+            raise ValueError("Rows inserted into a sharded table must be "
+                             "split by shard, see ShardRouter.insert_rows")
+        shard_ids = None
+        for table in tables:
+            values = _key_values(statement, orm_context.parameters, table,
+                                 SHARD_KEYS[table])
+            if values is not None:
+                found = {self.shard_of(value) for value in values}
+                shard_ids = found if shard_ids is None else shard_ids & found
+        if shard_ids is None:
+            return self.shard_ids
+        return sorted(shard_ids)
+
+    # Resharding
+
+    def reshard(self, app, uris, batch_size=1000):
+        """
+        Move the rows of the sharded tables from the current shards (the
+        primary when sharding is off) to the shards of `uris`. Rows
+        already in place are not touched, and a run interrupted halfway
+        can be run again.
+
+        Returns:
+            dict: Number of rows moved per table.
+        """
+        from app.extensions import db
+
+        sources = self.engines.values() if self.enabled else [db.engine]
+        current = {_url_key(engine.url): engine for engine in sources}
+        targets = []
+        for uri in uris:
+            url = resolve_uri(app, uri)
+            targets.append(current.get(_url_key(url)) or create_engine(url))
+        tables = [db.metadata.tables[name] for name in SHARD_KEYS]
+        for engine in targets:
+            db.metadata.create_all(engine, tables=tables)
+
+        moved = {}
+        for table in tables:
+            key = table.c[SHARD_KEYS[table.name]]
+            moved[table.name] = 0
+            for source in current.values():
+                for batch in _keyset_batches(source, table, batch_size):
+                    by_target = {}
+                    for row in batch:
+                        target = targets[shard_index(row[key.name],
+                                                     len(targets))]
+                        if target is not source:
+                            by_target.setdefault(target, []).append(row)
+                    for target, rows in by_target.items():
+                        ids = [row['id'] for row in rows]
+                        with target.begin() as connection:
+                            connection.execute(delete(table).where(
+                                table.c.id.in_(ids)))
+                            connection.execute(insert(table), rows)
+                        with source.begin() as connection:
+                            connection.execute(delete(table).where(
+                                table.c.id.in_(ids)))
+                        moved[table.name] += len(rows)
+        return moved
+
+
+def _url_key(url):
+    return url.render_as_string(hide_password=False)
+
+
+def _keyset_batches(engine, table, batch_size):
+    """Yield the rows of `table` as lists of dicts, by id."""
+    query = select(table).order_by(table.c.id).limit(batch_size)
+    last_id = None
+    while True:
+        page = query if last_id is None else \
+            query.where(table.c.id > last_id)
+        with engine.connect() as connection:
+            batch = [dict(row._mapping)
+                     for row in connection.execute(page)]
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1]['id']
+
+
+def _key_values(statement, parameters, table, key):
+    """
+    Values the WHERE clause of `statement` requires `table.key` to take,
+    or None when it does not pin the column. Only the top-level AND terms
+    are looked at: `key == x` and `key IN (...)`, either way around.
+    """
+    where = getattr(statement, 'whereclause', None)
+    if where is None:
+        return None
+    terms = where.clauses if getattr(where, 'operator', None) \
+        is operators.and_ else [where]
+    params = parameters if isinstance(parameters, dict) else {}
+    for term in terms:
+        if not isinstance(term, BinaryExpression) or \
+                term.operator not in (operator.eq, operators.in_op):
+            continue
+        for column, value in ((term.left, term.right),
+                              (term.right, term.left)):
+            if getattr(column, 'name', None) != key or \
+                    getattr(getattr(column, 'table', None), 'name',
+                            None) != table or \
+                    not isinstance(value, BindParameter):
+                continue
+            bound = params.get(value.key, value.effective_value)
+            if bound is None:
+                continue
+            if term.operator is operators.in_op:
+                return list(bound)
+            return [bound]
+    return None
+
+
+class ShardedSession(horizontal_shard.ShardedSession):
+    """ShardedSession taking its shards and choosers from `shards`."""
+
+    def __init__(self, **kwargs):
+        from app.extensions import db
+
+        binds = dict(shards.engines)
+        binds[GLOBAL] = db.engine
+        super().__init__(shard_chooser=shards.choose_shard,
+                         identity_chooser=shards.identity_shards,
+                         execute_chooser=shards.execute_shards,
+                         shards=binds, **kwargs)
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None,
+                 clause=None, **kw):
+        # Statements that are not about a mapped class (textual SQL,
+        # session.connection()) go to the global shard.
+        if shard_id is None and mapper is None and instance is None:
+            shard_id = GLOBAL
+        return super().get_bind(mapper, shard_id=shard_id,
+                                instance=instance, clause=clause, **kw)
+
+
+shards = ShardRouter()
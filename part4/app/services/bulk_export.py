@@ -0,0 +1,321 @@
+"""
+Streaming bulk export of places and reviews.
+
+Rows are read in batches of EXPORT_BATCH_SIZE with keyset pagination on
+the primary key and encoded as they arrive, so memory use depends on the
+batch size and never on the table size. Each batch is a short query of its
+own: unlike a server-side cursor kept open for the whole export, it does
+not hold the SQLite read lock between batches, so writers (including the
+job's own progress updates) are not blocked by a long download. The
+price is that rows written during the export may or may not be included.
+With sharded storage every shard is read the same way and the batches of
+the shards are merged on the key, so the export stays ordered by id.
+Supported formats:
+
+- csv: header line then one line per row;
+- ndjson: one JSON object per line;
+- parquet: columnar file, one row group per batch. Requires the optional
+  `pyarrow` package.
+
+Any format can be gzip compressed on the fly.
+"""
+import csv
+import heapq
+import io
+import itertools
+import json
+import operator
+import os
+import time
+import zlib
+from contextlib import ExitStack
+from datetime import datetime
+
+from sqlalchemy import DateTime, Float, Integer, func, select
+
+from app.extensions import shards
+from app.models.place import Place
+from app.models.review import Review
+
+ENTITIES = {
+    'places': (Place, ('id', 'title', 'description', 'price', 'latitude',
+                       'longitude', 'owner_id', 'review_count',
+                       'rating_sum', 'views', 'created_at', 'updated_at')),
+    'reviews': (Review, ('id', 'text', 'rating', 'user_id', 'place_id',
+                         'created_at', 'updated_at')),
+}
+FORMATS = ('csv', 'ndjson', 'parquet')
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson',
+             'parquet': 'application/vnd.apache.parquet'}
+
+
+def check_export(entity, fmt, compress=None):
+    """
+    Validate the export parameters.
+
+    Raises:
+        ValueError: If the entity, format or compression is not supported.
+    """
+    if entity not in ENTITIES:
+        raise ValueError(f"Invalid export entity: {entity}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid export format: {fmt}")
+    if compress not in (None, 'gzip'):
+        raise ValueError(f"Invalid compression: {compress}")
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("parquet export requires the pyarrow package")
+
+
+def export_filename(entity, fmt, compress=None):
+    name = f"{entity}.{fmt}"
+    return f"{name}.gz" if compress == 'gzip' else name
+
+
+def count_rows(connections, entity):
+    model, _ = ENTITIES[entity]
+    return sum(connection.execute(
+        select(func.count()).select_from(model.__table__)).scalar()
+        for connection in connections)
+
+
+def iter_batches(connection, entity, batch_size=1000):
+    """Yield lists of row tuples, `batch_size` rows at a time, by id."""
+    model, columns = ENTITIES[entity]
+    table = model.__table__
+    query = select(*(table.c[column] for column in columns)) \
+        .order_by(table.c.id).limit(batch_size)
+    last_id = None
+    while True:
+        page = query if last_id is None else \
+            query.where(table.c.id > last_id)
+        batch = connection.execute(page).all()
+        connection.rollback()
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1][columns.index('id')]
+
+
+def merge_batches(connections, entity, batch_size=1000):
+    """
+    Yield batches of the rows read from several connections (one per
+    shard), in id order: the keyset batches of each connection are merged.
+    """
+    if len(connections) == 1:
+        yield from iter_batches(connections[0], entity, batch_size)
+        return
+    _, columns = ENTITIES[entity]
+    rows = heapq.merge(
+        *(itertools.chain.from_iterable(
+            iter_batches(connection, entity, batch_size))
+          for connection in connections),
+        key=operator.itemgetter(columns.index('id')))
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _encode_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([[_plain(value) for value in row] for row in batch])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _encode_ndjson(columns, batches):
+    for batch in batches:
+        yield ''.join(
+            json.dumps(dict(zip(columns, map(_plain, row)))) + '\n'
+            for row in batch).encode('utf-8')
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file collecting bytes until they are taken."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _arrow_schema(table, columns):
+    import pyarrow as pa
+
+    def arrow_type(column):
+        if isinstance(column.type, Integer):
+            return pa.int64()
+        if isinstance(column.type, Float):
+            return pa.float64()
+        if isinstance(column.type, DateTime):
+            return pa.timestamp('us')
+        return pa.string()
+
+    return pa.schema([(name, arrow_type(table.c[name])) for name in columns])
+
+
+def _encode_parquet(columns, batches, schema):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    for batch in batches:
+        writer.write_table(pa.Table.from_pylist(
+            [dict(zip(columns, row)) for row in batch], schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(connections, entity, fmt, compress=None, batch_size=1000,
+                  on_batch=None):
+    """
+    Yield the encoded bytes of an export, batch by batch.
+
+    Args:
+        connections (list): SQLAlchemy connections to read from, one per
+            shard holding the entity.
+        entity (str): 'places' or 'reviews'.
+        fmt (str): 'csv', 'ndjson' or 'parquet'.
+        compress (str): None or 'gzip'.
+        batch_size (int): Rows fetched and encoded at a time.
+        on_batch (callable): Called with the number of rows of each batch,
+            used to report progress.
+    """
+    model, columns = ENTITIES[entity]
+    batches = merge_batches(connections, entity, batch_size)
+    if on_batch is not None:
+        batches = _counted(batches, on_batch)
+    if fmt == 'parquet':
+        chunks = _encode_parquet(columns, batches,
+                                 _arrow_schema(model.__table__, columns))
+    elif fmt == 'csv':
+        chunks = _encode_csv(columns, batches)
+    else:
+        chunks = _encode_ndjson(columns, batches)
+    if compress == 'gzip':
+        chunks = _gzip(chunks)
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+
+
+def _counted(batches, on_batch):
+    for batch in batches:
+        yield batch
+        on_batch(len(batch))
+
+
+def stream_export(entity, fmt, compress=None, batch_size=1000):
+    """
+    Return a generator of export bytes suitable for a streamed response.
+    The database connections are opened on the first chunk and released
+    when the generator is exhausted or closed.
+    """
+    engines = shards.engines_for(entity)
+
+    def generate():
+        with ExitStack() as stack:
+            connections = [stack.enter_context(engine.connect())
+                           for engine in engines]
+            yield from export_chunks(connections, entity, fmt, compress,
+                                     batch_size)
+    return generate()
+
+
+def export_dir(app):
+    """Directory of the background export files: EXPORT_DIR, taken from
+    the instance folder of `app` when relative."""
+    return os.path.join(app.instance_path, app.config['EXPORT_DIR'])
+
+
+def purge_export_files(directory, max_age_seconds):
+    """
+    Delete the files of `directory` (exports and the temporary files of
+    failed ones) written more than `max_age_seconds` ago.
+
+    Returns:
+        int: Number of files deleted.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    deleted = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    deleted += 1
+            except FileNotFoundError:
+                pass    # deleted by another worker
+    return deleted
+
+
+def export_to_file(path, entity, fmt, compress=None, batch_size=1000,
+                   progress=None):
+    """
+    Write an export to `path` atomically (through a temporary file).
+
+    Args:
+        progress (callable): Called with the fraction of rows written.
+
+    Returns:
+        int: Number of rows exported.
+    """
+    written = 0
+    tmp_path = f"{path}.part"
+    with ExitStack() as stack:
+        connections = [stack.enter_context(engine.connect())
+                       for engine in shards.engines_for(entity)]
+        total = count_rows(connections, entity) or 1
+
+        def on_batch(rows):
+            nonlocal written
+            written += rows
+            if progress is not None:
+                progress(min(written / total, 1.0))
+
+        with open(tmp_path, 'wb') as output:
+            for chunk in export_chunks(connections, entity, fmt, compress,
+                                       batch_size, on_batch):
+                output.write(chunk)
+    os.replace(tmp_path, path)
+    return written
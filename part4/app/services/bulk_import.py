@@ -0,0 +1,345 @@
+"""
+Bulk NDJSON import of places, amenities and users.
+
+Input is a stream of newline delimited JSON objects, optionally gzip
+compressed. Records are processed in chunks of IMPORT_CHUNK_SIZE lines:
+
+1. every line of the chunk is parsed and its fields are validated column
+   by column (one pass per field over the whole chunk; the ranges of the
+   numeric fields are checked as NumPy arrays);
+2. the owners, amenities or emails referenced by the chunk are resolved
+   with one IN query each;
+3. the valid rows are inserted with a single executemany per table (per
+   shard of the table with sharded storage) and the chunk is committed as
+   one transaction. Places and amenities are
+   logged to the change log by the same transaction.
+
+Invalid rows are skipped and reported with their line number; they never
+abort the import. Only a chunk-level database error (e.g. a concurrent
+insert of the same email) makes the chunk fall back to row-by-row inserts
+inside savepoints so the failing rows can still be reported.
+"""
+import gzip
+import io
+import json
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import bcrypt, db, shards
+from app.models.amenity import Amenity
+from app.models.change import Change
+from app.models.place import Place, place_amenity
+from app.models.user import User
+from app.services.change_log import change_rows
+
+
+def iter_ndjson(stream, compressed=False):
+    """
+    Yield (line_number, record, error) for every non-blank line of a
+    binary NDJSON stream. `error` is set when the line is not a JSON
+    object.
+    """
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream)
+    for number, line in enumerate(io.TextIOWrapper(stream, 'utf-8'), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "Each line must be a JSON object"
+            continue
+        yield number, record, None
+
+
+class ImportReport:
+    """Counts and per-line errors of an import run."""
+
+    def __init__(self, max_errors=1000):
+        self.max_errors = max_errors
+        self.total = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'total': self.total,
+            'inserted': self.inserted,
+            'failed': self.error_count,
+            'errors': self.errors
+        }
+
+
+class BulkImporter:
+    """Chunked NDJSON importer; see the module docstring."""
+
+    KINDS = ('places', 'amenities', 'users')
+
+    def __init__(self, chunk_size=5000):
+        self.chunk_size = chunk_size
+
+    def run(self, kind, stream, compressed=False):
+        """
+        Import every record of `stream` as `kind`.
+
+        Returns:
+            ImportReport: Counts and per-line errors.
+
+        Raises:
+            ValueError: If the kind is unknown.
+        """
+        if kind not in self.KINDS:
+            raise ValueError(f"Invalid import kind: {kind}")
+        handler = getattr(self, f"_import_{kind}")
+        report = ImportReport()
+        chunk = []
+        for line, record, error in iter_ndjson(stream, compressed):
+            report.total += 1
+            if error:
+                report.error(line, error)
+                continue
+            chunk.append((line, record))
+            if len(chunk) >= self.chunk_size:
+                handler(chunk, report)
+                chunk = []
+        if chunk:
+            handler(chunk, report)
+        return report
+
+    @staticmethod
+    def _column(chunk, report, field, convert, check, message,
+                required=True, default=None):
+        """
+        Validate one field over the whole chunk. Rows failing the check
+        are reported and dropped from the returned chunk.
+        """
+        kept = []
+        for line, record in chunk:
+            if field not in record or record[field] is None:
+                if required:
+                    report.error(line, f"{field} is required")
+                    continue
+                record[field] = default
+                kept.append((line, record))
+                continue
+            try:
+                value = convert(record[field])
+            except (TypeError, ValueError):
+                report.error(line, f"Invalid value for {field}")
+                continue
+            if not check(value):
+                report.error(line, message)
+                continue
+            record[field] = value
+            kept.append((line, record))
+        return kept
+
+    @staticmethod
+    def _numeric_columns(chunk, report, checks):
+        """
+        Validate required numeric fields over the whole chunk: each field
+        is converted to a float array, then checked with one vectorized
+        comparison. Rows failing are reported and dropped.
+
+        Args:
+            checks (list): (field, check, message) tuples; `check` takes
+                the float array and returns the mask of the valid values.
+        """
+        keep = np.ones(len(chunk), dtype=bool)
+        columns = {}
+        for field, check, message in checks:
+            column = columns[field] = np.full(len(chunk), np.nan)
+            for row in np.flatnonzero(keep).tolist():
+                line, record = chunk[row]
+                if record.get(field) is None:
+                    report.error(line, f"{field} is required")
+                    keep[row] = False
+                    continue
+                try:
+                    column[row] = float(record[field])
+                except (TypeError, ValueError, OverflowError):
+                    report.error(line, f"Invalid value for {field}")
+                    keep[row] = False
+            with np.errstate(invalid='ignore'):
+                failed = keep & ~check(column)
+            for row in np.flatnonzero(failed).tolist():
+                report.error(chunk[row][0], message)
+            keep &= ~failed
+        kept = []
+        for row in np.flatnonzero(keep).tolist():
+            for field, column in columns.items():
+                chunk[row][1][field] = float(column[row])
+            kept.append(chunk[row])
+        return kept
+
+    def _insert(self, chunk, report, insert_rows):
+        """
+        Run `insert_rows(rows)` for the chunk in one transaction, falling
+        back to one savepoint per row on a database error.
+        """
+        try:
+            insert_rows([record for _, record in chunk])
+            db.session.commit()
+            report.inserted += len(chunk)
+            return
+        except IntegrityError:
+            db.session.rollback()
+        for line, record in chunk:
+            try:
+                with db.session.begin_nested():
+                    insert_rows([record])
+                report.inserted += 1
+            except IntegrityError as e:
+                report.error(line, f"Database error: {e.orig}")
+        db.session.commit()
+
+    def _import_places(self, chunk, report):
+        chunk = self._column(chunk, report, 'title', str,
+                             lambda v: 0 < len(v) <= 100,
+                             "title must contain 1 to 100 characters")
+        chunk = self._column(chunk, report, 'description', str,
+                             lambda v: len(v) <= 5000,
+                             "description is too long",
+                             required=False, default='')
+        # NaN fails every comparison; infinities fail the ranges
+        chunk = self._numeric_columns(chunk, report, [
+            ('price', lambda v: np.isfinite(v) & (v >= 0),
+             "price must be a finite positive number"),
+            ('latitude', lambda v: (v >= -90) & (v <= 90),
+             "latitude must be between -90 and 90"),
+            ('longitude', lambda v: (v >= -180) & (v <= 180),
+             "longitude must be between -180 and 180")])
+        chunk = self._column(chunk, report, 'owner_id', str, bool,
+                             "owner_id is required")
+        chunk = self._column(chunk, report, 'amenities', lambda v: v,
+                             lambda v: isinstance(v, list) and all(
+                                 isinstance(a, str) for a in v),
+                             "amenities must be a list of amenity ids",
+                             required=False, default=[])
+
+        owner_ids = {record['owner_id'] for _, record in chunk}
+        known_owners = set(db.session.scalars(
+            select(User.id).where(User.id.in_(owner_ids)))) \
+            if owner_ids else set()
+        amenity_ids = {amenity_id for _, record in chunk
+                       for amenity_id in record['amenities']}
+        known_amenities = set(db.session.scalars(
+            select(Amenity.id).where(Amenity.id.in_(amenity_ids)))) \
+            if amenity_ids else set()
+
+        rows = []
+        now = datetime.now(timezone.utc)
+        for line, record in chunk:
+            if record['owner_id'] not in known_owners:
+                report.error(line, "Owner not found")
+                continue
+            unknown = set(record['amenities']) - known_amenities
+            if unknown:
+                report.error(line, f"Amenity not found: {sorted(unknown)[0]}")
+                continue
+            place_id = str(uuid.uuid4())
+            rows.append((line, {
+                'id': place_id, 'title': record['title'],
+                'description': record['description'],
+                'price': record['price'], 'latitude': record['latitude'],
+                'longitude': record['longitude'],
+                'owner_id': record['owner_id'],
+                'created_at': now, 'updated_at': now,
+                'amenities': set(record['amenities'])}))
+
+        def insert_rows(records):
+            links = [{'place_id': record['id'], 'amenity_id': amenity_id}
+                     for record in records
+                     for amenity_id in record['amenities']]
+            shards.insert_rows(db.session, Place, [
+                {key: value for key, value in record.items()
+                 if key != 'amenities'} for record in records])
+            if links:
+                db.session.execute(insert(place_amenity), links)
+            shards.insert_rows(db.session, Change, change_rows(
+                'places', [record['id'] for record in records]))
+
+        if rows:
+            self._insert(rows, report, insert_rows)
+
+    def _import_amenities(self, chunk, report):
+        chunk = self._column(chunk, report, 'name',
+                             lambda v: str(v).strip(),
+                             lambda v: 0 < len(v) <= 128,
+                             "name must contain 1 to 128 characters")
+        names = {record['name'] for _, record in chunk}
+        existing = set(db.session.scalars(
+            select(Amenity.name).where(Amenity.name.in_(names)))) \
+            if names else set()
+
+        rows = []
+        now = datetime.now(timezone.utc)
+        for line, record in chunk:
+            if record['name'] in existing:
+                report.error(line, "Amenity already exists")
+                continue
+            existing.add(record['name'])
+            rows.append((line, {'id': str(uuid.uuid4()),
+                                'name': record['name'],
+                                'created_at': now, 'updated_at': now}))
+
+        def insert_rows(records):
+            shards.insert_rows(db.session, Amenity, records)
+            shards.insert_rows(db.session, Change, change_rows(
+                'amenities', [record['id'] for record in records]))
+
+        if rows:
+            self._insert(rows, report, insert_rows)
+
+    def _import_users(self, chunk, report):
+        for field in ('first_name', 'last_name'):
+            chunk = self._column(chunk, report, field, str,
+                                 lambda v: 0 < len(v) <= 50,
+                                 f"{field} must contain 1 to 50 characters")
+        chunk = self._column(chunk, report, 'email', str,
+                             User.is_email_valid,
+                             "invalid email format")
+        chunk = self._column(chunk, report, 'password', str, bool,
+                             "password is required")
+        chunk = self._column(chunk, report, 'is_admin', lambda v: v,
+                             lambda v: isinstance(v, bool),
+                             "is_admin must be a boolean", required=False,
+                             default=False)
+
+        emails = {record['email'] for _, record in chunk}
+        existing = set(db.session.scalars(
+            select(User.email).where(User.email.in_(emails)))) \
+            if emails else set()
+
+        rows = []
+        now = datetime.now(timezone.utc)
+        for line, record in chunk:
+            if record['email'] in existing:
+                report.error(line, "Email already registered")
+                continue
+            existing.add(record['email'])
+            # bcrypt is deliberately slow: hashing dominates user imports.
+            password = bcrypt.generate_password_hash(
+                record['password']).decode('utf-8')
+            rows.append((line, {
+                'id': str(uuid.uuid4()), 'first_name': record['first_name'],
+                'last_name': record['last_name'], 'email': record['email'],
+                'password': password, 'is_admin': record['is_admin'],
+                'created_at': now, 'updated_at': now}))
+
+        if rows:
+            self._insert(rows, report, lambda records: shards.insert_rows(
+                db.session, User, records))
@@ -0,0 +1,474 @@
+"""
+Catalogue snapshot shared by the worker processes through mmap.
+
+With CATALOGUE_SNAPSHOT_PATH set, the places (with the name of their
+owner and the ids of their amenities) and the amenities are written to
+one binary file that every worker memory-maps. The pages of the file are
+shared by all the processes mapping it, so N workers hold one copy of
+the catalogue instead of N, and a lookup reads only the record it needs:
+
+    header    magic, change log seq and latest users.updated_at the file
+              reflects, then count and offset of the two indexes
+    indexes   one entry per place, then per amenity, sorted by id: the
+              id (36 bytes, NUL padded) and the offset of its record
+    records   fixed-size fields, then length-prefixed UTF-8 strings; a
+              place ends with the positions of its amenities in the
+              amenity index
+
+A lookup by id binary-searches an index inside the mapping and returns a
+record whose fields are decoded from the mapping when accessed; nothing
+else is deserialized.
+
+Every CATALOGUE_REFRESH_SECONDS a thread of each worker compares the
+change log cursor and the latest users.updated_at with the header of the
+file. After a change, the worker holding the build lock (flock of
+`<path>.lock`; the others skip) rebuilds the file: it is written to a
+temporary file, fsynced and renamed over the old one, so a reader opens
+either the old or the new snapshot, never a partial one. Workers map the
+new file when its inode changes; the records handed out before keep the
+old mapping alive until they are dropped.
+
+Served from the snapshot: GET /api/v1/amenities/ and the places of the
+/places/top and /places/trending rails, which therefore lag the database
+by up to CATALOGUE_REFRESH_SECONDS plus a rebuild. The single-entity
+GETs, whose ETag a client sends back in If-Match, and every write keep
+using the repositories, so a client always reads its own writes.
+"""
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+
+from sqlalchemy import func, select
+
+from app import db
+from app.extensions import serving
+from app.models.amenity import Amenity
+from app.models.place import Place, place_amenity
+from app.models.user import User
+from app.services import change_log
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'HBNBCAT1'
+# magic, change log seq, users.updated_at (POSIX time), place count,
+# amenity count, place index offset, amenity index offset
+_HEADER = struct.Struct('<8sQdIIQQ')
+_ENTRY = struct.Struct('<36sQ')
+# price, latitude, longitude, version, review_count, rating_sum,
+# rating_1 .. rating_5, views, number of amenities
+_PLACE = struct.Struct('<3d10I')
+_AMENITY = struct.Struct('<I')
+_LENGTH = struct.Struct('<I')
+_POSITION = struct.Struct('<I')
+
+OwnerSummary = namedtuple('OwnerSummary', ('id', 'first_name', 'last_name'))
+
+
+def _key(obj_id):
+    return obj_id.encode().ljust(36, b'\0')
+
+
+def _strings(*values):
+    data = bytearray()
+    for value in values:
+        encoded = (value or '').encode()
+        data += _LENGTH.pack(len(encoded)) + encoded
+    return data
+
+
+def _read_strings(buffer, offset, count):
+    """Decode `count` strings at `offset`; return them and the offset
+    following them."""
+    values = []
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(buffer, offset)
+        offset += _LENGTH.size
+        values.append(str(buffer[offset:offset + length], 'utf-8'))
+        offset += length
+    return values, offset
+
+
+def _timestamp(value):
+    return value.timestamp() if value is not None else 0.0
+
+
+def database_version():
+    """(change log seq, latest users.updated_at) of the database, the
+    positions a snapshot is compared on."""
+    return (change_log.get_cursor(), _timestamp(
+        db.session.scalar(select(func.max(User.updated_at)))))
+
+
+def build_snapshot(path):
+    """
+    Write the catalogue of the database to `path`, atomically.
+
+    Returns:
+        tuple: Counts of the places and amenities written.
+    """
+    cursor, users_updated = database_version()
+    owners = {row.id: row for row in db.session.execute(
+        select(User.id, User.first_name, User.last_name))}
+    amenities = sorted(db.session.execute(
+        select(Amenity.id, Amenity.version, Amenity.name)),
+        key=lambda row: _key(row.id))
+    positions = {row.id: position for position, row in enumerate(amenities)}
+    links = {}
+    for place_id, amenity_id in db.session.execute(
+            select(place_amenity.c.place_id, place_amenity.c.amenity_id)):
+        if amenity_id in positions:
+            links.setdefault(place_id, []).append(positions[amenity_id])
+    places = sorted(db.session.execute(select(
+        Place.id, Place.title, Place.description, Place.price,
+        Place.latitude, Place.longitude, Place.owner_id, Place.version,
+        Place.review_count, Place.rating_sum,
+        *(getattr(Place, column) for column in Place.RATING_COLUMNS),
+        Place.views)), key=lambda row: _key(row.id))
+
+    place_index = _HEADER.size
+    amenity_index = place_index + _ENTRY.size * len(places)
+    base = amenity_index + _ENTRY.size * len(amenities)
+    entries, records = bytearray(), bytearray()
+    for row in places:
+        entries += _ENTRY.pack(_key(row.id), base + len(records))
+        amenity_positions = sorted(links.get(row.id, ()))
+        owner = owners.get(row.owner_id)
+        records += _PLACE.pack(
+            row.price, row.latitude, row.longitude, row.version or 1,
+            *(value or 0 for value in row[8:]), len(amenity_positions))
+        records += _strings(row.id, row.title, row.description, row.owner_id,
+                            owner.first_name if owner else None,
+                            owner.last_name if owner else None)
+        for position in amenity_positions:
+            records += _POSITION.pack(position)
+    for row in amenities:
+        entries += _ENTRY.pack(_key(row.id), base + len(records))
+        records += _AMENITY.pack(row.version or 1)
+        records += _strings(row.id, row.name)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as stream:
+        stream.write(_HEADER.pack(MAGIC, cursor, users_updated, len(places),
+                                  len(amenities), place_index,
+                                  amenity_index))
+        stream.write(entries)
+        stream.write(records)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(tmp, path)
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return len(places), len(amenities)
+
+
+class AmenityRecord:
+    """Amenity of a snapshot, decoded from the mapping on access."""
+
+    __slots__ = ('_snapshot', '_offset', '_strings')
+
+    def __init__(self, snapshot, offset):
+        self._snapshot = snapshot
+        self._offset = offset
+        self._strings = None
+
+    def _string(self, index):
+        if self._strings is None:
+            self._strings, _ = _read_strings(
+                self._snapshot.buffer, self._offset + _AMENITY.size, 2)
+        return self._strings[index]
+
+    @property
+    def id(self):
+        return self._string(0)
+
+    @property
+    def name(self):
+        return self._string(1)
+
+    @property
+    def version(self):
+        return _AMENITY.unpack_from(self._snapshot.buffer, self._offset)[0]
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'version': self.version}
+
+
+class PlaceRecord:
+    """
+    Place of a snapshot, with the attributes of Place read by the API.
+    The fixed-size fields are unpacked when the record is found, the
+    strings and amenities on first access.
+    """
+
+    __slots__ = ('_snapshot', '_offset', '_fields', '_strings', '_end')
+
+    def __init__(self, snapshot, offset):
+        self._snapshot = snapshot
+        self._offset = offset
+        self._fields = _PLACE.unpack_from(snapshot.buffer, offset)
+        self._strings = None
+        self._end = None
+
+    def _string(self, index):
+        if self._strings is None:
+            self._strings, self._end = _read_strings(
+                self._snapshot.buffer, self._offset + _PLACE.size, 6)
+        return self._strings[index]
+
+    id = property(lambda self: self._string(0))
+    title = property(lambda self: self._string(1))
+    description = property(lambda self: self._string(2))
+    owner_id = property(lambda self: self._string(3))
+    price = property(lambda self: self._fields[0])
+    latitude = property(lambda self: self._fields[1])
+    longitude = property(lambda self: self._fields[2])
+    version = property(lambda self: self._fields[3])
+    review_count = property(lambda self: self._fields[4])
+    rating_sum = property(lambda self: self._fields[5])
+    views = property(lambda self: self._fields[11])
+
+    @property
+    def owner(self):
+        return OwnerSummary(self._string(3), self._string(4),
+                            self._string(5))
+
+    @property
+    def average_rating(self):
+        if not self.review_count:
+            return None
+        return round(self.rating_sum / self.review_count, 2)
+
+    @property
+    def rating_histogram(self):
+        return {str(star): count
+                for star, count in enumerate(self._fields[6:11], start=1)}
+
+    @property
+    def amenities(self):
+        self._string(0)
+        buffer = self._snapshot.buffer
+        return [self._snapshot.amenity_at(_POSITION.unpack_from(
+                    buffer, self._end + _POSITION.size * i)[0])
+                for i in range(self._fields[12])]
+
+    def to_dict(self):
+        """Place.to_dict without the reviews, which are not in the
+        snapshot."""
+        return {
+            'id': self.id,
+            'title': self.title,
+            'description': self.description,
+            'price': self.price,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'owner_id': self.owner_id,
+            'owner': {
+                "first_name": self.owner.first_name,
+                "last_name": self.owner.last_name
+            },
+            'review_count': self.review_count,
+            'rating_sum': self.rating_sum,
+            'average_rating': self.average_rating,
+            'rating_histogram': self.rating_histogram,
+            'views': self.views,
+            'version': self.version,
+            'amenities': [a.to_dict() for a in self.amenities]
+        }
+
+
+class Snapshot:
+    """A snapshot file mapped in memory."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as stream:
+            self.inode = os.fstat(stream.fileno()).st_ino
+            self.buffer = mmap.mmap(stream.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        (magic, self.cursor, self.users_updated, self.place_count,
+         self.amenity_count, self.place_index,
+         self.amenity_index) = _HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a catalogue snapshot: {path}")
+
+    @property
+    def version(self):
+        return self.cursor, self.users_updated
+
+    def _find(self, index, count, obj_id):
+        """Offset of the record of `obj_id` in an index, or None."""
+        if not isinstance(obj_id, str) or len(obj_id.encode()) > 36:
+            return None
+        key = _key(obj_id)
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            start = index + _ENTRY.size * middle
+            found = self.buffer[start:start + 36]
+            if found == key:
+                return _ENTRY.unpack_from(self.buffer, start)[1]
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def place(self, place_id):
+        offset = self._find(self.place_index, self.place_count, place_id)
+        return PlaceRecord(self, offset) if offset is not None else None
+
+    def amenity(self, amenity_id):
+        offset = self._find(self.amenity_index, self.amenity_count,
+                            amenity_id)
+        return AmenityRecord(self, offset) if offset is not None else None
+
+    def amenity_at(self, position):
+        start = self.amenity_index + _ENTRY.size * position
+        return AmenityRecord(self, _ENTRY.unpack_from(self.buffer, start)[1])
+
+    def amenities(self):
+        return [self.amenity_at(position)
+                for position in range(self.amenity_count)]
+
+
+class CatalogueSnapshot:
+    """
+    The snapshot mapped by this worker, and the thread keeping it up to
+    date.
+
+    Attributes:
+        path (str or None): Snapshot file; None disables the snapshot.
+        refresh_seconds (float): Interval of the checks for changes.
+        builds (int): Snapshots written by this process.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.refresh_seconds = 2.0
+        self.builds = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._app = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def init_app(self, app):
+        """Read the snapshot settings and start the refresh thread, when
+        serving requests."""
+        path = app.config.get('CATALOGUE_SNAPSHOT_PATH')
+        self.path = os.path.abspath(path) if path else None
+        self.refresh_seconds = app.config.get('CATALOGUE_REFRESH_SECONDS',
+                                              self.refresh_seconds)
+        self._snapshot = None
+        self._app = app
+        if self.path and self.refresh_seconds > 0 and serving() and \
+                self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='catalogue-refresh')
+            self._thread.start()
+
+    def stop(self):
+        """Stop the refresh thread."""
+        self._stopped.set()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def current(self):
+        """The latest snapshot, mapped, or None if there is none yet."""
+        if self._snapshot is None and self.path \
+                and os.path.exists(self.path):
+            self._remap()
+        return self._snapshot
+
+    def get_place(self, place_id):
+        snapshot = self.current()
+        return snapshot.place(place_id) if snapshot else None
+
+    def get_places(self, place_ids):
+        """Records of the places of `place_ids` found in the snapshot."""
+        snapshot = self.current()
+        if snapshot is None:
+            return []
+        return [place for place in map(snapshot.place, place_ids)
+                if place is not None]
+
+    def get_amenity(self, amenity_id):
+        snapshot = self.current()
+        return snapshot.amenity(amenity_id) if snapshot else None
+
+    def get_all_amenities(self):
+        """Every amenity, or None if there is no snapshot yet."""
+        snapshot = self.current()
+        return snapshot.amenities() if snapshot else None
+
+    def refresh(self, force=False):
+        """
+        Rebuild the snapshot if the database changed since it was written
+        (always with `force`) and no other process is building it, then
+        map the latest file.
+
+        Returns:
+            bool: Whether this call wrote a snapshot.
+        """
+        built = False
+        current = self.current()
+        if force or current is None or current.version != database_version():
+            built = self._build(force)
+        if self._changed():
+            self._remap()
+        return built
+
+    def _build(self, force):
+        with open(self.path + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if force
+                                                   else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+            try:
+                # Another process may have built it while we waited
+                if not force and self._changed():
+                    self._remap()
+                    if self._snapshot.version == database_version():
+                        return False
+                build_snapshot(self.path)
+                self.builds += 1
+                return True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _changed(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+        return self._snapshot is None or self._snapshot.inode != inode
+
+    def _remap(self):
+        with self._lock:
+            try:
+                self._snapshot = Snapshot(self.path)
+            except (FileNotFoundError, ValueError):
+                logger.exception("Cannot map the catalogue snapshot")
+
+    def _run(self):
+        while not self._stopped.wait(self.refresh_seconds):
+            if not self.path:
+                continue
+            with self._app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Catalogue snapshot refresh failed")
+                finally:
+                    db.session.remove()
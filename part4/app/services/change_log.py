@@ -0,0 +1,216 @@
+"""
+Change log backing the delta-sync endpoint (GET /api/v1/changes).
+
+Every write to a place, review or amenity appends a row to the `changes`
+table in the same transaction as the write itself:
+
+- ORM writes are logged by a `before_flush` listener on the session, so
+  the repositories need no change;
+- bulk statements that bypass the unit of work (rating aggregates, NDJSON
+  imports) call `record_change` / `change_rows` explicitly.
+
+Deletes leave a tombstone. A client keeps the `seq` of the last change it
+applied and asks for the changes after it, so a sync reads the log by
+primary key and costs in proportion to the churn, not to the catalogue.
+
+SQLite serialises writers, so seq order is also commit order and a cursor
+never skips a change committed late. Place view counts are not logged:
+they are write-behind counters, not catalogue changes.
+
+The log is not kept with sharded storage (SQLALCHEMY_SHARDS): it lives
+on the primary database, so a change could not commit in the same
+transaction as its row on a shard. Writes are then not logged and the
+readers of the log raise ChangeLogUnavailable; the shard router refuses
+the configurations that depend on the log.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import selectinload
+
+from app import db
+from app.extensions import shards
+from app.models.amenity import Amenity
+from app.models.change import Change
+from app.models.place import Place
+from app.models.review import Review
+
+ENTITIES = {Place: 'places', Review: 'reviews', Amenity: 'amenities'}
+MODELS = {name: model for model, name in ENTITIES.items()}
+
+
+class CursorExpired(Exception):
+    """The changes after the cursor were purged; a full resync is needed."""
+
+
+class ChangeLogUnavailable(Exception):
+    """Writes are not logged, because storage is sharded."""
+
+
+def available():
+    """Whether writes are logged: not with sharded storage."""
+    return not shards.enabled
+
+
+def _check_available():
+    if not available():
+        raise ChangeLogUnavailable(
+            "The change log is not kept with sharded storage")
+
+
+def record_change(session, entity, entity_id, op='upsert'):
+    """Log a write done outside the unit of work, in `session`'s
+    transaction."""
+    if available():
+        session.add(Change(entity=entity, entity_id=entity_id, op=op))
+
+
+def change_rows(entity, entity_ids, op='upsert'):
+    """Rows for a bulk `insert(Change)` logging many writes at once; none
+    when the log is not kept."""
+    if not available():
+        return []
+    now = datetime.now(timezone.utc)
+    return [{'entity': entity, 'entity_id': entity_id, 'op': op,
+             'created_at': now} for entity_id in entity_ids]
+
+
+def _before_flush(session, flush_context, instances):
+    if not available():
+        return
+    logged = set()
+
+    def log(obj, op):
+        entity = ENTITIES.get(type(obj))
+        if entity is None:
+            return
+        if obj.id is None:
+            # BaseModel ids are column defaults, only set at INSERT time
+            obj.id = str(uuid.uuid4())
+        if (entity, obj.id) not in logged:
+            logged.add((entity, obj.id))
+            session.add(Change(entity=entity, entity_id=obj.id, op=op))
+
+    for obj in session.deleted:
+        log(obj, 'delete')
+    for obj in session.new:
+        log(obj, 'upsert')
+    for obj in session.dirty:
+        # Only a place embeds its collections (amenities, reviews) in its
+        # representation; backref changes don't alter the other entities.
+        if session.is_modified(obj,
+                               include_collections=isinstance(obj, Place)):
+            log(obj, 'upsert')
+
+
+def track_changes(session):
+    """Install the change log listener on a (scoped) session."""
+    event.listen(session, 'before_flush', _before_flush)
+
+
+def _load(entity, ids):
+    model = MODELS[entity]
+    query = select(model).where(model.id.in_(ids))
+    if model is Place:
+        query = query.options(selectinload(Place.owner),
+                              selectinload(Place.reviews)
+                              .selectinload(Review.user))
+    elif model is Review:
+        query = query.options(selectinload(Review.user))
+    return {obj.id: obj for obj in db.session.scalars(query)}
+
+
+def latest_changes(since, limit=500):
+    """
+    Return the latest operation of each entity changed after cursor
+    `since`, reading at most `limit` changes.
+
+    Returns:
+        tuple: dict of (seq, op) keyed by (entity, entity_id) in seq
+        order, the cursor to pass as `since` next time, and whether more
+        changes follow.
+
+    Raises:
+        CursorExpired: If changes after `since` were already purged.
+        ChangeLogUnavailable: If storage is sharded.
+    """
+    _check_available()
+    oldest = db.session.scalar(select(func.min(Change.seq)))
+    if oldest is not None and since < oldest - 1:
+        raise CursorExpired(
+            f"Changes before {oldest} were purged, resync from scratch")
+
+    rows = db.session.execute(
+        select(Change.seq, Change.entity, Change.entity_id, Change.op)
+        .where(Change.seq > since).order_by(Change.seq)
+        .limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest = {}
+    for seq, entity, entity_id, op in rows:
+        latest.pop((entity, entity_id), None)
+        latest[(entity, entity_id)] = (seq, op)
+    return latest, rows[-1][0] if rows else since, has_more
+
+
+def get_changes(since, limit=500):
+    """
+    Return the changes logged after cursor `since`.
+
+    Each entity appears once per page, with its latest operation and, for
+    upserts, its current representation.
+
+    Returns:
+        dict: changes, cursor (to pass as `since` next time) and has_more.
+
+    Raises:
+        CursorExpired: If changes after `since` were already purged.
+        ChangeLogUnavailable: If storage is sharded.
+    """
+    latest, cursor, has_more = latest_changes(since, limit)
+
+    upserts = {}
+    for entity, entity_id in latest:
+        if latest[(entity, entity_id)][1] == 'upsert':
+            upserts.setdefault(entity, []).append(entity_id)
+    current = {entity: _load(entity, ids) for entity, ids in upserts.items()}
+
+    changes = []
+    for (entity, entity_id), (seq, op) in latest.items():
+        obj = current.get(entity, {}).get(entity_id)
+        if op == 'upsert' and obj is None:
+            # Deleted after this page's changes; its tombstone follows.
+            continue
+        change = {'seq': seq, 'entity': entity, 'id': entity_id, 'op': op}
+        if op == 'upsert':
+            change['data'] = obj.to_dict()
+        changes.append(change)
+
+    return {'changes': changes, 'cursor': cursor, 'has_more': has_more}
+
+
+def get_cursor():
+    """Seq of the latest change, the cursor to start syncing from."""
+    _check_available()
+    return db.session.scalar(select(func.max(Change.seq))) or 0
+
+
+def purge_changes(days=30):
+    """
+    Delete changes older than `days` days, always keeping the latest one
+    so the oldest retained seq tells clients whether their cursor expired.
+
+    Returns:
+        int: Number of changes deleted.
+    """
+    if not available():
+        return 0
+    limit = datetime.now(timezone.utc) - timedelta(days=days)
+    newest = get_cursor()
+    deleted = Change.query.filter(
+        Change.created_at < limit, Change.seq < newest) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,297 @@
+"""
+Map clusters of places, per geohash cell.
+
+A geohash of precision p splits the globe into a grid of 2**ceil(5p/2)
+columns by 2**floor(5p/2) rows, and names each cell by interleaving the
+bits of its column and row. For every precision from 1 to MAX_PRECISION
+the places are aggregated per cell: number of places, sums of their
+coordinates (for the centroid) and lowest price. A place write updates
+one cell per precision, so the aggregates never need a full scan.
+
+A delete cannot lower a minimum, and can only raise it when the deleted
+place held it; that cell's minimum is then marked stale and recomputed
+on its next read, from the (at most 32) cells of the next precision it
+contains, or from its places at the finest precision.
+
+A request names a viewport (bbox) and a web map zoom level. The zoom
+picks the precision whose cells are about an eighth of a 256 pixel
+tile wide, and the precision is lowered until the viewport covers at
+most CLUSTERS_MAX_CELLS cells: the answer holds at most that many
+clusters however dense the listings are.
+
+The cells are built from the places table on the first query. The
+facade keeps them in step with its place writes; other workers' writes
+reach them through the background thread of app/services/place_indexes.py.
+"""
+import math
+import threading
+import time
+
+from sqlalchemy import select
+
+from app import db
+from app.models.place import Place
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_PRECISION = 8
+MAX_ZOOM = 22
+
+
+def grid_bits(precision):
+    """(column bits, row bits) of a geohash precision."""
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def cell_of(latitude, longitude, precision):
+    """(row, column) of the cell containing a point."""
+    column_bits, row_bits = grid_bits(precision)
+    row = int((latitude + 90) / 180 * (1 << row_bits))
+    column = int((longitude + 180) / 360 * (1 << column_bits))
+    return (min(max(row, 0), (1 << row_bits) - 1),
+            min(max(column, 0), (1 << column_bits) - 1))
+
+
+def geohash(row, column, precision):
+    """Geohash of a cell, longitude bit first."""
+    column_bits, row_bits = grid_bits(precision)
+    value = 0
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            column_bits -= 1
+            bit = column >> column_bits & 1
+        else:
+            row_bits -= 1
+            bit = row >> row_bits & 1
+        value = value << 1 | bit
+    return ''.join(BASE32[value >> shift & 31]
+                   for shift in range(5 * precision - 5, -1, -5))
+
+
+def precision_for_zoom(zoom):
+    """
+    Geohash precision for a web map zoom level: the finest whose cells
+    are at least an eighth of a 256 pixel tile (360 / 2**zoom degrees)
+    wide.
+    """
+    width = 360 / 2 ** zoom / 8
+    precision = 1
+    while precision < MAX_PRECISION and \
+            360 / 2 ** grid_bits(precision + 1)[0] >= width:
+        precision += 1
+    return precision
+
+
+class Cell:
+    """Aggregate of the places of one geohash cell."""
+
+    __slots__ = ('count', 'latitude_sum', 'longitude_sum', 'min_price',
+                 'min_stale', 'prices')
+
+    def __init__(self, finest):
+        self.count = 0
+        self.latitude_sum = 0.0
+        self.longitude_sum = 0.0
+        self.min_price = math.inf
+        self.min_stale = False
+        # Price of each place, kept at the finest precision only
+        self.prices = {} if finest else None
+
+
+class PlaceClusters:
+    """
+    Place aggregates per geohash cell, for every precision.
+
+    Attributes:
+        source (callable or None): Returns the (id, price, latitude,
+            longitude, ...) rows of every place; the database when None.
+        max_cells (int): Most cells a viewport may cover.
+        reload_seconds (float): Interval of the periodic reloads, done
+            only without a change log (see place_indexes); 0 never reloads.
+    """
+
+    def __init__(self, max_cells=512, reload_seconds=60.0):
+        self.source = None
+        self.max_cells = max_cells
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._clear()
+
+    def init_app(self, app):
+        """Read the cluster settings and drop the loaded places."""
+        self.max_cells = app.config.get('CLUSTERS_MAX_CELLS', self.max_cells)
+        self.reload_seconds = app.config.get('CLUSTERS_RELOAD_SECONDS',
+                                             self.reload_seconds)
+        self.invalidate()
+
+    def invalidate(self):
+        """Force a reload on the next query, e.g. after a bulk import."""
+        self._loaded_at = None
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def reload_due(self):
+        """Whether the periodic reload is due (see reload_seconds)."""
+        return self.loaded and self.reload_seconds > 0 and \
+            time.monotonic() - self._loaded_at > self.reload_seconds
+
+    def _clear(self):
+        # Cells of each precision keyed by (row, column); index 0 unused
+        self._levels = [{} for _ in range(MAX_PRECISION + 1)]
+        # (latitude, longitude, price) of each place
+        self._places = {}
+
+    def load(self):
+        """Rebuild every cell from the places table (or `source`)."""
+        if self.source is not None:
+            rows = [row[:4] for row in self.source()]
+        else:
+            rows = db.session.execute(select(
+                Place.id, Place.price, Place.latitude, Place.longitude)).all()
+        with self._lock:
+            self._clear()
+            for place_id, price, latitude, longitude in rows:
+                self._add(place_id, latitude, longitude, price)
+            self._loaded_at = time.monotonic()
+
+    def _add(self, place_id, latitude, longitude, price):
+        self._places[place_id] = (latitude, longitude, price)
+        for precision in range(1, MAX_PRECISION + 1):
+            key = cell_of(latitude, longitude, precision)
+            cell = self._levels[precision].get(key)
+            if cell is None:
+                cell = self._levels[precision][key] = Cell(
+                    precision == MAX_PRECISION)
+            cell.count += 1
+            cell.latitude_sum += latitude
+            cell.longitude_sum += longitude
+            if price < cell.min_price:
+                cell.min_price = price
+            if cell.prices is not None:
+                cell.prices[place_id] = price
+
+    def _remove(self, place_id):
+        latitude, longitude, price = self._places.pop(place_id)
+        for precision in range(1, MAX_PRECISION + 1):
+            key = cell_of(latitude, longitude, precision)
+            cell = self._levels[precision][key]
+            cell.count -= 1
+            if not cell.count:
+                del self._levels[precision][key]
+                continue
+            cell.latitude_sum -= latitude
+            cell.longitude_sum -= longitude
+            if cell.prices is not None:
+                del cell.prices[place_id]
+            if price <= cell.min_price:
+                cell.min_stale = True
+
+    def place_changed(self, place):
+        """Account for a created or updated place."""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            if self._places.get(place.id) == (place.latitude,
+                                              place.longitude, place.price):
+                return
+            if place.id in self._places:
+                self._remove(place.id)
+            self._add(place.id, place.latitude, place.longitude, place.price)
+
+    def place_deleted(self, place_id):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            if place_id in self._places:
+                self._remove(place_id)
+
+    def _min_price(self, precision, key, cell):
+        if cell.min_stale:
+            if cell.prices is not None:
+                cell.min_price = min(cell.prices.values())
+            else:
+                row, column = key
+                column_bits, row_bits = grid_bits(precision)
+                finer_columns, finer_rows = grid_bits(precision + 1)
+                row_shift = finer_rows - row_bits
+                column_shift = finer_columns - column_bits
+                level = self._levels[precision + 1]
+                cell.min_price = min(
+                    self._min_price(precision + 1, child, level[child])
+                    for child in (
+                        (row << row_shift | i, column << column_shift | j)
+                        for i in range(1 << row_shift)
+                        for j in range(1 << column_shift))
+                    if child in level)
+            cell.min_stale = False
+        return cell.min_price
+
+    def _viewport(self, bbox, precision):
+        """Row range and column ranges of the cells covering `bbox`."""
+        south, west, north, east = bbox
+        row_start, column_start = cell_of(south, west, precision)
+        row_end, column_end = cell_of(north, east, precision)
+        if west <= east:
+            columns = [(column_start, column_end)]
+        else:
+            last = (1 << grid_bits(precision)[0]) - 1
+            columns = [(column_start, last), (0, column_end)]
+        return (row_start, row_end), columns
+
+    def clusters(self, bbox, zoom):
+        """
+        Return the precision used and the clusters of the non-empty cells
+        covering `bbox` at `zoom`, as dicts with the geohash, number of
+        places, centroid and lowest price of the cell.
+
+        Args:
+            bbox (tuple): (south, west, north, east) in degrees; west
+                greater than east crosses the antimeridian.
+            zoom (int): Web map zoom level, 0 to MAX_ZOOM.
+
+        Raises:
+            ValueError: If the bbox or the zoom is out of range.
+        """
+        south, west, north, east = bbox
+        if not -90 <= south <= north <= 90:
+            raise ValueError("bbox latitudes must be -90 <= south <= north "
+                             "<= 90")
+        if not (-180 <= west <= 180 and -180 <= east <= 180):
+            raise ValueError("bbox longitudes must be between -180 and 180")
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+        if not self.loaded:
+            self.load()
+
+        precision = precision_for_zoom(zoom)
+        while True:
+            rows, columns = self._viewport(bbox, precision)
+            covered = (rows[1] - rows[0] + 1) * sum(
+                end - start + 1 for start, end in columns)
+            if covered <= self.max_cells or precision == 1:
+                break
+            precision -= 1
+
+        with self._lock:
+            level = self._levels[precision]
+            if covered <= len(level):
+                keys = sorted(
+                    (row, column) for row in range(rows[0], rows[1] + 1)
+                    for start, end in columns
+                    for column in range(start, end + 1)
+                    if (row, column) in level)
+            else:
+                keys = sorted(
+                    key for key in level
+                    if rows[0] <= key[0] <= rows[1] and any(
+                        start <= key[1] <= end for start, end in columns))
+            return precision, [{
+                'geohash': geohash(*key, precision),
+                'count': level[key].count,
+                'latitude': level[key].latitude_sum / level[key].count,
+                'longitude': level[key].longitude_sum / level[key].count,
+                'min_price': self._min_price(precision, key, level[key])
+            } for key in keys]
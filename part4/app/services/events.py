@@ -0,0 +1,324 @@
+"""
+Fan-out hub pushing place and review events to Server-Sent Events
+subscribers (GET /api/v1/places/<place_id>/events).
+
+Events are collected while the session flushes and published only once
+the transaction commits, so a subscriber never sees a write that was
+rolled back. Every event is encoded once and the same bytes are appended
+to the buffer of each subscriber of the place.
+
+Buffers are bounded (SSE_BUFFER_SIZE events): publishing never blocks on
+a client, and a subscriber that falls that far behind is evicted. It
+receives a final `evicted` event and should reload the place before
+reconnecting.
+
+Writes of the other worker processes are read from the change log
+(app/services/change_log.py): while the process has subscribers, one
+thread polls the log every SSE_POLL_SECONDS for all of them, and
+publishes the changes of the subscribed places it did not commit itself
+(their seqs are remembered at commit). A review deleted by another
+process leaves only a tombstone without its place, so it reaches the
+subscribers as the place.updated of the place's new rating aggregates.
+With sharded storage, where the log is not kept, each process only sees
+its own writes.
+
+A subscriber costs a deque and an Event, not a thread: the stream
+generator sleeps on the Event between events and heartbeats. On a
+threaded server each open response would still hold one worker thread,
+so streams are refused (503) unless the app runs on an evented worker,
+e.g. `gunicorn -k gevent`, whose monkey patching turns the waits into
+yields to the event loop. SSE_REQUIRE_EVENTED_WORKER = False lifts the
+check, for development servers.
+"""
+import json
+import logging
+import sys
+import threading
+from collections import deque
+
+from sqlalchemy import event, select
+
+from app import db
+from app.models.change import Change
+from app.models.place import Place
+from app.models.review import Review
+from app.services import change_log
+
+logger = logging.getLogger(__name__)
+
+
+class EventedWorkerRequired(Exception):
+    """An event stream was opened outside an evented worker."""
+
+
+def evented_worker():
+    """Whether threads are green (gevent or eventlet monkey patching), so
+    a waiting stream holds no OS thread."""
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is not None and monkey.is_module_patched('threading'):
+        return True
+    patcher = sys.modules.get('eventlet.patcher')
+    return patcher is not None and patcher.is_monkey_patched('thread')
+
+
+def _review_data(review):
+    return {'id': review.id, 'text': review.text, 'rating': review.rating,
+            'place_id': review.place_id, 'user_id': review.user_id}
+
+
+def _place_data(place):
+    return {'id': place.id, 'title': place.title,
+            'description': place.description, 'price': place.price,
+            'latitude': place.latitude, 'longitude': place.longitude,
+            'review_count': place.review_count,
+            'average_rating': place.average_rating}
+
+
+class Subscriber:
+    """Bounded buffer of encoded events for one client connection."""
+
+    def __init__(self, place_id, buffer_size):
+        self.place_id = place_id
+        self.buffer = deque()
+        self.buffer_size = buffer_size
+        self.evicted = False
+        self.wakeup = threading.Event()
+
+    def push(self, message):
+        """Queue a message; return False if the buffer is full."""
+        if len(self.buffer) >= self.buffer_size:
+            return False
+        self.buffer.append(message)
+        self.wakeup.set()
+        return True
+
+
+class EventHub:
+    """
+    In-process publish/subscribe of place events.
+
+    Attributes:
+        buffer_size (int): Events buffered per subscriber before eviction.
+        heartbeat_seconds (float): Idle time before a keep-alive comment.
+        max_subscribers (int): Open streams allowed on this node.
+        poll_seconds (float): Interval of the change log polls; 0 leaves
+            them to explicit poll() calls.
+        require_evented (bool): Refuse streams outside an evented worker.
+    """
+
+    def __init__(self, buffer_size=100, heartbeat_seconds=15.0,
+                 max_subscribers=10000, poll_seconds=1.0,
+                 require_evented=True):
+        self.buffer_size = buffer_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_subscribers = max_subscribers
+        self.poll_seconds = poll_seconds
+        self.require_evented = require_evented
+        self.poll_limit = 1000
+        self.evictions = 0
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._app = None
+        self._thread = None
+        self._stopped = threading.Event()
+        # Change log cursor of the polls, None while nobody subscribes,
+        # and seqs after it of the changes this process published itself
+        self._cursor = None
+        self._own_seqs = set()
+
+    def init_app(self, app):
+        self.buffer_size = app.config.get('SSE_BUFFER_SIZE',
+                                          self.buffer_size)
+        self.heartbeat_seconds = app.config.get('SSE_HEARTBEAT_SECONDS',
+                                                self.heartbeat_seconds)
+        self.max_subscribers = app.config.get('SSE_MAX_SUBSCRIBERS',
+                                              self.max_subscribers)
+        self.poll_seconds = app.config.get('SSE_POLL_SECONDS',
+                                           self.poll_seconds)
+        self.require_evented = app.config.get('SSE_REQUIRE_EVENTED_WORKER',
+                                              self.require_evented)
+        self._app = app
+        self._cursor = None
+
+    def stop(self):
+        """Stop the poll thread."""
+        self._stopped.set()
+
+    def listen(self, session):
+        """Publish the events of the writes committed by `session`."""
+        event.listen(session, 'after_flush', self._collect)
+        event.listen(session, 'after_commit', self._publish_pending)
+        event.listen(session, 'after_soft_rollback', self._discard_pending)
+
+    def subscribe(self, place_id):
+        """
+        Register a new subscriber to the events of a place.
+
+        Returns:
+            Subscriber: The subscriber, or None if the node is full.
+
+        Raises:
+            EventedWorkerRequired: If streams require an evented worker
+                and the app does not run on one.
+        """
+        if self.require_evented and not evented_worker():
+            raise EventedWorkerRequired(
+                "Event streams need an evented worker (gunicorn -k gevent)")
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(place_id, self.buffer_size)
+            self._subscribers.setdefault(place_id, set()).add(subscriber)
+            self._count += 1
+            if self._thread is None and self._app is not None and \
+                    self.poll_seconds > 0 and change_log.available():
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name='event-poll')
+                self._thread.start()
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.place_id)
+            if subscribers is None or subscriber not in subscribers:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.place_id]
+            self._count -= 1
+
+    def publish(self, place_id, name, data):
+        """Send an event to every subscriber of a place."""
+        message = f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+        with self._lock:
+            subscribers = list(self._subscribers.get(place_id, ()))
+        for subscriber in subscribers:
+            if not subscriber.push(message):
+                self._evict(subscriber)
+
+    def _evict(self, subscriber):
+        self.unsubscribe(subscriber)
+        self.evictions += 1
+        subscriber.evicted = True
+        subscriber.wakeup.set()
+
+    def stream(self, subscriber):
+        """
+        Generator of the bytes of an SSE response. It ends when the
+        subscriber is evicted and unsubscribes when the client leaves.
+        """
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                subscriber.wakeup.wait(self.heartbeat_seconds)
+                subscriber.wakeup.clear()
+                if not subscriber.buffer and not subscriber.evicted:
+                    yield b": keep-alive\n\n"
+                while subscriber.buffer:
+                    yield subscriber.buffer.popleft()
+                if subscriber.evicted:
+                    yield b"event: evicted\ndata: {}\n\n"
+                    return
+        finally:
+            self.unsubscribe(subscriber)
+
+    def poll(self):
+        """
+        Publish the changes to subscribed places committed by other
+        processes since the last poll. Needs an app context.
+        """
+        with self._lock:
+            place_ids = set(self._subscribers)
+        if not place_ids:
+            self._cursor = None
+            return
+        if self._cursor is None:
+            self._cursor = change_log.get_cursor()
+            return
+        try:
+            latest, cursor, _ = change_log.latest_changes(self._cursor,
+                                                          self.poll_limit)
+        except change_log.CursorExpired:
+            self._cursor = change_log.get_cursor()
+            return
+        with self._lock:
+            changes = {key: op for key, (seq, op) in latest.items()
+                       if seq not in self._own_seqs}
+            self._own_seqs = {seq for seq in self._own_seqs if seq > cursor}
+        self._cursor = cursor
+
+        upserts = {}
+        for (entity, entity_id), op in changes.items():
+            if op == 'upsert':
+                upserts.setdefault(entity, []).append(entity_id)
+            elif entity == 'places' and entity_id in place_ids:
+                self.publish(entity_id, 'place.deleted', {'id': entity_id})
+        if upserts.get('places'):
+            for place in db.session.scalars(select(Place).where(
+                    Place.id.in_(place_ids.intersection(upserts['places'])))):
+                self.publish(place.id, 'place.updated', _place_data(place))
+        if upserts.get('reviews'):
+            for review in db.session.scalars(select(Review).where(
+                    Review.id.in_(upserts['reviews']),
+                    Review.place_id.in_(place_ids))):
+                name = 'review.created' if review.version == 1 \
+                    else 'review.updated'
+                self.publish(review.place_id, name, _review_data(review))
+
+    def _run(self):
+        while not self._stopped.wait(self.poll_seconds):
+            with self._app.app_context():
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("Event poll failed")
+                finally:
+                    db.session.remove()
+
+    @staticmethod
+    def _collect(session, flush_context):
+        # Seqs of the changes logged by this process, not to be published
+        # again by the polls
+        seqs = session.info.setdefault('pending_seqs', [])
+        seqs.extend(obj.seq for obj in session.new
+                    if isinstance(obj, Change))
+        # A transaction may flush the same object several times; keep one
+        # event per object and kind, with its latest data.
+        pending = session.info.setdefault('pending_events', {})
+
+        def add(place_id, name, data):
+            pending.pop((place_id, name, data['id']), None)
+            pending[(place_id, name, data['id'])] = data
+
+        for obj in session.new:
+            if isinstance(obj, Review):
+                add(obj.place_id, 'review.created', _review_data(obj))
+        for obj in session.dirty:
+            if not session.is_modified(obj, include_collections=False):
+                continue
+            if isinstance(obj, Review):
+                add(obj.place_id, 'review.updated', _review_data(obj))
+            elif isinstance(obj, Place):
+                add(obj.id, 'place.updated', _place_data(obj))
+        for obj in session.deleted:
+            if isinstance(obj, Review):
+                add(obj.place_id, 'review.deleted',
+                    {'id': obj.id, 'place_id': obj.place_id})
+            elif isinstance(obj, Place):
+                add(obj.id, 'place.deleted', {'id': obj.id})
+
+    def _publish_pending(self, session):
+        seqs = session.info.pop('pending_seqs', [])
+        if seqs and self._cursor is not None:
+            with self._lock:
+                self._own_seqs.update(seqs)
+        pending = session.info.pop('pending_events', {})
+        for (place_id, name, _), data in pending.items():
+            self.publish(place_id, name, data)
+
+    @staticmethod
+    def _discard_pending(session, previous_transaction):
+        if not session.in_transaction():
+            session.info.pop('pending_events', None)
+            session.info.pop('pending_seqs', None)
@@ -1,39 +1,368 @@
+import threading
+
 from app.models.user import User
 from app.models.place import Place
 from app.models.review import Review
 from app.models.amenity import Amenity
 
-from app.services.repositories.user_repository import UserRepository
-from app.services.repositories.amenity_repository import AmenityRepository
-from app.services.repositories.place_repository import PlaceRepository
-from app.services.repositories.review_repository import ReviewRepository
+from app.services.repositories.user_repository import (
+    InMemoryUserRepository, UserRepository)
+from app.services.repositories.amenity_repository import (
+    AmenityRepository, InMemoryAmenityRepository)
+from app.services.repositories.place_repository import (
+    InMemoryPlaceRepository, PlaceRepository)
+from app.services.repositories.review_repository import (
+    InMemoryReviewRepository, ReviewRepository)
+from app.services.repositories.cached_repository import (
+    CachedAmenityRepository, CachedPlaceRepository, CachedReviewRepository,
+    CachedUserRepository, RepositoryCache)
+from app import db
+from app.services import bulk_export, change_log
+from app.services.bulk_import import BulkImporter
+from app.services.catalogue import CatalogueSnapshot
+from app.services.clusters import PlaceClusters
+from app.services.events import EventHub
+from app.services.idempotency import IdempotencyStore
+from app.services.jobs import JobRunner
+from app.services.leaderboard import Leaderboards
+from app.services.nearest import PlaceLocator
+from app.services.place_columns import PlaceColumns
+from app.services.place_indexes import PlaceIndexRefresher
+from app.services.tasks import register_tasks
+from app.services.trending import TrendingTracker
+from app.services.versioning import expect_version
+from app.services.view_counter import ViewCounter
+
+
+# Values of REPOSITORY_BACKEND
+REPOSITORY_BACKENDS = ('sqlalchemy', 'memory', 'cached')
+
+
+class DatabaseRequired(Exception):
+    """
+    Raised by the features reading or writing the tables directly (change
+    log, live events, bulk import and export), which see none of the
+    objects of the memory backend.
+    """
 
 
 class HBnBFacade:
     def __init__(self):
-        self.user_repository = UserRepository()
-        self.review_repository = ReviewRepository()
-        self.amenity_repository = AmenityRepository()
-        self.place_repository = PlaceRepository(
-            self.user_repository,
-            self.amenity_repository,
-            self.review_repository
-        )
+        self.leaderboards = Leaderboards()
+        self.place_columns = PlaceColumns()
+        self.locator = PlaceLocator()
+        self.clusters = PlaceClusters()
+        self.place_indexes = PlaceIndexRefresher(
+            self.place_columns, self.locator, self.clusters,
+            self.leaderboards)
+        self._create_repositories('sqlalchemy')
+        self.trending = TrendingTracker()
+        self.view_counter = ViewCounter()
+        self.jobs = JobRunner()
+        register_tasks(self.jobs, self)
+        self.importer = BulkImporter()
+        self.export_batch_size = 1000
+        self.changes_page_size = 500
+        change_log.track_changes(db.session)
+        self.events = EventHub()
+        self.events.listen(db.session)
+        self.idempotency = IdempotencyStore()
+        self.catalogue = CatalogueSnapshot()
+
+    def init_app(self, app):
+        backend = app.config.get('REPOSITORY_BACKEND', 'sqlalchemy')
+        if backend == 'memory' and app.config.get('CATALOGUE_SNAPSHOT_PATH'):
+            # The snapshot is written from the tables
+            raise ValueError("The catalogue snapshot cannot be used with "
+                             "the memory repository backend")
+        self._create_repositories(backend)
+        if self.repository_cache is not None:
+            self.repository_cache.init_app(app)
+        self.importer.chunk_size = app.config.get(
+            'IMPORT_CHUNK_SIZE', self.importer.chunk_size)
+        self.export_batch_size = app.config.get(
+            'EXPORT_BATCH_SIZE', self.export_batch_size)
+        self.changes_page_size = app.config.get(
+            'CHANGES_PAGE_SIZE', self.changes_page_size)
+        self.events.init_app(app)
+        self.idempotency.init_app(app)
+        self.leaderboards.init_app(app)
+        self.place_columns.init_app(app)
+        self.locator.init_app(app)
+        self.clusters.init_app(app)
+        if backend != 'memory':
+            # Memory backend: a single process, whose writes all go
+            # through this facade
+            self.place_indexes.init_app(app)
+        self.trending.init_app(app)
+        self.view_counter.init_app(app)
+        self.jobs.init_app(app)
+        self.catalogue.init_app(app)
+
+    def _create_repositories(self, backend):
+        """
+        Build the repositories of `backend`:
+
+        - 'sqlalchemy': every read and write goes to the database;
+        - 'memory': objects live in memory only and are lost on restart;
+        - 'cached': reads are served from a copy of the database kept in
+          memory, writes go to the database (see
+          app/services/repositories/cached_repository.py).
+
+        Raises:
+            ValueError: If the backend is unknown.
+        """
+        if backend not in REPOSITORY_BACKENDS:
+            raise ValueError(f"Invalid repository backend: {backend}")
+        users, amenities = UserRepository(), AmenityRepository()
+        reviews = ReviewRepository()
+        places = PlaceRepository(users, amenities, reviews)
+        if getattr(self, 'repository_cache', None) is not None:
+            self.repository_cache.stop()
+        self.repository_cache = None
+        if backend == 'memory':
+            lock = threading.RLock()
+            users = InMemoryUserRepository(lock)
+            amenities = InMemoryAmenityRepository(lock)
+            reviews = InMemoryReviewRepository(users, lock)
+            places = InMemoryPlaceRepository(users, amenities, reviews, lock)
+            reviews.place_repository = places
+        elif backend == 'cached':
+            cache = self.repository_cache = RepositoryCache()
+            users = CachedUserRepository(users, cache)
+            amenities = CachedAmenityRepository(amenities, cache)
+            reviews = CachedReviewRepository(reviews, cache, users)
+            places = CachedPlaceRepository(places, cache, users, amenities,
+                                           reviews)
+            reviews.place_repository = places
+            cache.attach(users, amenities, places, reviews)
+        self.repository_backend = backend
+        self.user_repository = users
+        self.amenity_repository = amenities
+        self.review_repository = reviews
+        self.place_repository = places
+        # The in-memory places hold the aggregates the leaderboards need
+        self.leaderboards.source = getattr(places, 'rating_rows', None)
+        self.place_columns.source = getattr(places, 'filter_rows', None)
+        self.locator.source = self.leaderboards.source
+        self.clusters.source = self.place_columns.source
+
+    def _require_database(self, feature):
+        """
+        Raises:
+            DatabaseRequired: With the memory backend.
+        """
+        if self.repository_backend == 'memory':
+            raise DatabaseRequired(f"{feature} is not available with the "
+                                   f"memory repository backend")
+
+    def get_repository_cache_metrics(self):
+        """Lag and refresh cost of the cached backend, or None when the
+        repositories are not cached."""
+        if self.repository_cache is None:
+            return None
+        return self.repository_cache.metrics()
+
+    def enqueue_job(self, name, payload=None, run_at=None):
+        if name == 'export':
+            self._require_database("Export")
+        return self.jobs.enqueue(name, payload, run_at)
+
+    def get_job(self, job_id):
+        return self.jobs.get_job(job_id)
+
+    def get_jobs(self, status=None, limit=50):
+        return self.jobs.get_jobs(status, limit)
+
+    def import_ndjson(self, kind, stream, compressed=False):
+        """Bulk import NDJSON records of `kind` and return the report."""
+        self._require_database("Bulk import")
+        report = self.importer.run(kind, stream, compressed)
+        if report.inserted and self.repository_cache is not None:
+            self.repository_cache.reload()
+        if kind == 'places' and report.inserted:
+            self.leaderboards.invalidate()
+            self.place_columns.invalidate()
+            self.locator.invalidate()
+            self.clusters.invalidate()
+        return report
+
+    def export_stream(self, entity, fmt, compress=None):
+        """Return a generator streaming an export of `entity`."""
+        self._require_database("Export")
+        bulk_export.check_export(entity, fmt, compress)
+        return bulk_export.stream_export(entity, fmt, compress,
+                                         self.export_batch_size)
+
+    def start_export(self, entity, fmt, compress=None):
+        """Enqueue a background export job writing a downloadable file."""
+        self._require_database("Export")
+        bulk_export.check_export(entity, fmt, compress)
+        return self.jobs.enqueue('export', {'entity': entity, 'format': fmt,
+                                            'compress': compress})
+
+    def get_changes(self, since, limit=None):
+        """Page of the change log after cursor `since`."""
+        self._require_database("The change log")
+        limit = min(limit or self.changes_page_size, self.changes_page_size)
+        return change_log.get_changes(since, limit)
+
+    def get_changes_cursor(self):
+        self._require_database("The change log")
+        return change_log.get_cursor()
+
+    def purge_changes(self, days=30):
+        if self.repository_backend == 'memory':
+            return 0
+        return change_log.purge_changes(days)
 
     def create_place(self, place_data):
-        return self.place_repository.create_place(place_data)
+        place = self.place_repository.create_place(place_data)
+        self.leaderboards.place_changed(place)
+        self.place_columns.place_changed(place, amenities=True)
+        self.locator.place_changed(place)
+        self.clusters.place_changed(place)
+        return place
 
     def get_place(self, place_id):
         return self.place_repository.get_place(place_id)
 
-    def get_all_places(self):
-        return self.place_repository.get_all_places()
+    def record_place_view(self, place_id):
+        self.trending.record(place_id, 'view')
+        # The counts are flushed to places.views, rows the memory backend
+        # never writes
+        if self.repository_backend != 'memory':
+            self.view_counter.increment(place_id)
+
+    def subscribe_place_events(self, place_id):
+        """
+        Subscribe to the events of a place.
+
+        Returns:
+            generator: Bytes of the SSE stream, or None if this node has
+            no room for another subscriber.
+
+        Raises:
+            DatabaseRequired: With the memory backend, whose writes are
+            never committed to the session the events are collected from.
+        """
+        self._require_database("Live events")
+        subscriber = self.events.subscribe(place_id)
+        if subscriber is None:
+            return None
+        return self.events.stream(subscriber)
+
+    def get_trending_places(self, limit=10):
+        """
+        Return the trending places of the last published snapshot as
+        (place, score) pairs, best first.
+        """
+        ranked = self.trending.top(limit)
+        places = self._get_place_summaries([pid for pid, _ in ranked])
+        return [(places[pid], score) for pid, score in ranked
+                if pid in places]
+
+    def _get_place_summaries(self, place_ids):
+        """
+        Places of `place_ids` by id, for the lists of places that show
+        no reviews: from the catalogue snapshot when there is one, from
+        the repository for the places not in it yet.
+        """
+        places = {place.id: place
+                  for place in self.catalogue.get_places(place_ids)}
+        missing = [pid for pid in place_ids if pid not in places]
+        if missing:
+            places.update((place.id, place) for place in
+                          self.place_repository.get_places(missing))
+        return places
+
+    def get_nearest_places(self, latitude, longitude, k=10,
+                           radius_km=None):
+        """
+        Return the `k` places nearest to a point, optionally within
+        `radius_km`, as (place, distance in km) pairs, nearest first.
+        """
+        self.place_indexes.start()
+        nearest = self.locator.nearest(latitude, longitude, k, radius_km)
+        places = self._get_place_summaries([pid for pid, _ in nearest])
+        return [(places[pid], distance) for pid, distance in nearest
+                if pid in places]
 
-    def update_place(self, place_id, place_data):
-        return self.place_repository.update_place(place_id, place_data)
+    def get_place_clusters(self, bbox, zoom):
+        """Clusters of the places in `bbox` at map `zoom`; see
+        PlaceClusters.clusters."""
+        self.place_indexes.start()
+        return self.clusters.clusters(bbox, zoom)
+
+    def get_all_places(self, sort=None):
+        return self.place_repository.get_all_places(sort)
+
+    def get_places_page(self, sort=None, cursor=None, limit=50):
+        """
+        Return a page of places after `cursor` and the cursor of the next
+        page (None after the last one); see
+        PlaceRepository.get_places_page.
+        """
+        return self.place_repository.get_places_page(sort, cursor, limit)
+
+    def search_places(self, sort=None, offset=0, limit=50, **filters):
+        """
+        Return the number of places matching `filters` (see
+        PlaceColumns.search) and the places of the requested page, in
+        order.
+        """
+        self.place_indexes.start()
+        total, ids = self.place_columns.search(sort=sort, offset=offset,
+                                               limit=limit, **filters)
+        places = {place.id: place
+                  for place in self.place_repository.get_places(ids)}
+        return total, [places[pid] for pid in ids if pid in places]
+
+    def update_place(self, place_id, place_data, versions=None):
+        """
+        Update a place. `versions` (from If-Match) are the versions the
+        write may apply to; see app/services/versioning.py.
+        """
+        with expect_version(self.place_repository.get_place(place_id),
+                            versions):
+            place = self.place_repository.update_place(place_id, place_data)
+        if place:
+            self.leaderboards.place_changed(place)
+            self.place_columns.place_changed(place, amenities=True)
+            self.locator.place_changed(place)
+            self.clusters.place_changed(place)
+        return place
 
     def delete_place(self, place_id):
-        return self.place_repository.delete_place(place_id)
+        deleted = self.place_repository.delete_place(place_id)
+        if deleted:
+            self.leaderboards.place_deleted(place_id)
+            self.place_columns.place_deleted(place_id)
+            self.locator.place_deleted(place_id)
+            self.clusters.place_deleted(place_id)
+        return deleted
+
+    def reconcile_rating_aggregates(self):
+        fixed = self.place_repository.reconcile_rating_aggregates()
+        if fixed:
+            self.leaderboards.rebuild()
+            self.place_columns.invalidate()
+        return fixed
+
+    def rebuild_leaderboards(self):
+        self.leaderboards.rebuild()
+
+    def get_top_places(self, metric, latitude=None, longitude=None,
+                       limit=10):
+        """
+        Return the best places for a leaderboard metric as
+        (place, score) pairs, best first.
+        """
+        self.place_indexes.start()
+        ranked = self.leaderboards.top(metric, latitude, longitude, limit)
+        places = self._get_place_summaries([pid for pid, _ in ranked])
+        return [(places[pid], score) for pid, score in ranked
+                if pid in places]
 
     def create_user(self, user_data):
         user = User(**user_data)
@@ -47,12 +376,12 @@ class HBnBFacade:
     def get_user_by_email(self, email):
         return self.user_repository.get_user_by_email(email)
 
-    def put_user(self, user_id, new_data):
+    def put_user(self, user_id, new_data, versions=None):
         user = self.get_user(user_id)
         if not user:
             return None
-        user.update(new_data)
-        return user
+        with expect_version(user, versions):
+            return self.user_repository.put_user(user_id, new_data)
 
     def get_all_user(self):
         return self.user_repository.get_all_user()
@@ -61,16 +390,36 @@ class HBnBFacade:
         return self.amenity_repository.create_amenity(amenity_data)
 
     def get_amenity(self, amenity_id):
+        # Not from the catalogue: its version, sent as the ETag, must be
+        # the current one for a following If-Match update to succeed.
         return self.amenity_repository.get_amenity(amenity_id)
 
     def get_all_amenities(self):
-        return self.amenity_repository.get_all_amenities()
+        amenities = self.catalogue.get_all_amenities()
+        if amenities is None:
+            amenities = self.amenity_repository.get_all_amenities()
+        return amenities
+
+    def build_catalogue(self):
+        """Write the catalogue snapshot now, whatever its version."""
+        if not self.catalogue.enabled:
+            raise ValueError("CATALOGUE_SNAPSHOT_PATH is not set")
+        self.catalogue.refresh(force=True)
+        snapshot = self.catalogue.current()
+        return snapshot.place_count, snapshot.amenity_count
 
-    def update_amenity(self, amenity_id, amenity_data):
-        return self.amenity_repository.update_amenity(amenity_id, amenity_data)
+    def update_amenity(self, amenity_id, amenity_data, versions=None):
+        with expect_version(self.amenity_repository.get_amenity(amenity_id),
+                            versions):
+            return self.amenity_repository.update_amenity(amenity_id,
+                                                          amenity_data)
 
     def create_review(self, review_data):
-        return self.review_repository.create_review(review_data)
+        review = self.review_repository.create_review(review_data)
+        self.leaderboards.place_changed(review.place)
+        self.place_columns.place_changed(review.place)
+        self.trending.record(review.place_id, 'review')
+        return review
 
     def get_review(self, review_id):
         return self.review_repository.get_review(review_id)
@@ -81,12 +430,29 @@ class HBnBFacade:
     def get_reviews_by_place(self, place_id):
         return self.review_repository.get_reviews_by_place(place_id)
 
-    def update_review(self, review_id, review_data):
-        return self.review_repository.update_review(review_id, review_data)
+    def update_review(self, review_id, review_data, versions=None):
+        review = self.review_repository.get_review(review_id)
+        old_place = review.place if review else None
+        with expect_version(review, versions):
+            review = self.review_repository.update_review(review_id,
+                                                          review_data)
+        if review:
+            self.leaderboards.place_changed(old_place)
+            self.place_columns.place_changed(old_place)
+            if review.place is not old_place:
+                self.leaderboards.place_changed(review.place)
+                self.place_columns.place_changed(review.place)
+        return review
 
     def get_review_by_user_and_place(self, user_id, place_id):
         return self.review_repository.get_review_by_user_and_place(
             user_id, place_id)
 
     def delete_review(self, review_id):
-        return self.review_repository.delete_review(review_id)
+        review = self.review_repository.get_review(review_id)
+        place = review.place if review else None
+        deleted = self.review_repository.delete_review(review_id)
+        if deleted:
+            self.leaderboards.place_changed(place)
+            self.place_columns.place_changed(place)
+        return deleted
@@ -0,0 +1,175 @@
+"""
+Idempotency keys for the create endpoints.
+
+A client (or a gateway) retrying a POST after a timeout sends the same
+Idempotency-Key header; the request must then create its resource once
+and every retry must get the first response back. The first request
+claims the key in the `idempotency_keys` table, runs, and stores its
+status, body and headers there for IDEMPOTENCY_TTL_SECONDS.
+
+- Retries with the same key and body replay the stored response.
+- A retry with the same key but another body is rejected (422).
+- Concurrent duplicates in this process are coalesced: one runs, the
+  others wait for it and replay its response. A duplicate arriving in
+  another process while the first one still runs gets a 409; it can be
+  retried.
+- Server errors (5xx, exceptions) are not stored, so a retry runs again.
+
+The key row is claimed and completed on connections of its own, outside
+the request's transaction, so it is visible to duplicates immediately.
+"""
+import json
+import threading
+from datetime import timedelta
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.idempotency import IdempotencyKey
+from app.services.jobs import utcnow
+
+
+class RequestInProgress(Exception):
+    """A request with the same key is still running elsewhere."""
+
+
+class KeyReused(Exception):
+    """The key was already used for a request with another body."""
+
+
+class IdempotencyStore:
+    """
+    Runs requests at most once per key and stores their responses.
+
+    Attributes:
+        ttl_seconds (float): How long a response is replayed.
+        lock_seconds (float): How long a running request keeps its key
+            before a retry may assume it died and run again.
+    """
+
+    def __init__(self, ttl_seconds=24 * 3600, lock_seconds=30.0):
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl_seconds = app.config.get('IDEMPOTENCY_TTL_SECONDS',
+                                          self.ttl_seconds)
+        self.lock_seconds = app.config.get('IDEMPOTENCY_LOCK_SECONDS',
+                                           self.lock_seconds)
+
+    def run(self, key, request_hash, execute):
+        """
+        Run `execute()` once for `key`, or replay its stored response.
+
+        Args:
+            key (str): Scoped idempotency key.
+            request_hash (str): Hash of the request body.
+            execute (callable): Returns (body, status, headers).
+
+        Returns:
+            tuple: (body, status, headers, replayed).
+
+        Raises:
+            RequestInProgress: If another process is running the key.
+            KeyReused: If the key was used with another request body.
+        """
+        while True:
+            with self._lock:
+                running = self._inflight.get(key)
+                if running is None:
+                    running = self._inflight[key] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                # Coalesce: wait for the duplicate being run here, then
+                # claim again, which replays its stored response.
+                running.wait(self.lock_seconds)
+                continue
+            try:
+                stored = self._claim(key, request_hash)
+                if stored is not None:
+                    return stored + (True,)
+                try:
+                    body, status, headers = execute()
+                except BaseException:
+                    self._release(key)
+                    raise
+                self._complete(key, body, status, headers)
+                return body, status, headers, False
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                running.set()
+
+    def _claim(self, key, request_hash):
+        """Take the key, or return its stored (body, status, headers)."""
+        keys = IdempotencyKey.__table__
+        now = utcnow()
+        lease = {'status': 'running', 'request_hash': request_hash,
+                 'response_status': None, 'response': None,
+                 'locked_until': now + timedelta(seconds=self.lock_seconds),
+                 'expires_at': now + timedelta(seconds=self.ttl_seconds)}
+        with db.engine.begin() as connection:
+            row = connection.execute(
+                select(keys).where(keys.c.key == key)).first()
+            if row is None:
+                try:
+                    connection.execute(insert(keys).values(key=key, **lease))
+                except IntegrityError:
+                    raise RequestInProgress()
+                return None
+            if row.expires_at <= now:
+                connection.execute(update(keys).where(keys.c.key == key)
+                                   .values(**lease))
+                return None
+            if row.request_hash != request_hash:
+                raise KeyReused()
+            if row.status == 'done':
+                stored = json.loads(row.response)
+                return stored['body'], row.response_status, stored['headers']
+            taken = connection.execute(
+                update(keys).where(keys.c.key == key,
+                                   keys.c.status == 'running',
+                                   keys.c.locked_until <= now)
+                .values(**lease))
+            if not taken.rowcount:
+                raise RequestInProgress()
+            return None
+
+    def _complete(self, key, body, status, headers):
+        keys = IdempotencyKey.__table__
+        try:
+            response = json.dumps({'body': body, 'headers': headers})
+        except TypeError:
+            response = None
+        if status >= 500 or response is None:
+            self._release(key)
+            return
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(keys).where(keys.c.key == key)
+                .values(status='done', response_status=status,
+                        response=response,
+                        expires_at=utcnow() + timedelta(
+                            seconds=self.ttl_seconds)))
+
+    def _release(self, key):
+        keys = IdempotencyKey.__table__
+        with db.engine.begin() as connection:
+            connection.execute(delete(keys).where(keys.c.key == key))
+
+    def purge(self):
+        """
+        Delete the expired keys.
+
+        Returns:
+            int: Number of keys deleted.
+        """
+        keys = IdempotencyKey.__table__
+        with db.engine.begin() as connection:
+            return connection.execute(
+                delete(keys).where(keys.c.expires_at <= utcnow())).rowcount
@@ -0,0 +1,376 @@
+"""
+In-process background job runner.
+
+Jobs are rows of the `jobs` table, so the queue lives in the application
+database (SQLite), survives restarts and can be enqueued in the same
+transaction as the write that needs it. Every worker process runs a
+dispatcher thread that claims due jobs with a conditional UPDATE (so a job
+is only ever claimed once) and hands them to a thread or process pool.
+
+Failed jobs are retried with exponential backoff
+(JOBS_BACKOFF_SECONDS * 2 ** (attempt - 1)) until they reach their
+max_attempts. Scheduled jobs use cron-like expressions and are enqueued
+only by the worker holding the "scheduler" lease, so a multi-process
+deployment runs each scheduled slot once.
+
+Handlers are registered by name, and long running ones may publish their
+progress with `report_progress`:
+
+    @jobs.register('purge_jobs')
+    def purge_jobs(days=7):
+        ...
+"""
+import contextvars
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.extensions import serving
+from app.models.job import Job, JobLease
+
+logger = logging.getLogger(__name__)
+
+# Id of the job run by the current worker thread or process.
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+def utcnow():
+    """Current UTC time as a naive datetime, as stored by SQLite."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CronSchedule:
+    """
+    Minimal cron expression: "minute hour day-of-month month day-of-week".
+
+    Each field accepts `*`, a number, a range `a-b`, a step `*/n` or
+    `a-b/n`, and comma separated lists of those. Day-of-week uses 0 for
+    Monday, like datetime.weekday().
+    """
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression: {expression}")
+        self.expression = expression
+        self.fields = [self._parse(field, low, high)
+                       for field, (low, high) in zip(fields, self.RANGES)]
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            body, _, step = part.partition('/')
+            if body == '*':
+                start, end = low, high
+            elif '-' in body:
+                start, end = (int(value) for value in body.split('-'))
+            else:
+                start = end = int(body)
+            if start < low or end > high or start > end:
+                raise ValueError(f"Cron field out of range: {field}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def matches(self, moment):
+        minute, hour, day, month, weekday = self.fields
+        return (moment.minute in minute and moment.hour in hour
+                and moment.day in day and moment.month in month
+                and moment.weekday() in weekday)
+
+
+def report_progress(fraction):
+    """
+    Record the progress (0.0 to 1.0) of the job being run by the caller.
+
+    The update is committed on its own connection so it is visible while
+    the handler's transaction is still open. Outside a job it is a no-op.
+    """
+    job_id = current_job.get()
+    if job_id is None:
+        return
+    jobs = Job.__table__
+    with db.engine.begin() as connection:
+        connection.execute(jobs.update().where(jobs.c.id == job_id)
+                           .values(progress=round(fraction, 4)))
+
+
+def _run_in_child(config_object, job_id, name, payload):
+    """Entry point of process pool workers: run a handler in a new app."""
+    from app import create_app
+    from app.services import facade
+
+    global _child_app
+    if '_child_app' not in globals():
+        _child_app = create_app(config_object)
+    token = current_job.set(job_id)
+    try:
+        with _child_app.app_context():
+            return facade.jobs.handlers[name]['func'](**payload)
+    finally:
+        current_job.reset(token)
+
+
+class JobRunner:
+    """
+    Registry of job handlers and the dispatcher that runs queued jobs.
+
+    Attributes:
+        handlers (dict): Handler function and max attempts by job name.
+        schedules (dict): CronSchedule of each scheduled job name.
+        worker_id (str): Identifier of this process in the queue and lease.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.schedules = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:" \
+                         f"{uuid.uuid4().hex[:6]}"
+        self.workers = 4
+        self.poll_seconds = 1.0
+        self.backoff_seconds = 10.0
+        self.lease_seconds = 30.0
+        self.timeout_seconds = 3600.0
+        self._app = None
+        self._executor = None
+        self._child_config = None
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_slot = None
+
+    def init_app(self, app):
+        """Read the job settings and start the dispatcher thread."""
+        self._app = app
+        self.workers = app.config.get('JOBS_WORKERS', self.workers)
+        self.poll_seconds = app.config.get('JOBS_POLL_SECONDS',
+                                           self.poll_seconds)
+        self.backoff_seconds = app.config.get('JOBS_BACKOFF_SECONDS',
+                                              self.backoff_seconds)
+        self.lease_seconds = app.config.get('JOBS_LEASE_SECONDS',
+                                            self.lease_seconds)
+        self.timeout_seconds = app.config.get('JOBS_TIMEOUT_SECONDS',
+                                              self.timeout_seconds)
+        for name, expression in app.config.get('JOBS_SCHEDULE', {}).items():
+            self.schedule(name, expression)
+        if not app.config.get('JOBS_ENABLED', True) or not serving() or \
+                self._thread:
+            return
+        if app.config.get('JOBS_EXECUTOR', 'thread') == 'process':
+            self._child_config = app.config['JOBS_CHILD_CONFIG']
+            self._executor = ProcessPoolExecutor(self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix='job-worker')
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='job-dispatcher')
+        self._thread.start()
+
+    def register(self, name, max_attempts=3):
+        """Decorator registering a function as the handler of a job name."""
+        def decorator(func):
+            self.handlers[name] = {'func': func,
+                                   'max_attempts': max_attempts}
+            return func
+        return decorator
+
+    def schedule(self, name, expression):
+        """Enqueue job `name` whenever the cron expression matches."""
+        self.schedules[name] = CronSchedule(expression)
+
+    def enqueue(self, name, payload=None, run_at=None, unique_key=None,
+                commit=True):
+        """
+        Add a job to the queue.
+
+        Args:
+            name (str): Registered handler name.
+            payload (dict): Keyword arguments of the handler (JSON).
+            run_at (datetime): Earliest start time, defaults to now.
+            unique_key (str): Optional deduplication key.
+            commit (bool): Commit immediately; pass False to enqueue in
+                the caller's transaction.
+
+        Returns:
+            Job: The queued job, or None if `unique_key` already exists.
+
+        Raises:
+            ValueError: If no handler is registered under `name`.
+        """
+        if name not in self.handlers:
+            raise ValueError(f"Unknown job: {name}")
+        job = Job(name=name, payload=json.dumps(payload or {}),
+                  run_at=run_at or utcnow(), unique_key=unique_key,
+                  max_attempts=self.handlers[name]['max_attempts'])
+        if not commit:
+            db.session.add(job)
+            return job
+        try:
+            db.session.add(job)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        self._wake.set()
+        return job
+
+    def get_job(self, job_id):
+        return db.session.get(Job, job_id)
+
+    def get_jobs(self, status=None, limit=50):
+        query = Job.query.order_by(Job.created_at.desc())
+        if status:
+            if status not in Job.STATUSES:
+                raise ValueError(f"Invalid status: {status}")
+            query = query.filter_by(status=status)
+        return query.limit(limit).all()
+
+    def purge(self, days=7):
+        """
+        Delete finished jobs older than `days` days.
+
+        Returns:
+            int: Number of jobs deleted.
+        """
+        limit = utcnow() - timedelta(days=days)
+        deleted = Job.query.filter(
+            Job.status.in_(('done', 'failed')),
+            Job.updated_at < limit).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def acquire_lease(self, name):
+        """
+        Take or renew lease `name` for this worker.
+
+        Returns:
+            bool: True if this worker holds the lease.
+        """
+        now = utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        result = db.session.execute(
+            update(JobLease)
+            .where(JobLease.name == name)
+            .where((JobLease.holder == self.worker_id)
+                   | (JobLease.expires_at < now))
+            .values(holder=self.worker_id, expires_at=expires_at))
+        if result.rowcount:
+            db.session.commit()
+            return True
+        try:
+            db.session.add(JobLease(name=name, holder=self.worker_id,
+                                    expires_at=expires_at))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    def run_pending(self):
+        """
+        One dispatcher pass: enqueue due scheduled jobs if leader, then
+        claim and start as many due jobs as there are free workers.
+        """
+        if self.schedules and self.acquire_lease('scheduler'):
+            self._enqueue_scheduled()
+            self._requeue_stale()
+
+        free = self.workers - len(self._running)
+        if free <= 0:
+            return
+        due = db.session.execute(
+            select(Job.id, Job.name, Job.payload)
+            .where(Job.status == 'queued', Job.run_at <= utcnow())
+            .order_by(Job.run_at).limit(free)).all()
+        for job_id, name, payload in due:
+            claimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', locked_by=self.worker_id,
+                        locked_at=utcnow(), attempts=Job.attempts + 1))
+            db.session.commit()
+            if claimed.rowcount:
+                self._start(job_id, name, json.loads(payload))
+
+    def _enqueue_scheduled(self):
+        slot = utcnow().replace(second=0, microsecond=0)
+        if slot == self._last_slot:
+            return
+        self._last_slot = slot
+        for name, schedule in self.schedules.items():
+            if schedule.matches(slot):
+                self.enqueue(name, unique_key=f"{name}@{slot.isoformat()}")
+
+    def _requeue_stale(self):
+        """Put back jobs whose worker died while running them."""
+        limit = utcnow() - timedelta(seconds=self.timeout_seconds)
+        db.session.execute(
+            update(Job)
+            .where(Job.status == 'running', Job.locked_at < limit)
+            .values(status='queued', locked_by=None,
+                    last_error='Worker timed out'))
+        db.session.commit()
+
+    def _start(self, job_id, name, payload):
+        with self._lock:
+            self._running.add(job_id)
+        if isinstance(self._executor, ProcessPoolExecutor):
+            future = self._executor.submit(_run_in_child, self._child_config,
+                                           job_id, name, payload)
+        else:
+            future = self._executor.submit(self._call, job_id, name, payload)
+        future.add_done_callback(
+            lambda done: self._finish(job_id, done))
+
+    def _call(self, job_id, name, payload):
+        token = current_job.set(job_id)
+        try:
+            with self._app.app_context():
+                return self.handlers[name]['func'](**payload)
+        finally:
+            current_job.reset(token)
+
+    def _finish(self, job_id, future):
+        with self._app.app_context():
+            job = db.session.get(Job, job_id)
+            try:
+                job.result = json.dumps(future.result())
+                job.status = 'done'
+                job.progress = 1.0
+                job.last_error = None
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job.name, job_id)
+                job.last_error = f"{type(e).__name__}: {e}"
+                if job.attempts < job.max_attempts:
+                    delay = self.backoff_seconds * 2 ** (job.attempts - 1)
+                    job.status = 'queued'
+                    job.run_at = utcnow() + timedelta(seconds=delay)
+                else:
+                    job.status = 'failed'
+            job.locked_by = None
+            db.session.commit()
+        with self._lock:
+            self._running.discard(job_id)
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            try:
+                with self._app.app_context():
+                    self.run_pending()
+            except Exception:
+                logger.exception("Job dispatcher pass failed")
@@ -0,0 +1,240 @@
+"""
+In-memory leaderboards of the best rated and most reviewed places.
+
+Each leaderboard keeps a bounded top-K set per metric, both globally and
+per geographic cell (a square of LEADERBOARD_CELL_DEGREES degrees). The
+sets are updated incrementally from the rating aggregates stored on
+`Place` whenever a review or a place is written, so serving a rail never
+sorts the whole catalogue.
+
+A bounded set cannot know about places it has evicted, so every set
+remembers the best score it ever turned away (its floor). As long as the
+requested entries all score at least the floor the answer is exact;
+otherwise the set is stale and the leaderboards are rebuilt from the
+places table (aggregate columns only, the reviews table is never read).
+
+The facade offers its own place and review writes to the sets; the
+writes of the other workers reach them through the background thread of
+app/services/place_indexes.py, like the other place indexes.
+"""
+import math
+import threading
+import time
+
+from sqlalchemy import select
+
+from app import db
+from app.models.place import Place
+
+
+class TopK:
+    """
+    Bounded set of the best scored members.
+
+    Attributes:
+        capacity (int): Maximum number of members kept.
+        scores (dict): Score of each member, keyed by member id.
+        floor (tuple or None): Best score rejected or evicted so far,
+            None while the set has never overflowed.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.scores = {}
+        self.floor = None
+
+    def offer(self, member, score):
+        """Insert or update `member`; a None score removes it."""
+        if score is None:
+            self.scores.pop(member, None)
+            return
+        if member in self.scores or len(self.scores) < self.capacity:
+            self.scores[member] = score
+            return
+        lowest = min(self.scores, key=self.scores.get)
+        if score > self.scores[lowest]:
+            rejected = self.scores.pop(lowest)
+            self.scores[member] = score
+        else:
+            rejected = score
+        if self.floor is None or rejected > self.floor:
+            self.floor = rejected
+
+    def discard(self, member):
+        self.scores.pop(member, None)
+
+    def top(self, limit):
+        """
+        Return the `limit` best members as (member, score) pairs, or None
+        when the set can no longer guarantee an exact answer.
+        """
+        ranked = sorted(self.scores.items(), key=lambda item: item[1],
+                        reverse=True)[:limit]
+        if self.floor is None:
+            return ranked
+        if len(ranked) < limit or ranked[-1][1] < self.floor:
+            return None
+        return ranked
+
+
+class Leaderboards:
+    """
+    Top-K places per metric, globally and per geographic cell.
+
+    Metrics:
+        rated: average rating, ties broken by review count. Places need
+            at least `min_reviews` reviews to be ranked.
+        reviewed: review count, ties broken by average rating.
+
+    Attributes:
+        reload_seconds (float): Interval of the periodic rebuilds, done
+            only without a change log (see place_indexes); 0 never
+            rebuilds.
+    """
+
+    METRICS = ('rated', 'reviewed')
+
+    def __init__(self, size=20, cell_degrees=1.0, min_reviews=1,
+                 reload_seconds=60.0):
+        self.size = size
+        self.cell_degrees = cell_degrees
+        self.min_reviews = min_reviews
+        self.reload_seconds = reload_seconds
+        # Callable returning the (id, latitude, longitude, review_count,
+        # rating_sum) rows of every place; the places table when None.
+        self.source = None
+        self._boards = {}
+        self._cells = {}
+        self._loaded = False
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the leaderboard settings from the application config."""
+        self.size = app.config.get('LEADERBOARD_SIZE', self.size)
+        self.cell_degrees = app.config.get('LEADERBOARD_CELL_DEGREES',
+                                           self.cell_degrees)
+        self.min_reviews = app.config.get('LEADERBOARD_MIN_REVIEWS',
+                                          self.min_reviews)
+        self.reload_seconds = app.config.get('LEADERBOARD_RELOAD_SECONDS',
+                                             self.reload_seconds)
+        with self._lock:
+            self._boards.clear()
+            self._cells.clear()
+            self._loaded = False
+            self._loaded_at = None
+
+    @property
+    def loaded(self):
+        """Whether the sets were built, even if a rebuild is now forced."""
+        return self._loaded_at is not None
+
+    def reload_due(self):
+        """Whether the periodic rebuild is due (see reload_seconds)."""
+        return self.loaded and self.reload_seconds > 0 and \
+            time.monotonic() - self._loaded_at > self.reload_seconds
+
+    def cell_of(self, latitude, longitude):
+        """Return the key of the geographic cell containing a point."""
+        return (math.floor(latitude / self.cell_degrees),
+                math.floor(longitude / self.cell_degrees))
+
+    def _score(self, metric, review_count, rating_sum):
+        review_count = review_count or 0
+        average = rating_sum / review_count if review_count else 0.0
+        if metric == 'rated':
+            if review_count < self.min_reviews:
+                return None
+            return (average, review_count)
+        return (review_count, average)
+
+    def _board(self, metric, cell):
+        key = (metric, cell)
+        if key not in self._boards:
+            # Twice the served size so a few score drops do not force a
+            # rebuild.
+            self._boards[key] = TopK(self.size * 2)
+        return self._boards[key]
+
+    def _offer(self, place_id, latitude, longitude, review_count,
+               rating_sum):
+        cell = self.cell_of(latitude, longitude)
+        previous = self._cells.get(place_id)
+        if previous is not None and previous != cell:
+            for metric in self.METRICS:
+                self._board(metric, previous).discard(place_id)
+        self._cells[place_id] = cell
+        for metric in self.METRICS:
+            score = self._score(metric, review_count, rating_sum)
+            self._board(metric, None).offer(place_id, score)
+            self._board(metric, cell).offer(place_id, score)
+
+    def rebuild(self):
+        """Reload every leaderboard from the places table (or `source`)."""
+        if self.source is not None:
+            rows = self.source()
+        else:
+            rows = db.session.execute(select(
+                Place.id, Place.latitude, Place.longitude,
+                Place.review_count, Place.rating_sum))
+        with self._lock:
+            self._boards.clear()
+            self._cells.clear()
+            for row in rows:
+                self._offer(*row)
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+
+    def load(self):
+        """Same as rebuild(), as the refresher calls the place indexes."""
+        self.rebuild()
+
+    def invalidate(self):
+        """Force a rebuild on the next read, e.g. after a bulk import."""
+        self._loaded = False
+
+    def place_changed(self, place):
+        """Account for a created or updated place (or its reviews)."""
+        if not self._loaded:
+            return
+        with self._lock:
+            self._offer(place.id, place.latitude, place.longitude,
+                        place.review_count, place.rating_sum)
+
+    def place_deleted(self, place_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            cell = self._cells.pop(place_id, None)
+            for metric in self.METRICS:
+                self._board(metric, None).discard(place_id)
+                if cell is not None:
+                    self._board(metric, cell).discard(place_id)
+
+    def top(self, metric, latitude=None, longitude=None, limit=10):
+        """
+        Return the ids and scores of the best places for `metric`,
+        restricted to the cell containing (latitude, longitude) if given.
+
+        Raises:
+            ValueError: If the metric is unknown.
+        """
+        if metric not in self.METRICS:
+            raise ValueError(f"Invalid metric: {metric}")
+        limit = min(limit, self.size)
+        cell = None
+        if latitude is not None and longitude is not None:
+            cell = self.cell_of(latitude, longitude)
+
+        for _ in range(2):
+            if not self._loaded:
+                self.rebuild()
+            with self._lock:
+                board = self._boards.get((metric, cell))
+                if board is None:
+                    return []
+                ranked = board.top(limit)
+                if ranked is not None:
+                    return ranked
+                self._loaded = False
+        return ranked or []
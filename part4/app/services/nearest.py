@@ -0,0 +1,333 @@
+"""
+Nearest places by great-circle distance.
+
+Places are points on the unit sphere (x, y, z). The straight-line (chord)
+distance between two such points grows with their great-circle distance,
+so the k nearest places by chord are the k nearest on the globe, and a
+radius on the globe is a radius in space. That lets an ordinary KD-tree
+over the 3-D points answer both queries.
+
+The tree splits boxes on their widest axis down to leaves of LEAF_SIZE
+points, and is searched best first: nodes are visited in order of the
+distance from the query to their bounding box, and the search stops once
+the next box is farther than the k-th place found. A query therefore
+reads O(log n + k) nodes instead of every place.
+
+The tree itself is rebuilt, not edited. A deleted or moved place is
+marked dead in it; created and moved places wait in a small buffer that
+queries scan along with the tree. The tree is rebuilt from its live
+points and the buffer once the buffer or the dead points grow past a
+fraction of the tree (no database read). The tree is loaded from the
+places table on the first query; other workers' writes reach it through
+the background thread of app/services/place_indexes.py.
+"""
+import heapq
+import math
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+from app import db
+from app.models.place import Place
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def unit_vectors(latitudes, longitudes):
+    """Points on the unit sphere of coordinates in degrees, as an (n, 3)
+    array."""
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+    cos = np.cos(latitudes)
+    return np.stack((cos * np.cos(longitudes), cos * np.sin(longitudes),
+                     np.sin(latitudes)), axis=-1)
+
+
+def chord_to_km(chord):
+    """Great-circle distance of a chord of the unit sphere."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+def km_to_chord(km):
+    return 2 * math.sin(min(km / (2 * EARTH_RADIUS_KM), math.pi / 2))
+
+
+def check_coordinates(latitude, longitude):
+    """
+    Raises:
+        ValueError: If the coordinates are out of range.
+    """
+    if not -90 <= latitude <= 90:
+        raise ValueError("Latitude must be between -90 and 90")
+    if not -180 <= longitude <= 180:
+        raise ValueError("Longitude must be between -180 and 180")
+
+
+def check_radius(radius_km):
+    """
+    Raises:
+        ValueError: If the radius is negative or not finite.
+    """
+    if not (math.isfinite(radius_km) and radius_km >= 0):
+        raise ValueError("radius_km must be a finite number, positive or "
+                         "zero")
+
+
+class KDTree:
+    """
+    Static KD-tree over 3-D points, with points that can be marked dead.
+
+    Attributes:
+        points (ndarray): The points, reordered so each leaf is a
+            contiguous slice.
+        index (ndarray): Position in the input of each point.
+        dead (ndarray): Whether each point (in tree order) is dead.
+    """
+
+    LEAF_SIZE = 16
+
+    def __init__(self, points):
+        count = len(points)
+        order = np.arange(count)
+        # Per node: bounding box, slice of the points, children (leaves
+        # have none)
+        self._lo, self._hi, self._slices, self._children = [], [], [], []
+        stack = [(None, 0, count)] if count else []
+        while stack:
+            parent, start, end = stack.pop()
+            node = len(self._slices)
+            if parent is not None:
+                self._children[parent[0]][parent[1]] = node
+            box = points[order[start:end]]
+            lo, hi = box.min(axis=0), box.max(axis=0)
+            self._lo.append(tuple(lo))
+            self._hi.append(tuple(hi))
+            self._slices.append((start, end))
+            self._children.append([-1, -1])
+            if end - start <= self.LEAF_SIZE:
+                continue
+            axis = int(np.argmax(hi - lo))
+            middle = (start + end) // 2
+            segment = order[start:end]
+            order[start:end] = segment[np.argpartition(
+                points[segment, axis], middle - start)]
+            stack.append(((node, 1), middle, end))
+            stack.append(((node, 0), start, middle))
+        self.points = points[order]
+        self.index = order
+        self.dead = np.zeros(count, dtype=bool)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _box_distance(self, node, query):
+        """Squared distance from `query` to the box of `node`."""
+        total = 0.0
+        for value, lo, hi in zip(query, self._lo[node], self._hi[node]):
+            if value < lo:
+                total += (lo - value) ** 2
+            elif value > hi:
+                total += (value - hi) ** 2
+        return total
+
+    def _leaf(self, node, query):
+        """Tree positions and squared distances of the live points of a
+        leaf."""
+        start, end = self._slices[node]
+        alive = np.flatnonzero(~self.dead[start:end]) + start
+        offsets = self.points[alive] - query
+        return alive, np.einsum('ij,ij->i', offsets, offsets)
+
+    def search(self, query, k=None, bound=math.inf):
+        """
+        Return (squared chord, tree position) pairs of the live points
+        within sqrt(`bound`) of `query`, nearest first; only the `k`
+        nearest when `k` is given.
+        """
+        if not len(self.points):
+            return []
+        query = tuple(float(value) for value in query)
+        found = []    # max-heap of (-distance, position)
+        nodes = [(self._box_distance(0, query), 0)]
+        while nodes:
+            distance, node = heapq.heappop(nodes)
+            if distance > bound:
+                break
+            left, right = self._children[node]
+            if left >= 0:
+                for child in (left, right):
+                    child_distance = self._box_distance(child, query)
+                    if child_distance <= bound:
+                        heapq.heappush(nodes, (child_distance, child))
+                continue
+            positions, distances = self._leaf(node, query)
+            for position, distance in zip(positions.tolist(),
+                                          distances.tolist()):
+                if distance > bound:
+                    continue
+                if k is None:
+                    found.append((-distance, position))
+                    continue
+                heapq.heappush(found, (-distance, position))
+                if len(found) > k:
+                    heapq.heappop(found)
+                if len(found) == k:
+                    bound = -found[0][0]
+        return sorted((-distance, position) for distance, position in found)
+
+
+class PlaceLocator:
+    """
+    Coordinates of every place in a KD-tree, plus a buffer of the recent
+    writes, answering the nearest and within-radius queries.
+
+    Attributes:
+        source (callable or None): Returns rows starting with (id,
+            latitude, longitude) for every place; the database when None.
+        reload_seconds (float): Interval of the periodic reloads, done
+            only without a change log (see place_indexes); 0 never reloads.
+        buffer_size (int): Buffered writes always allowed before the tree
+            is rebuilt; more are allowed up to an eighth of the tree.
+    """
+
+    def __init__(self, reload_seconds=60.0, buffer_size=256):
+        self.source = None
+        self.reload_seconds = reload_seconds
+        self.buffer_size = buffer_size
+        self.rebuilds = 0
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._set_tree([], np.zeros((0, 3)))
+
+    def init_app(self, app):
+        """Read the reload interval and drop the loaded places."""
+        self.reload_seconds = app.config.get('NEAREST_RELOAD_SECONDS',
+                                             self.reload_seconds)
+        self.invalidate()
+
+    def invalidate(self):
+        """Force a reload on the next query, e.g. after a bulk import."""
+        self._loaded_at = None
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def reload_due(self):
+        """Whether the periodic reload is due (see reload_seconds)."""
+        return self.loaded and self.reload_seconds > 0 and \
+            time.monotonic() - self._loaded_at > self.reload_seconds
+
+    def _set_tree(self, ids, points):
+        self._tree = KDTree(points)
+        self._ids = [ids[i] for i in self._tree.index.tolist()]
+        self._positions = {place_id: position
+                           for position, place_id in enumerate(self._ids)}
+        self._pending = {}
+        self._dead = 0
+
+    def load(self):
+        """Rebuild the tree from the places table (or `source`)."""
+        if self.source is not None:
+            rows = [row[:3] for row in self.source()]
+        else:
+            rows = db.session.execute(
+                select(Place.id, Place.latitude, Place.longitude)).all()
+        ids = [row[0] for row in rows]
+        points = unit_vectors([row[1] for row in rows],
+                              [row[2] for row in rows]).reshape(-1, 3)
+        with self._lock:
+            self._set_tree(ids, points)
+            self._loaded_at = time.monotonic()
+
+    def _rebuild(self):
+        """Rebuild the tree from its live points and the buffer."""
+        live = [position for position in self._positions.values()]
+        ids = [self._ids[position] for position in live]
+        ids.extend(self._pending)
+        points = np.concatenate((self._tree.points[live], np.array(
+            list(self._pending.values())).reshape(-1, 3)))
+        self._set_tree(ids, points)
+        self.rebuilds += 1
+
+    def place_changed(self, place):
+        """Account for a created place, or an updated one that may have
+        moved."""
+        if self._loaded_at is None:
+            return
+        point = unit_vectors(place.latitude, place.longitude)
+        with self._lock:
+            position = self._positions.get(place.id)
+            if position is not None:
+                if np.array_equal(self._tree.points[position], point):
+                    return
+                self._kill(place.id, position)
+            self._pending[place.id] = point
+            self._maybe_rebuild()
+
+    def place_deleted(self, place_id):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            position = self._positions.get(place_id)
+            if position is not None:
+                self._kill(place_id, position)
+            self._pending.pop(place_id, None)
+            self._maybe_rebuild()
+
+    def _kill(self, place_id, position):
+        self._tree.dead[position] = True
+        del self._positions[place_id]
+        self._dead += 1
+
+    def _maybe_rebuild(self):
+        size = len(self._tree)
+        if len(self._pending) > max(self.buffer_size, size // 8) \
+                or self._dead > max(self.buffer_size, size // 4):
+            self._rebuild()
+
+    def _query(self, latitude, longitude, k=None, radius_km=None):
+        check_coordinates(latitude, longitude)
+        if not self.loaded:
+            self.load()
+        query = unit_vectors(latitude, longitude)
+        bound = math.inf if radius_km is None else km_to_chord(radius_km) ** 2
+        with self._lock:
+            found = [(distance, self._ids[position]) for distance, position
+                     in self._tree.search(query, k, bound)]
+            if self._pending:
+                ids = list(self._pending)
+                offsets = np.array(list(self._pending.values())) - query
+                distances = np.einsum('ij,ij->i', offsets, offsets)
+                found.extend((distance, ids[i]) for i, distance
+                             in enumerate(distances.tolist())
+                             if distance <= bound)
+                found.sort()
+        if k is not None:
+            found = found[:k]
+        return [(place_id, float(chord_to_km(math.sqrt(distance))))
+                for distance, place_id in found]
+
+    def nearest(self, latitude, longitude, k=10, radius_km=None):
+        """
+        Return the `k` places nearest to a point as (place id, distance
+        in km) pairs, nearest first, optionally only those within
+        `radius_km`.
+
+        Raises:
+            ValueError: If the coordinates are out of range, k < 1 or the
+                radius is negative or not finite.
+        """
+        if k < 1:
+            raise ValueError("k must be positive")
+        if radius_km is not None:
+            check_radius(radius_km)
+        return self._query(latitude, longitude, k, radius_km)
+
+    def within(self, latitude, longitude, radius_km):
+        """Every place within `radius_km` of a point, nearest first, as
+        (place id, distance in km) pairs."""
+        check_radius(radius_km)
+        return self._query(latitude, longitude, radius_km=radius_km)
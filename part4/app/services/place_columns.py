@@ -0,0 +1,269 @@
+"""
+Columnar copy of the place attributes searches filter on.
+
+Price, coordinates, rating aggregates and amenities of every place are
+held in NumPy arrays, one row per place. A search evaluates each filter
+(price range, bounding box, minimum average rating, required amenities)
+as a boolean mask over whole columns, combines the masks, sorts the
+matching rows and returns the ids of one page; only those places are
+then loaded from the repository.
+
+Amenities are a bitset per place: every amenity seen gets a bit, and a
+row holds as many 64-bit words as there are bits in use. Requiring a set
+of amenities is one AND and compare per word.
+
+The columns are loaded from the places table (single-table selects) on
+the first search. The facade keeps the rows in step with its place and
+review writes, as it does for the leaderboards; the writes of other
+workers are applied by a background thread (app/services/place_indexes.py).
+"""
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+from app import db
+from app.models.place import Place, place_amenity
+
+
+class PlaceColumns:
+    """
+    Place attributes in NumPy arrays, and the searches over them.
+
+    Attributes:
+        source (callable or None): Returns the (id, price, latitude,
+            longitude, review_count, rating_sum, amenity ids) rows of
+            every place; the database when None.
+        reload_seconds (float): Interval of the periodic reloads, done
+            only without a change log (see place_indexes); 0 never reloads.
+    """
+
+    SORTS = ('rating', 'reviews', 'price')
+
+    def __init__(self, reload_seconds=60.0):
+        self.source = None
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._clear(0, [])
+
+    def init_app(self, app):
+        """Read the reload interval and drop the loaded columns."""
+        self.reload_seconds = app.config.get('PLACE_COLUMNS_RELOAD_SECONDS',
+                                             self.reload_seconds)
+        self.invalidate()
+
+    def invalidate(self):
+        """Force a reload on the next search, e.g. after a bulk import."""
+        self._loaded_at = None
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def reload_due(self):
+        """Whether the periodic reload is due (see reload_seconds)."""
+        return self.loaded and self.reload_seconds > 0 and \
+            time.monotonic() - self._loaded_at > self.reload_seconds
+
+    def _clear(self, capacity, amenity_ids):
+        self._ids = [None] * capacity
+        self._rows = {}
+        self._free = []
+        self._size = 0
+        self._bits = {amenity_id: bit
+                      for bit, amenity_id in enumerate(amenity_ids)}
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.price = np.zeros(capacity)
+        self.latitude = np.zeros(capacity)
+        self.longitude = np.zeros(capacity)
+        self.review_count = np.zeros(capacity, dtype=np.int64)
+        self.rating_sum = np.zeros(capacity, dtype=np.int64)
+        self.amenities = np.zeros((capacity, max(1, -(-len(amenity_ids)
+                                                      // 64))),
+                                  dtype=np.uint64)
+
+    def _rows_of_database(self):
+        links = {}
+        for place_id, amenity_id in db.session.execute(
+                select(place_amenity.c.place_id, place_amenity.c.amenity_id)):
+            links.setdefault(place_id, []).append(amenity_id)
+        return [(*row, links.get(row[0], ())) for row in db.session.execute(
+            select(Place.id, Place.price, Place.latitude, Place.longitude,
+                   Place.review_count, Place.rating_sum))]
+
+    def load(self):
+        """Reload every column from the places table (or `source`)."""
+        rows = (self.source or self._rows_of_database)()
+        amenity_ids = list(dict.fromkeys(
+            amenity_id for row in rows for amenity_id in row[6]))
+        with self._lock:
+            self._clear(max(len(rows), 64), amenity_ids)
+            count = len(rows)
+            if count:
+                ids, price, latitude, longitude, reviews, ratings, _ = zip(
+                    *rows)
+                self._ids[:count] = ids
+                self._rows = {place_id: row
+                              for row, place_id in enumerate(ids)}
+                self._size = count
+                self.alive[:count] = True
+                self.price[:count] = price
+                self.latitude[:count] = latitude
+                self.longitude[:count] = longitude
+                self.review_count[:count] = [value or 0 for value in reviews]
+                self.rating_sum[:count] = [value or 0 for value in ratings]
+                for row, values in enumerate(rows):
+                    self._set_amenities(row, values[6])
+            self._loaded_at = time.monotonic()
+
+    def _grow(self):
+        capacity = max(64, 2 * len(self.alive))
+        for name in ('alive', 'price', 'latitude', 'longitude',
+                     'review_count', 'rating_sum', 'amenities'):
+            column = getattr(self, name)
+            grown = np.zeros((capacity,) + column.shape[1:],
+                             dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+        self._ids.extend([None] * (capacity - len(self._ids)))
+
+    def _bit(self, amenity_id):
+        """Bit of an amenity, assigning the next one to a new amenity."""
+        bit = self._bits.get(amenity_id)
+        if bit is None:
+            bit = self._bits[amenity_id] = len(self._bits)
+            if bit // 64 >= self.amenities.shape[1]:
+                self.amenities = np.hstack((self.amenities, np.zeros(
+                    (len(self.amenities), 1), dtype=np.uint64)))
+        return bit
+
+    def _mask(self, amenity_ids):
+        """Words of the bitset of `amenity_ids`, or None if one of them
+        is held by no place."""
+        words = np.zeros(self.amenities.shape[1], dtype=np.uint64)
+        for amenity_id in amenity_ids:
+            bit = self._bits.get(amenity_id)
+            if bit is None:
+                return None
+            words[bit // 64] |= np.uint64(1 << bit % 64)
+        return words
+
+    def _set_amenities(self, row, amenity_ids):
+        words = [0] * self.amenities.shape[1]
+        for amenity_id in amenity_ids:
+            bit = self._bit(amenity_id)
+            if bit // 64 >= len(words):
+                words.extend([0] * (bit // 64 + 1 - len(words)))
+            words[bit // 64] |= 1 << bit % 64
+        self.amenities[row] = words
+
+    def place_changed(self, place, amenities=False):
+        """
+        Account for a created or updated place, or for a review write
+        changing its rating aggregates; `amenities` also copies its
+        amenity list.
+        """
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            row = self._rows.get(place.id)
+            if row is None:
+                if self._free:
+                    row = self._free.pop()
+                else:
+                    if self._size == len(self.alive):
+                        self._grow()
+                    row = self._size
+                    self._size += 1
+                self._rows[place.id] = row
+                self._ids[row] = place.id
+                self.alive[row] = True
+                amenities = True
+            self.price[row] = place.price
+            self.latitude[row] = place.latitude
+            self.longitude[row] = place.longitude
+            self.review_count[row] = place.review_count or 0
+            self.rating_sum[row] = place.rating_sum or 0
+            if amenities:
+                self._set_amenities(row, [a.id for a in place.amenities])
+
+    def place_deleted(self, place_id):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            row = self._rows.pop(place_id, None)
+            if row is not None:
+                self.alive[row] = False
+                self._ids[row] = None
+                self.amenities[row] = 0
+                self._free.append(row)
+
+    def search(self, min_price=None, max_price=None, bbox=None,
+               min_rating=None, amenity_ids=(), sort=None, offset=0,
+               limit=50):
+        """
+        Return the number of places matching every given filter and the
+        ids of the page [offset, offset + limit) of them.
+
+        Args:
+            bbox (tuple): (south, west, north, east) in degrees; west
+                greater than east crosses the antimeridian.
+            min_rating (float): Minimum average rating; places without
+                reviews never match.
+            amenity_ids (iterable): Amenities a place must all have.
+            sort (str): 'rating', 'reviews' or 'price', as
+                PlaceRepository.get_all_places; row order when None.
+
+        Raises:
+            ValueError: If the sort key is unknown.
+        """
+        if sort is not None and sort not in self.SORTS:
+            raise ValueError(f"Invalid sort key: {sort}")
+        if not self.loaded:
+            self.load()
+        with self._lock:
+            size = self._size
+            mask = self.alive[:size].copy()
+            if min_price is not None:
+                mask &= self.price[:size] >= min_price
+            if max_price is not None:
+                mask &= self.price[:size] <= max_price
+            if bbox is not None:
+                south, west, north, east = bbox
+                latitude = self.latitude[:size]
+                longitude = self.longitude[:size]
+                mask &= (latitude >= south) & (latitude <= north)
+                if west <= east:
+                    mask &= (longitude >= west) & (longitude <= east)
+                else:
+                    mask &= (longitude >= west) | (longitude <= east)
+            if min_rating is not None:
+                count = self.review_count[:size]
+                mask &= (count > 0) & (self.rating_sum[:size]
+                                       >= min_rating * count)
+            amenity_ids = list(amenity_ids)
+            if amenity_ids:
+                words = self._mask(amenity_ids)
+                if words is None:
+                    return 0, []
+                mask &= np.all(self.amenities[:size] & words == words,
+                               axis=1)
+            rows = np.flatnonzero(mask)
+            if sort is not None:
+                rows = rows[self._order(sort, rows)]
+            page = rows[offset:offset + limit]
+            return len(rows), [self._ids[row] for row in page]
+
+    def _order(self, sort, rows):
+        """Positions sorting `rows` by `sort`, ties in row order."""
+        if sort == 'price':
+            return np.argsort(self.price[rows], kind='stable')
+        count = self.review_count[rows]
+        if sort == 'reviews':
+            return np.argsort(-count, kind='stable')
+        average = np.divide(self.rating_sum[rows], count,
+                            out=np.zeros(len(rows)), where=count > 0)
+        # Rated places first, best average first
+        return np.lexsort((-average, count == 0))
@@ -0,0 +1,154 @@
+"""
+Background refresh of the in-memory place indexes: search columns
+(place_columns.py), nearest places (nearest.py), map clusters
+(clusters.py) and leaderboards (leaderboard.py).
+
+Each index is loaded from the places table on its first query, and the
+facade applies its own place writes to it as it makes them. The writes of
+the other workers are applied by a thread: every
+PLACE_INDEX_REFRESH_SECONDS it reads the place changes logged after the
+last seq applied and passes the current row of each changed place (or its
+delete) to every loaded index. A query therefore never reloads the whole
+table, and the indexes lag the other workers by about that interval.
+Review writes log their place, whose rating aggregates they change.
+
+A cursor purged from the log reloads the loaded indexes, on the thread.
+Without a change log (sharded storage) the thread reloads each index
+every PLACE_COLUMNS_RELOAD_SECONDS, NEAREST_RELOAD_SECONDS,
+CLUSTERS_RELOAD_SECONDS or LEADERBOARD_RELOAD_SECONDS instead. The
+thread starts with the first query of an index, so a worker serving none
+never polls; with PLACE_INDEX_REFRESH_SECONDS = 0 (a single worker) it
+never starts.
+"""
+import logging
+import threading
+
+from sqlalchemy import select
+
+from app import db
+from app.extensions import serving
+from app.models.place import Place
+from app.services import change_log
+
+logger = logging.getLogger(__name__)
+
+
+class PlaceIndexRefresher:
+    """
+    Applies the place writes of the other workers to the place indexes.
+
+    Args:
+        columns (PlaceColumns): Search columns.
+        locator (PlaceLocator): Nearest places.
+        clusters (PlaceClusters): Map clusters.
+        leaderboards (Leaderboards): Best rated and most reviewed places.
+    """
+
+    def __init__(self, columns, locator, clusters, leaderboards):
+        self.columns = columns
+        self.locator = locator
+        self.clusters = clusters
+        self.leaderboards = leaderboards
+        self.indexes = (columns, locator, clusters, leaderboards)
+        self.refresh_seconds = 0.0
+        self.page_size = 500
+        self._cursor = None
+        self._app = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """Read the refresh settings; the thread is only started by
+        start(), when serving requests."""
+        self.refresh_seconds = app.config.get('PLACE_INDEX_REFRESH_SECONDS',
+                                              self.refresh_seconds)
+        self.page_size = app.config.get('CHANGES_PAGE_SIZE', self.page_size)
+        self._cursor = None
+        self._app = app if serving() else None
+
+    def start(self):
+        """Start the refresh thread unless it runs or is disabled; called
+        before the indexes are queried."""
+        if self._thread is not None or self._app is None or \
+                self.refresh_seconds <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(self._app,), daemon=True,
+                    name='place-index-refresh')
+                self._thread.start()
+
+    def stop(self):
+        """Stop the refresh thread."""
+        self._stopped.set()
+
+    def refresh(self):
+        """
+        Apply the place writes logged since the last refresh to the
+        loaded indexes; without a change log, reload the indexes whose
+        reload is due.
+
+        Returns:
+            int: Number of places applied.
+        """
+        if not change_log.available():
+            for index in self.indexes:
+                if index.reload_due():
+                    index.load()
+            return 0
+        if self._cursor is None:
+            self._resync()
+            return 0
+        changed = {}
+        cursor, has_more = self._cursor, True
+        try:
+            while has_more:
+                latest, cursor, has_more = change_log.latest_changes(
+                    cursor, self.page_size)
+                for (entity, place_id), (_, op) in latest.items():
+                    if entity == 'places':
+                        changed.pop(place_id, None)
+                        changed[place_id] = op
+        except change_log.CursorExpired:
+            self._resync()
+            return 0
+
+        ids = list(changed)
+        for start in range(0, len(ids), self.page_size):
+            page = ids[start:start + self.page_size]
+            # The amenity links are loaded with the places (selectin)
+            places = {place.id: place for place in db.session.scalars(
+                select(Place).where(Place.id.in_(page)))}
+            for place_id in page:
+                place = places.get(place_id)
+                if place is not None:
+                    self.columns.place_changed(place, amenities=True)
+                    self.locator.place_changed(place)
+                    self.clusters.place_changed(place)
+                    self.leaderboards.place_changed(place)
+                elif changed[place_id] == 'delete':
+                    for index in self.indexes:
+                        index.place_deleted(place_id)
+                # else deleted since it was logged; its tombstone follows
+        self._cursor = cursor
+        return len(ids)
+
+    def _resync(self):
+        # Cursor first: the writes committed during the loads are then
+        # applied again by the next refresh.
+        self._cursor = change_log.get_cursor()
+        for index in self.indexes:
+            if index.loaded:
+                index.load()
+
+    def _run(self, app):
+        while not self._stopped.wait(self.refresh_seconds):
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Place index refresh failed")
+                finally:
+                    db.session.remove()
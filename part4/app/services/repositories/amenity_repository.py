@@ -1,7 +1,9 @@
 from app import db
 from app.models.amenity import Amenity
 from datetime import datetime, timezone
-from app.persistence.repository import SQLAlchemyRepository
+from app.persistence.replicas import replica_read
+from app.persistence.repository import (InMemoryRepository,
+                                        SQLAlchemyRepository)
 
 
 class AmenityRepository(SQLAlchemyRepository):
@@ -11,6 +13,7 @@ class AmenityRepository(SQLAlchemyRepository):
     def get_amenity(self, amenity_id):
         return self.get(amenity_id)
 
+    @replica_read
     def get_all_amenities(self):
         return self.model.query.all()
 
@@ -37,3 +40,39 @@ class AmenityRepository(SQLAlchemyRepository):
         amenity.updated_at = datetime.now(timezone.utc)
         db.session.commit()
         return amenity
+
+
+class InMemoryAmenityRepository(InMemoryRepository):
+    def __init__(self, lock=None):
+        super().__init__(Amenity, indexes=('name',), lock=lock)
+
+    def get_amenity(self, amenity_id):
+        return self.get(amenity_id)
+
+    def get_all_amenities(self):
+        return self.get_all()
+
+    def create_amenity(self, amenity_data):
+        name = amenity_data.get('name')
+        if not name or not isinstance(name, str):
+            raise ValueError("Name is required and must be a string")
+        with self.lock:
+            existing = self.get_by_attribute('name', name)
+            if existing:
+                return existing
+
+            amenity = Amenity(name=name)
+            self.add(amenity)
+            return amenity
+
+    def update_amenity(self, amenity_id, amenity_data):
+        with self.lock:
+            amenity = self.get(amenity_id)
+            if amenity is None:
+                return None
+            name = amenity_data.get('name')
+            if not name or not isinstance(name, str):
+                raise ValueError('Name is required and must be a string')
+            amenity.name = name
+            self.save(amenity)
+            return amenity
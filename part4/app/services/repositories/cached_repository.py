@@ -0,0 +1,575 @@
+"""
+Repositories reading from memory and writing through to the database.
+
+With REPOSITORY_BACKEND = 'cached', the facade reads users, amenities,
+places and reviews from the in-memory repositories, which hold a copy of
+the database, and writes through the SQLAlchemy repositories:
+
+- the copy is loaded on first use, one query per table;
+- a write runs on the SQLAlchemy repository, in its own transaction,
+  then the rows it wrote are copied into memory before it returns, so a
+  node reads its own writes;
+- the copies are transient model instances linked to each other and
+  never attached to the session, so serving a read runs no query;
+- a copy is never changed: a write stores a new instance in its place, so
+  a reader sees a row whole, as it was before or after the write. The
+  references to the previous instance are then pointed at the new one.
+  Only the links the API reads are kept: the owner, amenities and reviews
+  of a place, and the user and place of a review.
+
+The database still receives every write, so the change log, events,
+exports and jobs work as with the 'sqlalchemy' backend.
+
+Several nodes: every CACHE_REFRESH_SECONDS a thread applies the writes of
+the other nodes, read from the change log after the last seq applied
+(places, reviews, amenities) and from the users whose indexed updated_at
+moved, so the copy lags by about that interval. A lookup by id missing
+from the copy is read from the database. If refreshes stop succeeding for
+CACHE_MAX_STALENESS_SECONDS, get_place, get_all_places and
+get_all_amenities read the database until they succeed again, so those
+reads are never staler than that bound. Polling is off with
+CACHE_REFRESH_SECONDS = 0, for a single node.
+
+View counts are flushed by bulk UPDATEs that are not logged, so the copy
+of a place shows the views of its last logged change.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import func, inspect, select
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.extensions import serving
+from app.models.place import PlaceAmenity
+from app.models.user import User
+from app.persistence.repository import InMemoryRepository
+from app.services import change_log
+from app.services.repositories.amenity_repository import \
+    InMemoryAmenityRepository
+from app.services.repositories.place_repository import \
+    InMemoryPlaceRepository
+from app.services.repositories.review_repository import \
+    InMemoryReviewRepository
+from app.services.repositories.user_repository import InMemoryUserRepository
+
+logger = logging.getLogger(__name__)
+
+
+class RepositoryCache:
+    """
+    Copy of the database shared by the cached repositories.
+
+    Args:
+        lock: Lock of the writers of the in-memory repositories.
+    """
+
+    # Users read again on each refresh in case their write committed
+    # after a later one: updated_at is set before the commit.
+    USER_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self, lock=None):
+        self.lock = lock or threading.RLock()
+        self.repositories = ()
+        self.refresh_seconds = 0.0
+        self.max_staleness = 5.0
+        self.page_size = 500
+        self._loaded = False
+        self._cursor = 0
+        self._users_since = None
+        self._refreshed_at = time.monotonic()
+        self._stats = dict.fromkeys(
+            ('refreshes', 'reloads', 'failures', 'rows', 'stale_reads',
+             'misses', 'last_rows'), 0)
+        self._stats.update(last_refresh_ms=0.0, total_refresh_ms=0.0)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """Read the refresh settings and start the refresh thread, when
+        serving requests."""
+        self.refresh_seconds = app.config.get('CACHE_REFRESH_SECONDS',
+                                              self.refresh_seconds)
+        self.max_staleness = app.config.get('CACHE_MAX_STALENESS_SECONDS',
+                                            self.max_staleness)
+        self.page_size = app.config.get('CHANGES_PAGE_SIZE', self.page_size)
+        if self.refresh_seconds > 0 and serving() and self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(app,),
+                                            daemon=True,
+                                            name='repository-cache-refresh')
+            self._thread.start()
+
+    def stop(self):
+        """Stop the refresh thread, when this cache is replaced."""
+        self._stopped.set()
+
+    def attach(self, *repositories):
+        """Set the cached repositories, a table before the tables
+        referencing it (users, amenities, places, reviews)."""
+        self.repositories = repositories
+
+    def load(self):
+        """Load the copy of the database unless it is loaded."""
+        if not self._loaded:
+            self.reload()
+
+    def fresh(self):
+        """
+        Whether reads may be served from the copy: always with polling
+        off, else while the last refresh is at most max_staleness old.
+        """
+        if self.refresh_seconds <= 0 or \
+                time.monotonic() - self._refreshed_at <= self.max_staleness:
+            return True
+        self._stats['stale_reads'] += 1
+        return False
+
+    def reload(self):
+        """
+        Copy every row of the database into memory again. Objects are
+        updated in place, so readers keep being served during a reload.
+        """
+        self._timed(self._reload)
+
+    def refresh(self):
+        """
+        Apply the writes committed since the last refresh, or reload the
+        copy if it is not loaded or the change log was purged past the
+        last seq applied.
+
+        Returns:
+            int: Number of rows copied or evicted.
+        """
+        return self._timed(self._refresh)
+
+    def metrics(self):
+        """
+        Lag and cost of the refreshes.
+
+        Returns:
+            dict: lag_seconds (age of the data of the last successful
+            refresh), cursor (last change log seq applied), counters of
+            refreshes, full reloads, failures, rows applied, reads sent to
+            the database (stale_reads, misses), and refresh durations.
+        """
+        return {'backend': 'cached', 'loaded': self._loaded,
+                'refresh_seconds': self.refresh_seconds,
+                'max_staleness_seconds': self.max_staleness,
+                'lag_seconds': round(time.monotonic() - self._refreshed_at,
+                                     3),
+                'cursor': self._cursor, **self._stats}
+
+    def miss(self):
+        self._stats['misses'] += 1
+
+    def _timed(self, apply):
+        with self.lock:
+            started = time.monotonic()
+            start = time.perf_counter()
+            try:
+                rows = apply()
+            except Exception:
+                self._stats['failures'] += 1
+                raise
+        elapsed = (time.perf_counter() - start) * 1000
+        # The copy holds every write committed before the refresh began
+        self._refreshed_at = started
+        self._stats['refreshes'] += 1
+        self._stats['rows'] += rows
+        self._stats['last_rows'] = rows
+        self._stats['last_refresh_ms'] = round(elapsed, 3)
+        self._stats['total_refresh_ms'] = round(
+            self._stats['total_refresh_ms'] + elapsed, 3)
+        return rows
+
+    def _reload(self):
+        # Read the positions first: a write committed during the load is
+        # then applied again by the next refresh.
+        cursor = change_log.get_cursor()
+        users_since = db.session.scalar(select(func.max(User.updated_at)))
+        # Set first: the repositories read the cache while loading
+        self._loaded = True
+        rows = 0
+        try:
+            for repository in self.repositories:
+                kept = {repository.store(row).id
+                        for row in repository.backing.get_all()}
+                for obj in repository.get_all():
+                    if obj.id not in kept:
+                        repository.evict(obj.id)
+                rows += len(kept)
+        except Exception:
+            self._loaded = False
+            raise
+        self._cursor, self._users_since = cursor, users_since
+        self._stats['reloads'] += 1
+        return rows
+
+    def _refresh(self):
+        if not self._loaded:
+            return self._reload()
+        try:
+            changed = {}
+            has_more = True
+            cursor = self._cursor
+            while has_more:
+                latest, cursor, has_more = change_log.latest_changes(
+                    cursor, self.page_size)
+                for key, (_, op) in latest.items():
+                    changed.pop(key, None)
+                    changed[key] = op
+        except change_log.CursorExpired:
+            return self._reload()
+
+        rows = 0
+        users, *others = self.repositories
+        if self._users_since is not None:
+            since = self._users_since - self.USER_OVERLAP
+            for user in User.query.filter(User.updated_at >= since):
+                users.store(user)
+                rows += 1
+                self._users_since = max(self._users_since, user.updated_at)
+        else:
+            self._users_since = db.session.scalar(
+                select(func.max(User.updated_at)))
+
+        entities = [(change_log.ENTITIES[repository.model], repository)
+                    for repository in others]
+        for entity, repository in entities:
+            ids = [entity_id for (name, entity_id), op in changed.items()
+                   if name == entity and op == 'upsert']
+            rows += repository.refresh_many(ids)
+        for entity, repository in reversed(entities):
+            for (name, entity_id), op in changed.items():
+                if name == entity and op == 'delete':
+                    repository.evict(entity_id)
+                    rows += 1
+        self._cursor = cursor
+        return rows
+
+    def _run(self, app):
+        while not self._stopped.wait(self.refresh_seconds):
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Repository cache refresh failed")
+                finally:
+                    db.session.remove()
+
+
+class _CachedRepository:
+    """
+    Reads of an in-memory repository; writes go through `backing`, a
+    SQLAlchemy repository, and are then copied into memory.
+    """
+
+    def __init__(self, backing, cache, *args):
+        super().__init__(*args, lock=cache.lock)
+        self.backing = backing
+        self.cache = cache
+
+    def get(self, obj_id):
+        self.cache.load()
+        obj = super().get(obj_id)
+        if obj is None and obj_id is not None:
+            # Possibly written by another node since the last refresh
+            row = self.backing.get(obj_id)
+            if row is not None:
+                self.cache.miss()
+                obj = self.store(row)
+        return obj
+
+    def get_all(self):
+        self.cache.load()
+        return super().get_all()
+
+    def get_all_by_attribute(self, attr_name, attr_value):
+        self.cache.load()
+        return super().get_all_by_attribute(attr_name, attr_value)
+
+    def add(self, obj):
+        with self.lock:
+            self.backing.add(obj)
+            self.store(obj)
+
+    def update(self, obj_id, data):
+        with self.lock:
+            self.backing.update(obj_id, data)
+            self.refresh(obj_id)
+
+    def delete(self, obj_id):
+        with self.lock:
+            self.backing.delete(obj_id)
+            self.evict(obj_id)
+
+    def peek(self, obj_id):
+        """The copy of `obj_id`, without reading the database on a miss."""
+        return super().get(obj_id)
+
+    def store(self, row):
+        """
+        Copy `row`, an instance loaded through the session, into memory,
+        as a new instance replacing the previous copy unless the row is
+        unchanged.
+
+        Returns:
+            The in-memory copy.
+        """
+        mapper = inspect(self.model)
+        with self.lock:
+            old = super().get(row.id)
+            if old is not None and self._unchanged(old, row):
+                return old
+            obj = mapper.class_manager.new_instance()
+            for column in mapper.column_attrs:
+                setattr(obj, column.key, getattr(row, column.key))
+            self._link(obj, row, old)
+            if old is None:
+                super().add(obj)
+            else:
+                self.replace(obj)
+            self._relink(obj, old)
+            return obj
+
+    def refresh(self, obj_id):
+        """Copy the current row of `obj_id` into memory, or evict it if
+        the row is gone."""
+        row = self.backing.get(obj_id)
+        if row is not None:
+            return self.store(row)
+        self.evict(obj_id)
+        return None
+
+    def refresh_many(self, ids):
+        """
+        Copy the current rows of `ids` into memory, evicting the ids whose
+        row is gone.
+
+        Returns:
+            int: Number of rows copied or evicted.
+        """
+        if not ids:
+            return 0
+        model = self.backing.model
+        rows = {row.id: row for row in model.query.filter(model.id.in_(ids))}
+        for obj_id in ids:
+            if obj_id in rows:
+                self.store(rows[obj_id])
+            else:
+                self.evict(obj_id)
+        return len(ids)
+
+    def evict(self, obj_id):
+        """Remove the copy of a deleted row."""
+        # Not the delete() of the in-memory repository, which unlinks
+        # the copy in place
+        InMemoryRepository.delete(self, obj_id)
+
+    def _unchanged(self, obj, row):
+        """Whether copy `obj` holds the current values of `row`."""
+        return all(getattr(obj, column.key) == getattr(row, column.key)
+                   for column in inspect(self.model).column_attrs)
+
+    def _link(self, obj, row, old):
+        """
+        Point the relationships of the new copy `obj` at the copies of
+        the rows `row` references; `old` is the copy it replaces, if any.
+        Links are set without backrefs, which would change other copies
+        in place.
+        """
+
+    def _relink(self, obj, old):
+        """Point the copies referencing `old` (None for a new row) at
+        its replacement `obj`."""
+
+
+class CachedUserRepository(_CachedRepository, InMemoryUserRepository):
+
+    def _relink(self, user, old):
+        if old is None:
+            return
+        _, _, places, reviews = self.cache.repositories
+        for place in places.get_all_by_attribute('owner_id', user.id):
+            set_committed_value(place, 'owner', user)
+        for review in reviews.get_all_by_attribute('user_id', user.id):
+            set_committed_value(review, 'user', user)
+
+    def put_user(self, user_id, new_data):
+        with self.lock:
+            user = self.backing.put_user(user_id, new_data)
+            return self.store(user) if user else None
+
+    def create_user(self, user_data):
+        with self.lock:
+            return self.store(self.backing.create_user(user_data))
+
+
+class CachedAmenityRepository(_CachedRepository, InMemoryAmenityRepository):
+
+    def get_all_amenities(self):
+        if not self.cache.fresh():
+            return self.backing.get_all_amenities()
+        return super().get_all_amenities()
+
+    def create_amenity(self, amenity_data):
+        with self.lock:
+            return self.store(self.backing.create_amenity(amenity_data))
+
+    def update_amenity(self, amenity_id, amenity_data):
+        with self.lock:
+            amenity = self.backing.update_amenity(amenity_id, amenity_data)
+            return self.store(amenity) if amenity else None
+
+    def _relink(self, amenity, old):
+        if old is None:
+            return
+        # Amenities change rarely; no index of the places holding one
+        for place in self.cache.repositories[2].get_all():
+            for link in place.amenity_links:
+                if link.amenity is old:
+                    set_committed_value(link, 'amenity', amenity)
+
+
+class CachedPlaceRepository(_CachedRepository, InMemoryPlaceRepository):
+
+    def get_place(self, place_id):
+        if not self.cache.fresh():
+            return self.backing.get_place(place_id)
+        return super().get_place(place_id)
+
+    def get_all_places(self, sort=None):
+        if not self.cache.fresh():
+            return self.backing.get_all_places(sort)
+        return super().get_all_places(sort)
+
+    def get_places_page(self, sort=None, cursor=None, limit=50):
+        if not self.cache.fresh():
+            return self.backing.get_places_page(sort, cursor, limit)
+        return super().get_places_page(sort, cursor, limit)
+
+    def create_place(self, place_data):
+        with self.lock:
+            return self.store(self.backing.create_place(place_data))
+
+    def update_place(self, place_id, place_data):
+        with self.lock:
+            place = self.backing.update_place(place_id, place_data)
+            if place is None:
+                return None
+            # Reviews may have been moved from or to the place
+            for review in place.reviews:
+                self.review_repository.store(review)
+            return self.store(place)
+
+    def delete_place(self, place_id):
+        with self.lock:
+            deleted = self.backing.delete_place(place_id)
+            if deleted:
+                self.evict(place_id)
+            return deleted
+
+    def reconcile_rating_aggregates(self):
+        with self.lock:
+            fixed = self.backing.reconcile_rating_aggregates()
+            if fixed:
+                for place in self.backing.get_all_places():
+                    self.store(place)
+            return fixed
+
+    def _unchanged(self, place, row):
+        # Amenity links are written without an UPDATE of the place row
+        return super()._unchanged(place, row) and \
+            [amenity.id for amenity in place.amenities] == \
+            [amenity.id for amenity in row.amenities]
+
+    def _link(self, place, row, old):
+        set_committed_value(place, 'owner',
+                            self.user_repository.get(row.owner_id))
+        amenities = self._get_all(self.amenity_repository,
+                                  [amenity.id for amenity in row.amenities])
+        if old is not None and list(old.amenities) == amenities:
+            links = list(old.amenity_links)
+        else:
+            links = []
+            for amenity in amenities:
+                link = PlaceAmenity()
+                set_committed_value(link, 'place', place)
+                set_committed_value(link, 'amenity', amenity)
+                links.append(link)
+        set_committed_value(place, 'amenity_links', links)
+        # Kept up to date by the stores of the reviews
+        set_committed_value(place, 'reviews',
+                            list(old.reviews) if old is not None else [])
+
+    def _relink(self, place, old):
+        for review in place.reviews:
+            set_committed_value(review, 'place', place)
+
+
+class CachedReviewRepository(_CachedRepository, InMemoryReviewRepository):
+
+    def create_review(self, review_data):
+        with self.lock:
+            review = self.backing.create_review(review_data)
+            # The rating aggregates of the place changed too
+            self.place_repository.refresh(review.place_id)
+            return self.store(review)
+
+    def update_review(self, review_id, review_data):
+        with self.lock:
+            old = self.get(review_id)
+            old_place_id = old.place_id if old else None
+            review = self.backing.update_review(review_id, review_data)
+            if review is None:
+                return None
+            review = self.store(review)
+            for place_id in {old_place_id, review.place_id}:
+                self.place_repository.refresh(place_id)
+            return review
+
+    def delete_review(self, review_id):
+        with self.lock:
+            review = self.get(review_id)
+            deleted = self.backing.delete_review(review_id)
+            if deleted:
+                self.evict(review_id)
+                self.place_repository.refresh(review.place_id)
+            return deleted
+
+    def evict(self, obj_id):
+        review = self.peek(obj_id)
+        if review is not None:
+            self._drop_from(review.place_id, obj_id)
+        super().evict(obj_id)
+
+    def _link(self, review, row, old):
+        set_committed_value(review, 'user',
+                            self.user_repository.get(row.user_id))
+        set_committed_value(review, 'place',
+                            self.place_repository.get(row.place_id))
+
+    def _relink(self, review, old):
+        if old is not None and old.place_id != review.place_id:
+            self._drop_from(old.place_id, review.id)
+        place = review.place
+        if place is None:
+            return
+        # A new list, so a reader iterating the previous one is unaffected
+        reviews = list(place.reviews)
+        for index, other in enumerate(reviews):
+            if other.id == review.id:
+                reviews[index] = review
+                break
+        else:
+            reviews.append(review)
+        set_committed_value(place, 'reviews', reviews)
+
+    def _drop_from(self, place_id, review_id):
+        """Remove a review from the reviews of the copy of a place."""
+        place = self.place_repository.peek(place_id)
+        if place is not None:
+            set_committed_value(place, 'reviews', [
+                review for review in place.reviews if review.id != review_id])
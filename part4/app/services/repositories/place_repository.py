@@ -1,11 +1,105 @@
+import base64
+import heapq
+import itertools
+import json
 from datetime import datetime, timezone
+from fractions import Fraction
+
+from sqlalchemy import and_, bindparam, func, or_, select
 
 from app import db
+from app.models.change import Change
 from app.models.place import Place
-from app.persistence.repository import SQLAlchemyRepository
+from app.models.review import Review
+from app.persistence.replicas import replica_read
+from app.persistence.repository import (InMemoryRepository,
+                                        SQLAlchemyRepository)
+from app.persistence.sharding import shards
+from app.services.change_log import change_rows
+
+
+# Keyset pages of get_places_page. A cursor holds the sort and the values
+# of the last place of a page that order it: [price, id], [review_count,
+# id], [rating_sum, review_count, id] or [id].
+
+def _cursor_values(sort, place):
+    if sort == 'price':
+        return [place.price, place.id]
+    if sort == 'reviews':
+        return [place.review_count or 0, place.id]
+    if sort == 'rating':
+        return [place.rating_sum or 0, place.review_count or 0, place.id]
+    return [place.id]
+
+
+def _cursor_key(sort, values):
+    """Python sort key of cursor values, in the order of the SQL pages;
+    averages are compared exactly, as fractions."""
+    if sort == 'reviews':
+        return (-values[0], values[1])
+    if sort == 'rating':
+        rating_sum, review_count, place_id = values
+        if not review_count:
+            return (True, 0, place_id)
+        return (False, -Fraction(rating_sum, review_count), place_id)
+    return tuple(values)
+
+
+def _page_key(sort):
+    return lambda place: _cursor_key(sort, _cursor_values(sort, place))
+
+
+def encode_cursor(sort, place):
+    """Opaque cursor of the places after `place` in `sort` order."""
+    return base64.urlsafe_b64encode(json.dumps(
+        [sort] + _cursor_values(sort, place)).encode()).decode()
+
+
+def decode_cursor(sort, cursor):
+    """
+    Values of a cursor made by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed or of another sort.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    lengths = {'price': 2, 'reviews': 2, 'rating': 3}
+    if not isinstance(values, list) or len(values) != \
+            lengths.get(sort, 1) + 1 or values[0] != sort or \
+            not isinstance(values[-1], str) or not all(
+                isinstance(value, (int, float)) and
+                not isinstance(value, bool) for value in values[1:-1]):
+        raise ValueError("Invalid cursor")
+    return values[1:]
+
+
+def _page(places, sort, limit):
+    """(first `limit` of `places`, cursor of the next page or None)."""
+    if len(places) <= limit:
+        return places, None
+    return places[:limit], encode_cursor(sort, places[limit - 1])
 
 
 class PlaceRepository(SQLAlchemyRepository):
+    # Sort keys accepted by get_all_places, all backed by columns of the
+    # places table so sorting never joins the reviews table.
+    SORT_KEYS = {
+        'rating': lambda: Place.average_rating.desc().nulls_last(),
+        'reviews': lambda: Place.review_count.desc(),
+        'price': lambda: Place.price.asc(),
+    }
+    # The same orders on loaded places, to merge the sorted lists of
+    # several shards (app/persistence/sharding.py).
+    SORT_VALUES = {
+        'rating': lambda place: (place.average_rating is None,
+                                 -(place.average_rating or 0)),
+        'reviews': lambda place: -place.review_count,
+        'price': lambda place: place.price,
+    }
+
     def __init__(self, user_repository, amenity_repository, review_repository):
         super().__init__(Place)
         self.user_repository = user_repository
@@ -63,11 +157,127 @@ class PlaceRepository(SQLAlchemyRepository):
         db.session.commit()
         return new_place
 
+    @replica_read
     def get_place(self, place_id):
         return self.model.query.filter_by(id=place_id).first()
 
-    def get_all_places(self):
-        return self.model.query.all()
+    @replica_read
+    def get_places(self, place_ids):
+        """Load several places with a single query."""
+        if not place_ids:
+            return []
+        return self.model.query.filter(self.model.id.in_(place_ids)).all()
+
+    @replica_read
+    def get_all_places(self, sort=None):
+        if sort is None:
+            return self.model.query.all()
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"Invalid sort key: {sort}")
+        places = self.model.query.order_by(self.SORT_KEYS[sort]()).all()
+        if shards.enabled:
+            places.sort(key=self.SORT_VALUES[sort])
+        return places
+
+    @staticmethod
+    def _after(sort, values):
+        """WHERE clause of the places after cursor `values`."""
+        if sort == 'price':
+            price, place_id = values
+            return or_(Place.price > price,
+                       and_(Place.price == price, Place.id > place_id))
+        if sort == 'reviews':
+            count, place_id = values
+            return or_(Place.review_count < count,
+                       and_(Place.review_count == count,
+                            Place.id > place_id))
+        if sort == 'rating':
+            rating_sum, count, place_id = values
+            unrated = Place.review_count == 0
+            if not count:
+                return and_(unrated, Place.id > place_id)
+            # Averages compared exactly: a/b < s/c <=> a*c < s*b
+            this, other = Place.rating_sum * count, \
+                rating_sum * Place.review_count
+            return or_(unrated, and_(Place.review_count > 0, or_(
+                this < other, and_(this == other, Place.id > place_id))))
+        return Place.id > values[0]
+
+    @replica_read
+    def get_places_page(self, sort=None, cursor=None, limit=50):
+        """
+        Return a page of at most `limit` places in `sort` order (ties by
+        id), starting after `cursor`, and the cursor of the next page
+        (None after the last page).
+
+        The page is a keyset range read: no row before the cursor is
+        read, whatever the depth of the page. With sharded storage every
+        shard returns its first limit + 1 places after the cursor, and
+        those sorted streams are merged.
+
+        Raises:
+            ValueError: If the sort key or the cursor is invalid.
+        """
+        if sort is not None and sort not in self.SORT_KEYS:
+            raise ValueError(f"Invalid sort key: {sort}")
+        order = [Place.id.asc()] if sort is None else \
+            [self.SORT_KEYS[sort](), Place.id.asc()]
+        statement = select(Place)
+        if cursor:
+            statement = statement.where(self._after(
+                sort, decode_cursor(sort, cursor)))
+        statement = statement.order_by(*order).limit(limit + 1)
+        if not shards.enabled:
+            return _page(db.session.scalars(statement).all(), sort, limit)
+        # A bind argument, not set_shard_id(), which would also read the
+        # amenity links loaded with the places from the shard
+        streams = [db.session.scalars(statement, bind_arguments={
+            'shard_id': shard_id}).all() for shard_id in shards.shard_ids]
+        places = list(itertools.islice(
+            heapq.merge(*streams, key=_page_key(sort)), limit + 1))
+        return _page(places, sort, limit)
+
+    def reconcile_rating_aggregates(self):
+        """
+        Recompute review_count, rating_sum and the rating histogram of every
+        place from the reviews table, fixing any drift in the incrementally
+        maintained values.
+
+        Returns:
+            int: Number of places whose aggregates were corrected.
+        """
+        expected = {}
+        rows = db.session.execute(
+            select(Review.place_id, Review.rating, func.count())
+            .group_by(Review.place_id, Review.rating))
+        for place_id, rating, count in rows:
+            values = expected.setdefault(place_id, dict.fromkeys(
+                ('review_count', 'rating_sum') + Place.RATING_COLUMNS, 0))
+            values['review_count'] += count
+            values['rating_sum'] += rating * count
+            values[Place.RATING_COLUMNS[rating - 1]] += count
+
+        columns = (Place.review_count, Place.rating_sum) + tuple(
+            getattr(Place, column) for column in Place.RATING_COLUMNS)
+        empty = dict.fromkeys(
+            ('review_count', 'rating_sum') + Place.RATING_COLUMNS, 0)
+        fixes = []
+        for row in db.session.execute(select(Place.id, *columns)):
+            values = expected.get(row[0], empty)
+            if tuple(row[1:]) != tuple(values.values()):
+                fixes.append({'place_id': row[0], **values})
+
+        if fixes:
+            # Core executemany: derived columns are not user edits, so
+            # they must not bump the optimistic-locking version.
+            places = Place.__table__
+            db.session.execute(
+                places.update().where(places.c.id == bindparam('place_id')),
+                fixes)
+            shards.insert_rows(db.session, Change, change_rows(
+                'places', [fix['place_id'] for fix in fixes]))
+        db.session.commit()
+        return len(fixes)
 
     def update_place(self, place_id, place_data):
         place = self.model.query.filter_by(id=place_id).first()
@@ -128,3 +338,179 @@ class PlaceRepository(SQLAlchemyRepository):
             db.session.commit()
             return True
         return False
+
+
+class InMemoryPlaceRepository(InMemoryRepository):
+    SORT_VALUES = PlaceRepository.SORT_VALUES
+
+    def __init__(self, user_repository, amenity_repository, review_repository,
+                 lock=None):
+        super().__init__(Place, indexes=('owner_id',), lock=lock)
+        self.user_repository = user_repository
+        self.amenity_repository = amenity_repository
+        self.review_repository = review_repository
+
+    def create_place(self, place_data):
+        owner_id = place_data.get('owner_id')
+        if isinstance(owner_id, dict):
+            owner_id = owner_id.get('id')
+        if not owner_id:
+            raise ValueError("owner_id is required")
+
+        with self.lock:
+            owner = self.user_repository.get(owner_id)
+            if not owner:
+                raise ValueError("Owner not found")
+
+            try:
+                price = float(place_data['price'])
+                latitude = float(place_data['latitude'])
+                longitude = float(place_data['longitude'])
+            except (ValueError, KeyError):
+                raise ValueError("Invalid numeric value for price,"
+                                 "latitude or longitude")
+            try:
+                new_place = Place(
+                    title=place_data['title'],
+                    description=place_data['description'],
+                    price=price,
+                    latitude=latitude,
+                    longitude=longitude,
+                    owner=owner,
+                    owner_id=owner.id
+                )
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid place data: {str(e)}")
+
+            new_place.amenities = self._get_all(
+                self.amenity_repository, place_data.get('amenities', []))
+            new_place.reviews = self._get_all(
+                self.review_repository, place_data.get('reviews', []))
+            self.add(new_place)
+            return new_place
+
+    def get_place(self, place_id):
+        return self.get(place_id)
+
+    def get_places(self, place_ids):
+        return self._get_all(self, place_ids)
+
+    def get_all_places(self, sort=None):
+        if sort is None:
+            return self.get_all()
+        if sort not in self.SORT_VALUES:
+            raise ValueError(f"Invalid sort key: {sort}")
+        return sorted(self.get_all(), key=self.SORT_VALUES[sort])
+
+    def get_places_page(self, sort=None, cursor=None, limit=50):
+        if sort is not None and sort not in self.SORT_VALUES:
+            raise ValueError(f"Invalid sort key: {sort}")
+        key = _page_key(sort)
+        places = self.get_all()
+        if cursor:
+            after = _cursor_key(sort, decode_cursor(sort, cursor))
+            places = [place for place in places if key(place) > after]
+        return _page(heapq.nsmallest(limit + 1, places, key=key), sort,
+                     limit)
+
+    def rating_rows(self):
+        """
+        (id, latitude, longitude, review_count, rating_sum) of every
+        place, the rows Leaderboards.rebuild reads.
+        """
+        return [(place.id, place.latitude, place.longitude,
+                 place.review_count, place.rating_sum)
+                for place in self.get_all()]
+
+    def filter_rows(self):
+        """
+        (id, price, latitude, longitude, review_count, rating_sum,
+        amenity ids) of every place, the rows PlaceColumns.load reads.
+        """
+        return [(place.id, place.price, place.latitude, place.longitude,
+                 place.review_count, place.rating_sum,
+                 [amenity.id for amenity in place.amenities])
+                for place in self.get_all()]
+
+    def reconcile_rating_aggregates(self):
+        """
+        Recompute the rating aggregates of every place from the reviews,
+        as PlaceRepository.reconcile_rating_aggregates does.
+
+        Returns:
+            int: Number of places whose aggregates were corrected.
+        """
+        columns = ('review_count', 'rating_sum') + Place.RATING_COLUMNS
+        with self.lock:
+            expected = {}
+            for review in self.review_repository.get_all():
+                values = expected.setdefault(review.place_id,
+                                             dict.fromkeys(columns, 0))
+                values['review_count'] += 1
+                values['rating_sum'] += review.rating
+                values[Place.RATING_COLUMNS[review.rating - 1]] += 1
+
+            empty = dict.fromkeys(columns, 0)
+            fixed = 0
+            for place in self.get_all():
+                values = expected.get(place.id, empty)
+                if any(getattr(place, column) != value
+                       for column, value in values.items()):
+                    for column, value in values.items():
+                        setattr(place, column, value)
+                    fixed += 1
+            return fixed
+
+    def update_place(self, place_id, place_data):
+        with self.lock:
+            place = self.get(place_id)
+            if not place:
+                return None
+
+            # Validate everything before changing the place
+            changes = {key: place_data[key] for key in ('title', 'description')
+                       if key in place_data}
+            for key in ('price', 'latitude', 'longitude'):
+                if key in place_data:
+                    try:
+                        changes[key] = float(place_data[key])
+                    except (TypeError, ValueError):
+                        raise ValueError(f"Invalid {key} value")
+            if 'owner_id' in place_data:
+                owner = self.user_repository.get(place_data['owner_id'])
+                if not owner:
+                    raise ValueError("Owner not found")
+                changes.update(owner=owner, owner_id=owner.id)
+
+            for key, value in changes.items():
+                setattr(place, key, value)
+            if 'amenities' in place_data:
+                place.amenities = self._get_all(self.amenity_repository,
+                                                place_data['amenities'])
+            if 'reviews' in place_data:
+                place.reviews = self._get_all(self.review_repository,
+                                              place_data['reviews'])
+            self.save(place)
+            return place
+
+    def delete_place(self, place_id):
+        with self.lock:
+            place = self.get(place_id)
+            if place:
+                self.delete(place_id)
+                return True
+            return False
+
+    def delete(self, obj_id):
+        with self.lock:
+            place = self.get(obj_id)
+            if place:
+                # Drop it from owner.places
+                place.owner = None
+            super().delete(obj_id)
+
+    @staticmethod
+    def _get_all(repository, ids):
+        """Objects of `repository` with the given ids, skipping unknown
+        ones."""
+        return [obj for obj in map(repository.get, ids) if obj is not None]
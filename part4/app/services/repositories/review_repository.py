@@ -1,10 +1,16 @@
 from datetime import datetime, timezone
 
+from sqlalchemy import update
+
 from app import db
 from app.models.place import Place
 from app.models.review import Review
 from app.models.user import User
-from app.persistence.repository import SQLAlchemyRepository
+from app.persistence.replicas import replica_read
+from app.persistence.repository import (InMemoryRepository,
+                                        SQLAlchemyRepository)
+from app.persistence.sharding import shards
+from app.services.change_log import record_change
 
 
 class ReviewRepository(SQLAlchemyRepository):
@@ -24,30 +30,38 @@ class ReviewRepository(SQLAlchemyRepository):
 
         review = Review(**review_data)
         db.session.add(review)
+        self._apply_rating(place.id, rating, 1)
         db.session.commit()
         return review
 
+    @replica_read
     def get_review(self, review_id):
         return self.model.query.filter_by(id=review_id).first()
 
+    @replica_read
     def get_all_reviews(self):
         return self.model.query.all()
 
+    @replica_read
     def get_reviews_by_place(self, place_id):
-        return self.model.query.filter_by(id=place_id)
+        return self.model.query.filter_by(place_id=place_id).all()
 
     def update_review(self, review_id, review_data):
         review = self.model.query.filter_by(id=review_id).first()
         if not review:
             return None
+        old_place_id, old_rating = review.place_id, review.rating
 
         if 'text' in review_data:
             review.text = review_data['text']
         if 'rating' in review_data:
             try:
-                review.rating = float(review_data['rating'])
-            except ValueError:
+                rating = int(review_data['rating'])
+            except (TypeError, ValueError):
                 raise ValueError("Invalid rating value")
+            if not 1 <= rating <= 5:
+                raise ValueError("Rating must be an integer between 1 and 5")
+            review.rating = rating
         if 'user_id' in review_data:
             user = User.query.filter_by(id=review_data['user_id']).first()
             if not user:
@@ -57,12 +71,24 @@ class ReviewRepository(SQLAlchemyRepository):
             place = Place.query.filter_by(id=review_data['place_id']).first()
             if not place:
                 raise ValueError("Place not found")
+            if shards.enabled and shards.shard_of(place.id) != \
+                    shards.shard_of(old_place_id):
+                raise ValueError("A review cannot move to a place stored "
+                                 "on another shard")
             review.place = place
+            review.place_id = place.id
 
+        # Set before the aggregates UPDATE autoflushes the review, so the
+        # write is flushed (and its version bumped) once.
         review.updated_at = datetime.now(timezone.utc)
+        if (review.place_id, review.rating) != (old_place_id, old_rating):
+            self._apply_rating(old_place_id, old_rating, -1)
+            self._apply_rating(review.place_id, review.rating, 1)
+
         db.session.commit()
         return review
 
+    @replica_read
     def get_review_by_user_and_place(self, user_id, place_id):
         return self.model.query.filter_by(user_id=user_id,
                                           place_id=place_id).first()
@@ -70,7 +96,131 @@ class ReviewRepository(SQLAlchemyRepository):
     def delete_review(self, review_id):
         review = self.model.query.filter_by(id=review_id).first()
         if review:
+            self._apply_rating(review.place_id, review.rating, -1)
             db.session.delete(review)
             db.session.commit()
             return True
         return False
+
+    def _apply_rating(self, place_id, rating, delta):
+        """
+        Add (delta=1) or remove (delta=-1) one rating from the aggregates
+        of a place. The UPDATE is issued in the current transaction, so it
+        is committed or rolled back together with the review write.
+        """
+        column = Place.RATING_COLUMNS[int(rating) - 1]
+        db.session.execute(
+            update(Place).where(Place.id == place_id).values({
+                Place.review_count: Place.review_count + delta,
+                Place.rating_sum: Place.rating_sum + delta * int(rating),
+                getattr(Place, column): getattr(Place, column) + delta,
+            }))
+        record_change(db.session, 'places', place_id)
+
+
+class InMemoryReviewRepository(InMemoryRepository):
+    def __init__(self, user_repository, lock=None):
+        super().__init__(Review, indexes=('place_id', 'user_id'), lock=lock)
+        self.user_repository = user_repository
+        # Set once the place repository, which needs this one, is built
+        self.place_repository = None
+
+    def create_review(self, review_data):
+        with self.lock:
+            user = self.user_repository.get(review_data["user_id"])
+            place = self.place_repository.get(review_data["place_id"])
+
+            if not user or not place:
+                raise ValueError("Invalid user_id or place_id")
+
+            rating = review_data.get("rating")
+            if not isinstance(rating, int) or not (1 <= rating <= 5):
+                raise ValueError("Rating must be an integer between 1 and 5")
+
+            review = Review(**review_data)
+            review.user = user
+            review.place = place
+            self.add(review)
+            self._apply_rating(place, rating, 1)
+            return review
+
+    def get_review(self, review_id):
+        return self.get(review_id)
+
+    def get_all_reviews(self):
+        return self.get_all()
+
+    def get_reviews_by_place(self, place_id):
+        return self.get_all_by_attribute('place_id', place_id)
+
+    def update_review(self, review_id, review_data):
+        with self.lock:
+            review = self.get(review_id)
+            if not review:
+                return None
+            old_place, old_rating = review.place, review.rating
+
+            # Validate everything before changing the review
+            rating, user, place = old_rating, review.user, old_place
+            if 'rating' in review_data:
+                try:
+                    rating = int(review_data['rating'])
+                except (TypeError, ValueError):
+                    raise ValueError("Invalid rating value")
+                if not 1 <= rating <= 5:
+                    raise ValueError(
+                        "Rating must be an integer between 1 and 5")
+            if 'user_id' in review_data:
+                user = self.user_repository.get(review_data['user_id'])
+                if not user:
+                    raise ValueError("User not found")
+            if 'place_id' in review_data:
+                place = self.place_repository.get(review_data['place_id'])
+                if not place:
+                    raise ValueError("Place not found")
+
+            if 'text' in review_data:
+                review.text = review_data['text']
+            review.rating = rating
+            review.user, review.user_id = user, user.id
+            review.place, review.place_id = place, place.id
+
+            if (place, rating) != (old_place, old_rating):
+                self._apply_rating(old_place, old_rating, -1)
+                self._apply_rating(place, rating, 1)
+
+            self.save(review)
+            return review
+
+    def get_review_by_user_and_place(self, user_id, place_id):
+        return next((review for review in self.get_reviews_by_place(place_id)
+                     if review.user_id == user_id), None)
+
+    def delete_review(self, review_id):
+        with self.lock:
+            review = self.get(review_id)
+            if review:
+                self._apply_rating(review.place, review.rating, -1)
+                self.delete(review_id)
+                return True
+            return False
+
+    def delete(self, obj_id):
+        with self.lock:
+            review = self.get(obj_id)
+            if review:
+                # Drop it from place.reviews and user.reviews
+                review.place = None
+                review.user = None
+            super().delete(obj_id)
+
+    def _apply_rating(self, place, rating, delta):
+        """
+        Add (delta=1) or remove (delta=-1) one rating from the aggregates
+        of a place. Like the UPDATE of ReviewRepository, this does not
+        bump the version of the place.
+        """
+        column = Place.RATING_COLUMNS[int(rating) - 1]
+        place.review_count += delta
+        place.rating_sum += delta * int(rating)
+        setattr(place, column, getattr(place, column) + delta)
@@ -1,27 +1,56 @@
 from app.models.user import User
-from app import db
-from app.persistence.repository import SQLAlchemyRepository
+from app.persistence.replicas import replica_read
+from app.persistence.repository import (InMemoryRepository,
+                                        SQLAlchemyRepository)
 
 
 class UserRepository(SQLAlchemyRepository):
     def __init__(self):
         super().__init__(User)
 
+    @replica_read
     def get_user_by_email(self, email):
         return self.model.query.filter_by(email=email).first()
 
+    @replica_read
     def get_all_user(self):
         return self.model.query.all()
 
     def put_user(self, user_id, new_data):
         user = self.get(user_id)
         if user:
-            for key, value in new_data.items():
-                setattr(user, key, value)
-            db.session.commit()
+            user.update(new_data)
             return user
         return None
-        
+
+    def get_user(self, user_id):
+        return self.get(user_id)
+
+    def create_user(self, user_data):
+        new_user = User(**user_data)
+        self.add(new_user)
+        return new_user
+
+
+class InMemoryUserRepository(InMemoryRepository):
+    def __init__(self, lock=None):
+        super().__init__(User, unique=('email',), lock=lock)
+
+    def get_user_by_email(self, email):
+        return self.get_by_attribute('email', email)
+
+    def get_all_user(self):
+        return self.get_all()
+
+    def put_user(self, user_id, new_data):
+        user = self.get(user_id)
+        if user:
+            # Same attributes as BaseModel.update
+            self.update(user_id, {key: value for key, value in new_data.items()
+                                  if hasattr(user, key) and key != 'version'})
+            return user
+        return None
+
     def get_user(self, user_id):
         return self.get(user_id)
 
@@ -0,0 +1,65 @@
+"""
+Built-in background jobs.
+
+`register_tasks` is called by the facade so the handlers exist in every
+process, including process pool workers.
+"""
+import os
+
+from flask import current_app
+
+from app.extensions import replicas
+from app.services import bulk_export
+from app.services.jobs import current_job, report_progress
+
+
+def register_tasks(jobs, facade):
+    """Register the maintenance jobs of the application on `jobs`."""
+
+    @jobs.register('reconcile_rating_aggregates')
+    def reconcile_rating_aggregates():
+        return {'fixed': facade.reconcile_rating_aggregates()}
+
+    @jobs.register('purge_jobs')
+    def purge_jobs(days=7):
+        return {'deleted': jobs.purge(days)}
+
+    @jobs.register('purge_idempotency_keys')
+    def purge_idempotency_keys():
+        return {'deleted': facade.idempotency.purge()}
+
+    @jobs.register('purge_changes')
+    def purge_changes(days=None):
+        if days is None:
+            days = current_app.config['CHANGES_RETENTION_DAYS']
+        return {'deleted': facade.purge_changes(days)}
+
+    @jobs.register('sync_replicas', max_attempts=1)
+    def sync_replicas():
+        return {'replicas': replicas.sync()}
+
+    @jobs.register('purge_exports')
+    def purge_exports(hours=None):
+        if hours is None:
+            hours = current_app.config['EXPORT_RETENTION_HOURS']
+        return {'deleted': bulk_export.purge_export_files(
+            bulk_export.export_dir(current_app), hours * 3600)}
+
+    @jobs.register('export', max_attempts=1)
+    def export(entity, format, compress=None):
+        directory = bulk_export.export_dir(current_app)
+        os.makedirs(directory, exist_ok=True)
+        filename = bulk_export.export_filename(entity, format, compress)
+        path = os.path.join(directory, f"{current_job.get()}-{filename}")
+        reported = 0.0
+
+        def progress(fraction):
+            nonlocal reported
+            if fraction - reported >= 0.01:
+                reported = fraction
+                report_progress(fraction)
+
+        rows = bulk_export.export_to_file(
+            path, entity, format, compress,
+            current_app.config['EXPORT_BATCH_SIZE'], progress)
+        return {'path': path, 'filename': filename, 'rows': rows}
@@ -0,0 +1,127 @@
+"""
+Trending places ranked by exponentially decayed activity.
+
+Activity events (detail views, new reviews) are appended to an in-memory
+ring buffer without taking a lock. A background thread drains the buffer
+every TRENDING_TICK_SECONDS, decays the running scores with a half-life
+of TRENDING_HALF_LIFE seconds, adds the new events and publishes a sorted
+snapshot. Readers only ever look at the last published snapshot, and
+recording an event never touches the database.
+"""
+import itertools
+import math
+import threading
+import time
+
+from app.extensions import serving
+
+
+class EventRing:
+    """
+    Fixed-size ring buffer of (place_id, weight, timestamp) events.
+
+    Writers claim a sequence number from an itertools counter, which is
+    atomic under the GIL, and store the event in its slot; no lock is
+    taken. The single reader keeps its own cursor. If writers lap the
+    reader, or an event is stored while a drain is in progress, the event
+    is dropped: trending scores are approximate by design.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._counter = itertools.count()
+        self._cursor = 0
+        self.dropped = 0
+
+    def append(self, place_id, weight, timestamp):
+        seq = next(self._counter)
+        self._slots[seq % self.capacity] = (seq, place_id, weight, timestamp)
+
+    def drain(self):
+        """Return the events recorded since the previous drain."""
+        events = [slot for slot in self._slots
+                  if slot is not None and slot[0] >= self._cursor]
+        if not events:
+            return []
+        events.sort()
+        last = events[-1][0]
+        self.dropped += last - self._cursor + 1 - len(events)
+        self._cursor = last + 1
+        return [event[1:] for event in events]
+
+
+class TrendingTracker:
+    """
+    Decayed activity scores per place and the published top snapshot.
+
+    Attributes:
+        weights (dict): Score added per event kind ('view', 'review').
+        half_life (float): Seconds for a score to decay by half.
+        snapshot_size (int): Number of places kept in the snapshot.
+    """
+
+    def __init__(self, half_life=6 * 3600, tick_seconds=5.0,
+                 buffer_size=65536, snapshot_size=100,
+                 weights=None):
+        self.half_life = half_life
+        self.tick_seconds = tick_seconds
+        self.snapshot_size = snapshot_size
+        self.weights = weights or {'view': 1.0, 'review': 5.0}
+        self._ring = EventRing(buffer_size)
+        self._scores = {}
+        self._scored_at = time.time()
+        self._snapshot = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        """Read the trending settings and start the background tick."""
+        self.half_life = app.config.get('TRENDING_HALF_LIFE', self.half_life)
+        self.tick_seconds = app.config.get('TRENDING_TICK_SECONDS',
+                                           self.tick_seconds)
+        self.snapshot_size = app.config.get('TRENDING_SNAPSHOT_SIZE',
+                                            self.snapshot_size)
+        self.weights = app.config.get('TRENDING_WEIGHTS', self.weights)
+        if app.config.get('TRENDING_ENABLED', True) and serving():
+            self.start()
+
+    def record(self, place_id, kind):
+        """Record one activity event for a place."""
+        self._ring.append(place_id, self.weights.get(kind, 0.0), time.time())
+
+    def tick(self, now=None):
+        """Fold pending events into the scores and publish a snapshot."""
+        now = now or time.time()
+        rate = math.log(2) / self.half_life
+        decay = math.exp(-rate * (now - self._scored_at))
+        scores = {place_id: score * decay
+                  for place_id, score in self._scores.items()
+                  if score * decay >= 0.01}
+        for place_id, weight, timestamp in self._ring.drain():
+            scores[place_id] = (scores.get(place_id, 0.0)
+                                + weight * math.exp(-rate * (now - timestamp)))
+        self._scores = scores
+        self._scored_at = now
+        ranked = sorted(scores.items(), key=lambda item: item[1],
+                        reverse=True)
+        self._snapshot = ranked[:self.snapshot_size]
+
+    def top(self, limit=10):
+        """Return the last published (place_id, score) pairs, best first."""
+        return self._snapshot[:limit]
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='trending-tick')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.tick_seconds):
+            self.tick()
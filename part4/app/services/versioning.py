@@ -0,0 +1,81 @@
+"""
+Optimistic concurrency control for the PUT endpoints.
+
+Every model has a `version` column used as SQLAlchemy's version_id_col:
+an ORM UPDATE is issued as `... WHERE id = :id AND version = :read` and
+bumps the version, so a write based on a stale read matches no row and
+raises StaleDataError instead of silently overwriting the other writer.
+No lock is held between the read and the write.
+
+Clients send back the ETag they read (`W/"<version>"`) in an If-Match
+header; a mismatch, detected before or during the write, becomes a
+412 Precondition Failed.
+
+The ETags are weak: Core UPDATEs (rating aggregates of a place, view
+counts) change a representation without bumping its version, so the
+version only identifies the writable fields. If-Match compares the
+versions, not the bytes, whether or not the client keeps the W/ prefix.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db
+
+
+class PreconditionFailed(Exception):
+    """The resource changed since the version the client based its write
+    on."""
+
+
+def etag(obj):
+    """Weak ETag of a versioned model instance."""
+    return f'W/"{obj.version}"'
+
+
+def parse_if_match(header):
+    """
+    Parse an If-Match header into the set of accepted versions.
+
+    Returns:
+        set: Accepted versions, or None when any version is accepted
+        (no header or `*`).
+
+    Raises:
+        ValueError: If an entity tag is not one of our version ETags.
+    """
+    if header is None or header.strip() == '*':
+        return None
+    versions = set()
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if len(tag) < 2 or tag[0] != '"' or tag[-1] != '"':
+            raise ValueError(f"Invalid entity tag: {tag}")
+        try:
+            versions.add(int(tag[1:-1]))
+        except ValueError:
+            raise ValueError(f"Invalid entity tag: {tag}")
+    return versions
+
+
+@contextmanager
+def expect_version(obj, versions):
+    """
+    Run a write of `obj` only if its version is one of `versions`.
+
+    Raises:
+        PreconditionFailed: If the version read does not match, or if
+            another writer committed between the read and the write.
+    """
+    if obj is not None and versions is not None \
+            and obj.version not in versions:
+        db.session.rollback()
+        raise PreconditionFailed(
+            f"Resource is at version {obj.version}")
+    try:
+        yield
+    except StaleDataError:
+        db.session.rollback()
+        raise PreconditionFailed("Resource was modified concurrently")
@@ -0,0 +1,135 @@
+"""
+Write-behind view counters for place detail pages.
+
+Views are accumulated in process memory and flushed to `places.views` in
+one batched UPDATE every VIEW_COUNTER_FLUSH_SECONDS, or as soon as
+VIEW_COUNTER_FLUSH_THRESHOLD views are pending. Flushes add deltas
+(`views = views + n`), so several workers flushing the same place merge
+instead of overwriting each other.
+
+Memory is bounded by VIEW_COUNTER_MAX_PLACES distinct pending places;
+views for further places are dropped (and counted) until the next flush.
+
+The flush thread and the flush at exit are only set up with
+VIEW_COUNTER_ENABLED and outside `flask` commands (app.extensions.serving);
+otherwise views are written by explicit flush() calls only.
+
+Loss window: pending views are flushed on a clean interpreter exit. If a
+worker crashes, the views it has not flushed yet are lost, i.e. at most
+VIEW_COUNTER_FLUSH_SECONDS worth of views, and never more than
+VIEW_COUNTER_FLUSH_THRESHOLD views, per worker.
+"""
+import atexit
+import logging
+import threading
+
+from sqlalchemy import bindparam
+
+from app.extensions import serving, shards
+from app.models.place import Place
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """In-process accumulator of place views with batched flushes."""
+
+    def __init__(self, flush_seconds=10.0, flush_threshold=1000,
+                 max_places=10000):
+        self.flush_seconds = flush_seconds
+        self.flush_threshold = flush_threshold
+        self.max_places = max_places
+        self.dropped = 0
+        self._pending = {}
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._app = None
+        self._thread = None
+
+    def init_app(self, app):
+        """Read the counter settings and start the flush thread, when
+        enabled and serving requests."""
+        self.flush_seconds = app.config.get('VIEW_COUNTER_FLUSH_SECONDS',
+                                            self.flush_seconds)
+        self.flush_threshold = app.config.get('VIEW_COUNTER_FLUSH_THRESHOLD',
+                                              self.flush_threshold)
+        self.max_places = app.config.get('VIEW_COUNTER_MAX_PLACES',
+                                         self.max_places)
+        self._app = app
+        if app.config.get('VIEW_COUNTER_ENABLED', True) and serving() and \
+                self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='view-counter-flush')
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def increment(self, place_id):
+        """Count one view of a place; never touches the database."""
+        with self._lock:
+            if (place_id not in self._pending
+                    and len(self._pending) >= self.max_places):
+                self.dropped += 1
+                self._wake.set()
+                return
+            self._pending[place_id] = self._pending.get(place_id, 0) + 1
+            self._pending_total += 1
+            if self._pending_total >= self.flush_threshold:
+                self._wake.set()
+
+    def pending(self, place_id):
+        """Views of a place counted here but not flushed yet."""
+        return self._pending.get(place_id, 0)
+
+    def flush(self):
+        """
+        Write the pending views to the database in a single transaction.
+
+        Returns:
+            int: Number of views flushed.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._pending_total = 0
+        if not batch or self._app is None:
+            return 0
+
+        places = Place.__table__
+        statement = (places.update()
+                     .where(places.c.id == bindparam('place_id'))
+                     .values(views=places.c.views + bindparam('delta')))
+        flushed = 0
+        with self._app.app_context():
+            # One transaction per shard of the places (a single one
+            # without sharded storage); a failed shard is requeued alone.
+            for engine, place_ids in shards.split_keys('places', batch):
+                try:
+                    with engine.begin() as connection:
+                        connection.execute(statement, [
+                            {'place_id': place_id, 'delta': batch[place_id]}
+                            for place_id in place_ids])
+                except Exception:
+                    logger.exception("Failed to flush %d place view "
+                                     "counters", len(place_ids))
+                    self._requeue({place_id: batch[place_id]
+                                   for place_id in place_ids})
+                    continue
+                flushed += sum(batch[place_id] for place_id in place_ids)
+        return flushed
+
+    def _requeue(self, batch):
+        with self._lock:
+            for place_id, delta in batch.items():
+                if (place_id in self._pending
+                        or len(self._pending) < self.max_places):
+                    self._pending[place_id] = (
+                        self._pending.get(place_id, 0) + delta)
+                    self._pending_total += delta
+                else:
+                    self.dropped += delta
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
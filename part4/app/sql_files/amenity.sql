@@ -1,6 +1,7 @@
 CREATE TABLE IF NOT EXISTS Amenity(
     id CHAR(36) PRIMARY KEY,
-    name VARCHAR(255) UNIQUE
+    name VARCHAR(255) UNIQUE,
+    version INT NOT NULL DEFAULT 1
 );
 CREATE TABLE IF NOT EXISTS place_amenity(
     place_id CHAR(36),
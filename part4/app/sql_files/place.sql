@@ -6,5 +6,14 @@ CREATE TABLE IF NOT EXISTS Place(
     latitude FLOAT,
     longitude FLOAT,
     owner_id CHAR(36),
+    review_count INT NOT NULL DEFAULT 0,
+    rating_sum INT NOT NULL DEFAULT 0,
+    rating_1 INT NOT NULL DEFAULT 0,
+    rating_2 INT NOT NULL DEFAULT 0,
+    rating_3 INT NOT NULL DEFAULT 0,
+    rating_4 INT NOT NULL DEFAULT 0,
+    rating_5 INT NOT NULL DEFAULT 0,
+    views INT NOT NULL DEFAULT 0,
+    version INT NOT NULL DEFAULT 1,
    FOREIGN KEY (owner_id) REFERENCES User(id)
 );
\ No newline at end of file
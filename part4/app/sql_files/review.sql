@@ -4,6 +4,7 @@ CREATE TABLE IF NOT EXISTS Review(
     rating INT CHECK (rating BETWEEN 1 AND 5),
     user_id CHAR(36),
     place_id CHAR(36),
+    version INT NOT NULL DEFAULT 1,
     FOREIGN KEY (user_id) REFERENCES User(id),
     FOREIGN KEY (place_id) REFERENCES Place(id),
     UNIQUE (user_id, place_id)
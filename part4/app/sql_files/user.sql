@@ -4,5 +4,6 @@ CREATE TABLE IF NOT EXISTS User(
     last_name VARCHAR(255),
     email VARCHAR(255) UNIQUE,
     password VARCHAR(255),
-    is_admin BOOLEAN DEFAULT FALSE
+    is_admin BOOLEAN DEFAULT FALSE,
+    version INT NOT NULL DEFAULT 1
 );
\ No newline at end of file
@@ -56,6 +56,7 @@ document.addEventListener('DOMContentLoaded', () => {
     if (placeId) {
         const token = getCookie('token');
         fetchPlaceDetails(placeId, token);
+        subscribeToPlaceEvents(placeId, token);
     }
 
     const reviewForm = document.getElementById('review-form');
@@ -243,6 +244,23 @@ async function fetchPlaceDetails(placeId, token) {
     }
 }
 
+// Refresh the place page when a review or the place itself changes,
+// instead of waiting for a reload.
+function subscribeToPlaceEvents(placeId, token) {
+    if (!window.EventSource) return;
+    const source = new EventSource(`http://127.0.0.1:5000/api/v1/places/${placeId}/events`);
+    const refresh = () => fetchPlaceDetails(placeId, token);
+    ['review.created', 'review.updated', 'review.deleted', 'place.updated'].forEach(name => {
+        source.addEventListener(name, refresh);
+    });
+    // Too far behind: the server dropped us, reload and subscribe again.
+    source.addEventListener('evicted', () => {
+        source.close();
+        refresh();
+        subscribeToPlaceEvents(placeId, token);
+    });
+}
+
 function displayPlaceDetails(place) {
     const section = document.querySelector('#place-details .place-info');
     const reviewContainer = document.querySelector('.review-card');
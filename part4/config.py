@@ -3,9 +3,121 @@ import os
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'default_secret_key')
     DEBUG = False
+    # Storage of users, places, reviews and amenities: 'sqlalchemy',
+    # 'memory' (nothing persisted; no change log, live events, view counts,
+    # bulk import or export) or 'cached' (reads from memory, writes through
+    # to the database)
+    REPOSITORY_BACKEND = os.getenv('REPOSITORY_BACKEND', 'sqlalchemy')
+    # Cached backend on several nodes: the copy applies the other nodes'
+    # writes every CACHE_REFRESH_SECONDS (0 disables polling, for a single
+    # node); place and amenity reads go to the database while no refresh
+    # succeeded for CACHE_MAX_STALENESS_SECONDS.
+    CACHE_REFRESH_SECONDS = float(os.getenv('CACHE_REFRESH_SECONDS', 0.25))
+    CACHE_MAX_STALENESS_SECONDS = 5.0
+    # Catalogue snapshot shared by the workers through mmap
+    # (app/services/catalogue.py); None disables it. Workers check the
+    # database for changes every CATALOGUE_REFRESH_SECONDS.
+    CATALOGUE_SNAPSHOT_PATH = os.getenv('CATALOGUE_SNAPSHOT_PATH')
+    CATALOGUE_REFRESH_SECONDS = float(
+        os.getenv('CATALOGUE_REFRESH_SECONDS', 2.0))
+    # Leaderboards served by GET /api/v1/places/top
+    LEADERBOARD_SIZE = 20
+    LEADERBOARD_CELL_DEGREES = 1.0
+    LEADERBOARD_MIN_REVIEWS = 1
+    LEADERBOARD_RELOAD_SECONDS = 60.0
+    # Place indexes (app/services/place_indexes.py) and leaderboards: a
+    # thread applies the other workers' place writes from the change log
+    # every PLACE_INDEX_REFRESH_SECONDS (0 disables it, for a single worker).
+    # With sharded storage, which keeps no change log, it reloads each
+    # index every *_RELOAD_SECONDS below instead.
+    PLACE_INDEX_REFRESH_SECONDS = 2.0
+    # Filtered GET /api/v1/places/ (app/services/place_columns.py)
+    PLACE_COLUMNS_RELOAD_SECONDS = 60.0
+    # GET /api/v1/places/nearest (app/services/nearest.py): largest k
+    NEAREST_MAX_RESULTS = 100
+    NEAREST_RELOAD_SECONDS = 60.0
+    # GET /api/v1/places/clusters (app/services/clusters.py): most
+    # geohash cells a viewport may cover
+    CLUSTERS_MAX_CELLS = 512
+    CLUSTERS_RELOAD_SECONDS = 60.0
+    # Trending feed served by GET /api/v1/places/trending
+    TRENDING_ENABLED = True
+    TRENDING_HALF_LIFE = 6 * 3600
+    TRENDING_TICK_SECONDS = 5.0
+    TRENDING_SNAPSHOT_SIZE = 100
+    # Write-behind place view counters (see app/services/view_counter.py
+    # for the loss window on crash)
+    VIEW_COUNTER_ENABLED = True
+    VIEW_COUNTER_FLUSH_SECONDS = 10.0
+    VIEW_COUNTER_FLUSH_THRESHOLD = 1000
+    VIEW_COUNTER_MAX_PLACES = 10000
+    # Background jobs (app/services/jobs.py). JOBS_EXECUTOR may be
+    # 'thread' or 'process'; process workers build their own app from
+    # JOBS_CHILD_CONFIG.
+    JOBS_ENABLED = True
+    JOBS_EXECUTOR = 'thread'
+    JOBS_CHILD_CONFIG = 'config.DevelopmentConfig'
+    JOBS_WORKERS = 4
+    JOBS_POLL_SECONDS = 1.0
+    JOBS_BACKOFF_SECONDS = 10.0
+    JOBS_LEASE_SECONDS = 30.0
+    JOBS_TIMEOUT_SECONDS = 3600.0
+    JOBS_SCHEDULE = {
+        'reconcile_rating_aggregates': '0 3 * * *',
+        'purge_jobs': '30 3 * * *',
+        'purge_changes': '45 3 * * *',
+        'purge_idempotency_keys': '15 * * * *',
+        'purge_exports': '20 * * * *',
+    }
+    # Bulk NDJSON imports
+    IMPORT_CHUNK_SIZE = 5000
+    # Bulk exports; files of background exports are written to EXPORT_DIR
+    # (a relative path is taken from the instance folder) and deleted by
+    # the purge_exports job EXPORT_RETENTION_HOURS after they are written
+    EXPORT_BATCH_SIZE = 1000
+    EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+    EXPORT_RETENTION_HOURS = 24
+    # POST /api/v1/batch: sub-requests per batch, threads for parallel GETs
+    BATCH_MAX_REQUESTS = 20
+    BATCH_WORKERS = 4
+    # Delta sync (GET /api/v1/changes): page size and change log retention
+    CHANGES_PAGE_SIZE = 500
+    CHANGES_RETENTION_DAYS = 30
+    # Server-Sent Events of GET /api/v1/places/<place_id>/events (see
+    # app/services/events.py for running them on an evented worker)
+    SSE_BUFFER_SIZE = 100
+    SSE_HEARTBEAT_SECONDS = 15.0
+    SSE_MAX_SUBSCRIBERS = 10000
+    # Other workers' writes are read from the change log every
+    # SSE_POLL_SECONDS; streams are refused outside an evented worker
+    # (gevent, eventlet) unless SSE_REQUIRE_EVENTED_WORKER is False
+    SSE_POLL_SECONDS = 1.0
+    SSE_REQUIRE_EVENTED_WORKER = True
+    # Idempotency-Key on POST /places, /reviews and /users: how long
+    # responses are replayed, and how long a running request holds its key
+    IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+    IDEMPOTENCY_LOCK_SECONDS = 30.0
+    # Read replicas (app/persistence/replicas.py): comma separated URIs in
+    # SQLALCHEMY_REPLICAS, none by default. A client that wrote reads from
+    # the primary for READ_YOUR_WRITES_SECONDS; a failed replica is probed
+    # again after REPLICA_RETRY_SECONDS.
+    SQLALCHEMY_REPLICAS = [uri for uri in
+                           os.getenv('SQLALCHEMY_REPLICAS', '').split(',')
+                           if uri]
+    READ_YOUR_WRITES_SECONDS = 5.0
+    REPLICA_RETRY_SECONDS = 10.0
+    # Sharded storage of users, places and reviews
+    # (app/persistence/sharding.py): comma separated URIs in
+    # SQLALCHEMY_SHARDS, none by default. Other tables stay on
+    # SQLALCHEMY_DATABASE_URI.
+    SQLALCHEMY_SHARDS = [uri for uri in
+                         os.getenv('SQLALCHEMY_SHARDS', '').split(',')
+                         if uri]
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    # The development server is threaded
+    SSE_REQUIRE_EVENTED_WORKER = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///development.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
@@ -1,10 +1,13 @@
 from app import create_app
-from app.extensions import db
+from app.extensions import db, shards
+from app.services import facade
 
 app = create_app()
 
 with app.app_context():
     db.create_all()
+    shards.create_all()
+    facade.rebuild_leaderboards()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,109 @@
+"""
+Lookups served by the catalogue snapshot (CATALOGUE_SNAPSHOT_PATH).
+
+Creates --places places with three amenities each on a SQLite file,
+writes the snapshot, then times the place lookups of the /places/top
+rails and GET /api/v1/amenities/ from the snapshot against the same
+reads through the SQLAlchemy repositories. Also reports the snapshot
+size, which is what each worker maps instead of holding its own copy.
+
+Run from part4:
+
+    python test/benchmark_catalogue.py [--places N] [--reads N]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from app import create_app
+from app.extensions import db
+from app.services import facade
+
+
+def rate(count, operation):
+    """Operations per second of `count` calls of operation(i)."""
+    start = time.perf_counter()
+    for i in range(count):
+        operation(i)
+        db.session.remove()
+    return count / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--places', type=int, default=2000)
+    parser.add_argument('--amenities', type=int, default=30)
+    parser.add_argument('--reads', type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='hbnb-catalogue-')
+    path = os.path.join(directory, 'catalogue.bin')
+    app = create_app(type('BenchmarkConfig', (config.Config,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory,
+                                                               'hbnb.db'),
+        'CATALOGUE_SNAPSHOT_PATH': path,
+        'CATALOGUE_REFRESH_SECONDS': 0,
+        'TRENDING_ENABLED': False,
+        'JOBS_ENABLED': False,
+    }))
+    with app.app_context():
+        db.create_all()
+        owner = facade.create_user({
+            'first_name': 'Jane', 'last_name': 'Doe',
+            'email': 'owner@example.com', 'password': 'secret'}).id
+        amenities = [facade.create_amenity({'name': f'Amenity {i}'}).id
+                     for i in range(args.amenities)]
+        random.seed(0)
+        places = [facade.create_place({
+            'title': f'Place {i}', 'description': 'Nice',
+            'price': random.uniform(20, 400),
+            'latitude': random.uniform(-60, 60),
+            'longitude': random.uniform(-180, 180),
+            'owner_id': owner,
+            'amenities': random.sample(amenities, 3)}).id
+            for i in range(args.places)]
+        db.session.remove()
+
+        start = time.perf_counter()
+        facade.build_catalogue()
+        build = time.perf_counter() - start
+        ids = [[places[(i * 10 + j) * 7919 % len(places)] for j in range(10)]
+               for i in range(args.reads)]
+        catalogue = facade.catalogue
+        repository = facade.place_repository
+        results = {
+            '10 places + amenities': (
+                rate(args.reads, lambda i: [
+                    (p.title, p.owner.first_name, [a.name for a in p.amenities])
+                    for p in catalogue.get_places(ids[i])]),
+                rate(args.reads, lambda i: [
+                    (p.title, p.owner.first_name, [a.name for a in p.amenities])
+                    for p in repository.get_places(ids[i])])),
+            'all amenities': (
+                rate(args.reads, lambda i: [
+                    a.to_dict() for a in catalogue.get_all_amenities()]),
+                rate(args.reads, lambda i: [
+                    a.to_dict() for a in
+                    facade.amenity_repository.get_all_amenities()])),
+        }
+        size = os.path.getsize(path)
+        db.session.remove()
+        db.engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{args.places} places: snapshot of {size / 1024:,.0f} KiB "
+          f"written in {build * 1000:,.0f} ms; operations per second")
+    print(f"{'':<24}{'snapshot':>12}{'sqlalchemy':>12}")
+    for operation, (snapshot, sqlalchemy) in results.items():
+        print(f"{operation:<24}{snapshot:>12,.0f}{sqlalchemy:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
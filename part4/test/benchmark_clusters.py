@@ -0,0 +1,91 @@
+"""
+Map clusters (app/services/clusters.py) against one marker per place.
+
+Aggregates --places random places, clustered around cities, then for a
+1920x1080 viewport at several zoom levels reports the JSON size of the
+clusters next to that of a marker (id, coordinates, price) per place in
+the viewport, and the time to answer. Also times place moves, which
+update one cell per geohash precision.
+
+Run from part4:
+
+    python test/benchmark_clusters.py [--places N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.clusters import PlaceClusters
+
+
+def viewport(latitude, longitude, zoom):
+    """Bounding box of a 1920x1080 pixel map centred on a point."""
+    width = 360 / 2 ** zoom * 1920 / 256
+    height = min(width * 1080 / 1920, 170)
+    return (max(latitude - height / 2, -90), max(longitude - width / 2, -180),
+            min(latitude + height / 2, 90), min(longitude + width / 2, 180))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--places', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    cities = np.column_stack((rng.uniform(-50, 60, 100),
+                              rng.uniform(-170, 170, 100)))
+    centers = cities[rng.integers(0, len(cities), args.places)]
+    latitudes = centers[:, 0] + rng.normal(0, 0.3, args.places)
+    longitudes = centers[:, 1] + rng.normal(0, 0.3, args.places)
+    prices = rng.uniform(20, 400, args.places).round(2)
+    ids = [f'place-{i:07d}' for i in range(args.places)]
+
+    clusters = PlaceClusters(reload_seconds=0)
+    clusters.source = lambda: list(zip(ids, prices.tolist(),
+                                       latitudes.tolist(),
+                                       longitudes.tolist()))
+    start = time.perf_counter()
+    clusters.load()
+    print(f"{args.places} places aggregated in "
+          f"{time.perf_counter() - start:.1f} s")
+
+    print(f"{'zoom':>4}{'precision':>10}{'clusters':>10}{'cluster KB':>12}"
+          f"{'markers':>10}{'marker KB':>12}{'ms/query':>10}")
+    latitude, longitude = cities[0]
+    for zoom in (2, 5, 8, 11, 14):
+        bbox = viewport(latitude, longitude, zoom)
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            precision, found = clusters.clusters(bbox, zoom)
+        elapsed = (time.perf_counter() - start) / args.queries
+        south, west, north, east = bbox
+        inside = np.flatnonzero((latitudes >= south) & (latitudes <= north)
+                                & (longitudes >= west) & (longitudes <= east))
+        markers = [{'id': ids[i], 'latitude': latitudes[i],
+                    'longitude': longitudes[i], 'price': prices[i]}
+                   for i in inside.tolist()]
+        print(f"{zoom:>4}{precision:>10}{len(found):>10}"
+              f"{len(json.dumps(found)) / 1024:>12,.1f}{len(markers):>10}"
+              f"{len(json.dumps(markers)) / 1024:>12,.1f}"
+              f"{elapsed * 1000:>10.2f}")
+
+    moves = rng.integers(0, args.places, 10000)
+    start = time.perf_counter()
+    for i in moves.tolist():
+        clusters.place_changed(SimpleNamespace(
+            id=ids[i], latitude=float(latitudes[i] + 0.01),
+            longitude=float(longitudes[i]), price=float(prices[i])))
+    print(f"move a place: {len(moves) / (time.perf_counter() - start):,.0f}"
+          f"/s")
+
+
+if __name__ == '__main__':
+    main()
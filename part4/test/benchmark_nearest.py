@@ -0,0 +1,114 @@
+"""
+Nearest places: the KD-tree of app/services/nearest.py against a
+brute-force vectorized haversine over every place.
+
+Builds a PlaceLocator over --places random places (no database), then
+answers --queries k-nearest queries (k = --k) and radius queries with
+the tree and with haversine distances computed in NumPy for every place,
+and checks both give the same places. Also times the incremental moves
+of places, which the buffer absorbs between rebuilds.
+
+Run from part4:
+
+    python test/benchmark_nearest.py [--places N] [--queries N] [--k N]
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.nearest import EARTH_RADIUS_KM, PlaceLocator
+
+
+def haversine(latitudes, longitudes, latitude, longitude):
+    """Distances in km from a point to every place, in NumPy."""
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    a = (np.sin((latitudes - latitude) / 2) ** 2 + np.cos(latitude)
+         * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def timed(count, operation):
+    """Calls per second of operation(i), and the results."""
+    start = time.perf_counter()
+    results = [operation(i) for i in range(count)]
+    return count / (time.perf_counter() - start), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--places', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--radius-km', type=float, default=50.0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    # Places clustered around 200 cities, as real listings are
+    cities = np.column_stack((rng.uniform(-60, 70, 200),
+                              rng.uniform(-180, 180, 200)))
+    centers = cities[rng.integers(0, len(cities), args.places)]
+    latitudes = np.clip(centers[:, 0] + rng.normal(0, 0.5, args.places),
+                        -90, 90)
+    longitudes = (centers[:, 1] + rng.normal(0, 0.5, args.places)
+                  + 180) % 360 - 180
+    ids = [f'place-{i}' for i in range(args.places)]
+    queries = cities[rng.integers(0, len(cities), args.queries)] \
+        + rng.normal(0, 0.5, (args.queries, 2))
+    queries[:, 0] = np.clip(queries[:, 0], -90, 90)
+    queries[:, 1] = (queries[:, 1] + 180) % 360 - 180
+
+    locator = PlaceLocator(reload_seconds=0)
+    locator.source = lambda: list(zip(ids, latitudes.tolist(),
+                                      longitudes.tolist()))
+    start = time.perf_counter()
+    locator.load()
+    build = time.perf_counter() - start
+
+    def brute_nearest(i):
+        distances = haversine(latitudes, longitudes, *queries[i])
+        best = np.argpartition(distances, args.k)[:args.k]
+        return [ids[j] for j in best[np.argsort(distances[best])]]
+
+    def brute_within(i):
+        distances = haversine(latitudes, longitudes, *queries[i])
+        inside = np.flatnonzero(distances <= args.radius_km)
+        return sorted(ids[j] for j in inside)
+
+    results = {}
+    results['k nearest'] = (
+        timed(args.queries, lambda i: [pid for pid, _ in locator.nearest(
+            *queries[i], args.k)]),
+        timed(args.queries, brute_nearest))
+    results[f'within {args.radius_km:g} km'] = (
+        timed(args.queries, lambda i: sorted(pid for pid, _ in
+                                             locator.within(
+                                                 *queries[i],
+                                                 args.radius_km))),
+        timed(args.queries, brute_within))
+    for (_, tree), (_, brute) in results.values():
+        mismatches = sum(a != b for a, b in zip(tree, brute))
+        assert mismatches == 0, f"{mismatches} queries differ"
+
+    moves = rng.integers(0, args.places, args.queries)
+    move_rate, _ = timed(args.queries, lambda i: locator.place_changed(
+        SimpleNamespace(id=ids[moves[i]], latitude=float(queries[i][0]),
+                        longitude=float(queries[i][1]))))
+
+    print(f"{args.places} places: tree built in {build * 1000:,.0f} ms; "
+          f"queries per second")
+    print(f"{'':<18}{'kd-tree':>12}{'haversine':>12}")
+    for name, ((tree, _), (brute, _)) in results.items():
+        print(f"{name:<18}{tree:>12,.0f}{brute:>12,.0f}")
+    print(f"{'move a place':<18}{move_rate:>12,.0f}  "
+          f"({locator.rebuilds} rebuild(s))")
+
+
+if __name__ == '__main__':
+    main()
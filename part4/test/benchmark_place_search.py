@@ -0,0 +1,105 @@
+"""
+Filtered place searches: NumPy columns against row-by-row predicates.
+
+Creates --places places, with random prices, coordinates, amenities and
+reviews, in the memory backend (so the comparison is not dominated by
+SQL), then runs the same searches (price range, bounding box, minimum
+rating, required amenities, sorted by price, first page of 20) through
+facade.search_places and by evaluating the predicates on every Place
+object returned by the repository.
+
+Run from part4:
+
+    python test/benchmark_place_search.py [--places N] [--searches N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from app import create_app
+from app.services import facade
+
+
+def row_by_row(min_price, max_price, bbox, min_rating, amenity_ids):
+    south, west, north, east = bbox
+    required = set(amenity_ids)
+    places = [place for place in facade.get_all_places()
+              if min_price <= place.price <= max_price
+              and south <= place.latitude <= north
+              and west <= place.longitude <= east
+              and place.review_count
+              and place.rating_sum >= min_rating * place.review_count
+              and required <= {a.id for a in place.amenities}]
+    places.sort(key=lambda place: place.price)
+    return len(places), places[:20]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--places', type=int, default=20000)
+    parser.add_argument('--amenities', type=int, default=40)
+    parser.add_argument('--searches', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    app = create_app(type('BenchmarkConfig', (config.Config,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'REPOSITORY_BACKEND': 'memory',
+        'TRENDING_ENABLED': False,
+        'JOBS_ENABLED': False,
+    }))
+    random.seed(0)
+    with app.app_context():
+        owner = facade.create_user({
+            'first_name': 'Jane', 'last_name': 'Doe',
+            'email': 'owner@example.com', 'password': 'secret'})
+        amenities = [facade.create_amenity({'name': f'Amenity {i}'}).id
+                     for i in range(args.amenities)]
+        for i in range(args.places):
+            place = facade.create_place({
+                'title': f'Place {i}', 'description': 'Nice',
+                'price': random.uniform(20, 400),
+                'latitude': random.uniform(-60, 60),
+                'longitude': random.uniform(-180, 180),
+                'owner_id': owner.id,
+                'amenities': random.sample(amenities, 5)})
+            count = random.randint(0, 20)
+            place.review_count = count
+            place.rating_sum = sum(random.randint(1, 5) for _ in range(count))
+
+        searches = []
+        for _ in range(args.searches):
+            south, west = random.uniform(-60, 20), random.uniform(-180, 60)
+            low = random.uniform(20, 200)
+            searches.append({
+                'min_price': low, 'max_price': low + 150,
+                'bbox': (south, west, south + 40, west + 120),
+                'min_rating': random.choice((2.5, 3, 3.5)),
+                'amenity_ids': random.sample(amenities, 1)})
+
+        facade.search_places()
+        results = {}
+        for name, search in (
+                ('columns', lambda f: facade.search_places(
+                    sort='price', limit=20, **f)),
+                ('row by row', lambda f: row_by_row(**f))):
+            start = time.perf_counter()
+            answers = [search(f) for f in searches]
+            elapsed = time.perf_counter() - start
+            results[name] = (args.searches / elapsed,
+                             [(total, [p.id for p in page])
+                              for total, page in answers])
+
+    assert results['columns'][1] == results['row by row'][1]
+    print(f"{args.places} places, {args.searches} searches; searches per "
+          f"second")
+    for name, (rate, _) in results.items():
+        print(f"{name:<12}{rate:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
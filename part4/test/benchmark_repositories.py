@@ -0,0 +1,114 @@
+"""
+Throughput of the repository backends (REPOSITORY_BACKEND).
+
+Builds the same catalogue with each backend, on a SQLite file: --users
+users, --places places and --reviews reviews created through the facade,
+then times the reads served by GET /api/v1/places/<id>, GET
+/api/v1/places/?sort=rating and the review lookup of POST /reviews. Each
+operation ends with db.session.remove(), as a request does, so the
+SQLAlchemy backend cannot serve a read from the session's identity map.
+
+Run from part4:
+
+    python test/benchmark_repositories.py [--places N] [--reviews N]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from app import create_app
+from app.extensions import db
+from app.services import facade
+
+
+def make_config(backend, path):
+    return type('BenchmarkConfig', (config.Config,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'REPOSITORY_BACKEND': backend,
+        'TRENDING_ENABLED': False,
+        'JOBS_ENABLED': False,
+    })
+
+
+def rate(count, operation):
+    """Operations per second of `count` calls of operation(i)."""
+    start = time.perf_counter()
+    for i in range(count):
+        operation(i)
+        db.session.remove()
+    return count / (time.perf_counter() - start)
+
+
+def run(backend, args):
+    directory = tempfile.mkdtemp(prefix='hbnb-repositories-')
+    path = os.path.join(directory, 'hbnb.db')
+    app = create_app(make_config(backend, path))
+    results = {}
+    with app.app_context():
+        db.create_all()
+        users = [facade.create_user({
+            'first_name': 'Jane', 'last_name': 'Doe',
+            'email': f'user{i}@example.com', 'password': 'secret'}).id
+            for i in range(args.users)]
+        random.seed(0)
+        places = []
+        results['create place'] = rate(args.places, lambda i: places.append(
+            facade.create_place({
+                'title': f'Place {i}', 'description': 'Nice',
+                'price': random.uniform(20, 400),
+                'latitude': random.uniform(-60, 60),
+                'longitude': random.uniform(-180, 180),
+                'owner_id': users[i % len(users)]}).id))
+        pairs = [(users[i % len(users)], places[i % len(places)])
+                 for i in range(args.reviews)]
+        results['create review'] = rate(args.reviews, lambda i:
+                                        facade.create_review({
+                                            'text': 'Great',
+                                            'rating': 1 + i % 5,
+                                            'user_id': pairs[i][0],
+                                            'place_id': pairs[i][1]}))
+        # Load the cache (or warm SQLite's page cache) before timing reads
+        facade.get_all_places()
+        results['get place'] = rate(args.reads, lambda i: facade.get_place(
+            places[i * 7919 % len(places)]).to_dict())
+        results['list places by rating'] = rate(
+            max(args.reads // 100, 1),
+            lambda i: facade.get_all_places('rating'))
+        results['review by user and place'] = rate(
+            args.reads, lambda i: facade.get_review_by_user_and_place(
+                *pairs[i * 7919 % len(pairs)]))
+        db.session.remove()
+        db.engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    # Users are few: creating one hashes its password with bcrypt
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--places', type=int, default=200)
+    parser.add_argument('--reviews', type=int, default=400)
+    parser.add_argument('--reads', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    backends = ('sqlalchemy', 'memory', 'cached')
+    results = {backend: run(backend, args) for backend in backends}
+    print(f"{args.places} places, {args.reviews} reviews; operations per "
+          f"second")
+    print(f"{'':<26}" + ''.join(f"{backend:>12}" for backend in backends))
+    for operation in results['sqlalchemy']:
+        print(f"{operation:<26}" + ''.join(
+            f"{results[backend][operation]:>12,.0f}"
+            for backend in backends))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,43 @@
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
 import unittest
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import click
+import numpy as np
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.exc import ProgrammingError
+
+import config
 from app import create_app
+from app.extensions import db, replicas, serving, shards
+from app.models.amenity import Amenity
+from app.models.change import Change
+from app.models.job import Job, JobLease
+from app.models.place import Place
+from app.persistence.read_only import ReadOnlySessionError, read_only_session
+from app.persistence.sharding import jump_hash
+from app.services import change_log, facade
+from app.services.catalogue import CatalogueSnapshot
+from app.services.clusters import PlaceClusters, cell_of, geohash
+from app.services.facade import DatabaseRequired
+from app.services.jobs import CronSchedule, JobRunner, utcnow
+from app.services.leaderboard import Leaderboards, TopK
+from app.services.nearest import KDTree, PlaceLocator, unit_vectors
+from app.services.place_indexes import PlaceIndexRefresher
+from app.services.repositories.cached_repository import RepositoryCache
+from app.services.trending import EventRing, TrendingTracker
+from app.services.versioning import (PreconditionFailed, etag,
+                                     parse_if_match)
+from app.services.view_counter import ViewCounter
 
 class TestUserEndpoints(unittest.TestCase):
 
@@ -22,3 +60,1479 @@ class TestUserEndpoints(unittest.TestCase):
             "email": "invalid-email"
         })
         self.assertEqual(response.status_code, 400)
+
+
+class TestConfig(config.Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    TESTING = True
+    TRENDING_ENABLED = False
+    JOBS_ENABLED = False
+    VIEW_COUNTER_ENABLED = False
+    SSE_POLL_SECONDS = 0
+    SSE_REQUIRE_EVENTED_WORKER = False
+    PLACE_INDEX_REFRESH_SECONDS = 0
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Test case run in the context of an application of `config`, on empty
+    tables dropped after each test.
+    """
+
+    config = TestConfig
+
+    def setUp(self):
+        self.app = create_app(self.config)
+        self.client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    @staticmethod
+    def make_user(first_name="Jane"):
+        return facade.create_user({
+            "first_name": first_name, "last_name": "Doe",
+            "email": f"{first_name.lower()}.doe@example.com",
+            "password": "secret"})
+
+    @staticmethod
+    def make_place(owner, **fields):
+        return facade.create_place({
+            "title": "Loft", "description": "Nice", "price": 80,
+            "latitude": 48.85, "longitude": 2.35, "owner_id": owner.id,
+            **fields})
+
+
+class TestRatingAggregates(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user()
+        self.guest = self.make_user("John")
+        self.place = self.make_place(self.owner)
+
+    def test_aggregates_follow_review_writes(self):
+        review = facade.create_review({
+            "text": "Great", "rating": 4, "place_id": self.place.id,
+            "user_id": self.guest.id})
+        self.assertEqual(self.place.review_count, 1)
+        self.assertEqual(self.place.rating_histogram["4"], 1)
+
+        facade.update_review(review.id, {"rating": 2})
+        self.assertEqual(self.place.rating_sum, 2)
+        self.assertEqual(self.place.rating_histogram["4"], 0)
+
+        facade.delete_review(review.id)
+        self.assertEqual(self.place.review_count, 0)
+        self.assertIsNone(self.place.average_rating)
+
+    def test_reconcile_fixes_drift(self):
+        facade.create_review({
+            "text": "Great", "rating": 5, "place_id": self.place.id,
+            "user_id": self.guest.id})
+        self.place.review_count = 7
+        db.session.commit()
+        self.assertEqual(facade.reconcile_rating_aggregates(), 1)
+        self.assertEqual(self.place.to_dict()["review_count"], 1)
+        self.assertEqual(facade.reconcile_rating_aggregates(), 0)
+
+
+class TestLeaderboards(unittest.TestCase):
+
+    def test_top_k_floor(self):
+        top = TopK(2)
+        for member, score in (('a', 3), ('b', 1), ('c', 2)):
+            top.offer(member, score)
+        self.assertEqual(top.top(2), [('a', 3), ('c', 2)])
+        self.assertEqual(top.floor, 1)
+        # 'a' drops below the floor: the evicted 'b' might rank second
+        top.offer('c', 0)
+        self.assertIsNone(top.top(2))
+        self.assertEqual(top.top(1), [('a', 3)])
+
+    def test_rails_per_metric_and_cell(self):
+        rows = [('paris', 48.85, 2.35, 2, 9), ('lyon', 45.76, 4.83, 5, 15),
+                ('nice', 43.7, 7.26, 1, 5), ('new', 48.86, 2.34, 0, 0)]
+        boards = Leaderboards(size=3, min_reviews=2)
+        boards.source = lambda: rows
+        self.assertEqual(boards.top('rated'),
+                         [('paris', (4.5, 2)), ('lyon', (3.0, 5))])
+        self.assertEqual([member for member, _ in boards.top('reviewed')],
+                         ['lyon', 'paris', 'nice'])
+        self.assertEqual(boards.top('reviewed', 48.9, 2.3),
+                         [('paris', (2, 4.5)), ('new', (0, 0.0))])
+        with self.assertRaises(ValueError):
+            boards.top('viewed')
+
+        # A place moving to another cell leaves the rail of the old one
+        boards.place_changed(SimpleNamespace(
+            id='new', latitude=45.7, longitude=4.8, review_count=3,
+            rating_sum=15))
+        self.assertEqual([m for m, _ in boards.top('rated', 45.7, 4.8)],
+                         ['new', 'lyon'])
+        self.assertEqual([m for m, _ in boards.top('reviewed', 48.9, 2.3)],
+                         ['paris'])
+        boards.place_deleted('paris')
+        self.assertEqual([m for m, _ in boards.top('rated')],
+                         ['new', 'lyon'])
+
+    def test_stale_board_is_rebuilt(self):
+        rows = [(f'p{i}', 10.0, 10.0, i, 4 * i) for i in range(1, 11)]
+        boards = Leaderboards(size=2)
+        boards.source = lambda: rows
+        self.assertEqual([m for m, _ in boards.top('reviewed', limit=2)],
+                         ['p10', 'p9'])
+        # The four kept places lose their reviews; the evicted ones rank
+        for i in (7, 8, 9, 10):
+            rows[i - 1] = (f'p{i}', 10.0, 10.0, 0, 0)
+            boards.place_changed(SimpleNamespace(
+                id=f'p{i}', latitude=10.0, longitude=10.0, review_count=0,
+                rating_sum=0))
+        self.assertEqual([m for m, _ in boards.top('reviewed', limit=2)],
+                         ['p6', 'p5'])
+
+
+class TestTrending(unittest.TestCase):
+
+    def test_ring_drains_once_and_counts_laps(self):
+        ring = EventRing(4)
+        ring.append('a', 1.0, 0.0)
+        ring.append('b', 1.0, 0.0)
+        self.assertEqual([e[0] for e in ring.drain()], ['a', 'b'])
+        self.assertEqual(ring.drain(), [])
+        for i in range(6):
+            ring.append(f'p{i}', 1.0, 0.0)
+        # Writers lapped the reader: the two oldest events were overwritten
+        self.assertEqual([e[0] for e in ring.drain()],
+                         ['p2', 'p3', 'p4', 'p5'])
+        self.assertEqual(ring.dropped, 2)
+
+    def test_scores_decay_with_the_half_life(self):
+        tracker = TrendingTracker(half_life=100, snapshot_size=2)
+        tracker._scored_at = 1000.0
+        tracker._ring.append('viewed', 1.0, 1000.0)
+        tracker._ring.append('reviewed', 5.0, 900.0)
+        tracker._ring.append('old', 1.0, 0.0)
+        tracker.tick(now=1000.0)
+        self.assertEqual([p for p, _ in tracker.top()], ['reviewed', 'viewed'])
+        self.assertAlmostEqual(tracker.top()[0][1], 2.5)
+
+        tracker.tick(now=1100.0)
+        self.assertAlmostEqual(dict(tracker.top())['viewed'], 0.5)
+        self.assertAlmostEqual(dict(tracker.top())['reviewed'], 1.25)
+        # Scores decayed under 0.01 are forgotten
+        self.assertNotIn('old', tracker._scores)
+
+    def test_record_weighs_event_kinds(self):
+        tracker = TrendingTracker()
+        tracker.record('a', 'view')
+        tracker.record('b', 'review')
+        tracker.record('c', 'unknown')
+        tracker.tick()
+        self.assertEqual([p for p, _ in tracker.top(2)], ['b', 'a'])
+
+
+class TestViewCounter(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        owner = self.make_user()
+        self.places = [self.make_place(owner, title=f"Place {i}")
+                       for i in range(3)]
+        self.counter = ViewCounter()
+        self.counter.init_app(self.app)
+        self.counter.max_places = 2
+
+    def views(self, place):
+        db.session.refresh(place)
+        return place.views
+
+    def test_flush_adds_the_pending_views(self):
+        first, second, _ = self.places
+        for _ in range(3):
+            self.counter.increment(first.id)
+        self.counter.increment(second.id)
+        self.assertEqual(self.views(first), 0)
+        self.assertEqual(self.counter.flush(), 4)
+        self.counter.increment(first.id)
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual((self.views(first), self.views(second)), (4, 1))
+        self.assertEqual(self.counter.flush(), 0)
+
+    def test_pending_places_are_bounded(self):
+        for place in self.places:
+            self.counter.increment(place.id)
+        self.counter.increment(self.places[0].id)
+        self.assertEqual(self.counter.dropped, 1)
+        self.assertEqual(self.counter.pending(self.places[0].id), 2)
+        self.assertEqual(self.counter.pending(self.places[2].id), 0)
+
+    def test_failed_flush_is_requeued(self):
+        first = self.places[0]
+        self.counter.increment(first.id)
+        broken = mock.Mock()
+        broken.begin.side_effect = RuntimeError("database down")
+        with mock.patch.object(shards, 'split_keys',
+                               return_value=[(broken, [first.id])]), \
+                self.assertLogs('app.services.view_counter', 'ERROR'):
+            self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(self.counter.pending(first.id), 1)
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual(self.views(first), 1)
+
+
+class InlineExecutor:
+    """Runs submitted calls at once, for the job runner tests."""
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TestJobRunner(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.runner = self.new_runner()
+        self.calls = []
+
+        @self.runner.register('flaky', max_attempts=3)
+        def flaky():
+            self.calls.append('flaky')
+            raise RuntimeError("boom")
+
+        @self.runner.register('tick')
+        def tick():
+            self.calls.append('tick')
+            return 'ok'
+
+    def new_runner(self):
+        runner = JobRunner()
+        runner._app = self.app
+        runner._executor = InlineExecutor()
+        return runner
+
+    def test_cron_schedule(self):
+        schedule = CronSchedule('*/15 9-17 * * 0-4')
+        self.assertTrue(schedule.matches(datetime(2024, 5, 6, 9, 45)))
+        self.assertFalse(schedule.matches(datetime(2024, 5, 6, 9, 40)))
+        self.assertFalse(schedule.matches(datetime(2024, 5, 6, 18, 0)))
+        # 2024-05-11 is a Saturday
+        self.assertFalse(schedule.matches(datetime(2024, 5, 11, 9, 45)))
+        self.assertEqual(CronSchedule('0,30 * 1 1,7 *').fields[3], {1, 7})
+        for expression in ('* * * *', '60 * * * *', '* 5-2 * * *',
+                           '* * 0 * *', 'a * * * *'):
+            with self.assertRaises(ValueError):
+                CronSchedule(expression)
+
+    def test_failed_jobs_back_off_then_fail(self):
+        job = self.runner.enqueue('flaky')
+        delays = []
+        for _ in range(3):
+            db.session.execute(update(Job).where(Job.id == job.id)
+                               .values(run_at=utcnow()))
+            db.session.commit()
+            started = utcnow()
+            self.runner.run_pending()
+            db.session.expire_all()
+            delays.append(round((job.run_at - started).total_seconds()))
+        self.assertEqual(self.calls, ['flaky'] * 3)
+        self.assertEqual(delays[:2], [10, 20])
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertEqual(job.last_error, "RuntimeError: boom")
+        # Not due, nothing runs
+        self.runner.run_pending()
+        self.assertEqual(len(self.calls), 3)
+
+    def test_scheduler_lease(self):
+        other = self.new_runner()
+        self.assertTrue(self.runner.acquire_lease('scheduler'))
+        self.assertFalse(other.acquire_lease('scheduler'))
+        self.assertTrue(self.runner.acquire_lease('scheduler'))
+        db.session.execute(update(JobLease).values(
+            expires_at=utcnow() - timedelta(seconds=1)))
+        db.session.commit()
+        self.assertTrue(other.acquire_lease('scheduler'))
+        self.assertFalse(self.runner.acquire_lease('scheduler'))
+
+    def test_only_the_leader_enqueues_a_slot_once(self):
+        other = self.new_runner()
+        other.handlers = self.runner.handlers
+        for runner in (self.runner, other):
+            runner.schedule('tick', '* * * * *')
+        with mock.patch('app.services.jobs.utcnow',
+                        return_value=utcnow()):
+            self.runner.run_pending()
+            other.run_pending()
+            self.runner.run_pending()
+        self.assertEqual(self.calls, ['tick'])
+        self.assertEqual(Job.query.filter_by(name='tick').count(), 1)
+
+
+class TestBackgroundThreads(unittest.TestCase):
+
+    def test_only_serving_apps_start_threads(self):
+        self.assertTrue(serving())
+        with click.Context(click.Command('run'), info_name='run'):
+            self.assertTrue(serving())
+        with click.Context(click.Command('build-catalogue'),
+                           info_name='build-catalogue'):
+            self.assertFalse(serving())
+            counter = ViewCounter()
+            counter.init_app(create_app(type('ServingConfig', (TestConfig,), {
+                'VIEW_COUNTER_ENABLED': True})))
+            self.assertIsNone(counter._thread)
+            app = SimpleNamespace(config={
+                'CACHE_REFRESH_SECONDS': 1.0, 'CATALOGUE_REFRESH_SECONDS': 1.0,
+                'CATALOGUE_SNAPSHOT_PATH': 'catalogue.bin'})
+            cache, snapshot = RepositoryCache(), CatalogueSnapshot()
+            cache.init_app(app)
+            snapshot.init_app(app)
+            self.assertIsNone(cache._thread)
+            self.assertIsNone(snapshot._thread)
+
+
+class TestBulkExport(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        owner = self.make_user()
+        for i in range(5):
+            self.make_place(owner, title=f"Loft {i}",
+                            description="Nice, quiet")
+
+    def test_csv_export_is_batched(self):
+        facade.export_batch_size = 2
+        data = b''.join(facade.export_stream('places', 'csv'))
+        lines = data.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('id,title,'))
+        self.assertIn('"Nice, quiet"', lines[1])
+
+    def test_unknown_entity(self):
+        with self.assertRaises(ValueError):
+            facade.export_stream('users', 'csv')
+
+    def test_export_files_expire(self):
+        self.app.instance_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.app.instance_path)
+        handlers = facade.jobs.handlers
+        result = handlers['export']['func']('places', 'csv')
+        self.assertEqual(os.path.dirname(result['path']),
+                         os.path.join(self.app.instance_path, 'exports'))
+        self.assertEqual(handlers['purge_exports']['func'](), {'deleted': 0})
+        old = time.time() - 25 * 3600
+        os.utime(result['path'], (old, old))
+        self.assertEqual(handlers['purge_exports']['func'](), {'deleted': 1})
+        self.assertFalse(os.path.exists(result['path']))
+
+
+class TestBulkImport(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user()
+
+    @staticmethod
+    def _ndjson(*lines):
+        return io.BytesIO('\n'.join(
+            line if isinstance(line, str) else json.dumps(line)
+            for line in lines).encode('utf-8'))
+
+    def test_invalid_rows_are_reported_by_line(self):
+        user = {"first_name": "John", "last_name": "Smith",
+                "password": "secret"}
+        report = facade.import_ndjson('users', self._ndjson(
+            {**user, "email": "john@example.com"},
+            '{not json',
+            '[1, 2]',
+            {**user, "email": "not-an-email"},
+            {**user, "email": "jane.doe@example.com"},
+            {**user, "email": "john@example.com"},
+            {**user, "first_name": "", "email": "ann@example.com"}))
+        self.assertEqual(report.total, 7)
+        self.assertEqual(report.inserted, 1)
+        errors = {error['line']: error['error'] for error in report.errors}
+        self.assertEqual(sorted(errors), [2, 3, 4, 5, 6, 7])
+        self.assertTrue(errors[2].startswith("Invalid JSON"))
+        self.assertEqual(errors[3], "Each line must be a JSON object")
+        self.assertEqual(errors[4], "invalid email format")
+        self.assertEqual(errors[5], "Email already registered")
+        self.assertEqual(errors[6], "Email already registered")
+        self.assertEqual(errors[7],
+                         "first_name must contain 1 to 50 characters")
+
+    def test_places_are_inserted_in_chunks(self):
+        facade.importer.chunk_size = 2
+        place = {"title": "Loft", "price": 80, "latitude": 48.85,
+                 "longitude": 2.35, "owner_id": self.owner.id}
+        inserts = []
+
+        def count_inserts(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO places'):
+                inserts.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_inserts)
+        try:
+            report = facade.import_ndjson('places', self._ndjson(
+                *[place] * 4, {**place, "owner_id": "unknown"}, place))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_inserts)
+        self.assertEqual(report.inserted, 5)
+        self.assertEqual(report.errors,
+                         [{'line': 5, 'error': "Owner not found"}])
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(db.session.scalar(
+            select(func.count()).select_from(Place)), 5)
+        self.assertEqual(db.session.scalar(select(func.count()).select_from(
+            Change).where(Change.entity == 'places')), 5)
+
+    def test_numeric_fields_are_checked(self):
+        place = {"title": "Loft", "price": 80, "latitude": 48.85,
+                 "longitude": 2.35, "owner_id": self.owner.id}
+        report = facade.import_ndjson('places', self._ndjson(
+            {**place, "price": "90.5"},
+            '{"title": "Loft", "price": Infinity, "latitude": 1, '
+            f'"longitude": 1, "owner_id": "{self.owner.id}"}}',
+            {**place, "price": "inf"},
+            {**place, "price": -1},
+            {**place, "latitude": "nan"},
+            {**place, "longitude": "east"},
+            {**place, "latitude": None}))
+        self.assertEqual(report.inserted, 1)
+        price = "price must be a finite positive number"
+        self.assertEqual(
+            {error['line']: error['error'] for error in report.errors},
+            {2: price, 3: price, 4: price,
+             5: "latitude must be between -90 and 90",
+             6: "Invalid value for longitude", 7: "latitude is required"})
+        self.assertEqual(db.session.scalar(select(Place.price)), 90.5)
+
+
+class TestBatchEndpoint(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.make_user()
+
+    def test_login_token_is_used_by_later_requests(self):
+        response = self.client.post('/api/v1/batch/', json={"requests": [
+            {"path": "/api/v1/auth/protected"},
+            {"method": "POST", "path": "/api/v1/auth/login",
+             "body": {"email": "jane.doe@example.com",
+                      "password": "secret"}},
+            {"path": "/api/v1/auth/protected"},
+            {"path": "/api/v1/amenities/"}
+        ]})
+        self.assertEqual(response.status_code, 200)
+        statuses = [item["status"] for item in response.json["responses"]]
+        self.assertEqual(statuses, [401, 200, 200, 200])
+
+    def test_every_request_verifies_its_token(self):
+        token = self.client.post('/api/v1/auth/login', json={
+            "email": "jane.doe@example.com",
+            "password": "secret"}).json["access_token"]
+        forged = token[:-4] + ("AAAA" if token[-4:] != "AAAA" else "BBBB")
+        response = self.client.post(
+            '/api/v1/batch/', headers={"Authorization": f"Bearer {token}"},
+            json={"parallel": True, "requests": [
+                {"path": "/api/v1/auth/protected"},
+                {"path": "/api/v1/auth/protected",
+                 "headers": {"Authorization": f"Bearer {forged}"}},
+                {"path": "/api/v1/auth/protected"}]})
+        statuses = [item["status"] for item in response.json["responses"]]
+        self.assertEqual(statuses, [200, 422, 200])
+
+    def test_rejects_non_api_paths(self):
+        response = self.client.post('/api/v1/batch/', json={
+            "requests": [{"path": "/login"}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_bodies_other_than_objects(self):
+        response = self.client.post('/api/v1/batch/', json=[
+            {"path": "/api/v1/amenities/"}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_errors_are_not_disclosed(self):
+        with mock.patch.object(facade, 'get_all_amenities',
+                               side_effect=RuntimeError("database secret")), \
+                self.assertLogs('app.api.v1.batch', 'ERROR'):
+            response = self.client.post('/api/v1/batch/', json={
+                "requests": [{"path": "/api/v1/amenities/"}]})
+        self.assertEqual(response.json["responses"], [
+            {"status": 500, "body": {"error": "Internal server error"}}])
+
+
+class TestChangeLog(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user()
+
+    def test_changes_since_cursor(self):
+        cursor = self.client.get('/api/v1/changes/').json["cursor"]
+        place = self.make_place(self.owner)
+        facade.update_place(place.id, {"price": 90})
+
+        response = self.client.get(f'/api/v1/changes/?since={cursor}')
+        changes = response.json["changes"]
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]["op"], "upsert")
+        self.assertEqual(changes[0]["data"]["price"], 90)
+
+        cursor = response.json["cursor"]
+        facade.delete_place(place.id)
+        changes = self.client.get(
+            f'/api/v1/changes/?since={cursor}').json["changes"]
+        self.assertEqual([(c["id"], c["op"]) for c in changes],
+                         [(place.id, "delete")])
+
+
+class TestPlaceEvents(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.place = self.make_place(self.make_user())
+
+    def test_committed_updates_are_pushed(self):
+        subscriber = facade.events.subscribe(self.place.id)
+        self.place.price = 1000
+        db.session.rollback()
+        self.assertEqual(len(subscriber.buffer), 0)
+        facade.update_place(self.place.id, {"price": 90})
+        self.assertEqual(len(subscriber.buffer), 1)
+        self.assertTrue(subscriber.buffer[0].startswith(
+            b"event: place.updated\n"))
+        facade.events.unsubscribe(subscriber)
+
+    def test_other_processes_writes_are_polled(self):
+        subscriber = facade.events.subscribe(self.place.id)
+        facade.events.poll()
+        facade.update_place(self.place.id, {"price": 90})
+        # A write of another process: no local event, only its change
+        db.session.execute(update(Place).where(Place.id == self.place.id)
+                           .values(title="Remote"))
+        db.session.execute(insert(Change).values(
+            entity='places', entity_id=self.place.id, op='upsert'))
+        db.session.commit()
+        facade.events.poll()
+        self.assertEqual(len(subscriber.buffer), 2)
+        self.assertIn(b'"title": "Remote"', subscriber.buffer[1])
+        facade.events.poll()
+        self.assertEqual(len(subscriber.buffer), 2)
+        facade.events.unsubscribe(subscriber)
+
+    def test_streams_require_an_evented_worker(self):
+        facade.events.require_evented = True
+        try:
+            response = self.client.get(
+                f'/api/v1/places/{self.place.id}/events')
+            self.assertEqual(response.status_code, 503)
+        finally:
+            facade.events.require_evented = False
+
+    def test_slow_subscriber_is_evicted(self):
+        subscriber = facade.events.subscribe(self.place.id)
+        for _ in range(facade.events.buffer_size + 1):
+            facade.events.publish(self.place.id, "place.updated", {})
+        self.assertTrue(subscriber.evicted)
+        self.assertEqual(facade.events._subscribers, {})
+
+
+class TestOptimisticConcurrency(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.amenity = facade.create_amenity({"name": "Wifi"})
+
+    def test_update_bumps_version(self):
+        self.assertEqual(self.amenity.version, 1)
+        facade.update_amenity(self.amenity.id, {"name": "Fiber"}, {1})
+        self.assertEqual(self.amenity.version, 2)
+
+    def test_stale_version_is_rejected(self):
+        facade.update_amenity(self.amenity.id, {"name": "Fiber"})
+        with self.assertRaises(PreconditionFailed):
+            facade.update_amenity(self.amenity.id, {"name": "Cable"}, {1})
+        self.assertEqual(facade.get_amenity(self.amenity.id).name, "Fiber")
+
+    def test_review_update_bumps_version_once(self):
+        owner = self.make_user()
+        place = self.make_place(owner)
+        review = facade.create_review({
+            "text": "Great", "rating": 4, "place_id": place.id,
+            "user_id": owner.id})
+        updates = []
+
+        def count_updates(conn, cursor, statement, *args):
+            if statement.startswith('UPDATE reviews'):
+                updates.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_updates)
+        try:
+            # The rating change also UPDATEs the place aggregates
+            facade.update_review(review.id, {"rating": 2}, {1})
+            facade.update_review(review.id, {"text": "Good"}, {2})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_updates)
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(facade.get_review(review.id).version, 3)
+
+    def test_etags_are_weak(self):
+        self.assertEqual(etag(self.amenity), 'W/"1"')
+        self.assertEqual(parse_if_match(etag(self.amenity)), {1})
+
+    def test_if_match_parsing(self):
+        self.assertIsNone(parse_if_match(None))
+        self.assertIsNone(parse_if_match('*'))
+        self.assertEqual(parse_if_match('"1", W/"2"'), {1, 2})
+        with self.assertRaises(ValueError):
+            parse_if_match('abc')
+
+
+class TestIdempotencyKeys(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = {"first_name": "Jane", "last_name": "Doe",
+                     "email": "jane.doe@example.com", "password": "secret"}
+
+    def test_retry_replays_first_response(self):
+        headers = {'Idempotency-Key': 'signup-1'}
+        first = self.client.post('/api/v1/users/', json=self.user,
+                                 headers=headers)
+        retry = self.client.post('/api/v1/users/', json=self.user,
+                                 headers=headers)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json, first.json)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+
+    def test_key_reused_with_another_body(self):
+        headers = {'Idempotency-Key': 'signup-1'}
+        self.client.post('/api/v1/users/', json=self.user, headers=headers)
+        other = dict(self.user, email="john.doe@example.com")
+        response = self.client.post('/api/v1/users/', json=other,
+                                    headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+
+class TestReadOnlyRequests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        facade.create_amenity({"name": "Wifi"})
+
+    def test_reads_work_and_writes_fail(self):
+        session = read_only_session()
+        try:
+            self.assertEqual(len(session.query(Amenity).all()), 1)
+            session.add(Amenity(name="Pool"))
+            with self.assertRaises(ReadOnlySessionError):
+                session.flush()
+        finally:
+            session.close()
+        self.assertEqual(len(facade.get_all_amenities()), 1)
+
+    def test_get_keeps_request_session(self):
+        amenity = facade.get_all_amenities()[0]
+        response = self.app.test_client().get('/api/v1/amenities/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(amenity, db.session)
+
+
+class TestReadReplicas(AppTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        path = os.path.join(self.tmp.name, '{}.db')
+
+        class ReplicaConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path.format('primary')
+            SQLALCHEMY_REPLICAS = ['sqlite:///' + path.format('replica'),
+                                   'sqlite:///' + path.format('no/such')]
+
+        self.config = ReplicaConfig
+        super().setUp()
+        replicas.sync()
+
+    def tearDown(self):
+        # The database files are removed with the directory
+        db.session.remove()
+        for replica in replicas.replicas:
+            replica.engine.dispose()
+        db.engine.dispose()
+        self.ctx.pop()
+        self.tmp.cleanup()
+
+    def test_reads_go_to_replica_after_sync(self):
+        amenity = facade.create_amenity({"name": "Wifi"})
+        url = f'/api/v1/amenities/{amenity.id}'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(replicas.sync(), 1)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_writer_reads_its_writes(self):
+        response = self.client.post('/api/v1/amenities/',
+                                    json={"name": "Pool"},
+                                    environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        url = f"/api/v1/amenities/{response.json['id']}"
+        writer = self.client.get(url, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        other = self.client.get(url, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(writer.status_code, 200)
+        self.assertEqual(other.status_code, 404)
+
+    def test_statement_errors_keep_the_replica(self):
+        replica = replicas.replicas[0]
+        with replica.engine.connect() as connection:
+            with self.assertRaises(ProgrammingError):
+                connection.exec_driver_sql('SELECT ?', ())
+        self.assertTrue(replica.healthy)
+
+    def test_unwritable_replica_is_skipped(self):
+        self.assertFalse(replicas.replicas[1].healthy)
+        self.assertIsNotNone(replicas.choose())
+        self.assertIs(replicas.choose(), replicas.replicas[0].engine)
+
+
+class TestShardedStorage(AppTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.path = os.path.join(self.tmp.name, '{}.db')
+
+        class ShardConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.path.format('global')
+            SQLALCHEMY_SHARDS = ['sqlite:///' + self.path.format(index)
+                                 for index in range(3)]
+
+        self.config = ShardConfig
+        super().setUp()
+        shards.create_all()
+        self.owner = self.make_user()
+        self.places = [self.make_place(self.owner, title=f"Place {index}",
+                                       price=100 - index)
+                       for index in range(8)]
+
+    def tearDown(self):
+        # The database files are removed with the directory
+        db.session.remove()
+        for engine in shards.engines.values():
+            engine.dispose()
+        db.engine.dispose()
+        self.ctx.pop()
+        self.tmp.cleanup()
+
+    def count(self, shard_id, table):
+        with shards.engines[shard_id].connect() as connection:
+            return connection.exec_driver_sql(
+                f"SELECT COUNT(*) FROM {table}").scalar()
+
+    def test_change_log_is_not_kept(self):
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql(
+                "SELECT COUNT(*) FROM changes").scalar(), 0)
+        response = self.client.get('/api/v1/changes/')
+        self.assertEqual(response.status_code, 501)
+        response = self.client.get('/api/v1/changes/?since=0')
+        self.assertEqual(response.status_code, 501)
+
+    def test_change_log_consumers_are_refused(self):
+        for option in ({'REPOSITORY_BACKEND': 'cached'},
+                       {'CATALOGUE_SNAPSHOT_PATH': self.path.format('cat')}):
+            with self.subTest(option=option):
+                with self.assertRaises(ValueError):
+                    create_app(type('ShardConfig', (TestConfig,), {
+                        'SQLALCHEMY_SHARDS': self.app.config[
+                            'SQLALCHEMY_SHARDS'], **option}))
+
+    def test_rows_are_spread_over_shards(self):
+        counts = [self.count(shard_id, 'places')
+                  for shard_id in shards.shard_ids]
+        self.assertEqual(sum(counts), 8)
+        for place in self.places:
+            self.assertEqual(self.count(shards.shard_of(place.id),
+                                        f"places WHERE id = '{place.id}'"), 1)
+
+    def test_review_is_stored_with_its_place(self):
+        place = self.places[0]
+        review = facade.create_review({
+            "text": "Great", "rating": 4, "place_id": place.id,
+            "user_id": self.owner.id})
+        shard_id = shards.shard_of(place.id)
+        self.assertEqual(self.count(shard_id, 'reviews'), 1)
+        response = self.client.get(f'/api/v1/places/{place.id}')
+        self.assertEqual(response.json['reviews'][0]['id'], review.id)
+        self.assertEqual(response.json['review_count'], 1)
+        self.assertEqual(facade.view_counter.flush(), 1)
+        db.session.refresh(place)
+        self.assertEqual(place.views, 1)
+
+    def test_lists_gather_every_shard(self):
+        response = self.client.get('/api/v1/places/?sort=price')
+        prices = [place['price'] for place in response.json]
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual(len(prices), 8)
+
+    def test_keyset_pages_merge_every_shard(self):
+        prices, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get(
+                f'/api/v1/places/?sort=price&limit=3&cursor={cursor}')
+            self.assertLessEqual(len(response.json), 3)
+            prices += [place['price'] for place in response.json]
+            cursor = response.headers.get('X-Next-Cursor')
+        self.assertEqual(prices, sorted(place.price for place in self.places))
+
+    def test_reshard_moves_a_share_of_the_rows(self):
+        uris = [self.app.config['SQLALCHEMY_SHARDS'][index]
+                for index in range(3)] + ['sqlite:///' + self.path.format(3)]
+        moved = shards.reshard(self.app, uris)
+        self.assertLess(moved['places'], 8)
+        for key in range(1000):
+            bucket = jump_hash(key, 4)
+            self.assertIn(bucket, (jump_hash(key, 3), 3))
+
+
+class RepositoryConformance:
+    """
+    Behaviour shared by every repository backend, run once per backend
+    by the subclasses below.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user()
+        self.guest = self.make_user("John")
+        self.wifi = facade.create_amenity({"name": "Wifi"})
+        self.place = self.make_place(self.owner, amenities=[self.wifi.id])
+
+    def create_review(self, rating):
+        return facade.create_review({
+            "text": "Great", "rating": rating, "place_id": self.place.id,
+            "user_id": self.guest.id})
+
+    def test_users(self):
+        self.assertEqual(facade.get_user_by_email("john.doe@example.com").id,
+                         self.guest.id)
+        self.assertEqual(len(facade.get_all_user()), 2)
+        user = facade.put_user(self.guest.id, {"first_name": "Johnny"})
+        self.assertEqual((user.first_name, user.version), ("Johnny", 2))
+        self.assertEqual(facade.get_user(self.guest.id).first_name, "Johnny")
+        self.assertTrue(facade.get_user(self.guest.id).verify_password(
+            "secret"))
+        with self.assertRaises(PreconditionFailed):
+            facade.put_user(self.guest.id, {"last_name": "Roe"}, {1})
+        self.assertIsNone(facade.put_user("missing", {"last_name": "Roe"}))
+
+    def test_amenities(self):
+        self.assertEqual(facade.create_amenity({"name": "Wifi"}).id,
+                         self.wifi.id)
+        amenity = facade.update_amenity(self.wifi.id, {"name": "Fiber"})
+        self.assertEqual((amenity.name, amenity.version), ("Fiber", 2))
+        with self.assertRaises(ValueError):
+            facade.update_amenity(self.wifi.id, {"name": ""})
+        self.assertIsNone(facade.update_amenity("missing", {"name": "Pool"}))
+        self.assertEqual([a.name for a in facade.get_all_amenities()],
+                         ["Fiber"])
+
+    def test_places(self):
+        place = facade.get_place(self.place.id)
+        self.assertEqual(place.owner.id, self.owner.id)
+        self.assertEqual([a["id"] for a in place.to_dict()["amenities"]],
+                         [self.wifi.id])
+        with self.assertRaises(ValueError):
+            facade.create_place({
+                "title": "Loft", "description": "Nice", "price": 80,
+                "latitude": 48.85, "longitude": 2.35,
+                "owner_id": "missing"})
+        with self.assertRaises(ValueError):
+            facade.update_place(self.place.id, {"price": "free"})
+
+        place = facade.update_place(self.place.id,
+                                    {"price": 120, "amenities": []})
+        self.assertEqual((place.price, place.version), (120.0, 2))
+        self.assertEqual(place.to_dict()["amenities"], [])
+        cheaper = facade.create_place({
+            "title": "Room", "description": "Small", "price": 50,
+            "latitude": 45.76, "longitude": 4.83,
+            "owner_id": self.owner.id})
+        self.assertEqual([p.id for p in facade.get_all_places("price")],
+                         [cheaper.id, self.place.id])
+        with self.assertRaises(ValueError):
+            facade.get_all_places("size")
+        self.assertEqual(
+            [p.id for p in facade.place_repository.get_places(
+                [cheaper.id, "missing"])], [cheaper.id])
+
+        self.assertTrue(facade.delete_place(cheaper.id))
+        self.assertIsNone(facade.get_place(cheaper.id))
+        self.assertFalse(facade.delete_place(cheaper.id))
+
+    def test_place_pages(self):
+        places = [self.place] + [facade.create_place({
+            "title": "Room", "description": "Small", "price": price,
+            "latitude": 45.76, "longitude": 4.83,
+            "owner_id": self.owner.id}) for price in (50, 80, 120)]
+        self.create_review(4)
+        by_id = sorted(place.id for place in places)
+        others = [pid for pid in by_id if pid != self.place.id]
+        expected = {
+            None: by_id,
+            'price': [place.id for place in sorted(
+                places, key=lambda place: (place.price, place.id))],
+            'reviews': [self.place.id] + others,
+            'rating': [self.place.id] + others}
+        for sort, ids in expected.items():
+            with self.subTest(sort=sort):
+                found, cursor = [], None
+                while True:
+                    page, cursor = facade.get_places_page(sort, cursor, 3)
+                    found += [place.id for place in page]
+                    if cursor is None:
+                        break
+                self.assertEqual(found, ids)
+        _, cursor = facade.get_places_page('price', None, 1)
+        for sort, bad in (('rating', cursor), ('price', 'garbage')):
+            with self.assertRaises(ValueError):
+                facade.get_places_page(sort, bad)
+
+    def test_reviews(self):
+        review = self.create_review(4)
+        self.assertEqual(facade.get_review_by_user_and_place(
+            self.guest.id, self.place.id).id, review.id)
+        self.assertIsNone(facade.get_review_by_user_and_place(
+            self.owner.id, self.place.id))
+        self.assertEqual([r.id for r in
+                          facade.get_reviews_by_place(self.place.id)],
+                         [review.id])
+        place = facade.get_place(self.place.id)
+        self.assertEqual((place.review_count, place.rating_histogram["4"]),
+                         (1, 1))
+        self.assertEqual(place.to_dict()["reviews"][0]["rating"], 4)
+        with self.assertRaises(ValueError):
+            self.create_review(6)
+        with self.assertRaises(ValueError):
+            facade.update_review(review.id, {"rating": 0})
+
+        review = facade.update_review(review.id, {"rating": 2})
+        self.assertEqual((review.rating, review.version), (2, 2))
+        self.assertEqual(facade.get_place(self.place.id).average_rating, 2.0)
+
+        self.assertTrue(facade.delete_review(review.id))
+        self.assertIsNone(facade.get_review(review.id))
+        self.assertEqual(facade.get_reviews_by_place(self.place.id), [])
+        self.assertEqual(facade.get_place(self.place.id).review_count, 0)
+        self.assertFalse(facade.delete_review(review.id))
+
+    def test_aggregates_and_leaderboards(self):
+        self.create_review(5)
+        self.assertEqual(facade.reconcile_rating_aggregates(), 0)
+        ranked = facade.get_top_places("rated")
+        self.assertEqual([(place.id, score) for place, score in ranked],
+                         [(self.place.id, (5.0, 1))])
+
+    def test_search_places(self):
+        def search(**filters):
+            total, places = facade.search_places(**filters)
+            return total, [place.id for place in places]
+
+        # Loads the columns; the writes below then update them in place
+        self.assertEqual(search(), (1, [self.place.id]))
+        pool = facade.create_amenity({"name": "Pool"})
+        room = facade.create_place({
+            "title": "Room", "description": "Small", "price": 50,
+            "latitude": 45.76, "longitude": 4.83,
+            "owner_id": self.owner.id, "amenities": [self.wifi.id, pool.id]})
+        studio = facade.create_place({
+            "title": "Studio", "description": "Bright", "price": 120,
+            "latitude": 40.71, "longitude": -74.0,
+            "owner_id": self.owner.id})
+        self.create_review(5)
+        facade.create_review({"text": "Fine", "rating": 3,
+                              "place_id": room.id, "user_id": self.guest.id})
+
+        for _ in range(2):
+            self.assertEqual(search(sort="price"),
+                             (3, [room.id, self.place.id, studio.id]))
+            self.assertEqual(search(min_price=60, max_price=120),
+                             (2, [self.place.id, studio.id]))
+            self.assertEqual(search(bbox=(40, 0, 50, 10), sort="price"),
+                             (2, [room.id, self.place.id]))
+            self.assertEqual(search(bbox=(40, 10, 50, -10)),
+                             (1, [studio.id]))
+            self.assertEqual(search(min_rating=4), (1, [self.place.id]))
+            self.assertEqual(search(sort="rating"),
+                             (3, [self.place.id, room.id, studio.id]))
+            self.assertEqual(search(amenity_ids=[self.wifi.id],
+                                    sort="price"),
+                             (2, [room.id, self.place.id]))
+            self.assertEqual(search(amenity_ids=[self.wifi.id, pool.id]),
+                             (1, [room.id]))
+            self.assertEqual(search(amenity_ids=["missing"]), (0, []))
+            self.assertEqual(search(sort="price", offset=1, limit=1),
+                             (3, [self.place.id]))
+            # Same answers from columns loaded from scratch
+            facade.place_columns.invalidate()
+
+        facade.update_place(room.id, {"price": 500, "amenities": []})
+        facade.delete_place(studio.id)
+        self.assertEqual(search(sort="price"), (2, [self.place.id, room.id]))
+        self.assertEqual(search(amenity_ids=[pool.id]), (0, []))
+        with self.assertRaises(ValueError):
+            search(sort="size")
+
+        client = self.app.test_client()
+        response = client.get(f'/api/v1/places/?max_price=100'
+                              f'&amenities={self.wifi.id}&limit=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Total-Count"], "1")
+        self.assertEqual([p["id"] for p in response.json], [self.place.id])
+        self.assertEqual(client.get('/api/v1/places/?bbox=1,2,3').status_code,
+                         400)
+        self.assertEqual(len(client.get('/api/v1/places/').json), 2)
+
+    def test_nearest_places(self):
+        def nearest(latitude, longitude, k=10, radius_km=None):
+            return [(place.id, round(distance))
+                    for place, distance in facade.get_nearest_places(
+                        latitude, longitude, k, radius_km)]
+
+        # Loads the tree; the writes below go through its buffer
+        self.assertEqual(nearest(48.85, 2.35), [(self.place.id, 0)])
+        lyon = facade.create_place({
+            "title": "Room", "description": "Small", "price": 50,
+            "latitude": 45.76, "longitude": 4.83,
+            "owner_id": self.owner.id})
+        new_york = facade.create_place({
+            "title": "Studio", "description": "Bright", "price": 120,
+            "latitude": 40.71, "longitude": -74.0,
+            "owner_id": self.owner.id})
+        self.assertEqual(nearest(45.0, 5.0, k=2),
+                         [(lyon.id, 86), (self.place.id, 473)])
+        self.assertEqual(nearest(45.0, 5.0, radius_km=400), [(lyon.id, 86)])
+        # Across the antimeridian
+        self.assertEqual(nearest(40.71, 179.0, k=1), [(new_york.id, 8349)])
+
+        facade.update_place(lyon.id, {"latitude": 48.86, "longitude": 2.34})
+        facade.delete_place(self.place.id)
+        self.assertEqual(nearest(48.85, 2.35, k=5),
+                         [(lyon.id, 1), (new_york.id, 5837)])
+        with self.assertRaises(ValueError):
+            nearest(91, 0)
+        for radius_km in (-1, math.nan, math.inf):
+            with self.assertRaises(ValueError):
+                nearest(45.0, 5.0, radius_km=radius_km)
+
+        client = self.app.test_client()
+        response = client.get('/api/v1/places/nearest?lat=40.7&lng=-74&k=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(p["id"], round(p["distance_km"]))
+                          for p in response.json], [(new_york.id, 1)])
+        self.assertEqual(client.get('/api/v1/places/nearest?lat=1&k=1')
+                         .status_code, 400)
+        self.assertEqual(client.get('/api/v1/places/nearest?lat=1&lng=1&k=0')
+                         .status_code, 400)
+        for radius_km in ('-1', 'nan', 'inf', 'far'):
+            self.assertEqual(client.get(
+                f'/api/v1/places/nearest?lat=1&lng=1&radius_km={radius_km}')
+                .status_code, 400)
+
+    def test_place_clusters(self):
+        world = (-90, -180, 90, 180)
+        # Loads the cells; the writes below update them in place
+        self.assertEqual(facade.get_place_clusters(world, 0), (1, [{
+            "geohash": "u", "count": 1, "latitude": 48.85,
+            "longitude": 2.35, "min_price": 80.0}]))
+        room = facade.create_place({
+            "title": "Room", "description": "Small", "price": 50,
+            "latitude": 48.86, "longitude": 2.34,
+            "owner_id": self.owner.id})
+        facade.create_place({
+            "title": "Studio", "description": "Bright", "price": 120,
+            "latitude": 40.71, "longitude": -74.0,
+            "owner_id": self.owner.id})
+
+        precision, clusters = facade.get_place_clusters(world, 0)
+        self.assertEqual([(c["geohash"], c["count"], c["min_price"])
+                          for c in clusters], [("d", 1, 120.0),
+                                               ("u", 2, 50.0)])
+        self.assertAlmostEqual(clusters[1]["latitude"], 48.855)
+        # The Paris places share a precision 5 cell, not a precision 6 one
+        paris = (48.8, 2.3, 48.9, 2.4)
+        self.assertEqual([(c["geohash"], c["count"]) for c in
+                          facade.get_place_clusters(paris, 10)[1]],
+                         [("u09tv", 2)])
+        self.assertEqual(len(facade.get_place_clusters(paris, 12)[1]), 2)
+
+        facade.delete_place(room.id)
+        self.assertEqual(facade.get_place_clusters(paris, 5)[1][0]["min_price"],
+                         80.0)
+        facade.update_place(self.place.id, {"price": 30})
+        self.assertEqual(facade.get_place_clusters(world, 0)[1][1]["min_price"],
+                         30.0)
+
+        client = self.app.test_client()
+        response = client.get('/api/v1/places/clusters?bbox=30,-80,50,-70'
+                               '&zoom=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["precision"], 2)
+        self.assertEqual([c["geohash"] for c in response.json["clusters"]],
+                         ["dr"])
+        self.assertEqual(client.get('/api/v1/places/clusters?bbox=30,-80,50,'
+                                    '-70').status_code, 400)
+        self.assertEqual(client.get('/api/v1/places/clusters?bbox=30,-80,50,'
+                                    '-70&zoom=30').status_code, 400)
+
+
+class TestKDTree(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        points = unit_vectors(rng.uniform(-90, 90, 2000),
+                              rng.uniform(-180, 180, 2000))
+        tree = KDTree(points)
+        tree.dead[rng.choice(len(points), 300, replace=False)] = True
+        alive = tree.index[~tree.dead]
+        for query in unit_vectors(rng.uniform(-90, 90, 20),
+                                  rng.uniform(-180, 180, 20)):
+            distances = ((points[alive] - query) ** 2).sum(axis=1)
+            expected = alive[np.argsort(distances)]
+            found = [tree.index[position]
+                     for _, position in tree.search(query, 25)]
+            self.assertEqual(found, expected[:25].tolist())
+            # Halfway between the 41st and 42nd nearest
+            bound = float(np.sort(distances)[40:42].mean())
+            found = [tree.index[position]
+                     for _, position in tree.search(query, bound=bound)]
+            self.assertEqual(found, expected[:41].tolist())
+
+    def test_locator_rebuilds_from_its_buffer(self):
+        locator = PlaceLocator(reload_seconds=0, buffer_size=4)
+        locator.source = lambda: [("a", 0.0, 0.0), ("b", 0.0, 1.0)]
+        self.assertEqual([pid for pid, _ in locator.nearest(0, 0.9, 1)],
+                         ["b"])
+        for i in range(6):
+            locator.place_changed(SimpleNamespace(
+                id=f"p{i}", latitude=10.0 + i, longitude=10.0))
+        locator.place_deleted("b")
+        self.assertEqual(locator.rebuilds, 1)
+        self.assertEqual([pid for pid, _ in locator.nearest(0, 0.9, 2)],
+                         ["a", "p0"])
+
+
+class TestPlaceClusters(unittest.TestCase):
+
+    def test_cells_match_a_full_recount(self):
+        rng = np.random.default_rng(0)
+        places = {f"p{i}": SimpleNamespace(
+            id=f"p{i}", latitude=float(rng.uniform(40, 50)),
+            longitude=float(rng.uniform(-5, 10)),
+            price=float(rng.integers(20, 400))) for i in range(300)}
+        clusters = PlaceClusters(max_cells=64, reload_seconds=0)
+        clusters.source = lambda: [(p.id, p.price, p.latitude, p.longitude)
+                                   for p in places.values()]
+        clusters.clusters((40, -5, 50, 10), 4)
+        for i in rng.choice(300, 100, replace=False):
+            place = places[f"p{i}"]
+            if i % 2:
+                del places[place.id]
+                clusters.place_deleted(place.id)
+            else:
+                place.price = float(rng.integers(20, 400))
+                place.latitude = float(rng.uniform(40, 50))
+                clusters.place_changed(place)
+
+        for zoom in (2, 4, 6, 20):
+            precision, found = clusters.clusters((40, -5, 50, 10), zoom)
+            self.assertLessEqual(len(found), 64)
+            expected = {}
+            for place in places.values():
+                key = geohash(*cell_of(place.latitude, place.longitude,
+                                       precision), precision)
+                count, price = expected.get(key, (0, math.inf))
+                expected[key] = (count + 1, min(price, place.price))
+            self.assertEqual({c["geohash"]: (c["count"], c["min_price"])
+                              for c in found}, expected)
+
+
+class TestPlaceIndexRefresh(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user()
+        self.place = self.make_place(self.owner)
+
+    def found(self):
+        """Place ids in the search columns, nearest places, clusters and
+        leaderboards."""
+        _, searched = facade.place_columns.search(sort='price')
+        nearest = [pid for pid, _ in facade.locator.nearest(48.85, 2.35)]
+        _, clusters = facade.clusters.clusters((-90, -180, 90, 180), 0)
+        top = [pid for pid, _ in facade.leaderboards.top('reviewed')]
+        return searched, nearest, sum(c['count'] for c in clusters), top
+
+    def test_other_workers_writes_are_applied(self):
+        place_id = self.place.id
+        self.assertEqual(self.found(),
+                         ([place_id], [place_id], 1, [place_id]))
+        facade.place_indexes.refresh()
+        # Another worker's writes: committed and logged, not seen by this
+        # worker's facade
+        other = Place("Flat", "Small", 50, 48.86, 2.36, self.owner,
+                      self.owner.id)
+        db.session.add(other)
+        db.session.commit()
+        db.session.delete(db.session.get(Place, place_id))
+        db.session.commit()
+        self.assertEqual(self.found(),
+                         ([place_id], [place_id], 1, [place_id]))
+        with mock.patch.object(facade.place_columns, 'load') as load, \
+                mock.patch.object(facade.leaderboards, 'rebuild') as rebuild:
+            self.assertEqual(facade.place_indexes.refresh(), 2)
+            load.assert_not_called()
+            rebuild.assert_not_called()
+        self.assertEqual(self.found(), ([other.id], [other.id], 1, [other.id]))
+
+    def test_thread_starts_with_the_first_query(self):
+        refresher = PlaceIndexRefresher(facade.place_columns, facade.locator,
+                                        facade.clusters, facade.leaderboards)
+        refresher.init_app(self.app)
+        refresher.start()
+        self.assertIsNone(refresher._thread)
+        refresher.refresh_seconds = 60
+        refresher.start()
+        thread = refresher._thread
+        self.assertTrue(thread.is_alive())
+        refresher.start()
+        self.assertIs(refresher._thread, thread)
+        refresher.stop()
+        thread.join()
+
+    def test_sharded_storage_reloads_periodically(self):
+        self.found()
+        facade.locator.reload_seconds = 0.01
+        facade.leaderboards.reload_seconds = 0.01
+        with mock.patch.object(change_log, 'available', return_value=False), \
+                mock.patch.object(facade.place_columns, 'load') as columns, \
+                mock.patch.object(facade.locator, 'load') as locator, \
+                mock.patch.object(facade.leaderboards, 'load') as leaderboards:
+            time.sleep(0.02)
+            facade.place_indexes.refresh()
+        columns.assert_not_called()
+        locator.assert_called_once_with()
+        leaderboards.assert_called_once_with()
+
+
+class MemoryConfig(TestConfig):
+    REPOSITORY_BACKEND = 'memory'
+
+
+class CachedConfig(TestConfig):
+    REPOSITORY_BACKEND = 'cached'
+    # No refresh thread on the single connection of the in-memory
+    # database; the tests call refresh() themselves.
+    CACHE_REFRESH_SECONDS = 0
+
+
+class TestSQLAlchemyRepositories(RepositoryConformance, AppTestCase):
+    pass
+
+
+class TestMemoryRepositories(RepositoryConformance, AppTestCase):
+
+    config = MemoryConfig
+
+    def test_nothing_is_written_to_the_database(self):
+        self.create_review(3)
+        self.assertEqual(Place.query.count(), 0)
+
+    def test_table_features_are_refused(self):
+        client = self.app.test_client()
+        self.assertEqual(client.get('/api/v1/changes/').status_code, 501)
+        self.assertEqual(client.get(
+            f'/api/v1/places/{self.place.id}/events').status_code, 501)
+        with self.assertRaises(DatabaseRequired):
+            facade.import_ndjson('amenities', io.BytesIO(b'{"name": "Spa"}'))
+        with self.assertRaises(DatabaseRequired):
+            facade.export_stream('places', 'csv')
+        with self.assertRaises(DatabaseRequired):
+            facade.start_export('places', 'csv')
+        self.assertEqual(facade.purge_changes(), 0)
+        facade.record_place_view(self.place.id)
+        self.assertEqual(facade.view_counter.flush(), 0)
+
+    def test_snapshot_is_refused(self):
+        class SnapshotConfig(MemoryConfig):
+            CATALOGUE_SNAPSHOT_PATH = 'catalogue.bin'
+
+        with self.assertRaises(ValueError):
+            create_app(SnapshotConfig)
+
+
+class TestCachedRepositories(RepositoryConformance, AppTestCase):
+
+    config = CachedConfig
+
+    def test_reads_are_served_from_memory(self):
+        self.create_review(3)
+        self.assertEqual(Place.query.count(), 1)
+        user_id, place_id = self.guest.id, self.place.id
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            facade.get_place(place_id).to_dict()
+            facade.get_all_places("rating")
+            facade.get_review_by_user_and_place(user_id, place_id)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(statements, [])
+
+    def test_reload_sees_writes_of_other_processes(self):
+        db.session.execute(update(Place).values(title="Studio"))
+        db.session.commit()
+        self.assertEqual(facade.get_place(self.place.id).title, "Loft")
+        facade.repository_cache.reload()
+        self.assertEqual(facade.get_place(self.place.id).title, "Studio")
+
+    def test_refresh_applies_writes_of_other_nodes(self):
+        # Writes of another node reach the database but not this copy
+        cache = facade.repository_cache
+        review = self.create_review(3)
+        other = facade.place_repository.backing
+        other.update_place(self.place.id, {"title": "Studio"})
+        facade.user_repository.backing.put_user(self.owner.id,
+                                                {"first_name": "Janet"})
+        facade.amenity_repository.backing.create_amenity({"name": "Pool"})
+        facade.review_repository.backing.delete_review(review.id)
+        place = facade.get_place(self.place.id)
+        self.assertEqual((place.title, place.review_count), ("Loft", 1))
+
+        self.assertGreater(cache.refresh(), 0)
+        place = facade.get_place(self.place.id)
+        self.assertEqual((place.title, place.review_count), ("Studio", 0))
+        self.assertEqual(place.to_dict()["owner"]["first_name"], "Janet")
+        self.assertEqual(place.reviews, [])
+        self.assertEqual(sorted(a.name for a in facade.get_all_amenities()),
+                         ["Pool", "Wifi"])
+        metrics = facade.get_repository_cache_metrics()
+        self.assertEqual(metrics["cursor"], facade.get_changes_cursor())
+        self.assertEqual(metrics["failures"], 0)
+
+    def test_writes_swap_in_new_copies(self):
+        review = self.create_review(3)
+        place = facade.get_place(self.place.id)
+        facade.update_place(self.place.id, {"title": "Studio"})
+        facade.user_repository.backing.put_user(self.owner.id,
+                                                {"first_name": "Janet"})
+        facade.repository_cache.refresh()
+
+        # Readers holding the previous copies see them unchanged
+        self.assertEqual(place.title, "Loft")
+        self.assertEqual(place.to_dict()["owner"]["first_name"], "Jane")
+        updated = facade.get_place(self.place.id)
+        self.assertIsNot(updated, place)
+        self.assertEqual(updated.title, "Studio")
+        self.assertEqual(updated.to_dict()["owner"]["first_name"], "Janet")
+        self.assertEqual([r.id for r in updated.reviews], [review.id])
+        self.assertIs(updated.reviews[0].place, updated)
+        self.assertEqual([a.name for a in updated.amenities], ["Wifi"])
+
+    def test_misses_and_stale_reads_go_to_the_database(self):
+        cache = facade.repository_cache
+        other = facade.place_repository.backing
+        place_id = other.create_place({
+            "title": "Room", "description": "Small", "price": 50,
+            "latitude": 45.76, "longitude": 4.83,
+            "owner_id": self.owner.id}).id
+        self.assertEqual(facade.get_place(place_id).title, "Room")
+        self.assertEqual(cache.metrics()["misses"], 1)
+
+        # Polling on, but no refresh succeeded for too long
+        cache.refresh_seconds = 0.25
+        cache.max_staleness = 0
+        other.update_place(place_id, {"title": "Suite"})
+        self.assertEqual(facade.get_place(place_id).title, "Suite")
+        self.assertEqual(len(facade.get_all_places()), 2)
+        self.assertEqual(cache.metrics()["stale_reads"], 2)
+
+
+class TestCatalogueSnapshot(AppTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = type('CatalogueConfig', (TestConfig,), {
+            'CATALOGUE_SNAPSHOT_PATH': os.path.join(self.directory,
+                                                    'catalogue.bin'),
+            # The tests call refresh() themselves
+            'CATALOGUE_REFRESH_SECONDS': 0})
+        super().setUp()
+        self.owner = self.make_user()
+        self.wifi = facade.create_amenity({"name": "Wifi"})
+        self.pool = facade.create_amenity({"name": "Pool"})
+        self.place = self.make_place(
+            self.owner, amenities=[self.wifi.id, self.pool.id])
+        facade.create_review({
+            "text": "Great", "rating": 4, "place_id": self.place.id,
+            "user_id": self.make_user("John").id})
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_records_match_the_database(self):
+        self.assertEqual(facade.build_catalogue(), (1, 2))
+        record = facade.catalogue.get_place(self.place.id)
+        expected = self.place.to_dict()
+        del expected["reviews"]
+        self.assertEqual(record.to_dict(), expected)
+        self.assertEqual(facade.get_amenity(self.wifi.id).to_dict(),
+                         self.wifi.to_dict())
+        self.assertEqual(sorted(a.name for a in facade.get_all_amenities()),
+                         ["Pool", "Wifi"])
+        self.assertIsNone(facade.catalogue.get_place("missing"))
+        self.assertIsNone(facade.catalogue.get_amenity(self.place.id))
+
+    def test_refresh_rebuilds_after_a_change(self):
+        facade.catalogue.refresh()
+        self.assertFalse(facade.catalogue.refresh())
+        old = facade.catalogue.get_place(self.place.id)
+
+        facade.update_place(self.place.id, {"title": "Studio"})
+        facade.put_user(self.owner.id, {"first_name": "Janet"})
+        self.assertEqual(facade.catalogue.get_place(self.place.id).title,
+                         "Loft")
+        self.assertTrue(facade.catalogue.refresh())
+        place = facade.catalogue.get_place(self.place.id)
+        self.assertEqual((place.title, place.owner.first_name),
+                         ("Studio", "Janet"))
+        # Records read before the rebuild keep the old mapping
+        self.assertEqual(old.title, "Loft")
+
+    def test_reads_fall_back_to_the_repositories(self):
+        facade.catalogue.refresh()
+        gym = facade.create_amenity({"name": "Gym"})
+        self.assertEqual(facade.get_amenity(gym.id).name, "Gym")
+        places = facade._get_place_summaries([self.place.id, "missing"])
+        self.assertEqual(list(places), [self.place.id])
+
+    def test_single_reads_see_their_own_writes(self):
+        facade.catalogue.refresh()
+        facade.update_amenity(self.wifi.id, {"name": "Fiber"})
+        amenity = facade.get_amenity(self.wifi.id)
+        self.assertEqual((amenity.name, amenity.version), ("Fiber", 2))
+        facade.update_amenity(self.wifi.id, {"name": "Cable"},
+                              {amenity.version})
+        # The list rail lags until the snapshot is rebuilt
+        self.assertIn("Wifi", [a.name for a in facade.get_all_amenities()])